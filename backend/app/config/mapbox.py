@@ -20,8 +20,12 @@ class MapboxConfig:
     # Token de acceso
     access_token: str
     
+    # URL base de las APIs (MAPBOX_API_URL permite apuntar a un stub local)
+    api_url: str = "https://api.mapbox.com"
+    
     # URLs de APIs
     directions_url: str = "https://api.mapbox.com/directions/v5/mapbox"
+    matrix_url: str = "https://api.mapbox.com/directions-matrix/v1/mapbox"
     geocoding_url: str = "https://api.mapbox.com/geocoding/v5/mapbox.places"
     static_images_url: str = "https://api.mapbox.com/styles/v1"
     static_tiles_url: str = "https://api.mapbox.com/v4"
@@ -35,6 +39,31 @@ class MapboxConfig:
     static_images_limit: int = 50000   # 50K imágenes estáticas/mes
     mobile_mau_limit: int = 25000      # 25K usuarios activos móviles/mes
     
+    # Límites de tasa por API (solicitudes/minuto) y concurrencia saliente
+    directions_rate_per_minute: int = 300
+    matrix_rate_per_minute: int = 60
+    geocoding_rate_per_minute: int = 600
+    max_concurrency: int = 16
+    
+    # Cuotas mensuales por API (plan gratuito; Matrix en elementos)
+    directions_monthly_limit: int = 100000
+    matrix_monthly_limit: int = 100000
+    geocoding_monthly_limit: int = 100000
+    
+    # Presupuesto de consumo (fracción de la cuota mensual): al superar el
+    # blando solo pasan llamadas interactivas; al superar el duro, solo caché
+    budget_soft_ratio: float = 0.8
+    budget_hard_ratio: float = 0.95
+    
+    def monthly_limits(self) -> Dict[str, int]:
+        """Cuota mensual por API medida en el backend"""
+        return {
+            "directions": self.directions_monthly_limit,
+            "matrix": self.matrix_monthly_limit,
+            "geocoding": self.geocoding_monthly_limit,
+            "static_images": self.static_images_limit,
+        }
+    
     def validate(self) -> Tuple[bool, str]:
         """Validar configuración"""
         if not self.access_token:
@@ -48,9 +77,26 @@ class MapboxConfig:
 
 def get_mapbox_config() -> MapboxConfig:
     """Obtener configuración de Mapbox desde variables de entorno"""
+    api_url = os.getenv("MAPBOX_API_URL", "https://api.mapbox.com").rstrip("/")
     return MapboxConfig(
         access_token=os.getenv("MAPBOX_ACCESS_TOKEN", ""),
+        api_url=api_url,
+        directions_url=f"{api_url}/directions/v5/mapbox",
+        matrix_url=f"{api_url}/directions-matrix/v1/mapbox",
+        geocoding_url=f"{api_url}/geocoding/v5/mapbox.places",
+        static_images_url=f"{api_url}/styles/v1",
+        static_tiles_url=f"{api_url}/v4",
         cache_ttl=int(os.getenv("TRAFFIC_CACHE_TTL", "30")),
+        directions_rate_per_minute=int(os.getenv("MAPBOX_RATE_DIRECTIONS_PER_MIN", "300")),
+        matrix_rate_per_minute=int(os.getenv("MAPBOX_RATE_MATRIX_PER_MIN", "60")),
+        geocoding_rate_per_minute=int(os.getenv("MAPBOX_RATE_GEOCODING_PER_MIN", "600")),
+        max_concurrency=int(os.getenv("MAPBOX_MAX_CONCURRENCY", "16")),
+        directions_monthly_limit=int(os.getenv("MAPBOX_MONTHLY_LIMIT_DIRECTIONS", "100000")),
+        matrix_monthly_limit=int(os.getenv("MAPBOX_MONTHLY_LIMIT_MATRIX", "100000")),
+        geocoding_monthly_limit=int(os.getenv("MAPBOX_MONTHLY_LIMIT_GEOCODING", "100000")),
+        static_images_limit=int(os.getenv("MAPBOX_MONTHLY_LIMIT_STATIC_IMAGES", "50000")),
+        budget_soft_ratio=float(os.getenv("MAPBOX_BUDGET_SOFT", "0.8")),
+        budget_hard_ratio=float(os.getenv("MAPBOX_BUDGET_HARD", "0.95")),
     )
 
 
@@ -19,3 +19,15 @@ def get_supabase() -> Client:
 	_supabase_client = create_client(url, service_key)
 	return _supabase_client
 
+
+
+def get_user_id(access_token: str) -> Optional[str]:
+	"""Resuelve el usuario de un JWT de Supabase Auth (None si el token no es válido)"""
+	try:
+		res = get_supabase().auth.get_user(access_token)
+	except RuntimeError:
+		raise
+	except Exception:
+		return None
+	user = getattr(res, "user", None)
+	return getattr(user, "id", None)
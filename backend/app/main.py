@@ -1,3 +1,4 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from dotenv import load_dotenv
@@ -33,10 +34,55 @@ except Exception as e:
 # Cargar variables de entorno
 load_dotenv()
 
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Inicia y detiene las tareas de fondo del worker"""
+    from app.services.http_client import start_http_client, close_http_client
+    from app.services.ttl_cache import CacheJanitor
+    from app.services.usage_meter import get_usage_meter
+    await start_http_client()
+    janitor = CacheJanitor()
+    janitor.start()
+    usage_meter = get_usage_meter()
+    usage_meter.start()
+
+    # Índice del geocodificador local, fuera del bucle de eventos; si falla
+    # solo se pierde la geocodificación local (las consultas van a Mapbox)
+    from app.services.local_geocoder import get_local_geocoder
+    try:
+        await get_local_geocoder()
+    except Exception as e:
+        print(f"⚠️ Geocodificador local no disponible: {e}")
+
+    from app.services.cache_warmer import get_cache_warmer, warmer_enabled
+    warmer = get_cache_warmer() if warmer_enabled() else None
+    if warmer is not None:
+        warmer.start()
+
+    scheduler = None
+    if predictions_real is not None:
+        from app.services.prediction_jobs import PredictionScheduler, scheduler_enabled
+        if scheduler_enabled():
+            scheduler = PredictionScheduler()
+            scheduler.start()
+
+    yield
+
+    if scheduler is not None:
+        await scheduler.stop()
+    if warmer is not None:
+        await warmer.stop()
+    await janitor.stop()
+    await usage_meter.stop()
+    await close_http_client()
+
+
 app = FastAPI(
     title="PrediRuta API",
     description="Sistema de predicción de tráfico vehicular con IA",
     version="1.0.0",
+    lifespan=lifespan,
 )
 
 # Configurar CORS
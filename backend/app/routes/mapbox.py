@@ -6,15 +6,28 @@ Endpoints para:
 - Geocodificación
 - Imágenes estáticas
 - Información de tráfico
+- Métricas de las cachés de proveedores, limitadores y circuitos
 """
 
+import asyncio
+
 from fastapi import APIRouter, HTTPException, Query
-from typing import List, Optional, Tuple
-from pydantic import BaseModel
+from typing import List, Literal, Optional, Tuple
+from pydantic import BaseModel, Field
 
 from app.services.mapbox_directions import get_directions, get_route_with_traffic, get_matrix
 from app.services.mapbox_geocoding import geocode_forward, geocode_reverse, search_places
 from app.services.mapbox_static import generate_static_image, generate_route_image, generate_traffic_snapshot
+from app.services.ttl_cache import get_cache_stats
+from app.services.single_flight import get_flight_stats
+from app.services.shared_cache import get_shared_cache_stats
+from app.services.cache_warmer import get_cache_warmer
+from app.services.rate_limiter import get_rate_limiter_stats
+from app.services.circuit_breaker import get_breaker_stats
+from app.services.usage_meter import get_usage_meter
+from app.services.historical_directions import get_historical_directions
+from app.services.local_geocoder import current_local_geocoder
+from app.services.route_shaping import VALID_ANNOTATIONS, shape_directions
 
 
 router = APIRouter(prefix="/api/mapbox", tags=["mapbox"])
@@ -33,6 +46,8 @@ class DirectionsRequest(BaseModel):
     alternatives: Optional[bool] = True
     steps: Optional[bool] = True
     annotations: Optional[List[str]] = None
+    geometry_format: Optional[Literal["geojson", "polyline6"]] = "geojson"
+    zoom: Optional[float] = Field(None, ge=0, le=22)
 
 
 class MarkerModel(BaseModel):
@@ -63,6 +78,41 @@ class StaticImageRequest(BaseModel):
     retina: Optional[bool] = False
 
 
+async def _with_fallback(
+    result: dict,
+    coords: List[Tuple[float, float]],
+    profile: str,
+    geometries: str = "geojson",
+    zoom: Optional[float] = None,
+) -> dict:
+    """
+    Si Mapbox está degradado (5xx, circuito abierto, sin turno en el
+    limitador o sin presupuesto mensual) responde con la ruta estimada con
+    datos históricos, en el mismo formato de geometría pedido (el motor de
+    rutas local corre en un hilo para no bloquear el bucle de eventos)
+    """
+    if result.get("status") != "error" or not (result.get("code", 500) >= 500 or result.get("code") == 429):
+        return result
+    fallback = await asyncio.to_thread(get_historical_directions, coords, profile)
+    if fallback is None:
+        return result
+    return {**shape_directions(fallback, geometries, zoom), "upstream_error": result.get("message")}
+
+
+def _parse_annotations(annotations: Optional[str]) -> Optional[List[str]]:
+    """Lista separada por comas -> anotaciones válidas (400 si alguna no existe)"""
+    if annotations is None:
+        return None
+    values = [a.strip() for a in annotations.split(",") if a.strip()]
+    invalid = [a for a in values if a not in VALID_ANNOTATIONS]
+    if invalid:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Anotaciones no válidas: {', '.join(invalid)}. Opciones: {', '.join(VALID_ANNOTATIONS)}",
+        )
+    return values
+
+
 # ==================== ENDPOINTS ====================
 
 @router.post("/directions")
@@ -84,18 +134,32 @@ async def get_directions_endpoint(request: DirectionsRequest):
             {"longitude": -79.88, "latitude": -2.19}
         ],
         "profile": "driving-traffic",
-        "alternatives": true
+        "alternatives": true,
+        "geometry_format": "polyline6",
+        "zoom": 12
     }
     ```
+    
+    `geometry_format=polyline6` devuelve la geometría codificada (mucho más
+    liviana que GeoJSON) y `zoom` la simplifica a la resolución de ese nivel
+    de zoom; las anotaciones se agregan a los segmentos simplificados.
     """
     coords = [(c.longitude, c.latitude) for c in request.coordinates]
+    if request.annotations:
+        _parse_annotations(",".join(request.annotations))
     
     result = await get_directions(
         coordinates=coords,
         profile=request.profile or "driving-traffic",
         alternatives=request.alternatives,
         steps=request.steps,
+        geometries=request.geometry_format or "geojson",
         annotations=request.annotations or ["duration", "distance", "speed", "congestion"],
+        zoom=request.zoom,
+        hedge=True,
+    )
+    result = await _with_fallback(
+        result, coords, request.profile or "driving-traffic", request.geometry_format or "geojson", request.zoom
     )
     
     if result.get("status") == "error":
@@ -111,17 +175,31 @@ async def get_route_endpoint(
     end_lon: float = Query(..., description="Longitud del punto final"),
     end_lat: float = Query(..., description="Latitud del punto final"),
     alternatives: bool = Query(True, description="Incluir rutas alternativas"),
+    steps: bool = Query(True, description="Incluir instrucciones paso a paso"),
+    geometry_format: Literal["geojson", "polyline6"] = Query("geojson", description="Formato de la geometría"),
+    zoom: Optional[float] = Query(None, ge=0, le=22, description="Simplificar la geometría para este zoom"),
+    annotations: Optional[str] = Query(None, description="Anotaciones separadas por comas (ej: duration,congestion)"),
 ):
     """
     Obtener ruta con información de tráfico entre dos puntos
     
     **Ejemplo:**
     - Manta a Guayaquil: `/route?start_lon=-80.72&start_lat=-0.95&end_lon=-79.88&end_lat=-2.19`
+    - Respuesta compacta para un mapa a zoom 10:
+      `/route?...&steps=false&geometry_format=polyline6&zoom=10&annotations=congestion`
     """
     result = await get_route_with_traffic(
         start=(start_lon, start_lat),
         end=(end_lon, end_lat),
         alternatives=alternatives,
+        steps=steps,
+        geometries=geometry_format,
+        zoom=zoom,
+        annotations=_parse_annotations(annotations),
+        hedge=True,
+    )
+    result = await _with_fallback(
+        result, [(start_lon, start_lat), (end_lon, end_lat)], "driving-traffic", geometry_format, zoom
     )
     
     if result.get("status") == "error":
@@ -160,17 +238,24 @@ async def geocode_forward_endpoint(
 async def geocode_reverse_endpoint(
     longitude: float = Query(..., description="Longitud"),
     latitude: float = Query(..., description="Latitud"),
+    types: Optional[str] = Query(None, description="Tipos separados por comas (ej: place,locality)"),
     language: str = Query("es", description="Idioma de los resultados"),
 ):
     """
     Geocodificación inversa: convertir coordenadas en dirección
     
+    Con `types=place,locality` (o uno de ellos) responde el geocodificador
+    local sin llamar a Mapbox si hay un lugar conocido cerca; sin `types`
+    se consulta Mapbox (direcciones, POIs, barrios...).
+    
     **Ejemplo:**
     - `/geocode/reverse?longitude=-80.72&latitude=-0.95`
+    - Solo ciudad: `/geocode/reverse?longitude=-80.72&latitude=-0.95&types=place`
     """
     result = await geocode_reverse(
         longitude=longitude,
         latitude=latitude,
+        types=[t.strip() for t in types.split(",") if t.strip()] if types else None,
         language=language,
     )
     
@@ -378,3 +463,42 @@ async def get_matrix_endpoint(
         raise HTTPException(status_code=result.get("code", 500), detail=result.get("message"))
     
     return result
+
+
+@router.get("/cache/stats")
+async def cache_stats_endpoint():
+    """
+    Métricas de las cachés en memoria del worker (rutas, geocodificación,
+    tráfico): entradas, bytes estimados, aciertos, fallos, desalojos y
+    expiraciones; aciertos de la caché compartida (L2) y llamadas al
+    proveedor compartidas por coalescencia, estado del calentador y
+    consultas resueltas por el geocodificador local (None si su índice aún
+    no está construido; esta consulta no lo construye).
+    """
+    local = current_local_geocoder()
+    return {
+        "status": "ok",
+        "caches": get_cache_stats(),
+        "compartida": get_shared_cache_stats(),
+        "coalescencia": get_flight_stats(),
+        "calentador": get_cache_warmer().stats(),
+        "geocodificador_local": local.stats() if local is not None else None,
+    }
+
+
+@router.get("/limits/stats")
+async def rate_limit_stats_endpoint():
+    """
+    Estado de los limitadores de tasa por API de Mapbox: tasa vigente (se
+    reduce tras un 429), fichas, solicitudes activas y en cola, espera en
+    cola, rechazos por plazo o cola llena y respuestas 429 recibidas; y de
+    los circuitos: estado, fallos, llamadas lentas, p95 y coberturas; y del
+    consumo mensual por API frente a su cuota y el modo vigente (normal,
+    solo interactivo o solo caché).
+    """
+    return {
+        "status": "ok",
+        "limites": get_rate_limiter_stats(),
+        "circuitos": get_breaker_stats(),
+        "cuotas": get_usage_meter().stats(),
+    }
@@ -10,10 +10,13 @@ Endpoints para la página /predicciones
 
 from fastapi import APIRouter, HTTPException, Query
 from typing import Optional, List, Dict, Any
-from datetime import datetime
+from datetime import datetime, date
 
 from app.services.dataset_loader import get_traffic_dataset
 from app.services.velocity_calculator import VelocityCalculator
+from app.services.forecast_model import get_forecast_model
+from app.services.prediction_jobs import LOCAL_TZ, get_precomputed_forecast, find_precomputed
+from app.services.online_estimator import get_online_estimator
 
 
 router = APIRouter(prefix="/api/v1/predictions", tags=["Predictions Real"])
@@ -135,26 +138,13 @@ async def get_congestion_zones(
     if not dataset.is_loaded:
         raise HTTPException(status_code=503, detail="Dataset no disponible")
     
-    df = dataset._df.copy()
-    
-    if provincia:
-        df = df[df['PROVINCIA_C'].str.upper() == provincia.upper()]
-    
-    # Agrupar por ubicación
-    grouped = df.groupby(['UBICACION_EXCESO', 'CIUDAD_OPER', 'PROVINCIA_C', 'LATITUD', 'LONGITUD']).agg({
-        'VELOCIDAD': ['mean', 'count', 'std']
-    }).reset_index()
-    
-    grouped.columns = ['ubicacion', 'ciudad', 'provincia', 'lat', 'lon', 'velocidad_promedio', 'registros', 'desviacion']
-    
-    # Calcular score de congestión (menor velocidad + más datos = mayor congestión)
-    grouped['congestion_score'] = (120 - grouped['velocidad_promedio']) * (grouped['registros'] / grouped['registros'].max())
+    # Agrupar por ubicación (score: menor velocidad + más datos = mayor congestión)
+    grouped = dataset.get_location_congestion(provincia)
     
     # Top zonas congestionadas
     top_congestion = grouped.nlargest(top, 'congestion_score')
     
     # Top zonas fluidas
-    grouped['flujo_score'] = grouped['velocidad_promedio'] * (grouped['registros'] / grouped['registros'].max())
     top_fluido = grouped.nlargest(top, 'flujo_score')
     
     def format_zone(row):
@@ -181,16 +171,20 @@ async def get_congestion_zones(
 @router.get("/forecast/{ciudad}")
 async def get_traffic_forecast(
     ciudad: str,
-    hora: Optional[int] = Query(None, ge=0, le=23, description="Hora objetivo (0-23)")
+    hora: Optional[int] = Query(None, ge=0, le=23, description="Hora objetivo (0-23)"),
+    fecha: Optional[date] = Query(None, description="Fecha objetivo (YYYY-MM-DD, por defecto hoy)")
 ) -> Dict[str, Any]:
     """
-    Pronóstico de tráfico para una ciudad basado en patrones históricos.
+    Pronóstico de tráfico para una ciudad.
     
     Parámetros:
     - ciudad: Nombre de la ciudad
     - hora: (opcional) Hora específica a predecir
+    - fecha: (opcional) Día a predecir; define día de la semana y mes
     
-    Retorna predicción basada en promedios históricos.
+    Lee primero los pronósticos precomputados en traffic_predictions; si no
+    existen, usa el modelo estadístico entrenado (hora/día/mes por ciudad) y,
+    sin artefacto publicado, los promedios históricos.
     """
     dataset = get_traffic_dataset()
     
@@ -204,31 +198,120 @@ async def get_traffic_forecast(
     if len(ciudad_df) == 0:
         raise HTTPException(status_code=404, detail=f"No hay datos para {ciudad}")
     
+    modelo = get_forecast_model()
+    fecha_obj = fecha or datetime.now(LOCAL_TZ).date()
+    precomputadas = await get_precomputed_forecast(ciudad)
+    
     # Si se especifica hora, filtrar
     if hora is not None and 'HORA' in ciudad_df.columns:
         hora_df = ciudad_df[ciudad_df['HORA'] == hora]
-        if len(hora_df) == 0:
-            raise HTTPException(status_code=404, detail=f"No hay datos para {ciudad} a las {hora}:00")
-        
-        velocidad_pred = hora_df['VELOCIDAD'].mean()
         registros = len(hora_df)
+        fila = find_precomputed(precomputadas, fecha_obj, hora) if precomputadas else None
+        
+        if fila is not None:
+            velocidad_pred = float(fila["predicted_speed"])
+            confianza = float(fila["confidence_score"])
+        elif modelo is not None:
+            pred = modelo.predict_day(ciudad, fecha_obj, [hora])
+            velocidad_pred = float(pred["velocidades"][0])
+            confianza = modelo.confidence(ciudad)
+        else:
+            if registros == 0:
+                raise HTTPException(status_code=404, detail=f"No hay datos para {ciudad} a las {hora}:00")
+            velocidad_pred = hora_df['VELOCIDAD'].mean()
+            confianza = min(0.95, registros / 50)
+        
+        # Ajuste con condiciones actuales si se pronostica la hora en curso
+        ajuste = _live_adjustment(ciudad, fecha_obj, hora)
+        if ajuste is not None:
+            velocidad_pred *= ajuste["factor"]
+        
         nivel = dataset.get_traffic_level(velocidad_pred, 60)
         
         return {
             "ciudad": ciudad,
+            "fecha": fecha_obj.isoformat(),
             "hora_predicha": f"{hora:02d}:00",
             "velocidad_predicha": round(velocidad_pred, 1),
             "nivel_trafico": nivel,
-            "confianza": min(0.95, registros / 50),
-            "registros_historicos": registros
+            "confianza": confianza,
+            "registros_historicos": registros,
+            "modelo": _precomputed_info(fila) if fila is not None else _model_info(modelo, ciudad),
+            "ajuste_en_vivo": ajuste
         }
     
     # Predicción general por hora
     hourly = dataset.get_stats_by_hour(ciudad)
     
+    if modelo is not None:
+        pred = modelo.predict_day(ciudad, fecha_obj)
+        por_hora = {item["hora"]: item for item in hourly}
+        confianza = modelo.confidence(ciudad)
+        hourly = [
+            {
+                "hora": f"{int(h):02d}:00",
+                "velocidad_promedio": round(float(v), 1),
+                "registros": por_hora.get(f"{int(h):02d}:00", {}).get("registros", 0),
+                "confianza": confianza
+            }
+            for h, v in zip(pred["horas"], pred["velocidades"])
+        ]
+    
+    # Superponer las horas que ya están precomputadas para esa fecha
+    info = _model_info(modelo, ciudad)
+    if precomputadas:
+        horas_pre = 0
+        for item in hourly:
+            fila = find_precomputed(precomputadas, fecha_obj, int(item["hora"].split(':')[0]))
+            if fila is not None:
+                item["velocidad_promedio"] = round(float(fila["predicted_speed"]), 1)
+                item["confianza"] = float(fila["confidence_score"])
+                horas_pre += 1
+        if horas_pre:
+            info = {**_precomputed_info(precomputadas[0]), "horas_precomputadas": horas_pre}
+    
+    # Ajuste con condiciones actuales para la hora en curso
+    hora_actual = datetime.now(LOCAL_TZ).hour
+    ajuste = _live_adjustment(ciudad, fecha_obj, hora_actual)
+    if ajuste is not None:
+        for item in hourly:
+            if int(item["hora"].split(':')[0]) == hora_actual:
+                item["velocidad_promedio"] = round(item["velocidad_promedio"] * ajuste["factor"], 1)
+    
     return {
         "ciudad": ciudad,
+        "fecha": fecha_obj.isoformat(),
         "predicciones_por_hora": hourly,
         "resumen": dataset.get_stats_by_city(ciudad),
-        "horas_pico": dataset.get_peak_hours(ciudad)
+        "horas_pico": dataset.get_peak_hours(ciudad),
+        "modelo": info,
+        "ajuste_en_vivo": ajuste
+    }
+
+
+def _live_adjustment(ciudad: str, fecha_obj: date, hora: int) -> Optional[Dict[str, Any]]:
+    """Factor vivo/histórico del estimador en línea (solo para hoy y la hora actual)"""
+    ahora = datetime.now(LOCAL_TZ)
+    if fecha_obj != ahora.date() or hora != ahora.hour:
+        return None
+    return get_online_estimator().city_factor(ciudad, hora)
+
+
+def _precomputed_info(fila: Dict[str, Any]) -> Dict[str, Any]:
+    """Describe una fila leída de traffic_predictions"""
+    return {
+        "tipo": "precomputado",
+        "version": fila.get("model_version"),
+        "calculado": fila.get("prediction_time")
+    }
+
+
+def _model_info(modelo, ciudad: str) -> Dict[str, Any]:
+    """Describe el origen del pronóstico para la respuesta"""
+    if modelo is None:
+        return {"tipo": "promedio_historico", "version": None}
+    return {
+        "tipo": "ridge_hora_dia_mes",
+        "version": modelo.version,
+        "especifico_ciudad": modelo.has_city(ciudad)
     }
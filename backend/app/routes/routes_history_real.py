@@ -5,13 +5,26 @@ API Routes para Rutas e Historial con Datos Reales
 Endpoints que reemplazan datos mock en las páginas de rutas e historial.
 """
 
-from fastapi import APIRouter, HTTPException, Query
+from fastapi import APIRouter, Depends, Header, HTTPException, Query
 from typing import Optional, List, Dict, Any
 from datetime import datetime, timedelta
-import random
+import asyncio
 import numpy as np
 
 from app.services.dataset_loader import get_traffic_dataset
+from app.services.routing_engine import get_routing_engine
+from app.services.city_matrix import get_city_matrix, ROAD_DETOUR_FACTOR
+from app.services.departure_optimizer import VALID_RESOLUTIONS, optimize_for_city_pair, optimize_for_path
+from app.services.mapbox_directions import get_route_with_traffic
+from app.services.prediction_jobs import LOCAL_TZ
+from app.services.history_store import (
+    InvalidCursor,
+    dataset_prediction_history,
+    dataset_route_history,
+    user_prediction_history,
+    user_route_history,
+    user_stats,
+)
 
 
 def convert_numpy_types(obj):
@@ -46,12 +59,17 @@ async def calculate_routes(
     origen_ciudad: str = Query(..., description="Ciudad origen"),
     destino_ciudad: str = Query(..., description="Ciudad destino"),
     evitar_peajes: bool = Query(False, description="Evitar rutas con peajes"),
-    hora: Optional[int] = Query(None, ge=0, le=23, description="Hora del viaje")
+    hora: Optional[int] = Query(None, ge=0, le=23, description="Hora del viaje"),
+    refinar_mapbox: bool = Query(False, description="Refinar la ruta principal con Mapbox (tráfico en vivo)")
 ) -> Dict[str, Any]:
     """
     Calcula rutas entre dos ciudades usando datos reales de velocidad.
     Reemplaza generarRutasSimuladas() en rutas/page.tsx
     
+    Si el grafo vial está construido (python -m app.services.road_graph build),
+    las rutas se calculan localmente sobre la red vial con pesos horarios;
+    en caso contrario se usa la estimación en línea recta.
+    
     Retorna:
     - Múltiples rutas con tiempos calculados basados en velocidades reales
     - Niveles de tráfico por segmento
@@ -72,30 +90,50 @@ async def calculate_routes(
         if 'error' in destino_stats:
             raise HTTPException(status_code=404, detail=f"Ciudad destino {destino_ciudad} no encontrada")
         
-        # Obtener coordenadas
-        df = dataset._df
-        origen_df = df[df['CIUDAD_OPER'].str.upper() == origen_ciudad.upper()]
-        destino_df = df[df['CIUDAD_OPER'].str.upper() == destino_ciudad.upper()]
+        # Coordenadas: centroides de la matriz ciudad×ciudad
+        matrix = get_city_matrix()
+        origen_idx = matrix.index(origen_ciudad) if matrix else None
+        destino_idx = matrix.index(destino_ciudad) if matrix else None
         
-        if len(origen_df) == 0:
+        if origen_idx is None:
             raise HTTPException(status_code=404, detail=f"No se encontraron coordenadas para {origen_ciudad}")
-        if len(destino_df) == 0:
+        if destino_idx is None:
             raise HTTPException(status_code=404, detail=f"No se encontraron coordenadas para {destino_ciudad}")
-        
-        origen_data = origen_df.iloc[0]
-        destino_data = destino_df.iloc[0]
     except HTTPException:
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error calculando ruta: {str(e)}")
     
-    origen_lat, origen_lon = float(origen_data['LATITUD']), float(origen_data['LONGITUD'])
-    destino_lat, destino_lon = float(destino_data['LATITUD']), float(destino_data['LONGITUD'])
+    origen_lat, origen_lon = float(matrix.lat[origen_idx]), float(matrix.lon[origen_idx])
+    destino_lat, destino_lon = float(matrix.lat[destino_idx]), float(matrix.lon[destino_idx])
     
-    # Calcular distancia aproximada (fórmula simple)
-    lat_diff = abs(destino_lat - origen_lat)
-    lon_diff = abs(destino_lon - origen_lon)
-    distancia_km = float(((lat_diff ** 2 + lon_diff ** 2) ** 0.5) * 111)  # 1 grado ≈ 111 km
+    # Motor de rutas local sobre el grafo vial (A* y optimizador fuera del
+    # event loop: son de CPU)
+    engine = get_routing_engine()
+    if engine is not None:
+        local = await asyncio.to_thread(
+            _calculate_local_routes,
+            engine, (origen_lat, origen_lon), (destino_lat, destino_lon),
+            hora, evitar_peajes, origen_stats
+        )
+        if local is not None:
+            local, principal = local
+            if refinar_mapbox:
+                await _refine_with_mapbox(local[0], (origen_lat, origen_lon), (destino_lat, destino_lon))
+            salida = await asyncio.to_thread(optimize_for_path, engine.graph, principal.edges)
+            return {
+                "origen": str(origen_ciudad),
+                "destino": str(destino_ciudad),
+                "rutas": local,
+                "mejor_hora_recomendada": salida["mejor_salida"],
+                "ventana_salida_optima": salida["ventana_optima"],
+                "hora_consulta": f"{hora:02d}:00" if hora is not None else None,
+                "distancia_total_km": local[0]["distancia"],
+                "datos_desde": "grafo_vial_local"
+            }
+    
+    # Distancia de gran círculo entre centroides
+    distancia_km = float(matrix.distance_km[origen_idx, destino_idx])
     
     # Obtener velocidad promedio según hora
     if hora is not None:
@@ -172,128 +210,302 @@ async def calculate_routes(
         "nivel_confianza": 0.65
     })
     
-    # Recomendación de mejor hora
-    peak_hours = dataset.get_peak_hours(origen_ciudad)
+    # Recomendación de mejor hora: ETA del trayecto para cada hora de salida
+    salida = optimize_for_city_pair(matrix, origen_idx, destino_idx)
     
     return {
         "origen": str(origen_ciudad),
         "destino": str(destino_ciudad),
         "rutas": rutas,
-        "mejor_hora_recomendada": peak_hours.get('horas_fluidas', [])[0] if peak_hours else None,
-        "hora_consulta": f"{hora:02d}:00" if hora else None,
+        "mejor_hora_recomendada": salida["mejor_salida"] if salida else None,
+        "ventana_salida_optima": salida["ventana_optima"] if salida else None,
+        "hora_consulta": f"{hora:02d}:00" if hora is not None else None,
         "distancia_total_km": round(float(distancia_km), 1),
         "datos_desde": "dataset_ecuador_2022"
     }
 
 
+def _calculate_local_routes(
+    engine,
+    origen: tuple,
+    destino: tuple,
+    hora: Optional[int],
+    evitar_peajes: bool,
+    origen_stats: Dict[str, Any]
+) -> Optional[tuple]:
+    """
+    Rutas reales sobre el grafo vial con ETA dependiente de la hora.
+    Retorna (rutas, ruta principal del motor) o None si no hay ruta.
+    """
+    if hora is not None:
+        depart_s = hora * 3600
+    else:
+        ahora = datetime.now(LOCAL_TZ)
+        depart_s = ahora.hour * 3600 + ahora.minute * 60
+    
+    result = engine.route(origen, destino, depart_s, k=3, avoid_toll=evitar_peajes)
+    if result.get("status") != "ok":
+        return None
+    
+    dataset = get_traffic_dataset()
+    graph = engine.graph
+    rutas = []
+    for i, path in enumerate(result["paths"]):
+        distancia_km = path.distance_m / 1000
+        duracion_min = path.duration_s / 60
+        velocidad = distancia_km / (path.duration_s / 3600) if path.duration_s > 0 else 0.0
+        # Velocidad a flujo libre (sin factor horario) para clasificar el tráfico
+        libre_s = float(graph.base_time[path.edges].sum()) if len(path.edges) else 0.0
+        velocidad_libre = distancia_km / (libre_s / 3600) if libre_s > 0 else velocidad
+        
+        rutas.append({
+            "id": i + 1,
+            "nombre": "Ruta Principal (más rápida)" if i == 0 else f"Ruta Alternativa {i}",
+            "distancia": round(distancia_km, 1),
+            "duracion": int(duracion_min),
+            "trafico": str(dataset.get_traffic_level(velocidad, velocidad_libre or 60)),
+            "peajes": path.toll,
+            "velocidadPromedio": round(velocidad, 1),
+            "coordenadas": engine.geometry(path),
+            "alternativa": i > 0,
+            "nivel_confianza": float(min(0.9, origen_stats['total_registros'] / 100)) if i == 0 else 0.75,
+            "fuente": "grafo_local"
+        })
+    return rutas, result["paths"][0]
+
+
+async def _refine_with_mapbox(ruta: Dict[str, Any], origen: tuple, destino: tuple) -> None:
+    """Reemplaza duración y distancia de la ruta principal con Mapbox si responde"""
+    data = await get_route_with_traffic(
+        (origen[1], origen[0]), (destino[1], destino[0]), alternatives=False, steps=False, geometries="polyline6"
+    )
+    if data.get("status") != "ok" or not data.get("routes"):
+        return
+    mb = data["routes"][0]
+    ruta["mapbox"] = {
+        "distancia": round(float(mb.get("distance") or 0) / 1000, 1),
+        "duracion": int(float(mb.get("duration") or 0) / 60)
+    }
+    if mb.get("duration"):
+        ruta["duracion"] = ruta["mapbox"]["duracion"]
+        ruta["fuente"] = "grafo_local+mapbox"
+
+
+def _parse_ciudades(valor: Optional[str], matrix) -> List[int]:
+    """Índices de una lista de ciudades separada por comas (todas si está vacía)"""
+    if not valor:
+        return list(range(len(matrix.ciudades)))
+    nombres = [c for c in (v.strip() for v in valor.split(",")) if c]
+    faltantes = [c for c in nombres if matrix.index(c) is None]
+    if faltantes:
+        raise HTTPException(status_code=404, detail=f"Ciudades no encontradas: {', '.join(faltantes)}")
+    return [matrix.index(c) for c in nombres]
+
+
+@router_routes.get("/matrix")
+async def get_routes_matrix(
+    origenes: Optional[str] = Query(None, description="Ciudades origen separadas por comas (todas si se omite)"),
+    destinos: Optional[str] = Query(None, description="Ciudades destino separadas por comas (todas si se omite)"),
+    hora: Optional[int] = Query(None, ge=0, le=23, description="Hora de salida (actual si se omite)"),
+    todas_las_horas: bool = Query(False, description="Incluir el ETA de las 24 horas de salida")
+) -> Dict[str, Any]:
+    """
+    Matriz precalculada de distancias y ETA entre ciudades.
+    
+    - distancia_km: gran círculo entre centroides
+    - eta_min: minutos con la distancia vial aproximada y la velocidad horaria
+    - mejor_hora: hora de salida con menor ETA para cada par
+    """
+    matrix = get_city_matrix()
+    if matrix is None:
+        raise HTTPException(status_code=503, detail="Dataset no disponible")
+    
+    filas = _parse_ciudades(origenes, matrix)
+    columnas = _parse_ciudades(destinos, matrix)
+    hora = hora if hora is not None else datetime.now(LOCAL_TZ).hour
+    sel = np.ix_(filas, columnas)
+    
+    def _redondear(arr: np.ndarray) -> list:
+        return np.round(arr.astype(np.float64), 1).tolist()
+    
+    eta = matrix.eta_min[:, filas][:, :, columnas] if todas_las_horas else matrix.eta_min[hora][sel]
+    
+    return {
+        "origenes": [matrix.ciudades[i] for i in filas],
+        "destinos": [matrix.ciudades[j] for j in columnas],
+        "hora": None if todas_las_horas else hora,
+        "distancia_km": _redondear(matrix.distance_km[sel]),
+        "eta_min": _redondear(eta),
+        "mejor_hora": matrix.best_hour[sel].astype(np.int64).tolist(),
+        "factor_desvio": ROAD_DETOUR_FACTOR,
+        "datos_desde": "dataset_ecuador_2022"
+    }
+
+
+@router_routes.get("/departure-time")
+async def optimize_departure_time(
+    origen_ciudad: str = Query(..., description="Ciudad origen"),
+    destino_ciudad: str = Query(..., description="Ciudad destino"),
+    resolucion_min: int = Query(60, description="Minutos entre salidas evaluadas (15, 30 o 60)"),
+    tolerancia: float = Query(0.05, ge=0, le=1, description="Margen sobre el ETA mínimo para la ventana óptima"),
+    evitar_peajes: bool = Query(False, description="Evitar rutas con peajes")
+) -> Dict[str, Any]:
+    """
+    Evalúa todas las horas de salida del día para un par de ciudades.
+    
+    Retorna la curva de ETA por salida, la mejor salida y la ventana óptima.
+    Usa la ruta principal del grafo vial si está construido; si no, la línea
+    entre centroides con los perfiles horarios del dataset.
+    """
+    if resolucion_min not in VALID_RESOLUTIONS:
+        raise HTTPException(status_code=400, detail=f"resolucion_min debe ser uno de {list(VALID_RESOLUTIONS)}")
+    
+    matrix = get_city_matrix()
+    if matrix is None:
+        raise HTTPException(status_code=503, detail="Dataset no disponible")
+    i, j = matrix.index(origen_ciudad), matrix.index(destino_ciudad)
+    if i is None:
+        raise HTTPException(status_code=404, detail=f"Ciudad origen {origen_ciudad} no encontrada")
+    if j is None:
+        raise HTTPException(status_code=404, detail=f"Ciudad destino {destino_ciudad} no encontrada")
+    
+    resultado = None
+    engine = get_routing_engine()
+    if engine is not None:
+        ahora = datetime.now(LOCAL_TZ)
+        # A* y barrido de salidas son de CPU: fuera del event loop
+        ruta = await asyncio.to_thread(
+            engine.route,
+            (float(matrix.lat[i]), float(matrix.lon[i])), (float(matrix.lat[j]), float(matrix.lon[j])),
+            ahora.hour * 3600 + ahora.minute * 60, k=1, avoid_toll=evitar_peajes
+        )
+        if ruta.get("status") == "ok":
+            path = ruta["paths"][0]
+            resultado = await asyncio.to_thread(optimize_for_path, engine.graph, path.edges, resolucion_min, tolerancia)
+            resultado["distancia_km"] = round(path.distance_m / 1000, 1)
+    
+    if resultado is None:
+        resultado = optimize_for_city_pair(matrix, i, j, resolucion_min, tolerancia)
+        if resultado is None:
+            raise HTTPException(status_code=400, detail="Origen y destino coinciden")
+        resultado["distancia_km"] = round(float(matrix.distance_km[i, j]) * ROAD_DETOUR_FACTOR, 1)
+    
+    return {
+        "origen": matrix.ciudades[i],
+        "destino": matrix.ciudades[j],
+        **resultado
+    }
+
+
 # ============================================
 # ENDPOINTS PARA PÁGINA DE HISTORIAL
 # ============================================
 
+async def _history_user(authorization: Optional[str] = Header(None)) -> Optional[str]:
+    """
+    Usuario del token Bearer de Supabase Auth. Sin token (o sin Supabase
+    configurado) retorna None y el historial se sirve desde el dataset.
+    """
+    if not authorization or not authorization.lower().startswith("bearer "):
+        return None
+    from app.database import get_user_id
+    
+    try:
+        user_id = await asyncio.to_thread(get_user_id, authorization[7:].strip())
+    except RuntimeError:
+        return None
+    if user_id is None:
+        raise HTTPException(status_code=401, detail="Token inválido o expirado")
+    return user_id
+
+
+async def _history_page(fetch, *args) -> Dict[str, Any]:
+    try:
+        return await asyncio.to_thread(fetch, *args)
+    except InvalidCursor as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
 @router_history.get("/routes")
 async def get_route_history(
     ciudad: Optional[str] = Query(None, description="Filtrar por ciudad"),
-    limit: int = Query(20, ge=1, le=100, description="Cantidad de registros")
+    limit: int = Query(20, ge=1, le=100, description="Cantidad de registros"),
+    cursor: Optional[str] = Query(None, description="Cursor de la página siguiente (next_cursor)"),
+    user_id: Optional[str] = Depends(_history_user)
 ) -> Dict[str, Any]:
     """
-    Historial de consultas de rutas basado en datos reales.
+    Historial de rutas paginado por cursor, del más reciente al más antiguo.
     Reemplaza rutasHistorialMock en historial/page.tsx
-    """
-    dataset = get_traffic_dataset()
     
-    if not dataset.is_loaded:
-        raise HTTPException(status_code=503, detail="Dataset no disponible")
-    
-    df = dataset._df.copy()
-    
-    if ciudad:
-        df = df[df['CIUDAD_OPER'].str.upper() == ciudad.upper()]
-    
-    # Agrupar por ciudad y fecha para simular "viajes"
-    if 'FECHA' in df.columns:
-        grouped = df.groupby(['CIUDAD_OPER', 'FECHA', 'UBICACION_EXCESO']).agg({
-            'VELOCIDAD': 'mean',
-            'LATITUD': 'first',
-            'LONGITUD': 'first'
-        }).reset_index().head(limit)
-        
-        historial = []
-        for idx, row in grouped.iterrows():
-            velocidad = float(row['VELOCIDAD'])
-            # Simular origen/destino
-            historial.append({
-                "id": int(idx) + 1,
-                "fecha": str(row['FECHA'])[:16] if row['FECHA'] else "2022-02-15 10:00",
-                "origen": str(row['CIUDAD_OPER']),
-                "destino": str(row['UBICACION_EXCESO'])[:30],
-                "distancia": round(float(random.uniform(5, 50)), 1),
-                "duracion": int((random.uniform(5, 50) / velocidad) * 60) if velocidad > 0 else 20,
-                "tiempoAhorrado": int(random.randint(3, 15)),
-                "trafico": str(dataset.get_traffic_level(velocidad, 60))
-            })
-        
-        return {
-            "total": int(len(historial)),
-            "rutas": historial,
-            "fuente": "dataset_ecuador"
-        }
+    Con token Bearer se lee historial_rutas del usuario; sin token se derivan
+    viajes del dataset.
+    """
+    if user_id is not None:
+        page = await _history_page(user_route_history, user_id, limit, cursor, ciudad)
+        fuente = "historial_rutas"
+    else:
+        if not get_traffic_dataset().is_loaded:
+            raise HTTPException(status_code=503, detail="Dataset no disponible")
+        page = await _history_page(dataset_route_history, limit, cursor, ciudad)
+        fuente = "dataset_ecuador"
     
-    raise HTTPException(status_code=404, detail="No hay datos de historial disponibles")
+    return {
+        "total": len(page["items"]),
+        "rutas": page["items"],
+        "next_cursor": page["next_cursor"],
+        "has_more": page["has_more"],
+        "fuente": fuente
+    }
 
 
 @router_history.get("/predictions")
 async def get_prediction_history(
     ciudad: Optional[str] = Query(None, description="Filtrar por ciudad"),
-    limit: int = Query(15, ge=1, le=50, description="Cantidad de registros")
+    limit: int = Query(15, ge=1, le=50, description="Cantidad de registros"),
+    cursor: Optional[str] = Query(None, description="Cursor de la página siguiente (next_cursor)"),
+    user_id: Optional[str] = Depends(_history_user)
 ) -> Dict[str, Any]:
     """
-    Historial de predicciones basado en datos reales.
+    Historial de predicciones paginado por cursor, del más reciente al más antiguo.
     Reemplaza prediccionesHistorialMock en historial/page.tsx
-    """
-    dataset = get_traffic_dataset()
-    
-    if not dataset.is_loaded:
-        raise HTTPException(status_code=503, detail="Dataset no disponible")
-    
-    df = dataset._df.copy()
     
-    if ciudad:
-        df = df[df['CIUDAD_OPER'].str.upper() == ciudad.upper()]
-    
-    # Agrupar por ciudad, fecha y hora
-    if 'FECHA' in df.columns and 'HORA' in df.columns:
-        grouped = df.groupby(['CIUDAD_OPER', 'FECHA', 'HORA']).agg({
-            'VELOCIDAD': ['mean', 'count']
-        }).reset_index().head(limit)
-        
-        grouped.columns = ['ciudad', 'fecha', 'hora', 'velocidad_real', 'registros']
-        
-        predicciones = []
-        for idx, row in grouped.iterrows():
-            velocidad = row['velocidad_real']
-            congestion = max(0, min(1, (120 - velocidad) / 120))
-            
-            # Simular precisión (mayor cantidad de datos = mayor precisión)
-            precision = min(95, 70 + (row['registros'] / 10))
-            
-            predicciones.append({
-                "id": int(idx) + 1,
-                "fecha": str(row['fecha'])[:10],
-                "zona": row['ciudad'],
-                "horaConsulta": f"{int(row['hora']):02d}:00",
-                "precisionReal": int(precision),
-                "congestionPredicha": round(congestion, 2),
-                "velocidadReal": round(velocidad, 1),
-                "registros": int(row['registros'])
-            })
-        
-        return {
-            "total": len(predicciones),
-            "predicciones": predicciones,
-            "fuente": "dataset_ecuador"
-        }
+    Con token Bearer se lee historial_predicciones del usuario; sin token se
+    usan las velocidades observadas del dataset por ciudad y hora.
+    """
+    if user_id is not None:
+        page = await _history_page(user_prediction_history, user_id, limit, cursor, ciudad)
+        fuente = "historial_predicciones"
+    else:
+        if not get_traffic_dataset().is_loaded:
+            raise HTTPException(status_code=503, detail="Dataset no disponible")
+        page = await _history_page(dataset_prediction_history, limit, cursor, ciudad)
+        fuente = "dataset_ecuador"
     
-    raise HTTPException(status_code=404, detail="No hay datos de predicciones disponibles")
+    return {
+        "total": len(page["items"]),
+        "predicciones": page["items"],
+        "next_cursor": page["next_cursor"],
+        "has_more": page["has_more"],
+        "fuente": fuente
+    }
+
+
+@router_history.get("/user-stats")
+async def get_user_history_stats(
+    user_id: Optional[str] = Depends(_history_user)
+) -> Dict[str, Any]:
+    """
+    Estadísticas del historial del usuario autenticado (token Bearer).
+    Lee una sola fila de estadisticas_historial_usuario, mantenida por
+    triggers, por lo que no depende del tamaño del historial.
+    """
+    if user_id is None:
+        raise HTTPException(status_code=401, detail="Se requiere un token Bearer de Supabase")
+    try:
+        stats = await asyncio.to_thread(user_stats, user_id)
+    except Exception as e:
+        raise HTTPException(status_code=503, detail=f"Estadísticas no disponibles: {str(e)}")
+    return {**stats, "fuente": "estadisticas_historial_usuario"}
 
 
 @router_history.get("/stats")
@@ -1,10 +1,14 @@
 from fastapi import APIRouter, HTTPException, Query
 from typing import Optional, Dict, Any, List, Tuple
-import asyncio
 from pydantic import BaseModel, Field
 from app.database import get_supabase
 
-from app.services.traffic_service import get_traffic_status_for_point
+from app.services.traffic_service import (
+    get_traffic_status_for_point,
+    get_traffic_status_for_points,
+    get_estimated_status_for_point,
+)
+from app.services.traffic_tiles import get_bbox_traffic
 
 
 router = APIRouter(prefix="/api/v1/traffic", tags=["Traffic"])
@@ -23,12 +27,68 @@ def parse_bbox(bbox: str):
         raise HTTPException(status_code=400, detail="Parámetro bbox inválido. Formato: west,south,east,north")
 
 
+# Confianza mínima del estimador para evitar la llamada al proveedor en modo auto
+AUTO_MIN_CONFIDENCE = 0.5
+# Puntos máximos por solicitud en /status:batch
+BATCH_MAX_POINTS = 500
+
+
+def _level_for_ratio(ratio: float) -> str:
+    """Clasificación sencilla del nivel de congestión según velocidad actual / libre"""
+    if ratio >= 0.9:
+        return "free"
+    if ratio >= 0.7:
+        return "moderate"
+    if ratio >= 0.5:
+        return "heavy"
+    return "severe"
+
+
+async def _status_for_point(lat: float, lon: float, fuente: str) -> Dict[str, Any]:
+    """Resuelve un punto según la fuente: live, estimador o auto"""
+    if fuente == "estimador":
+        return get_estimated_status_for_point(lat, lon)
+    if fuente == "auto":
+        estimated = get_estimated_status_for_point(lat, lon)
+        if estimated.get("status") == "ok" and (estimated.get("confidence") or 0) >= AUTO_MIN_CONFIDENCE:
+            return estimated
+    return await get_traffic_status_for_point(lat, lon)
+
+
+async def _status_for_points(points: List[Tuple[float, float]], fuente: str) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+    """
+    Resuelve varios puntos según la fuente. Los que no responde el estimador
+    van juntos a get_traffic_status_for_points (caché por punto y agrupación
+    Matrix). Retorna (estado por punto en el mismo orden, estadísticas).
+    """
+    statuses: List[Optional[Dict[str, Any]]] = [None] * len(points)
+
+    if fuente in ("estimador", "auto"):
+        for i, (la, lo) in enumerate(points):
+            estimated = get_estimated_status_for_point(la, lo)
+            if fuente == "estimador" or (
+                estimated.get("status") == "ok" and (estimated.get("confidence") or 0) >= AUTO_MIN_CONFIDENCE
+            ):
+                statuses[i] = estimated
+
+    pending = [i for i, st in enumerate(statuses) if st is None]
+    stats = {"puntos": len(points), "unicos": 0, "desde_cache": 0, "en_vuelo": 0, "solicitudes": 0, "agrupados": 0}
+    if pending:
+        batch = await get_traffic_status_for_points([points[i] for i in pending])
+        for i, key in zip(pending, batch["keys"]):
+            statuses[i] = batch["results"][key]
+        stats = {**batch["stats"], "puntos": len(points)}
+    stats["estimador"] = len(points) - len(pending)
+    return statuses, stats
+
+
 @router.get("/status")
 async def traffic_status(
     bbox: Optional[str] = Query(None, description="Caja delimitadora west,south,east,north"),
     lat: Optional[float] = Query(None, description="Latitud del punto a consultar"),
     lon: Optional[float] = Query(None, description="Longitud del punto a consultar"),
     threshold: float = Query(0.8, ge=0.1, le=1.0, description="Umbral (0-1) para considerar tráfico: speed < freeFlow*threshold"),
+    fuente: str = Query("live", pattern="^(live|estimador|auto)$", description="live: proveedor; estimador: histórico+vivo sin llamar al proveedor; auto: estimador si tiene confianza suficiente"),
 ) -> Dict[str, Any]:
     """
     Devuelve el estado de tráfico para el centro del bbox o para un punto (lat,lon).
@@ -41,8 +101,14 @@ async def traffic_status(
       "confidence": 0.87,
       "hasTraffic": true,
       "congestionLevel": "moderate",
-      "bbox": [west,south,east,north]
+      "bbox": [west,south,east,north],
+      "age": 12.4,
+      "stale": false
     }
+    `age` son los segundos desde que se obtuvo el dato del proveedor; `stale`
+    indica que se sirvió un valor expirado mientras se refresca en segundo plano.
+    Con bbox, la respuesta combina teselas slippy-map cacheadas y `tiles`
+    detalla el zoom usado y cuántas teselas salieron de caché.
     """
 
     if bbox:
@@ -51,60 +117,45 @@ async def traffic_status(
         lon0 = (west + east) / 2.0
         bbox_list = [west, south, east, north]
 
-        # Muestreo: centro + 4 esquinas
-        points: List[Tuple[float, float]] = [
-            (lat0, lon0),
-            (north, east),
-            (north, west),
-            (south, east),
-            (south, west),
-        ]
-
-        results = await asyncio.gather(*(get_traffic_status_for_point(la, lo) for la, lo in points))
-
-        valid = [r for r in results if r.get("status") == "ok" and r.get("currentSpeed") is not None and r.get("freeFlowSpeed")]
-        if not valid:
-            # Si todos fallan, devolver el primer error con mensaje claro
-            first = results[0] if results else {"status": "unavailable", "code": 502, "message": "Sin resultados del proveedor"}
-            raise HTTPException(status_code=first.get("code", 503), detail=f"Proveedor tráfico no disponible: {first.get('message','')} ")
-
-        # Agregación: promediar velocidades; nivel por peor ratio
-        avg_current = sum(v.get("currentSpeed", 0) for v in valid) / len(valid)
-        avg_free = sum(v.get("freeFlowSpeed", 0) for v in valid) / len(valid)
-        worst_ratio = min((v.get("currentSpeed", 0) / v.get("freeFlowSpeed", 1)) for v in valid)
-        conf = max((v.get("confidence", 0) or 0) for v in valid)
-        provider = valid[0].get("provider")
-
-        current, freeflow = avg_current, avg_free
+        async def resolve(points: List[Tuple[float, float]]) -> List[Dict[str, Any]]:
+            statuses, _ = await _status_for_points(points, fuente)
+            return statuses
+
+        # Rejilla de teselas: los puntos de las teselas sin caché se resuelven en un lote
+        agg = await get_bbox_traffic(west, south, east, north, resolve=resolve, fuente=fuente)
+        if agg.get("status") != "ok":
+            raise HTTPException(status_code=agg.get("code", 503), detail=f"Proveedor tráfico no disponible: {agg.get('message','')} ")
+
+        # Agregación: velocidades ponderadas por área; nivel por peor ratio
+        current, freeflow = agg["currentSpeed"], agg["freeFlowSpeed"]
+        worst_ratio = agg["worstRatio"]
+        conf = agg["confidence"]
+        provider = agg["provider"]
+        age = agg["age"]
+        stale = agg["stale"]
+        tiles = agg["tiles"]
     else:
         if lat is None or lon is None:
             raise HTTPException(status_code=400, detail="Proporcione bbox o lat y lon")
         lat0, lon0 = lat, lon
         bbox_list = None
+        tiles = None
 
-        status = await get_traffic_status_for_point(lat0, lon0)
+        status = await _status_for_point(lat0, lon0, fuente)
         if status.get("status") == "unavailable":
             raise HTTPException(status_code=status.get("code", 503), detail=f"Proveedor tráfico no disponible: {status.get('message','')}")
         current = status.get("currentSpeed")
         freeflow = status.get("freeFlowSpeed")
         conf = status.get("confidence")
         provider = status.get("provider")
+        age = status.get("age")
+        stale = bool(status.get("stale"))
         if current is None or freeflow is None or freeflow <= 0:
             raise HTTPException(status_code=502, detail="Respuesta del proveedor incompleta")
         worst_ratio = current / freeflow if freeflow > 0 else 1
 
     has_traffic = current < freeflow * threshold
-
-    # Clasificación sencilla del nivel de congestión según worst_ratio
-    ratio = worst_ratio
-    if ratio >= 0.9:
-        level = "free"
-    elif ratio >= 0.7:
-        level = "moderate"
-    elif ratio >= 0.5:
-        level = "heavy"
-    else:
-        level = "severe"
+    level = _level_for_ratio(worst_ratio)
 
     return {
         "provider": provider,
@@ -115,6 +166,68 @@ async def traffic_status(
         "hasTraffic": has_traffic,
         "congestionLevel": level,
         "bbox": bbox_list,
+        "age": age,
+        "stale": stale,
+        "tiles": tiles,
+    }
+
+
+class TrafficPoint(BaseModel):
+    lat: float = Field(ge=-90, le=90)
+    lon: float = Field(ge=-180, le=180)
+
+
+class TrafficBatchRequest(BaseModel):
+    points: List[TrafficPoint] = Field(min_length=1, max_length=BATCH_MAX_POINTS)
+    threshold: float = Field(0.8, ge=0.1, le=1.0)
+    fuente: str = Field("live", pattern="^(live|estimador|auto)$")
+
+
+def _batch_item(lat: float, lon: float, status: Dict[str, Any], threshold: float) -> Dict[str, Any]:
+    current = status.get("currentSpeed")
+    freeflow = status.get("freeFlowSpeed")
+    if status.get("status") != "ok" or current is None or not freeflow:
+        return {
+            "lat": lat,
+            "lon": lon,
+            "status": "unavailable",
+            "code": status.get("code", 502),
+            "message": status.get("message", "Respuesta del proveedor incompleta"),
+        }
+    return {
+        "lat": lat,
+        "lon": lon,
+        "status": "ok",
+        "provider": status.get("provider"),
+        "currentSpeed": current,
+        "freeFlowSpeed": freeflow,
+        "confidence": status.get("confidence"),
+        "hasTraffic": current < freeflow * threshold,
+        "congestionLevel": _level_for_ratio(current / freeflow),
+        "age": status.get("age"),
+        "stale": bool(status.get("stale")),
+    }
+
+
+@router.post("/status:batch")
+async def traffic_status_batch(payload: TrafficBatchRequest) -> Dict[str, Any]:
+    """
+    Estado de tráfico para muchos puntos en una sola solicitud (marcadores de
+    mapa). Los puntos se deduplican por celda de ~100 m, los aciertos de
+    caché se sirven directamente y los fallos se resuelven agrupando puntos
+    cercanos en una misma solicitud Matrix (o Directions, según
+    TRAFFIC_BATCH_RESOLVER).
+
+    Body: {"points": [{"lat": -0.95, "lon": -80.72}, ...], "threshold": 0.8, "fuente": "live"}
+
+    Retorna un resultado por punto, en el mismo orden de entrada.
+    """
+    points = [(p.lat, p.lon) for p in payload.points]
+    statuses, stats = await _status_for_points(points, payload.fuente)
+
+    return {
+        "results": [_batch_item(la, lo, st, payload.threshold) for (la, lo), st in zip(points, statuses)],
+        "stats": stats,
     }
 
 
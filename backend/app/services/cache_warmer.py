@@ -0,0 +1,284 @@
+"""
+Calentador de Caché de Puntos Calientes
+=======================================
+
+Mantiene calientes las claves más consultadas de las cachés de tráfico y
+rutas, refrescándolas antes de que expiren:
+
+- Los servicios registran cada consulta (track) con la clave de caché y los
+  argumentos necesarios para repetirla
+- Frecuencia con decaimiento exponencial (vida media configurable), así las
+  horas pico recientes pesan más que el histórico
+- Semillas fijas: ciudades de ECUADOR_CITIES y zonas de mayor congestión
+  del dataset
+- En cada ciclo se refrescan las top-K claves que expiran pronto (o ya
+  expiraron), en orden de frecuencia y sin superar el presupuesto de
+  solicitudes al proveedor por minuto
+
+Cada servicio registra su función de refresco con register_refresher(); el
+calentador no importa los servicios, para no crear ciclos. Sus llamadas al
+proveedor van con prioridad de segundo plano en el limitador de tasa.
+
+Autor: PrediRuta Team
+"""
+
+import os
+import math
+import time
+import asyncio
+import threading
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional, Tuple
+
+from app.services.rate_limiter import background_priority
+
+
+WARMER_INTERVAL = float(os.getenv("CACHE_WARMER_INTERVAL", "10"))
+WARMER_TOP_K = int(os.getenv("CACHE_WARMER_TOP_K", "50"))
+WARMER_BUDGET_PER_MINUTE = float(os.getenv("CACHE_WARMER_BUDGET_PER_MINUTE", "30"))
+WARMER_HALF_LIFE = float(os.getenv("CACHE_WARMER_HALF_LIFE", "600"))
+WARMER_CONCURRENCY = int(os.getenv("CACHE_WARMER_CONCURRENCY", "4"))
+# Claves rastreadas por espacio de nombres antes de podar las menos frecuentes
+MAX_TRACKED_KEYS = 5000
+# Frecuencia mínima (consultas decaídas) para que una clave se refresque
+MIN_SCORE = 0.5
+SEED_SCORE = 1.0
+SEED_CONGESTION_ZONES = 10
+
+
+class _Refresher:
+    __slots__ = ("refresh", "ttl_remaining")
+
+    def __init__(self, refresh, ttl_remaining):
+        self.refresh = refresh
+        self.ttl_remaining = ttl_remaining
+
+
+class HotKeyTracker:
+    """Frecuencia decaída por (espacio de nombres, clave) con los argumentos para repetirla"""
+
+    def __init__(self, half_life: float = WARMER_HALF_LIFE, max_keys: int = MAX_TRACKED_KEYS):
+        self._rate = math.log(2) / half_life
+        self.max_keys = max_keys
+        self._lock = threading.Lock()
+        # namespace -> clave -> [puntaje, timestamp, args, semilla]
+        self._keys: Dict[str, Dict[Hashable, list]] = {}
+
+    def _decayed(self, item: list, now: float) -> float:
+        return max(item[0] * math.exp(-self._rate * (now - item[1])), item[3])
+
+    def track(self, namespace: str, key: Hashable, args: Any, weight: float = 1.0) -> None:
+        now = time.time()
+        with self._lock:
+            keys = self._keys.setdefault(namespace, {})
+            item = keys.get(key)
+            if item is None:
+                keys[key] = [weight, now, args, 0.0]
+                if len(keys) > self.max_keys:
+                    self._prune(keys, now)
+            else:
+                item[0] = item[0] * math.exp(-self._rate * (now - item[1])) + weight
+                item[1] = now
+                item[2] = args
+
+    def seed(self, namespace: str, key: Hashable, args: Any, score: float = SEED_SCORE) -> None:
+        """Clave fija con un puntaje mínimo que no decae"""
+        with self._lock:
+            keys = self._keys.setdefault(namespace, {})
+            item = keys.get(key)
+            if item is None:
+                keys[key] = [0.0, time.time(), args, score]
+            else:
+                item[3] = max(item[3], score)
+
+    def _prune(self, keys: Dict[Hashable, list], now: float) -> None:
+        ranked = sorted(keys.items(), key=lambda kv: self._decayed(kv[1], now))
+        for key, _ in ranked[: len(keys) - self.max_keys // 2]:
+            del keys[key]
+
+    def top(self, namespace: str, k: int, min_score: float = MIN_SCORE) -> List[Tuple[Hashable, float, Any]]:
+        now = time.time()
+        with self._lock:
+            items = [
+                (key, self._decayed(item, now), item[2])
+                for key, item in self._keys.get(namespace, {}).items()
+            ]
+        items = [it for it in items if it[1] >= min_score]
+        items.sort(key=lambda it: it[1], reverse=True)
+        return items[:k]
+
+    def size(self, namespace: str) -> int:
+        return len(self._keys.get(namespace, {}))
+
+
+_tracker = HotKeyTracker()
+_refreshers: Dict[str, _Refresher] = {}
+
+
+def track(namespace: str, key: Hashable, args: Any) -> None:
+    """Registra una consulta a la clave (la llaman los servicios en cada solicitud)"""
+    if namespace in _refreshers:
+        _tracker.track(namespace, key, args)
+
+
+def register_refresher(
+    namespace: str,
+    refresh: Callable[[Any], Awaitable[Any]],
+    ttl_remaining: Callable[[Hashable], Optional[float]],
+) -> None:
+    """
+    Registra cómo refrescar las claves de un espacio de nombres: `refresh(args)`
+    consulta al proveedor sin pasar por la caché y guarda el resultado.
+    """
+    _refreshers[namespace] = _Refresher(refresh, ttl_remaining)
+
+
+def get_tracker() -> HotKeyTracker:
+    return _tracker
+
+
+def seed_hotspots() -> int:
+    """Semillas de tráfico: ciudades principales y zonas de mayor congestión"""
+    from app.config.mapbox import ECUADOR_CITIES
+    from app.services.traffic_service import _cache_key
+
+    points: List[Tuple[float, float]] = [(c["coords"][0], c["coords"][1]) for c in ECUADOR_CITIES]
+    try:
+        from app.services.dataset_loader import get_traffic_dataset
+
+        dataset = get_traffic_dataset()
+        if dataset.is_loaded:
+            zones = dataset.get_location_congestion().nlargest(SEED_CONGESTION_ZONES, 'congestion_score')
+            points.extend(zip(zones['lat'].astype(float), zones['lon'].astype(float)))
+    except Exception as e:
+        print(f"⚠️ Sin zonas de congestión para el calentador: {e}")
+
+    for lat, lon in points:
+        _tracker.seed("traffic", _cache_key(lat, lon), (lat, lon))
+    return len(points)
+
+
+class CacheWarmer:
+    """Refresca periódicamente las claves más consultadas antes de que expiren"""
+
+    def __init__(
+        self,
+        interval_seconds: float = WARMER_INTERVAL,
+        top_k: int = WARMER_TOP_K,
+        budget_per_minute: float = WARMER_BUDGET_PER_MINUTE,
+    ):
+        self.interval = interval_seconds
+        self.top_k = top_k
+        self.budget_per_minute = budget_per_minute
+        self._task: Optional[asyncio.Task] = None
+        # Presupuesto como cubeta de fichas: se recarga por tiempo transcurrido
+        self._tokens = budget_per_minute * interval_seconds / 60.0
+        self._last_fill = time.time()
+        self.refreshed = 0
+        self.failed = 0
+        self.skipped_budget = 0
+        self.last_run: Optional[Dict[str, Any]] = None
+
+    def _fill(self) -> None:
+        now = time.time()
+        # Como máximo el presupuesto de un minuto acumulado
+        self._tokens = min(
+            self.budget_per_minute,
+            self._tokens + (now - self._last_fill) * self.budget_per_minute / 60.0,
+        )
+        self._last_fill = now
+
+    def _candidates(self) -> List[Tuple[float, str, Hashable, Any]]:
+        """(puntaje, espacio, clave, args) de las top-K claves que expiran antes del próximo ciclo"""
+        lead = self.interval * 1.5
+        out = []
+        for namespace, refresher in _refreshers.items():
+            for key, score, args in _tracker.top(namespace, self.top_k):
+                remaining = refresher.ttl_remaining(key)
+                if remaining is None or remaining <= lead:
+                    out.append((score, namespace, key, args))
+        out.sort(key=lambda c: c[0], reverse=True)
+        return out[: self.top_k]
+
+    async def run_once(self) -> Dict[str, Any]:
+        self._fill()
+        candidates = self._candidates()
+        allowed = int(self._tokens)
+        selected = candidates[:allowed]
+        self._tokens -= len(selected)
+        self.skipped_budget += len(candidates) - len(selected)
+
+        semaphore = asyncio.Semaphore(WARMER_CONCURRENCY)
+
+        async def refresh(namespace: str, args: Any) -> bool:
+            async with semaphore:
+                try:
+                    result = await _refreshers[namespace].refresh(args)
+                except Exception as e:
+                    print(f"⚠️ Error refrescando caché {namespace}: {e}")
+                    return False
+                return isinstance(result, dict) and result.get("status") == "ok"
+
+        with background_priority():
+            results = await asyncio.gather(*(refresh(ns, args) for _, ns, _, args in selected))
+        ok = sum(results)
+        self.refreshed += ok
+        self.failed += len(results) - ok
+        self.last_run = {
+            "candidatas": len(candidates),
+            "refrescadas": ok,
+            "fallidas": len(results) - ok,
+            "sin_presupuesto": len(candidates) - len(selected),
+            "timestamp": time.time(),
+        }
+        return self.last_run
+
+    async def _loop(self):
+        seed_hotspots()
+        while True:
+            try:
+                await self.run_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"⚠️ Error en el calentador de caché: {e}")
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "activo": self._task is not None,
+            "intervalo_s": self.interval,
+            "top_k": self.top_k,
+            "presupuesto_por_minuto": self.budget_per_minute,
+            "claves_rastreadas": {ns: _tracker.size(ns) for ns in _refreshers},
+            "refrescadas": self.refreshed,
+            "fallidas": self.failed,
+            "omitidas_por_presupuesto": self.skipped_budget,
+            "ultimo_ciclo": self.last_run,
+        }
+
+
+_warmer: Optional[CacheWarmer] = None
+
+
+def get_cache_warmer() -> CacheWarmer:
+    global _warmer
+    if _warmer is None:
+        _warmer = CacheWarmer()
+    return _warmer
+
+
+def warmer_enabled() -> bool:
+    return os.getenv("CACHE_WARMER_ENABLED", "false").lower() in ("1", "true", "yes")
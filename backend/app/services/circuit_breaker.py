@@ -0,0 +1,177 @@
+"""
+Cortocircuito por API de Mapbox
+===============================
+
+Protege a los workers cuando Mapbox se degrada: en lugar de que cada
+solicitud espere su timeout completo, el circuito se abre y las llamadas
+fallan de inmediato (CircuitOpenError) para que el servicio use su
+alternativa histórica.
+
+- Cerrado: se registran resultado y latencia de cada llamada en una
+  ventana deslizante
+- Abierto: si en la ventana hay al menos BREAKER_MIN_CALLS llamadas y la
+  proporción de errores (5xx, errores de conexión) o llamadas lentas supera
+  BREAKER_FAILURE_RATIO; dura BREAKER_OPEN_SECONDS
+- Semiabierto: se dejan pasar BREAKER_HALF_OPEN_CALLS llamadas de prueba;
+  si todas salen bien se cierra, con el primer fallo se vuelve a abrir
+
+También lleva el p95 de latencia de las llamadas correctas, que usa
+mapbox_request() como retardo de las solicitudes de cobertura (hedging).
+
+Autor: PrediRuta Team
+"""
+
+import os
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Optional, Tuple
+
+import numpy as np
+
+
+BREAKER_WINDOW_SECONDS = float(os.getenv("MAPBOX_BREAKER_WINDOW", "60"))
+BREAKER_MIN_CALLS = int(os.getenv("MAPBOX_BREAKER_MIN_CALLS", "10"))
+BREAKER_FAILURE_RATIO = float(os.getenv("MAPBOX_BREAKER_FAILURE_RATIO", "0.5"))
+BREAKER_SLOW_CALL_SECONDS = float(os.getenv("MAPBOX_BREAKER_SLOW_CALL", "5"))
+BREAKER_OPEN_SECONDS = float(os.getenv("MAPBOX_BREAKER_OPEN_SECONDS", "30"))
+BREAKER_HALF_OPEN_CALLS = 3
+# Latencias recientes para el p95 y mínimo de muestras para usarlo
+LATENCY_SAMPLES = 200
+LATENCY_MIN_SAMPLES = 20
+
+CLOSED = "cerrado"
+OPEN = "abierto"
+HALF_OPEN = "semiabierto"
+
+
+class CircuitOpenError(Exception):
+    """El circuito de la API está abierto: la llamada no se envía"""
+
+    def __init__(self, api: str, retry_in: float):
+        self.api = api
+        self.retry_in = retry_in
+        super().__init__(f"Mapbox {api} degradado: circuito abierto, reintento en {retry_in:.0f} s")
+
+
+_registry: Dict[str, "CircuitBreaker"] = {}
+
+
+class CircuitBreaker:
+    """Estado cerrado / abierto / semiabierto según errores y latencia recientes"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.state = CLOSED
+        self._opened_at = 0.0
+        self._trials = 0
+        self._trial_ok = 0
+        # (timestamp, fallo)
+        self._calls: Deque[Tuple[float, bool]] = deque()
+        self._latencies: Deque[float] = deque(maxlen=LATENCY_SAMPLES)
+        self.opened = 0
+        self.short_circuited = 0
+        self.failures = 0
+        self.slow_calls = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+        _registry[name] = self
+
+    def _trim(self, now: float) -> None:
+        while self._calls and self._calls[0][0] < now - BREAKER_WINDOW_SECONDS:
+            self._calls.popleft()
+
+    def _open(self, now: float) -> None:
+        self.state = OPEN
+        self._opened_at = now
+        self.opened += 1
+        print(f"⚠️ Circuito de Mapbox {self.name} abierto durante {BREAKER_OPEN_SECONDS:.0f} s")
+
+    def allow(self) -> None:
+        """Lanza CircuitOpenError si la llamada no debe enviarse"""
+        now = time.time()
+        if self.state == OPEN:
+            remaining = self._opened_at + BREAKER_OPEN_SECONDS - now
+            if remaining > 0:
+                self.short_circuited += 1
+                raise CircuitOpenError(self.name, remaining)
+            self.state = HALF_OPEN
+            self._trials = 0
+            self._trial_ok = 0
+        if self.state == HALF_OPEN:
+            if self._trials >= BREAKER_HALF_OPEN_CALLS:
+                self.short_circuited += 1
+                raise CircuitOpenError(self.name, 0.0)
+            self._trials += 1
+
+    def record(self, latency: float, failed: bool) -> None:
+        """Resultado de una llamada enviada (fallo = 5xx o error de conexión)"""
+        now = time.time()
+        slow = latency >= BREAKER_SLOW_CALL_SECONDS
+        if failed:
+            self.failures += 1
+        else:
+            self._latencies.append(latency)
+        if slow:
+            self.slow_calls += 1
+        bad = failed or slow
+
+        if self.state == HALF_OPEN:
+            if bad:
+                self._open(now)
+                return
+            self._trial_ok += 1
+            if self._trial_ok >= BREAKER_HALF_OPEN_CALLS:
+                self.state = CLOSED
+                self._calls.clear()
+            return
+        if self.state == OPEN:
+            # Llamadas enviadas antes de abrir que terminan ahora
+            return
+
+        self._calls.append((now, bad))
+        self._trim(now)
+        if len(self._calls) >= BREAKER_MIN_CALLS:
+            ratio = sum(1 for _, b in self._calls if b) / len(self._calls)
+            if ratio >= BREAKER_FAILURE_RATIO:
+                self._open(now)
+
+    def release_trial(self) -> None:
+        """Devuelve el turno de prueba de una llamada semiabierta que no llegó a enviarse"""
+        if self.state == HALF_OPEN and self._trials > 0:
+            self._trials -= 1
+
+    def p95(self) -> Optional[float]:
+        """p95 de latencia (s) de las llamadas correctas recientes"""
+        if len(self._latencies) < LATENCY_MIN_SAMPLES:
+            return None
+        return float(np.percentile(np.fromiter(self._latencies, dtype=np.float64), 95))
+
+    def stats(self) -> Dict[str, Any]:
+        now = time.time()
+        self._trim(now)
+        p95 = self.p95()
+        return {
+            "estado": self.state,
+            "reintento_en_s": round(max(0.0, self._opened_at + BREAKER_OPEN_SECONDS - now), 1) if self.state == OPEN else None,
+            "llamadas_ventana": len(self._calls),
+            "fallos_ventana": sum(1 for _, b in self._calls if b),
+            "aperturas": self.opened,
+            "cortocircuitadas": self.short_circuited,
+            "fallos": self.failures,
+            "lentas": self.slow_calls,
+            "p95_ms": round(p95 * 1000, 1) if p95 is not None else None,
+            "coberturas": self.hedged,
+            "coberturas_ganadoras": self.hedge_wins,
+        }
+
+
+def get_circuit_breaker(api: str) -> CircuitBreaker:
+    breaker = _registry.get(api)
+    if breaker is None:
+        breaker = CircuitBreaker(api)
+    return breaker
+
+
+def get_breaker_stats() -> Dict[str, Dict[str, Any]]:
+    """Estado de los circuitos de todas las APIs"""
+    return {name: breaker.stats() for name, breaker in _registry.items()}
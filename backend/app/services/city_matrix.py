@@ -0,0 +1,133 @@
+"""
+Matriz Ciudad×Ciudad de Distancias y ETA
+========================================
+
+Precalcula para todos los pares de ciudades del dataset:
+
+- Distancia de gran círculo (Haversine vectorizado sobre los centroides)
+- ETA por hora de salida (24×C×C) con la distancia vial aproximada
+  (distancia × factor de desvío) y la velocidad horaria media de ambas
+  ciudades
+- Mejor hora de salida por par (argmin sobre las 24 horas)
+
+Todo se guarda como arrays float32 en memoria; las consultas de pares son
+búsquedas por índice. Se construye una vez por worker al primer uso.
+
+Autor: PrediRuta Team
+"""
+
+import os
+import threading
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from app.services.dataset_loader import get_traffic_dataset
+
+
+EARTH_RADIUS_KM = 6371.0088
+# Relación típica distancia por carretera / línea recta en la red vial
+ROAD_DETOUR_FACTOR = float(os.getenv("CITY_MATRIX_DETOUR_FACTOR", "1.3"))
+
+
+def haversine_matrix(lat_a, lon_a, lat_b=None, lon_b=None) -> np.ndarray:
+    """Distancias de gran círculo (km) entre todos los puntos de A y B"""
+    if lat_b is None:
+        lat_b, lon_b = lat_a, lon_a
+    la = np.radians(np.asarray(lat_a, dtype=np.float64))[:, None]
+    oa = np.radians(np.asarray(lon_a, dtype=np.float64))[:, None]
+    lb = np.radians(np.asarray(lat_b, dtype=np.float64))[None, :]
+    ob = np.radians(np.asarray(lon_b, dtype=np.float64))[None, :]
+    h = np.sin((lb - la) / 2) ** 2 + np.cos(la) * np.cos(lb) * np.sin((ob - oa) / 2) ** 2
+    return (2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(h, 0.0, 1.0)))).astype(np.float32)
+
+
+@dataclass
+class CityMatrix:
+    """Tablas densas indexadas por la posición de la ciudad en `ciudades`"""
+
+    ciudades: List[str]
+    lat: np.ndarray            # (C,) float32
+    lon: np.ndarray            # (C,) float32
+    distance_km: np.ndarray    # (C, C) float32, gran círculo
+    speed_kmh: np.ndarray      # (C, 24) float32
+    eta_min: np.ndarray        # (24, C, C) float32
+    best_hour: np.ndarray      # (C, C) int8
+    _index: Dict[str, int] = field(default_factory=dict, repr=False)
+
+    def __post_init__(self):
+        self._index = {c: i for i, c in enumerate(self.ciudades)}
+
+    def index(self, ciudad: str) -> Optional[int]:
+        return self._index.get(ciudad.strip().upper())
+
+    def centroid(self, ciudad: str) -> Optional[tuple]:
+        i = self.index(ciudad)
+        if i is None:
+            return None
+        return float(self.lat[i]), float(self.lon[i])
+
+    def pair(self, origen: str, destino: str) -> Optional[Dict[str, Any]]:
+        """Distancia, curva de ETA por hora y mejor hora para un par de ciudades"""
+        i, j = self.index(origen), self.index(destino)
+        if i is None or j is None:
+            return None
+        return {
+            "distancia_km": round(float(self.distance_km[i, j]), 1),
+            "distancia_vial_km": round(float(self.distance_km[i, j]) * ROAD_DETOUR_FACTOR, 1),
+            "eta_min": np.round(self.eta_min[:, i, j].astype(np.float64), 1).tolist(),
+            "mejor_hora": int(self.best_hour[i, j]),
+        }
+
+    @property
+    def nbytes(self) -> int:
+        return int(sum(a.nbytes for a in (
+            self.lat, self.lon, self.distance_km, self.speed_kmh, self.eta_min, self.best_hour
+        )))
+
+
+def build_city_matrix() -> Optional[CityMatrix]:
+    """Construye la matriz a partir de los centroides del dataset"""
+    dataset = get_traffic_dataset()
+    if not dataset.is_loaded:
+        return None
+
+    centroids = dataset.get_city_centroids()
+    if len(centroids) == 0:
+        return None
+    ciudades = centroids.index.tolist()
+    lat = centroids['lat'].to_numpy(dtype=np.float32)
+    lon = centroids['lon'].to_numpy(dtype=np.float32)
+
+    distance = haversine_matrix(lat, lon)
+    speed = dataset.get_city_hourly_matrix(ciudades)
+
+    # Velocidad del par por hora: media de origen y destino -> (24, C, C)
+    pair_speed = 0.5 * (speed.T[:, :, None] + speed.T[:, None, :])
+    eta = (distance[None, :, :] * ROAD_DETOUR_FACTOR) / np.maximum(pair_speed, 1.0) * 60.0
+    eta = eta.astype(np.float32)
+
+    return CityMatrix(
+        ciudades=ciudades,
+        lat=lat,
+        lon=lon,
+        distance_km=distance,
+        speed_kmh=speed,
+        eta_min=eta,
+        best_hour=eta.argmin(axis=0).astype(np.int8),
+    )
+
+
+_matrix: Optional[CityMatrix] = None
+_matrix_lock = threading.Lock()
+
+
+def get_city_matrix() -> Optional[CityMatrix]:
+    """Matriz del worker (None si el dataset no está disponible)"""
+    global _matrix
+    if _matrix is None:
+        with _matrix_lock:
+            if _matrix is None:
+                _matrix = build_city_matrix()
+    return _matrix
@@ -0,0 +1,706 @@
+"""
+Jerarquía de Contracción (CH) del Grafo Vial
+============================================
+
+Preprocesamiento offline para consultas de larga distancia (p. ej.
+Manta → Quito) que en el grafo completo explorarían gran parte de la red.
+
+- Contracción por rondas de conjuntos independientes (prioridad: diferencia
+  de aristas + vecinos eliminados + nivel), con búsquedas de testigos
+  acotadas y vectorizadas sobre arrays CSR
+- Pesos de referencia: tiempo a flujo libre; el ETA dependiente de la hora
+  se calcula después sobre la ruta desempaquetada
+- Resultado guardado como arrays .npy junto al grafo (<ROAD_GRAPH_DIR>/ch) y
+  cargado con mmap_mode='r': todos los workers comparten una sola copia
+  mapeada en memoria
+- Consulta: Dijkstra bidireccional ascendente con stall-on-demand;
+  alternativas por nodos vía (solo se desempaquetan las elegidas)
+
+Uso:
+    python -m app.services.contraction_hierarchy build
+    python -m app.services.contraction_hierarchy info
+    python -m app.services.contraction_hierarchy bench --pairs 1000
+
+Autor: PrediRuta Team
+"""
+
+import json
+import heapq
+import time
+import argparse
+import threading
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from app.services.road_graph import GRAPH_DIR, RoadGraph, load_graph
+
+
+CH_DIR = GRAPH_DIR / "ch"
+# Versión del formato de arrays (se reconstruye si no coincide)
+CH_FORMAT = 2
+# Búsqueda de testigos acotada: saltos máximos y nodos más cercanos que se
+# expanden por origen en cada salto. La simulación de prioridades usa una
+# búsqueda más corta: solo estima cuántos atajos agregaría cada nodo
+WITNESS_HOPS = 6
+WITNESS_FRONTIER = 16
+PRIORITY_HOPS = 2
+PRIORITY_FRONTIER = 8
+# Aristas entrantes por lote (limita la memoria de la expansión vectorizada)
+WITNESS_BATCH = 100_000
+
+INF = float("inf")
+
+_ARRAYS = (
+    "rank", "ch_tail", "ch_head", "ch_weight", "ch_length", "ch_orig", "ch_c1", "ch_c2",
+    "fwd_indptr", "fwd_edges", "fwd_heads", "fwd_weights",
+    "bwd_indptr", "bwd_edges", "bwd_tails", "bwd_weights",
+)
+
+
+# ============================================
+# CONSTRUCCIÓN
+# ============================================
+
+def _indptr(keys: np.ndarray, n: int) -> np.ndarray:
+    indptr = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(np.bincount(keys, minlength=n), out=indptr[1:])
+    return indptr
+
+
+def _expand(indptr: np.ndarray, nodes: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Posiciones CSR de las aristas de cada nodo de `nodes`, agrupadas en el
+    mismo orden: (índice en `nodes`, posición en el CSR)
+    """
+    start = indptr[nodes]
+    counts = indptr[nodes + 1] - start
+    rep = np.repeat(np.arange(len(nodes), dtype=np.int64), counts)
+    offsets = np.cumsum(counts) - counts
+    return rep, start[rep] + np.arange(rep.size, dtype=np.int64) - offsets[rep]
+
+
+def _min_by_key(keys: np.ndarray, values: np.ndarray, *extra: np.ndarray):
+    """Deja una fila por clave (la de menor valor); devuelve las filas ordenadas por clave"""
+    order = np.lexsort((values, keys))
+    keys = keys[order]
+    first = np.ones(len(keys), dtype=bool)
+    first[1:] = keys[1:] != keys[:-1]
+    keep = order[first]
+    return (keys[first], values[keep]) + tuple(x[keep] for x in extra)
+
+
+def _group_min(keys: np.ndarray, values: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Mínimo de `values` por clave (claves únicas ordenadas)"""
+    order = np.argsort(keys)
+    keys, values = keys[order], values[order]
+    first = np.ones(len(keys), dtype=bool)
+    first[1:] = keys[1:] != keys[:-1]
+    starts = np.flatnonzero(first)
+    return keys[starts], np.minimum.reduceat(values, starts) if len(starts) else values
+
+
+class _Overlay:
+    """
+    Grafo de los nodos aún no contraídos: una arista por par (u, w) con el
+    menor peso, en CSR directo (ordenado por u) e inverso
+    """
+
+    def __init__(self, n: int, u: np.ndarray, w: np.ndarray, wt: np.ndarray, eid: np.ndarray):
+        self.n = n
+        keys, wt, u, w, eid = _min_by_key(u.astype(np.int64) * n + w, wt, u, w, eid)
+        self.u = u.astype(np.int64)
+        self.w = w.astype(np.int64)
+        self.wt = wt.astype(np.float64)
+        self.eid = eid.astype(np.int64)
+        self.indptr = _indptr(self.u, n)
+        self.rorder = np.argsort(self.w, kind="stable")
+        self.rindptr = _indptr(self.w, n)
+
+    def degree(self) -> np.ndarray:
+        return np.bincount(self.u, minlength=self.n) + np.bincount(self.w, minlength=self.n)
+
+
+def _witness_search(
+    ov: _Overlay,
+    sources: np.ndarray,
+    excluded: np.ndarray,
+    bound: np.ndarray,
+    blocked: np.ndarray,
+    hops: int = WITNESS_HOPS,
+    frontier: int = WITNESS_FRONTIER,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Búsqueda de testigos acotada (vectorizada, por saltos): distancias desde
+    cada origen en `ov` hasta `hops` aristas y `bound[i]`, sin pasar
+    por `excluded[i]` (-1 = ninguno) ni por nodos de `blocked`; en cada salto
+    solo se expanden los `frontier` nodos más cercanos de cada origen.
+    Un testigo no encontrado solo agrega un atajo de más (nunca una ruta
+    incorrecta). Devuelve (claves origen*n + nodo ordenadas, distancias).
+    """
+    n = ov.n
+    f_src = np.arange(len(sources), dtype=np.int64)
+    f_node = sources.astype(np.int64)
+    f_dist = np.zeros(len(sources))
+    best_key = f_src * n + f_node
+    best_dist = f_dist.copy()
+
+    for _ in range(hops):
+        rep, pos = _expand(ov.indptr, f_node)
+        if rep.size == 0:
+            break
+        si = f_src[rep]
+        v = ov.w[pos]
+        nd = f_dist[rep] + ov.wt[pos]
+        ok = (nd <= bound[si]) & (v != excluded[si]) & ~blocked[v]
+        keys, nd = _group_min(si[ok] * n + v[ok], nd[ok])
+        if keys.size == 0:
+            break
+        si, v = keys // n, keys % n
+
+        at = np.minimum(np.searchsorted(best_key, keys), len(best_key) - 1)
+        found = best_key[at] == keys
+        improved = ~found | (nd < best_dist[at])
+        upd = found & improved
+        best_dist[at[upd]] = nd[upd]
+        new = ~found
+        if new.any():
+            best_key = np.concatenate([best_key, keys[new]])
+            best_dist = np.concatenate([best_dist, nd[new]])
+            order = np.argsort(best_key, kind="stable")
+            best_key, best_dist = best_key[order], best_dist[order]
+        f_src, f_node, f_dist = si[improved], v[improved], nd[improved]
+        if f_src.size == 0:
+            break
+        # Frontera acotada por origen: los más cercanos
+        order = np.lexsort((f_dist, f_src))
+        f_src, f_node, f_dist = f_src[order], f_node[order], f_dist[order]
+        starts = np.searchsorted(f_src, f_src, side="left")
+        near = np.arange(len(f_src)) - starts < frontier
+        f_src, f_node, f_dist = f_src[near], f_node[near], f_dist[near]
+    return best_key, best_dist
+
+
+def _lookup(keys: np.ndarray, dist: np.ndarray, query: np.ndarray) -> np.ndarray:
+    if keys.size == 0:
+        return np.full(len(query), INF)
+    at = np.minimum(np.searchsorted(keys, query), len(keys) - 1)
+    return np.where(keys[at] == query, dist[at], INF)
+
+
+def _candidate_shortcuts(ov: _Overlay, centers: np.ndarray) -> Dict[str, np.ndarray]:
+    """Pares u→c→w (u != w) de cada centro c: todos los atajos posibles al contraerlo"""
+    rep_in, pos_in = _expand(ov.rindptr, centers)
+    in_pos = ov.rorder[pos_in]
+    rep_out, out_pos = _expand(ov.indptr, centers)
+    out_counts = np.bincount(rep_out, minlength=len(centers))
+    out_offsets = np.cumsum(out_counts) - out_counts
+
+    per_in = out_counts[rep_in]
+    pin = np.repeat(np.arange(len(in_pos), dtype=np.int64), per_in)
+    k = np.arange(pin.size, dtype=np.int64) - np.repeat(np.cumsum(per_in) - per_in, per_in)
+    pout = out_offsets[rep_in[pin]] + k
+
+    e_in, e_out = in_pos[pin], out_pos[pout]
+    u, w = ov.u[e_in], ov.w[e_out]
+    keep = u != w
+    return {
+        "center": rep_in[pin][keep],        # índice en `centers`
+        "in_edge": pin[keep],               # índice de la arista entrante (origen de la búsqueda)
+        "u": u[keep],
+        "w": w[keep],
+        "weight": (ov.wt[e_in] + ov.wt[e_out])[keep],
+        "c1": ov.eid[e_in][keep],
+        "c2": ov.eid[e_out][keep],
+        "in_u": ov.u[in_pos],
+        "in_center": rep_in,
+    }
+
+
+def _batches(centers: np.ndarray, ov: _Overlay):
+    """Divide los centros para que cada lote tenga a lo sumo WITNESS_BATCH aristas entrantes"""
+    indeg = ov.rindptr[centers + 1] - ov.rindptr[centers]
+    cut = np.searchsorted(np.cumsum(indeg), np.arange(WITNESS_BATCH, int(indeg.sum()) + WITNESS_BATCH, WITNESS_BATCH))
+    start = 0
+    for end in np.unique(np.append(cut + 1, len(centers))):
+        end = int(min(end, len(centers)))
+        if end > start:
+            yield centers[start:end]
+            start = end
+
+
+def _shortcut_counts(ov: _Overlay, centers: np.ndarray, no_block: np.ndarray) -> np.ndarray:
+    """Atajos que produciría contraer cada centro por separado (testigos que evitan solo al centro)"""
+    counts = np.zeros(len(centers), dtype=np.int64)
+    done = 0
+    for batch in _batches(centers, ov):
+        c = _candidate_shortcuts(ov, batch)
+        if c["u"].size:
+            # Un origen por arista entrante u→centro, con el centro prohibido
+            max_out = np.zeros(len(batch))
+            np.maximum.at(max_out, c["center"], c["weight"])
+            in_wt = np.zeros(len(c["in_u"]))
+            np.maximum.at(in_wt, c["in_edge"], c["weight"])
+            keys, dist = _witness_search(ov, c["in_u"], batch[c["in_center"]], in_wt, no_block, PRIORITY_HOPS, PRIORITY_FRONTIER)
+            witness = _lookup(keys, dist, c["in_edge"] * ov.n + c["w"])
+            needed = witness > c["weight"]
+            counts[done:done + len(batch)] = np.bincount(c["center"][needed], minlength=len(batch))
+        done += len(batch)
+    return counts
+
+
+class _Contractor:
+    """
+    Contracción por rondas de conjuntos independientes: en cada ronda se
+    contraen a la vez los nodos cuya prioridad es mínima entre sus vecinos
+    (nunca dos vecinos), con atajos y testigos calculados sobre arrays
+    """
+
+    def __init__(self, graph: RoadGraph):
+        n = graph.n_nodes
+        self.n = n
+        tails = graph.edge_tails().astype(np.int64)
+        heads = np.asarray(graph.heads, dtype=np.int64)
+        loop = tails != heads
+        orig = np.flatnonzero(loop)
+
+        # Almacén de aristas CH (originales + atajos), por bloques
+        self._tail = [tails[orig]]
+        self._head = [heads[orig]]
+        self._weight = [graph.base_time[orig].astype(np.float64)]
+        self._length = [np.asarray(graph.length_m, dtype=np.float64)[orig]]
+        self._orig = [orig.astype(np.int64)]
+        self._c1 = [np.full(len(orig), -1, dtype=np.int64)]
+        self._c2 = [np.full(len(orig), -1, dtype=np.int64)]
+        self.n_ch = len(orig)
+        self.final: List[np.ndarray] = []
+
+        self.ov = _Overlay(n, tails[orig], heads[orig], self._weight[0], np.arange(len(orig), dtype=np.int64))
+        self.alive = np.ones(n, dtype=bool)
+        self.deleted_neighbors = np.zeros(n, dtype=np.int64)
+        self.level = np.zeros(n, dtype=np.int64)
+        self.priority = np.zeros(n, dtype=np.float64)
+        # Desempate estable entre prioridades iguales
+        self.tiebreak = np.random.default_rng(0).permutation(n)
+        self._no_block = np.zeros(n, dtype=bool)
+        self._lengths = np.concatenate(self._length)
+
+    def update_priorities(self, nodes: np.ndarray) -> None:
+        if nodes.size == 0:
+            return
+        shortcuts = _shortcut_counts(self.ov, nodes, self._no_block)
+        degree = self.ov.degree()[nodes]
+        self.priority[nodes] = (shortcuts - degree) + 2 * self.deleted_neighbors[nodes] + self.level[nodes]
+
+    def independent_set(self) -> np.ndarray:
+        """Nodos vivos cuya (prioridad, desempate) es menor que la de todos sus vecinos"""
+        ov = self.ov
+        beaten = np.zeros(self.n, dtype=bool)
+        pu, pw = self.priority[ov.u], self.priority[ov.w]
+        tu, tw = self.tiebreak[ov.u], self.tiebreak[ov.w]
+        u_loses = (pw < pu) | ((pw == pu) & (tw < tu))
+        beaten[ov.u[u_loses]] = True
+        beaten[ov.w[~u_loses]] = True
+        return np.flatnonzero(self.alive & ~beaten)
+
+    def contract(self, nodes: np.ndarray) -> None:
+        ov = self.ov
+        selected = np.zeros(self.n, dtype=bool)
+        selected[nodes] = True
+
+        # Atajos: testigos que evitan todos los nodos de la ronda
+        shortcuts = []
+        for batch in _batches(nodes, ov):
+            c = _candidate_shortcuts(ov, batch)
+            if c["u"].size == 0:
+                continue
+            sources, src_idx = np.unique(c["u"], return_inverse=True)
+            bound = np.zeros(len(sources))
+            np.maximum.at(bound, src_idx, c["weight"])
+            keys, dist = _witness_search(ov, sources, np.full(len(sources), -1, dtype=np.int64), bound, selected)
+            needed = _lookup(keys, dist, src_idx * self.n + c["w"]) > c["weight"]
+            shortcuts.append({k: c[k][needed] for k in ("u", "w", "weight", "c1", "c2")})
+
+        # Las aristas que tocan los nodos contraídos quedan en la jerarquía
+        incident = selected[ov.u] | selected[ov.w]
+        self.final.append(ov.eid[incident])
+        rest = ~incident
+        u, w, wt, eid = [ov.u[rest]], [ov.w[rest]], [ov.wt[rest]], [ov.eid[rest]]
+
+        if shortcuts:
+            sc = {k: np.concatenate([s[k] for s in shortcuts]) for k in shortcuts[0]}
+            # Un atajo por par (u, w): el más corto
+            _, weight, su, sw, c1, c2 = _min_by_key(sc["u"] * self.n + sc["w"], sc["weight"], sc["u"], sc["w"], sc["c1"], sc["c2"])
+            ids = np.arange(self.n_ch, self.n_ch + len(su), dtype=np.int64)
+            self.n_ch += len(su)
+            self._tail.append(su)
+            self._head.append(sw)
+            self._weight.append(weight)
+            length = self._lengths[c1] + self._lengths[c2]
+            self._length.append(length)
+            self._lengths = np.concatenate([self._lengths, length])
+            self._orig.append(np.full(len(su), -1, dtype=np.int64))
+            self._c1.append(c1)
+            self._c2.append(c2)
+            u.append(su)
+            w.append(sw)
+            wt.append(weight)
+            eid.append(ids)
+
+        # Vecinos de los contraídos: nivel y vecinos eliminados
+        nbr = np.concatenate([ov.w[selected[ov.u]], ov.u[selected[ov.w]]])
+        ctr = np.concatenate([ov.u[selected[ov.u]], ov.w[selected[ov.w]]])
+        pairs = np.unique(nbr * self.n + ctr)
+        nbr, ctr = pairs // self.n, pairs % self.n
+        np.add.at(self.deleted_neighbors, nbr, 1)
+        np.maximum.at(self.level, nbr, self.level[ctr] + 1)
+
+        self.alive[nodes] = False
+        self.ov = _Overlay(self.n, np.concatenate(u), np.concatenate(w), np.concatenate(wt), np.concatenate(eid))
+        self.update_priorities(np.unique(nbr))
+
+    def run(self, progress_every: int = 0) -> np.ndarray:
+        self.update_priorities(np.arange(self.n, dtype=np.int64))
+        rank = np.zeros(self.n, dtype=np.int32)
+        order = 0
+        rounds = 0
+        next_report = progress_every
+        while order < self.n:
+            nodes = self.independent_set()
+            self.contract(nodes)
+            rank[nodes] = np.arange(order, order + len(nodes), dtype=np.int32)
+            order += len(nodes)
+            rounds += 1
+            if progress_every and order >= next_report:
+                print(f"   {order}/{self.n} nodos contraídos en {rounds} rondas, {self.n_ch} aristas")
+                next_report += progress_every
+        self.rounds = rounds
+        return rank
+
+    def arrays(self) -> Dict[str, np.ndarray]:
+        return {
+            "tail": np.concatenate(self._tail),
+            "head": np.concatenate(self._head),
+            "weight": np.concatenate(self._weight),
+            "length": np.concatenate(self._length),
+            "orig": np.concatenate(self._orig),
+            "c1": np.concatenate(self._c1),
+            "c2": np.concatenate(self._c2),
+            "final": np.unique(np.concatenate(self.final)) if self.final else np.zeros(0, dtype=np.int64),
+        }
+
+
+def build_ch(graph: RoadGraph, out_dir: Path = CH_DIR, progress_every: int = 10000) -> Dict[str, Any]:
+    """Construye la jerarquía y la guarda como arrays .npy"""
+    t0 = time.time()
+    c = _Contractor(graph)
+    rank = c.run(progress_every)
+    a = c.arrays()
+    tail, head, current = a["tail"], a["head"], a["final"]
+
+    # Solo las aristas vigentes al contraer su extremo de menor rango
+    up = current[rank[head[current]] > rank[tail[current]]]
+    down = current[rank[head[current]] < rank[tail[current]]]
+    up = up[np.argsort(tail[up], kind="stable")]
+    down = down[np.argsort(head[down], kind="stable")]
+    weight = a["weight"].astype(np.float32)
+
+    arrays = {
+        "rank": rank,
+        "ch_tail": tail.astype(np.int32),
+        "ch_head": head.astype(np.int32),
+        "ch_weight": weight,
+        "ch_length": a["length"].astype(np.float32),
+        "ch_orig": a["orig"].astype(np.int32),
+        "ch_c1": a["c1"].astype(np.int32),
+        "ch_c2": a["c2"].astype(np.int32),
+        # CSR por dirección con vecino y peso contiguos: la consulta solo rebana
+        "fwd_indptr": _indptr(tail[up], graph.n_nodes),
+        "fwd_edges": up.astype(np.int32),
+        "fwd_heads": head[up].astype(np.int32),
+        "fwd_weights": weight[up],
+        "bwd_indptr": _indptr(head[down], graph.n_nodes),
+        "bwd_edges": down.astype(np.int32),
+        "bwd_tails": tail[down].astype(np.int32),
+        "bwd_weights": weight[down],
+    }
+
+    out_dir.mkdir(parents=True, exist_ok=True)
+    for name, arr in arrays.items():
+        np.save(out_dir / f"{name}.npy", arr)
+
+    meta = {
+        "formato": CH_FORMAT,
+        "nodos": graph.n_nodes,
+        "aristas_grafo": graph.n_edges,
+        "aristas_ch": int(len(up) + len(down)),
+        "atajos": int((a["orig"][current] < 0).sum()),
+        "aristas_ascendentes": int(len(up)),
+        "aristas_descendentes": int(len(down)),
+        "rondas": c.rounds,
+        "saltos_testigo": WITNESS_HOPS,
+        "segundos_construccion": round(time.time() - t0, 1),
+        "peso": "tiempo_flujo_libre",
+    }
+    (out_dir / "meta.json").write_text(json.dumps(meta, indent=2), encoding="utf-8")
+    return meta
+
+
+# ============================================
+# CONSULTA
+# ============================================
+
+class ContractionHierarchy:
+    """Jerarquía mapeada en memoria con consultas bidireccionales ascendentes"""
+
+    def __init__(self, arrays: Dict[str, np.ndarray], meta: Dict[str, Any]):
+        for name, arr in arrays.items():
+            # Vista ndarray sobre el mmap: rebanar np.memmap es varias veces más lento
+            setattr(self, name, np.asarray(arr))
+        self.meta = meta
+        # Adyacencias ascendentes ya convertidas a tuplas Python; los nodos del
+        # núcleo aparecen en casi todas las consultas y así no se rebanan de nuevo
+        self._adj: Tuple[Dict[int, tuple], Dict[int, tuple]] = ({}, {})
+
+    def _upward(self, side: int, u: int) -> tuple:
+        """Aristas ascendentes (peso, vecino, arista CH) de u hacia adelante (0) o atrás (1)"""
+        cache = self._adj[side]
+        adj = cache.get(u)
+        if adj is None:
+            if side == 0:
+                a, b = self.fwd_indptr[u:u + 2].tolist()
+                adj = tuple(zip(self.fwd_weights[a:b].tolist(), self.fwd_heads[a:b].tolist(),
+                                self.fwd_edges[a:b].tolist()))
+            else:
+                a, b = self.bwd_indptr[u:u + 2].tolist()
+                adj = tuple(zip(self.bwd_weights[a:b].tolist(), self.bwd_tails[a:b].tolist(),
+                                self.bwd_edges[a:b].tolist()))
+            cache[u] = adj
+        return adj
+
+    def _search(self, source: int, target: int, slack: float = 1.0):
+        """
+        Búsquedas hacia arriba desde ambos extremos hasta superar best*slack,
+        con poda stall-on-demand: un nodo alcanzable más barato desde un
+        vecino de mayor rango no se expande
+        """
+        dist = ({source: 0.0}, {target: 0.0})
+        # pred[v] = (arista CH, nodo anterior)
+        pred: Tuple[Dict[int, Tuple[int, int]], Dict[int, Tuple[int, int]]] = ({}, {})
+        heaps = ([(0.0, source)], [(0.0, target)])
+        best, meet = (0.0, source) if source == target else (INF, -1)
+        upward = self._upward
+        heappush, heappop = heapq.heappush, heapq.heappop
+
+        while True:
+            bound = best * slack
+            h0, h1 = heaps
+            if h0 and h0[0][0] < bound and (not h1 or h1[0][0] >= bound or h0[0][0] <= h1[0][0]):
+                side = 0
+            elif h1 and h1[0][0] < bound:
+                side = 1
+            else:
+                break
+            d_u, u = heappop(heaps[side])
+            dist_s = dist[side]
+            if d_u > dist_s[u]:
+                continue
+
+            o = dist[1 - side].get(u)
+            if o is not None and d_u + o < best:
+                best, meet = d_u + o, u
+
+            # Stall-on-demand: aristas desde vecinos de mayor rango hacia u
+            stalled = False
+            for w, x, _ in upward(1 - side, u):
+                dx = dist_s.get(x)
+                if dx is not None and dx + w < d_u:
+                    stalled = True
+                    break
+            if stalled:
+                continue
+
+            pred_s = pred[side]
+            heap = heaps[side]
+            for w, v, e in upward(side, u):
+                nd = d_u + w
+                if nd < dist_s.get(v, INF):
+                    dist_s[v] = nd
+                    pred_s[v] = (e, u)
+                    heappush(heap, (nd, v))
+
+        return best, meet, dist, pred
+
+    def _chain(self, pred, source: int, target: int, via: int) -> List[int]:
+        """Aristas CH (posibles atajos) del camino source → via → target"""
+        forward = []
+        v = via
+        while v != source:
+            e, v = pred[0][v]
+            forward.append(e)
+        forward.reverse()
+        v = via
+        while v != target:
+            e, v = pred[1][v]
+            forward.append(e)
+        return forward
+
+    def unpack(self, ch_edges: List[int]) -> List[int]:
+        """Expande aristas CH en aristas del grafo original (pila en orden de recorrido)"""
+        orig, c1, c2 = self.ch_orig, self.ch_c1, self.ch_c2
+        out: List[int] = []
+        stack = list(reversed(ch_edges))
+        while stack:
+            e = stack.pop()
+            o = int(orig[e])
+            if o >= 0:
+                out.append(o)
+            else:
+                stack.append(int(c2[e]))
+                stack.append(int(c1[e]))
+        return out
+
+    def query(self, source: int, target: int) -> Optional[Tuple[float, List[int]]]:
+        """Camino mínimo (peso de flujo libre, aristas del grafo original)"""
+        best, meet, _, pred = self._search(source, target)
+        if meet < 0:
+            return None
+        return best, self.unpack(self._chain(pred, source, target, meet))
+
+    def alternatives(
+        self,
+        source: int,
+        target: int,
+        k: int = 3,
+        max_stretch: float = 1.4,
+        max_overlap: float = 0.7,
+        max_candidates: int = 20,
+    ) -> List[Tuple[float, List[int]]]:
+        """
+        Ruta óptima y hasta k-1 alternativas por nodos vía: nodos alcanzados
+        por ambas búsquedas con d_f + d_b <= best*max_stretch. El solapamiento
+        se mide sobre las aristas CH (longitud compartida) y solo se
+        desempaquetan las rutas aceptadas.
+        """
+        best, meet, dist, pred = self._search(source, target, slack=max_stretch)
+        if meet < 0:
+            return []
+        chosen = [self._chain(pred, source, target, meet)]
+        weights = [best]
+        chosen_sets = [set(chosen[0])]
+
+        via = sorted(
+            (dist[0][v] + dist[1][v], v)
+            for v in dist[0].keys() & dist[1].keys()
+            if v != meet
+        )
+        for total, v in via[:max_candidates]:
+            if total > best * max_stretch or len(chosen) >= k:
+                break
+            chain = self._chain(pred, source, target, v)
+            length = float(self.ch_length[chain].sum()) if chain else 0.0
+            if length <= 0:
+                continue
+            ok = True
+            for other in chosen_sets:
+                shared = [e for e in chain if e in other]
+                if float(self.ch_length[shared].sum()) / length > max_overlap:
+                    ok = False
+                    break
+            if not ok:
+                continue
+            chosen.append(chain)
+            chosen_sets.append(set(chain))
+            weights.append(float(self.ch_weight[chain].sum()))
+        return [(w, self.unpack(chain)) for w, chain in zip(weights, chosen)]
+
+
+def load_ch(directory: Path = CH_DIR, graph: Optional[RoadGraph] = None) -> Optional[ContractionHierarchy]:
+    """Carga la jerarquía mapeada en memoria (None si no existe o no coincide con el grafo)"""
+    meta_file = directory / "meta.json"
+    if not meta_file.exists():
+        return None
+    try:
+        meta = json.loads(meta_file.read_text(encoding="utf-8"))
+        if meta.get("formato") != CH_FORMAT:
+            print("⚠️ La jerarquía de contracción tiene un formato anterior; reconstrúyela")
+            return None
+        if graph is not None and (meta.get("nodos") != graph.n_nodes or meta.get("aristas_grafo") != graph.n_edges):
+            print("⚠️ La jerarquía de contracción no corresponde al grafo actual; reconstrúyela")
+            return None
+        arrays = {name: np.load(directory / f"{name}.npy", mmap_mode="r") for name in _ARRAYS}
+        return ContractionHierarchy(arrays, meta)
+    except Exception as e:
+        print(f"❌ Error cargando jerarquía de contracción: {e}")
+        return None
+
+
+_ch: Optional[ContractionHierarchy] = None
+_ch_loaded = False
+_ch_lock = threading.Lock()
+
+
+def get_contraction_hierarchy(graph: Optional[RoadGraph] = None) -> Optional[ContractionHierarchy]:
+    """Jerarquía del worker (se mapea una sola vez)"""
+    global _ch, _ch_loaded
+    if _ch_loaded:
+        return _ch
+    with _ch_lock:
+        if not _ch_loaded:
+            _ch = load_ch(graph=graph)
+            _ch_loaded = True
+            if _ch is not None:
+                print(f"✅ Jerarquía de contracción cargada: {_ch.meta.get('aristas_ch')} aristas")
+    return _ch
+
+
+def benchmark(ch: ContractionHierarchy, pairs: int = 1000, k: int = 3, seed: int = 0) -> Dict[str, Any]:
+    """Latencia de consulta y de alternativas (ms) sobre pares aleatorios de nodos"""
+    rng = np.random.default_rng(seed)
+    sample = rng.integers(0, len(ch.rank), size=(pairs, 2)).tolist()
+    result: Dict[str, Any] = {"pares": pairs}
+    for name, run in (("consulta", ch.query), ("alternativas", lambda s, t: ch.alternatives(s, t, k=k))):
+        times = []
+        for s, t in sample:
+            t0 = time.perf_counter()
+            run(s, t)
+            times.append((time.perf_counter() - t0) * 1000)
+        result[name] = {
+            "media_ms": round(float(np.mean(times)), 3),
+            "p50_ms": round(float(np.percentile(times, 50)), 3),
+            "p95_ms": round(float(np.percentile(times, 95)), 3),
+        }
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Jerarquía de contracción del grafo vial")
+    sub = parser.add_subparsers(dest="command", required=True)
+    build = sub.add_parser("build", help="Preprocesar el grafo actual")
+    build.add_argument("--progress", type=int, default=10000, help="Mostrar avance cada N nodos")
+    sub.add_parser("info", help="Mostrar el resumen de la jerarquía")
+    bench = sub.add_parser("bench", help="Medir la latencia de consulta")
+    bench.add_argument("--pairs", type=int, default=1000, help="Pares origen-destino aleatorios")
+    args = parser.parse_args()
+
+    if args.command == "build":
+        graph = load_graph()
+        if graph is None:
+            print(f"⚠️ No hay grafo en {GRAPH_DIR}. Ejecuta primero: python -m app.services.road_graph build --osm ecuador.osm")
+            return
+        meta = build_ch(graph, progress_every=args.progress)
+        print(f"✅ Jerarquía construida en {CH_DIR}")
+        print(json.dumps(meta, indent=2, ensure_ascii=False))
+    else:
+        ch = load_ch()
+        if ch is None:
+            print("⚠️ No hay jerarquía. Ejecuta: python -m app.services.contraction_hierarchy build")
+        elif args.command == "bench":
+            print(json.dumps(benchmark(ch, pairs=args.pairs), indent=2, ensure_ascii=False))
+        else:
+            print(json.dumps(ch.meta, indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -14,6 +14,7 @@ Autor: PrediRuta Team
 """
 
 import os
+import numpy as np
 import pandas as pd
 from datetime import datetime, time
 from typing import List, Dict, Any, Optional, Tuple
@@ -31,6 +32,8 @@ class TrafficDataset:
     
     _instance = None
     _df: Optional[pd.DataFrame] = None
+    _version: Optional[str] = None
+    _cubes: Dict[float, Dict[Tuple[int, int], np.ndarray]] = {}
     
     def __new__(cls):
         """Singleton para evitar cargar el CSV múltiples veces"""
@@ -87,6 +90,11 @@ class TrafficDataset:
             # Limpiar coordenadas
             self._clean_coordinates()
             
+            # Versión del dataset: invalida los agregados derivados
+            stat = CSV_FILE.stat()
+            self._version = f"{stat.st_mtime_ns:x}-{stat.st_size:x}-{len(self._df)}"
+            self._cubes = {}
+            
             print(f"✅ Dataset cargado: {len(self._df)} registros")
             print(f"   Provincias: {self._df['PROVINCIA_C'].nunique()}")
             print(f"   Ciudades: {self._df['CIUDAD_OPER'].nunique()}")
@@ -128,6 +136,11 @@ class TrafficDataset:
         if 'LONGITUD' in self._df.columns:
             self._df['LONGITUD'] = pd.to_numeric(self._df['LONGITUD'], errors='coerce')
     
+    @property
+    def version(self) -> Optional[str]:
+        """Identificador del CSV cargado (cambia si el archivo cambia)"""
+        return self._version
+    
     @property
     def is_loaded(self) -> bool:
         """Verifica si el dataset está cargado"""
@@ -279,6 +292,87 @@ class TrafficDataset:
             "velocidad_fluida": round(hourly.loc[max_speed_hours, 'mean'].mean(), 1)
         }
     
+    def get_hourly_cube(self, cell_deg: float) -> Dict[Tuple[int, int], np.ndarray]:
+        """
+        Cubo de velocidad media por celda de `cell_deg` grados y hora del día.
+        Retorna {(fila, columna): array(24)}; las horas sin registros toman la
+        media de la celda. Se calcula una vez por tamaño de celda.
+        """
+        if cell_deg in self._cubes:
+            return self._cubes[cell_deg]
+        if not self.is_loaded or 'HORA' not in self._df.columns:
+            return {}
+        
+        df = self._df.dropna(subset=['LATITUD', 'LONGITUD', 'HORA', 'VELOCIDAD'])
+        hora = df['HORA'].to_numpy(dtype=np.intp)
+        vel = df['VELOCIDAD'].to_numpy(dtype=np.float64)
+        cy = np.floor(df['LATITUD'].to_numpy(dtype=np.float64) / cell_deg).astype(np.int64)
+        cx = np.floor(df['LONGITUD'].to_numpy(dtype=np.float64) / cell_deg).astype(np.int64)
+        
+        keys, inverse = np.unique(np.stack([cy, cx], axis=1), axis=0, return_inverse=True)
+        inverse = inverse.ravel()
+        flat = inverse * 24 + hora
+        sums = np.bincount(flat, weights=vel, minlength=len(keys) * 24).reshape(-1, 24)
+        counts = np.bincount(flat, minlength=len(keys) * 24).reshape(-1, 24)
+        cell_mean = sums.sum(axis=1) / counts.sum(axis=1)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            means = np.where(counts > 0, sums / counts, cell_mean[:, None]).astype(np.float32)
+        
+        cube = {(int(k[0]), int(k[1])): means[i] for i, k in enumerate(keys)}
+        self._cubes[cell_deg] = cube
+        return cube
+    
+    def get_city_centroids(self) -> pd.DataFrame:
+        """
+        Centroide (mediana de coordenadas) y número de registros por ciudad,
+        indexado por el nombre normalizado en mayúsculas y ordenado.
+        """
+        if not self.is_loaded:
+            return pd.DataFrame(columns=['lat', 'lon', 'registros'])
+        
+        df = self._df.dropna(subset=['CIUDAD_OPER', 'LATITUD', 'LONGITUD'])
+        df = df.assign(_CIUDAD=df['CIUDAD_OPER'].astype(str).str.strip().str.upper())
+        centroids = df.groupby('_CIUDAD').agg(
+            lat=('LATITUD', 'median'),
+            lon=('LONGITUD', 'median'),
+            registros=('VELOCIDAD', 'size'),
+        )
+        centroids.index.name = 'ciudad'
+        return centroids.sort_index()
+    
+    def get_location_congestion(self, provincia: Optional[str] = None) -> pd.DataFrame:
+        """
+        Velocidad media, registros y puntajes de congestión / flujo por
+        ubicación (una fila por ubicación y coordenadas). Mayor congestion_score
+        = menor velocidad con más registros.
+        """
+        df = self._df
+        if provincia:
+            df = df[df['PROVINCIA_C'].str.upper() == provincia.upper()]
+        
+        grouped = df.groupby(['UBICACION_EXCESO', 'CIUDAD_OPER', 'PROVINCIA_C', 'LATITUD', 'LONGITUD']).agg({
+            'VELOCIDAD': ['mean', 'count', 'std']
+        }).reset_index()
+        grouped.columns = ['ubicacion', 'ciudad', 'provincia', 'lat', 'lon', 'velocidad_promedio', 'registros', 'desviacion']
+        
+        peso = grouped['registros'] / grouped['registros'].max()
+        grouped['congestion_score'] = (120 - grouped['velocidad_promedio']) * peso
+        grouped['flujo_score'] = grouped['velocidad_promedio'] * peso
+        return grouped
+    
+    def get_city_hourly_matrix(self, ciudades: List[str]) -> np.ndarray:
+        """
+        Matriz (ciudades, 24) de velocidad media por hora. Las horas sin
+        registros toman la media de la ciudad; las ciudades sin registros, la
+        media global. `ciudades` son nombres normalizados en mayúsculas.
+        """
+        df = self._df
+        df = df.assign(_CIUDAD=df['CIUDAD_OPER'].astype(str).str.strip().str.upper())
+        pivot = df.pivot_table(index='_CIUDAD', columns='HORA', values='VELOCIDAD', aggfunc='mean')
+        pivot = pivot.reindex(index=ciudades, columns=range(24))
+        pivot = pivot.apply(lambda row: row.fillna(row.mean()), axis=1).fillna(df['VELOCIDAD'].mean())
+        return pivot.to_numpy(dtype=np.float32)
+    
     def get_summary(self) -> Dict[str, Any]:
         """Resumen general del dataset"""
         if not self.is_loaded:
@@ -0,0 +1,170 @@
+"""
+Optimizador de Hora de Salida
+=============================
+
+Evalúa todas las horas de salida de un día (24 horarias o 96 de 15 min)
+para un trayecto en una sola pasada vectorizada:
+
+- El trayecto se representa como segmentos con su tiempo de recorrido por
+  hora del día (matriz segmentos×24)
+- Todas las salidas avanzan a la vez: en cada segmento se consulta la hora
+  en la que cada salida llega a él
+- Resultado: curva de ETA, mejor salida y ventana óptima (salidas
+  contiguas con ETA dentro de una tolerancia del mínimo)
+
+Fuentes de segmentos: una ruta del grafo vial (perfiles horarios por
+arista) o, sin grafo, la línea entre centroides de la matriz de ciudades
+con los perfiles horarios del dataset.
+
+Autor: PrediRuta Team
+"""
+
+from typing import Any, Dict, Optional
+
+import numpy as np
+
+from app.services.dataset_loader import get_traffic_dataset
+from app.services.city_matrix import CityMatrix, ROAD_DETOUR_FACTOR
+
+
+DAY_SECONDS = 24 * 3600
+VALID_RESOLUTIONS = (15, 30, 60)
+# Segmentos en que se divide la línea entre centroides sin grafo vial
+CITY_PAIR_SEGMENTS = 16
+COARSE_CELL_DEG = 0.1
+
+
+def _run_starts(profile_ids: np.ndarray) -> np.ndarray:
+    """Inicio de cada tramo de aristas consecutivas con el mismo perfil horario"""
+    return np.flatnonzero(np.r_[True, profile_ids[1:] != profile_ids[:-1]])
+
+
+def segment_times_for_path(graph, edges: np.ndarray) -> np.ndarray:
+    """Matriz (segmentos, 24) en segundos para una ruta del grafo vial"""
+    edges = np.asarray(edges, dtype=np.int64)
+    if len(edges) == 0:
+        return np.zeros((0, 24), dtype=np.float32)
+    base = np.asarray(graph.base_time[edges], dtype=np.float64)
+    profile_ids = np.asarray(graph.edge_profile[edges])
+    # Los tramos con el mismo perfil se recorren como un solo segmento
+    starts = _run_starts(profile_ids)
+    run_base = np.add.reduceat(base, starts)
+    factors = np.asarray(graph.profiles[profile_ids[starts]], dtype=np.float64)
+    return (run_base[:, None] / factors).astype(np.float32)
+
+
+def segment_times_for_city_pair(matrix: CityMatrix, i: int, j: int) -> np.ndarray:
+    """
+    Matriz (segmentos, 24) en segundos sobre la línea entre centroides. Cada
+    segmento usa el perfil de su celda de 0.1° si el dataset tiene registros
+    ahí y, si no, la mezcla lineal de los perfiles de origen y destino.
+    """
+    length_km = float(matrix.distance_km[i, j]) * ROAD_DETOUR_FACTOR
+    if length_km <= 0:
+        return np.zeros((0, 24), dtype=np.float32)
+
+    n = CITY_PAIR_SEGMENTS
+    frac = (np.arange(n) + 0.5) / n
+    lat = matrix.lat[i] + (matrix.lat[j] - matrix.lat[i]) * frac
+    lon = matrix.lon[i] + (matrix.lon[j] - matrix.lon[i]) * frac
+
+    blend = (1 - frac)[:, None] * matrix.speed_kmh[i][None, :] + frac[:, None] * matrix.speed_kmh[j][None, :]
+    cube = get_traffic_dataset().get_hourly_cube(COARSE_CELL_DEG)
+    speeds = blend.astype(np.float64)
+    for k, (la, lo) in enumerate(zip(lat.tolist(), lon.tolist())):
+        profile = cube.get((int(np.floor(la / COARSE_CELL_DEG)), int(np.floor(lo / COARSE_CELL_DEG))))
+        if profile is not None:
+            speeds[k] = profile
+
+    seg_km = length_km / n
+    return (seg_km / np.maximum(speeds, 1.0) * 3600.0).astype(np.float32)
+
+
+def evaluate_departures(segment_times: np.ndarray, resolution_min: int = 60) -> np.ndarray:
+    """
+    Duración (s) del trayecto para cada salida del día. Todas las salidas se
+    propagan juntas segmento a segmento.
+    """
+    slots = np.arange(0, DAY_SECONDS, resolution_min * 60, dtype=np.float64)
+    t = slots.copy()
+    for row in segment_times.astype(np.float64):
+        hours = (t // 3600).astype(np.int64) % 24
+        t += row[hours]
+    return t - slots
+
+
+def _fmt(seconds: float) -> str:
+    minutes = int(round(seconds / 60))
+    if minutes > 24 * 60:
+        minutes %= 24 * 60
+    return f"{minutes // 60:02d}:{minutes % 60:02d}"
+
+
+def optimal_window(durations: np.ndarray, tolerance: float) -> tuple:
+    """(inicio, fin, cantidad) de las salidas contiguas alrededor del mínimo (circular)"""
+    n = len(durations)
+    best = int(durations.argmin())
+    ok = durations <= durations[best] * (1 + tolerance)
+    start = best
+    while ok[(start - 1) % n] and (best - start + 1) < n:
+        start -= 1
+    end = best
+    while ok[(end + 1) % n] and (end - start + 1) < n:
+        end += 1
+    if end - start + 1 >= n:
+        # Todo el día dentro de la tolerancia
+        return 0, n - 1, n
+    return start % n, end % n, end - start + 1
+
+
+def optimize_departure(
+    segment_times: np.ndarray,
+    resolution_min: int = 60,
+    tolerance: float = 0.05,
+) -> Dict[str, Any]:
+    """Curva de ETA por hora de salida, mejor salida y ventana óptima"""
+    if resolution_min not in VALID_RESOLUTIONS:
+        raise ValueError(f"Resolución no soportada: {resolution_min}")
+
+    durations = evaluate_departures(segment_times, resolution_min)
+    step = resolution_min * 60
+    best = int(durations.argmin())
+    worst = int(durations.argmax())
+    start, end, count = optimal_window(durations, tolerance)
+    window = np.take(durations, np.arange(start, start + count) % len(durations))
+
+    return {
+        "resolucion_min": resolution_min,
+        "curva": [
+            {"salida": _fmt(k * step), "eta_min": round(float(d) / 60, 1)}
+            for k, d in enumerate(durations.tolist())
+        ],
+        "mejor_salida": _fmt(best * step),
+        "eta_optima_min": round(float(durations[best]) / 60, 1),
+        "peor_salida": _fmt(worst * step),
+        "eta_peor_min": round(float(durations[worst]) / 60, 1),
+        "ahorro_max_min": round(float(durations[worst] - durations[best]) / 60, 1),
+        "ventana_optima": {
+            "inicio": _fmt(start * step),
+            "fin": _fmt((end + 1) * step),
+            "eta_max_min": round(float(window.max()) / 60, 1),
+            "tolerancia": tolerance,
+        },
+    }
+
+
+def optimize_for_path(graph, edges, resolution_min: int = 60, tolerance: float = 0.05) -> Dict[str, Any]:
+    result = optimize_departure(segment_times_for_path(graph, edges), resolution_min, tolerance)
+    result["fuente"] = "grafo_local"
+    return result
+
+
+def optimize_for_city_pair(
+    matrix: CityMatrix, i: int, j: int, resolution_min: int = 60, tolerance: float = 0.05
+) -> Optional[Dict[str, Any]]:
+    times = segment_times_for_city_pair(matrix, i, j)
+    if len(times) == 0:
+        return None
+    result = optimize_departure(times, resolution_min, tolerance)
+    result["fuente"] = "dataset_ecuador_2022"
+    return result
@@ -0,0 +1,428 @@
+"""
+Modelo de Pronóstico de Tráfico
+===============================
+
+Modelo estadístico de corto plazo entrenado sobre el dataset de Ecuador.
+
+- Entrenamiento offline: un modelo Ridge por ciudad sobre variables
+  one-hot de hora (24), día de la semana (7) y mes (12)
+- Almacén de artefactos versionado con joblib (models/traffic_forecast_<version>.joblib)
+- Carga perezosa: cada worker carga el artefacto una sola vez
+- Inferencia vectorizada: al ser un modelo lineal sobre variables one-hot,
+  una predicción es la suma de tres coeficientes + intercepto, por lo que
+  se resuelven lotes completos con indexación de NumPy
+
+Uso:
+    python -m app.services.forecast_model train              # Entrenar y publicar
+    python -m app.services.forecast_model train --register   # Registrar en ml_models
+    python -m app.services.forecast_model info               # Ver versión activa
+
+Autor: PrediRuta Team
+"""
+
+import os
+import json
+import argparse
+import threading
+from dataclasses import dataclass, field
+from datetime import datetime, date
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+
+from app.services.dataset_loader import get_traffic_dataset
+
+
+# Directorio de artefactos (backend/models por defecto)
+MODELS_DIR = Path(os.getenv(
+    "FORECAST_MODEL_DIR",
+    str(Path(__file__).parent.parent.parent / "models"),
+))
+MODEL_NAME = "traffic_forecast"
+LATEST_FILE = MODELS_DIR / f"{MODEL_NAME}_latest.json"
+
+# Ciudades con menos registros usan el modelo global
+MIN_SAMPLES_PER_CITY = int(os.getenv("FORECAST_MIN_SAMPLES", "30"))
+RIDGE_ALPHA = float(os.getenv("FORECAST_RIDGE_ALPHA", "1.0"))
+
+GLOBAL_KEY = "__GLOBAL__"
+
+# Disposición de variables: [hora(24) | día semana(7) | mes(12)]
+N_HOURS, N_WEEKDAYS, N_MONTHS = 24, 7, 12
+WEEKDAY_OFFSET = N_HOURS
+MONTH_OFFSET = N_HOURS + N_WEEKDAYS
+N_FEATURES = N_HOURS + N_WEEKDAYS + N_MONTHS
+FEATURE_NAMES = (
+    [f"hora_{h:02d}" for h in range(N_HOURS)]
+    + [f"dia_semana_{d}" for d in range(N_WEEKDAYS)]
+    + [f"mes_{m:02d}" for m in range(1, N_MONTHS + 1)]
+)
+
+
+def _normalize_city(ciudad: str) -> str:
+    return str(ciudad).strip().upper()
+
+
+def build_features(horas: np.ndarray, dias_semana: np.ndarray, meses: np.ndarray) -> np.ndarray:
+    """Construye la matriz one-hot (n, N_FEATURES) usada en el entrenamiento"""
+    n = len(horas)
+    X = np.zeros((n, N_FEATURES), dtype=np.float32)
+    rows = np.arange(n)
+    X[rows, horas.astype(np.intp)] = 1.0
+    X[rows, WEEKDAY_OFFSET + dias_semana.astype(np.intp)] = 1.0
+    X[rows, MONTH_OFFSET + meses.astype(np.intp) - 1] = 1.0
+    return X
+
+
+@dataclass
+class ForecastModel:
+    """Artefacto de pronóstico: coeficientes apilados por ciudad"""
+
+    version: str
+    cities: List[str]
+    coef: np.ndarray                 # (n_ciudades, N_FEATURES) float32
+    intercept: np.ndarray            # (n_ciudades,) float32
+    residual_std: np.ndarray         # (n_ciudades,) float32
+    n_samples: np.ndarray            # (n_ciudades,) int32
+    trained_at: str
+    training_range: Dict[str, Optional[str]] = field(default_factory=dict)
+    metrics: Dict[str, Any] = field(default_factory=dict)
+    parameters: Dict[str, Any] = field(default_factory=dict)
+
+    def __post_init__(self):
+        self._city_index = {c: i for i, c in enumerate(self.cities)}
+        self._global_idx = self._city_index.get(GLOBAL_KEY, 0)
+
+    def city_indices(self, ciudades: Sequence[str]) -> np.ndarray:
+        """Índices de fila por ciudad (ciudades desconocidas -> modelo global)"""
+        return np.fromiter(
+            (self._city_index.get(_normalize_city(c), self._global_idx) for c in ciudades),
+            dtype=np.intp,
+            count=len(ciudades),
+        )
+
+    def has_city(self, ciudad: str) -> bool:
+        return _normalize_city(ciudad) in self._city_index
+
+    def predict_indices(
+        self,
+        city_idx: np.ndarray,
+        horas: np.ndarray,
+        dias_semana: np.ndarray,
+        meses: np.ndarray,
+    ) -> np.ndarray:
+        """Predicción vectorizada por índices (sin construir la matriz one-hot)"""
+        horas = np.asarray(horas, dtype=np.intp)
+        dias_semana = np.asarray(dias_semana, dtype=np.intp)
+        meses = np.asarray(meses, dtype=np.intp)
+        return (
+            self.intercept[city_idx]
+            + self.coef[city_idx, horas]
+            + self.coef[city_idx, WEEKDAY_OFFSET + dias_semana]
+            + self.coef[city_idx, MONTH_OFFSET + meses - 1]
+        )
+
+    def predict(
+        self,
+        ciudades: Sequence[str],
+        horas: Sequence[int],
+        dias_semana: Sequence[int],
+        meses: Sequence[int],
+    ) -> np.ndarray:
+        """Predicción en lote para pares (ciudad, hora, día, mes)"""
+        return self.predict_indices(self.city_indices(ciudades), horas, dias_semana, meses)
+
+    def predict_day(self, ciudad: str, fecha: date, horas: Optional[Sequence[int]] = None) -> Dict[str, np.ndarray]:
+        """Pronóstico de un día completo (o de las horas indicadas) para una ciudad"""
+        horas_arr = np.arange(N_HOURS) if horas is None else np.asarray(horas, dtype=np.intp)
+        idx = np.full(len(horas_arr), self.city_indices([ciudad])[0], dtype=np.intp)
+        velocidades = self.predict_indices(
+            idx,
+            horas_arr,
+            np.full(len(horas_arr), fecha.weekday()),
+            np.full(len(horas_arr), fecha.month),
+        )
+        return {
+            "horas": horas_arr,
+            "velocidades": velocidades,
+            "desviacion": self.residual_std[idx],
+            "registros": self.n_samples[idx],
+        }
+
+    def confidence(self, ciudad: str) -> float:
+        """Confianza basada en el tamaño de muestra y el error residual"""
+        i = self.city_indices([ciudad])[0]
+        muestra = min(1.0, float(self.n_samples[i]) / 200)
+        dispersion = 1.0 / (1.0 + float(self.residual_std[i]) / 10)
+        return round(min(0.95, 0.5 * muestra + 0.5 * dispersion), 2)
+
+    def to_artifact(self) -> Dict[str, Any]:
+        return {
+            "name": MODEL_NAME,
+            "version": self.version,
+            "cities": self.cities,
+            "coef": self.coef,
+            "intercept": self.intercept,
+            "residual_std": self.residual_std,
+            "n_samples": self.n_samples,
+            "trained_at": self.trained_at,
+            "training_range": self.training_range,
+            "metrics": self.metrics,
+            "parameters": self.parameters,
+            "features": FEATURE_NAMES,
+        }
+
+    @classmethod
+    def from_artifact(cls, data: Dict[str, Any]) -> "ForecastModel":
+        return cls(
+            version=data["version"],
+            cities=list(data["cities"]),
+            coef=np.asarray(data["coef"], dtype=np.float32),
+            intercept=np.asarray(data["intercept"], dtype=np.float32),
+            residual_std=np.asarray(data["residual_std"], dtype=np.float32),
+            n_samples=np.asarray(data["n_samples"], dtype=np.int32),
+            trained_at=data.get("trained_at", ""),
+            training_range=data.get("training_range", {}),
+            metrics=data.get("metrics", {}),
+            parameters=data.get("parameters", {}),
+        )
+
+
+# ============================================
+# ENTRENAMIENTO
+# ============================================
+
+def _training_frame():
+    """Extrae del dataset las columnas necesarias sin filas incompletas"""
+    dataset = get_traffic_dataset()
+    if not dataset.is_loaded:
+        raise RuntimeError("Dataset no disponible para entrenar")
+
+    df = dataset._df
+    required = ['CIUDAD_OPER', 'HORA', 'DIA_SEMANA', 'MES', 'VELOCIDAD']
+    missing = [c for c in required if c not in df.columns]
+    if missing:
+        raise RuntimeError(f"Faltan columnas en el dataset: {missing}")
+
+    cols = required + (['FECHA'] if 'FECHA' in df.columns else [])
+    return df[cols].dropna(subset=required)
+
+
+def train_model(alpha: float = RIDGE_ALPHA, min_samples: int = MIN_SAMPLES_PER_CITY) -> ForecastModel:
+    """Entrena un modelo Ridge por ciudad (más uno global de respaldo)"""
+    from sklearn.linear_model import Ridge
+    from sklearn.model_selection import train_test_split
+
+    df = _training_frame()
+    X_all = build_features(df['HORA'].to_numpy(), df['DIA_SEMANA'].to_numpy(), df['MES'].to_numpy())
+    y_all = df['VELOCIDAD'].to_numpy(dtype=np.float32)
+    city_all = df['CIUDAD_OPER'].astype(str).str.strip().str.upper().to_numpy()
+
+    groups: Dict[str, np.ndarray] = {GLOBAL_KEY: np.arange(len(df))}
+    for ciudad in np.unique(city_all):
+        idx = np.flatnonzero(city_all == ciudad)
+        if len(idx) >= min_samples:
+            groups[ciudad] = idx
+
+    cities = list(groups.keys())
+    coef = np.zeros((len(cities), N_FEATURES), dtype=np.float32)
+    intercept = np.zeros(len(cities), dtype=np.float32)
+    residual_std = np.zeros(len(cities), dtype=np.float32)
+    n_samples = np.zeros(len(cities), dtype=np.int32)
+    maes: Dict[str, float] = {}
+
+    for i, ciudad in enumerate(cities):
+        idx = groups[ciudad]
+        X, y = X_all[idx], y_all[idx]
+
+        # Error de validación sobre un 20% reservado (semilla fija)
+        if len(idx) >= 10:
+            X_tr, X_te, y_tr, y_te = train_test_split(X, y, test_size=0.2, random_state=42)
+            holdout = Ridge(alpha=alpha).fit(X_tr, y_tr)
+            maes[ciudad] = float(np.mean(np.abs(holdout.predict(X_te) - y_te)))
+
+        model = Ridge(alpha=alpha).fit(X, y)
+        coef[i] = model.coef_
+        intercept[i] = model.intercept_
+        residual_std[i] = float(np.std(y - model.predict(X)))
+        n_samples[i] = len(idx)
+
+    fechas = df['FECHA'] if 'FECHA' in df.columns else None
+    training_range = {
+        "inicio": str(fechas.min())[:10] if fechas is not None else None,
+        "fin": str(fechas.max())[:10] if fechas is not None else None,
+    }
+
+    return ForecastModel(
+        version=datetime.now().strftime("%Y%m%d%H%M%S"),
+        cities=cities,
+        coef=coef,
+        intercept=intercept,
+        residual_std=residual_std,
+        n_samples=n_samples,
+        trained_at=datetime.now().isoformat(timespec="seconds"),
+        training_range=training_range,
+        metrics={
+            "mae_validacion_global": round(maes.get(GLOBAL_KEY, float("nan")), 3),
+            "mae_validacion_promedio_ciudades": round(
+                float(np.mean([v for k, v in maes.items() if k != GLOBAL_KEY])) if len(maes) > 1 else float("nan"), 3
+            ),
+            "ciudades_modeladas": len(cities) - 1,
+            "registros": int(len(df)),
+        },
+        parameters={"algoritmo": "ridge", "alpha": alpha, "min_registros_ciudad": min_samples},
+    )
+
+
+# ============================================
+# ALMACÉN DE ARTEFACTOS
+# ============================================
+
+def artifact_path(version: str) -> Path:
+    return MODELS_DIR / f"{MODEL_NAME}_{version}.joblib"
+
+
+def save_model(model: ForecastModel, activate: bool = True) -> Path:
+    """Guarda el artefacto versionado y, opcionalmente, lo marca como activo"""
+    import joblib
+
+    MODELS_DIR.mkdir(parents=True, exist_ok=True)
+    path = artifact_path(model.version)
+    joblib.dump(model.to_artifact(), path, compress=3)
+
+    if activate:
+        tmp = LATEST_FILE.with_suffix(".tmp")
+        tmp.write_text(json.dumps({"version": model.version, "path": path.name}), encoding="utf-8")
+        os.replace(tmp, LATEST_FILE)
+
+    return path
+
+
+def active_version() -> Optional[str]:
+    """Versión fijada por entorno o la última publicada"""
+    pinned = os.getenv("FORECAST_MODEL_VERSION")
+    if pinned:
+        return pinned
+    if not LATEST_FILE.exists():
+        return None
+    try:
+        return json.loads(LATEST_FILE.read_text(encoding="utf-8")).get("version")
+    except Exception:
+        return None
+
+
+def load_model(version: Optional[str] = None) -> Optional[ForecastModel]:
+    """Carga un artefacto desde disco (None si no existe)"""
+    import joblib
+
+    version = version or active_version()
+    if not version:
+        return None
+
+    path = artifact_path(version)
+    if not path.exists():
+        print(f"⚠️ Artefacto de pronóstico no encontrado: {path}")
+        return None
+
+    try:
+        return ForecastModel.from_artifact(joblib.load(path))
+    except Exception as e:
+        print(f"❌ Error cargando modelo de pronóstico {version}: {e}")
+        return None
+
+
+# Carga perezosa: una vez por worker
+_model: Optional[ForecastModel] = None
+_model_loaded = False
+_model_lock = threading.Lock()
+
+
+def get_forecast_model() -> Optional[ForecastModel]:
+    """Obtiene el modelo activo, cargándolo la primera vez que se solicita"""
+    global _model, _model_loaded
+    if _model_loaded:
+        return _model
+
+    with _model_lock:
+        if not _model_loaded:
+            _model = load_model()
+            _model_loaded = True
+            if _model is not None:
+                print(f"✅ Modelo de pronóstico cargado: v{_model.version} ({len(_model.cities) - 1} ciudades)")
+    return _model
+
+
+def reset_forecast_model() -> None:
+    """Fuerza la recarga del artefacto en la próxima consulta"""
+    global _model, _model_loaded
+    with _model_lock:
+        _model = None
+        _model_loaded = False
+
+
+def register_model(model: ForecastModel, path: Path) -> bool:
+    """Registra la versión entrenada en la tabla ml_models de Supabase"""
+    from app.database import get_supabase
+
+    try:
+        sb = get_supabase()
+        sb.table('ml_models').update({'is_active': False}).eq('name', MODEL_NAME).execute()
+        sb.table('ml_models').insert({
+            'name': MODEL_NAME,
+            'version': model.version,
+            'model_type': 'ridge_por_ciudad',
+            'file_path': str(path),
+            'training_data_range': (
+                f"[{model.training_range['inicio']},{model.training_range['fin']}]"
+                if model.training_range.get('inicio') and model.training_range.get('fin') else None
+            ),
+            'accuracy_metrics': model.metrics,
+            'features': FEATURE_NAMES,
+            'parameters': model.parameters,
+            'is_active': True,
+            'deployed_at': datetime.now().isoformat(),
+        }).execute()
+        return True
+    except Exception as e:
+        print(f"⚠️ No se pudo registrar el modelo en ml_models: {e}")
+        return False
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Modelo de pronóstico de tráfico PrediRuta")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    train = sub.add_parser("train", help="Entrenar y publicar una nueva versión")
+    train.add_argument("--alpha", type=float, default=RIDGE_ALPHA, help="Regularización Ridge")
+    train.add_argument("--min-samples", type=int, default=MIN_SAMPLES_PER_CITY, help="Registros mínimos por ciudad")
+    train.add_argument("--no-activate", action="store_true", help="No marcar la versión como activa")
+    train.add_argument("--register", action="store_true", help="Registrar la versión en ml_models")
+
+    sub.add_parser("info", help="Mostrar la versión activa")
+
+    args = parser.parse_args()
+
+    if args.command == "train":
+        model = train_model(alpha=args.alpha, min_samples=args.min_samples)
+        path = save_model(model, activate=not args.no_activate)
+        print(f"✅ Modelo v{model.version} guardado en {path}")
+        print(json.dumps(model.metrics, indent=2, ensure_ascii=False))
+        if args.register:
+            register_model(model, path)
+    else:
+        model = load_model()
+        if model is None:
+            print("⚠️ No hay modelo activo. Ejecuta: python -m app.services.forecast_model train")
+        else:
+            print(json.dumps({
+                "version": model.version,
+                "entrenado": model.trained_at,
+                "ciudades": len(model.cities) - 1,
+                "rango": model.training_range,
+                "metricas": model.metrics,
+            }, indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+"""
+Direcciones Históricas (alternativa sin Mapbox)
+===============================================
+
+Respuesta con el mismo formato que get_directions() construida solo con
+datos locales, para cuando Mapbox no responde o su circuito está abierto:
+
+- Con el grafo vial construido, cada tramo se calcula con el motor de rutas
+  local (pesos horarios derivados del TrafficDataset)
+- Sin grafo, distancia en línea recta × ROAD_DETOUR_FACTOR y velocidad del
+  estimador en línea en el punto medio del tramo (perfil histórico del
+  dataset + observaciones recientes), o la media horaria nacional del dataset
+
+Solo aplica a perfiles de conducción.
+
+Autor: PrediRuta Team
+"""
+
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.services.city_matrix import ROAD_DETOUR_FACTOR
+from app.services.dataset_loader import get_traffic_dataset
+from app.services.online_estimator import get_online_estimator
+from app.services.prediction_jobs import LOCAL_TZ
+from app.services.road_graph import haversine_m
+from app.services.routing_engine import get_routing_engine
+
+
+DRIVING_PROFILES = ("driving", "driving-traffic")
+# Velocidad (km/h) si no hay dataset ni estimación para el tramo
+DEFAULT_SPEED_KMH = 40.0
+
+_hourly_speed: Dict[str, Dict[int, float]] = {}
+
+
+def _national_hourly_speed(hour: int) -> float:
+    """Velocidad media del dataset para la hora (km/h), calculada una vez por versión"""
+    dataset = get_traffic_dataset()
+    if not dataset.is_loaded:
+        return DEFAULT_SPEED_KMH
+    version = dataset.version or ""
+    if version not in _hourly_speed:
+        _hourly_speed.clear()
+        _hourly_speed[version] = {
+            int(h["hora"].split(":")[0]): float(h["velocidad_promedio"])
+            for h in dataset.get_stats_by_hour()
+        }
+    return _hourly_speed[version].get(hour, DEFAULT_SPEED_KMH)
+
+
+def _straight_leg(start: Tuple[float, float], end: Tuple[float, float], hour: int) -> Dict[str, Any]:
+    """Tramo estimado en línea recta (coordenadas lon, lat)"""
+    distance = haversine_m(start[1], start[0], end[1], end[0]) * ROAD_DETOUR_FACTOR
+    estimate = get_online_estimator().estimate((start[1] + end[1]) / 2, (start[0] + end[0]) / 2)
+    speed = estimate["speed"] if estimate is not None else _national_hourly_speed(hour)
+    speed = max(speed, 5.0)
+    return {
+        "distance": round(distance, 1),
+        "duration": round(distance / (speed / 3.6), 1),
+        "geometry": [list(start), list(end)],
+    }
+
+
+def _graph_leg(engine, start: Tuple[float, float], end: Tuple[float, float], depart_s: float) -> Optional[Dict[str, Any]]:
+    result = engine.route((start[1], start[0]), (end[1], end[0]), depart_s, k=1)
+    if result.get("status") != "ok":
+        return None
+    path = result["paths"][0]
+    return {
+        "distance": round(path.distance_m, 1),
+        "duration": round(path.duration_s, 1),
+        "geometry": [[p["lng"], p["lat"]] for p in engine.geometry(path)],
+    }
+
+
+def get_historical_directions(
+    coordinates: List[Tuple[float, float]],
+    profile: str = "driving-traffic",
+) -> Optional[Dict[str, Any]]:
+    """
+    Ruta estimada con datos históricos para coordenadas (lon, lat), o None si
+    el perfil no es de conducción. Marca la respuesta con "fallback": True.
+    """
+    if profile not in DRIVING_PROFILES or len(coordinates) < 2:
+        return None
+
+    now = datetime.now(LOCAL_TZ)
+    depart_s = now.hour * 3600 + now.minute * 60
+    engine = get_routing_engine()
+    legs = []
+    geometry: List[List[float]] = []
+    source = "grafo_local" if engine is not None else "linea_recta"
+    for start, end in zip(coordinates, coordinates[1:]):
+        leg = _graph_leg(engine, start, end, depart_s) if engine is not None else None
+        if leg is None:
+            leg = _straight_leg(start, end, (depart_s // 3600) % 24)
+            source = "linea_recta"
+        depart_s += leg["duration"]
+        geometry.extend(leg["geometry"] if not geometry else leg["geometry"][1:])
+        legs.append(leg)
+
+    distance = sum(leg["distance"] for leg in legs)
+    duration = sum(leg["duration"] for leg in legs)
+    return {
+        "status": "ok",
+        "provider": "historico",
+        "fallback": True,
+        "source": source,
+        "routes": [
+            {
+                "distance": round(distance, 1),
+                "duration": round(duration, 1),
+                "geometry": {"type": "LineString", "coordinates": geometry},
+                "legs": [
+                    {"distance": leg["distance"], "duration": leg["duration"], "steps": [], "annotation": {}}
+                    for leg in legs
+                ],
+                "weight": round(duration, 1),
+                "weight_name": "historico",
+            }
+        ],
+        "waypoints": [{"location": list(c)} for c in coordinates],
+    }
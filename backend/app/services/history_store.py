@@ -0,0 +1,412 @@
+"""
+Historial Paginado por Cursor
+=============================
+
+Consultas de historial con paginación keyset sobre (fecha DESC, id DESC):
+
+- Usuarios autenticados: tablas historial_rutas / historial_predicciones
+  en Supabase, apoyadas en los índices (user_id, fecha DESC)
+- Sin usuario: viajes y predicciones derivados del dataset, agregados una
+  vez por versión del dataset en arrays ordenados con desplazamientos por
+  ciudad; cada página cuesta O(log n + limit)
+
+El cursor es opaco (base64 de la última clave devuelta), así que una página
+profunda cuesta lo mismo que la primera y el orden es estable aunque haya
+fechas repetidas.
+
+Autor: PrediRuta Team
+"""
+
+import json
+import base64
+import threading
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from app.services.dataset_loader import get_traffic_dataset
+from app.services.city_matrix import get_city_matrix, ROAD_DETOUR_FACTOR
+from app.services.road_graph import haversine_m
+
+
+ROUTES_TABLE = "historial_rutas"
+PREDICTIONS_TABLE = "historial_predicciones"
+STATS_TABLE = "estadisticas_historial_usuario"
+
+ROUTE_COLUMNS = "id,fecha,origen,destino,distancia,duracion,tiempo_ahorrado,trafico"
+PREDICTION_COLUMNS = "id,fecha,zona,hora_consulta,precision_real,congestion_predicha"
+
+
+class InvalidCursor(ValueError):
+    """Cursor mal formado o manipulado"""
+
+
+def encode_cursor(fecha: str, row_id: str) -> str:
+    raw = json.dumps({"f": fecha, "i": row_id}, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[str, str]:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        data = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+        return str(data["f"]), str(data["i"])
+    except Exception as e:
+        raise InvalidCursor("Cursor inválido") from e
+
+
+def _page(rows: List[Dict[str, Any]], limit: int, keys: Optional[List[Tuple[str, str]]] = None) -> Dict[str, Any]:
+    """
+    Recorta a `limit` filas; el cursor es la clave (fecha, id) de la última.
+    `keys` reemplaza la clave de cada fila cuando lo mostrado no la contiene
+    completa (p. ej. fecha sin hora).
+    """
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    next_cursor = None
+    if has_more and rows:
+        fecha, row_id = keys[len(rows) - 1] if keys else (rows[-1]["fecha"], rows[-1]["id"])
+        next_cursor = encode_cursor(str(fecha), str(row_id))
+    return {"items": rows, "next_cursor": next_cursor, "has_more": has_more}
+
+
+# ============================================
+# SUPABASE (usuarios autenticados)
+# ============================================
+
+def _quote(value: str) -> str:
+    """Valor entre comillas para filtros or= de PostgREST"""
+    return '"' + value.replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+
+def fetch_user_history(
+    table: str,
+    columns: str,
+    user_id: str,
+    limit: int,
+    cursor: Optional[str] = None,
+    filter_column: Optional[str] = None,
+    filter_value: Optional[str] = None,
+) -> Dict[str, Any]:
+    """Página de historial de un usuario ordenada por (fecha DESC, id DESC)"""
+    from app.database import get_supabase
+
+    query = (
+        get_supabase()
+        .table(table)
+        .select(columns)
+        .eq("user_id", user_id)
+    )
+    if filter_column and filter_value:
+        query = query.ilike(filter_column, f"%{filter_value}%")
+    if cursor:
+        fecha, row_id = decode_cursor(cursor)
+        f, i = _quote(fecha), _quote(row_id)
+        query = query.or_(f"fecha.lt.{f},and(fecha.eq.{f},id.lt.{i})")
+
+    res = (
+        query
+        .order("fecha", desc=True)
+        .order("id", desc=True)
+        .limit(limit + 1)
+        .execute()
+    )
+    return _page(res.data or [], limit)
+
+
+# ============================================
+# DATASET (sin usuario)
+# ============================================
+
+TRAFFIC_LEVELS = ("fluido", "moderado", "congestionado", "severo")
+
+
+@dataclass
+class HistoryRollup:
+    """
+    Agregado del dataset en arrays compactos ordenados por (fecha, id)
+    ascendente; el id es la posición en ese orden (1..N). Las filas de cada
+    ciudad son un bloque contiguo de `city_rows` delimitado por
+    `city_offsets`; las páginas se recorren hacia atrás y solo se
+    materializan las filas devueltas.
+    """
+
+    fecha_min: np.ndarray      # (N,) int64, minutos desde epoch
+    ids: np.ndarray            # (N,) int64, 1..N
+    city_code: np.ndarray      # (N,) int16
+    ciudades: List[str]
+    city_offsets: np.ndarray   # (C+1,) int64
+    city_rows: np.ndarray      # (N,) int32, posiciones globales agrupadas por ciudad
+    columns: Dict[str, np.ndarray]
+    labels: Dict[str, List[str]]
+    render: Callable[["HistoryRollup", int], Dict[str, Any]]
+    version: Optional[str] = None
+
+    @classmethod
+    def build(cls, fecha_min, keys, ciudad, columns, labels, render, version=None) -> "HistoryRollup":
+        # `keys` (texto) solo desempata filas de la misma fecha de forma estable
+        order = np.lexsort((keys, fecha_min))
+        ciudades, city_code = np.unique(np.asarray(ciudad)[order], return_inverse=True)
+        city_code = city_code.astype(np.int16)
+        # Orden estable por ciudad conserva el orden global dentro de cada bloque
+        city_rows = np.argsort(city_code, kind="stable").astype(np.int32)
+        city_offsets = np.zeros(len(ciudades) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(city_code, minlength=len(ciudades)), out=city_offsets[1:])
+        return cls(
+            fecha_min=np.asarray(fecha_min, dtype=np.int64)[order],
+            ids=np.arange(1, len(order) + 1, dtype=np.int64),
+            city_code=city_code,
+            ciudades=ciudades.tolist(),
+            city_offsets=city_offsets,
+            city_rows=city_rows,
+            columns={k: np.asarray(v)[order] for k, v in columns.items()},
+            labels=labels,
+            render=render,
+            version=version,
+        )
+
+    def fecha(self, i: int) -> str:
+        return str(np.datetime64(int(self.fecha_min[i]), "m")).replace("T", " ")
+
+    def _position(self, cursor: Optional[str]) -> int:
+        """Cantidad de filas con clave menor que la del cursor"""
+        if not cursor:
+            return len(self.ids)
+        fecha, row_id = decode_cursor(cursor)
+        try:
+            minutes = int(np.datetime64(fecha.replace(" ", "T"), "m").astype(np.int64))
+            row_id = int(row_id)
+        except ValueError as e:
+            raise InvalidCursor("Cursor inválido") from e
+        lo = int(np.searchsorted(self.fecha_min, minutes, side="left"))
+        hi = int(np.searchsorted(self.fecha_min, minutes, side="right"))
+        return lo + int(np.searchsorted(self.ids[lo:hi], row_id, side="left"))
+
+    def page(self, limit: int, cursor: Optional[str], ciudad: Optional[str]) -> Dict[str, Any]:
+        end = self._position(cursor)
+        if ciudad:
+            try:
+                c = self.ciudades.index(ciudad.strip().upper())
+            except ValueError:
+                return _page([], limit)
+            block = self.city_rows[self.city_offsets[c]:self.city_offsets[c + 1]]
+            q = int(np.searchsorted(block, end, side="left"))
+            positions = block[max(0, q - limit - 1):q][::-1]
+        else:
+            positions = np.arange(end - 1, max(-1, end - limit - 2), -1)
+        positions = positions.tolist()
+        return _page(
+            [self.render(self, i) for i in positions],
+            limit,
+            keys=[(self.fecha(i), int(self.ids[i])) for i in positions[:limit]],
+        )
+
+    @property
+    def nbytes(self) -> int:
+        arrays = [self.fecha_min, self.ids, self.city_code, self.city_offsets, self.city_rows, *self.columns.values()]
+        return int(sum(a.nbytes for a in arrays))
+
+
+def _city_frame(subset: List[str]):
+    df = get_traffic_dataset()._df.dropna(subset=subset)
+    return df.assign(ciudad=df['CIUDAD_OPER'].astype(str).str.strip().str.upper())
+
+
+def _fecha_minutes(fechas) -> np.ndarray:
+    return np.asarray(fechas, dtype="datetime64[m]").astype(np.int64)
+
+
+def _render_route(r: HistoryRollup, i: int) -> Dict[str, Any]:
+    c = r.columns
+    fecha = r.fecha(i)
+    return {
+        "id": int(r.ids[i]),
+        "fecha": fecha,
+        "origen": r.ciudades[int(r.city_code[i])],
+        "destino": r.labels["ubicacion"][int(c["ubicacion"][i])][:30],
+        "distancia": round(float(c["distancia"][i]), 1),
+        "duracion": int(c["duracion"][i]),
+        "tiempoAhorrado": int(c["ahorrado"][i]),
+        "trafico": TRAFFIC_LEVELS[int(c["trafico"][i])],
+    }
+
+
+def _render_prediction(r: HistoryRollup, i: int) -> Dict[str, Any]:
+    c = r.columns
+    fecha = r.fecha(i)
+    velocidad = float(c["velocidad"][i])
+    registros = int(c["registros"][i])
+    return {
+        "id": int(r.ids[i]),
+        "fecha": fecha[:10],
+        "zona": r.ciudades[int(r.city_code[i])],
+        "horaConsulta": fecha[11:16],
+        # Mayor cantidad de datos = mayor precisión
+        "precisionReal": int(min(95, 70 + registros / 10)),
+        "congestionPredicha": round(max(0.0, min(1.0, (120 - velocidad) / 120)), 2),
+        "velocidadReal": round(velocidad, 1),
+        "registros": registros,
+    }
+
+
+def _traffic_codes(velocidad: np.ndarray, limite: float = 60) -> np.ndarray:
+    """Códigos de TRAFFIC_LEVELS con los umbrales de TrafficDataset.get_traffic_level"""
+    ratio = velocidad / limite
+    return np.select([ratio >= 0.9, ratio >= 0.6, ratio >= 0.4], [0, 1, 2], default=3).astype(np.int8)
+
+
+def build_route_rollup() -> HistoryRollup:
+    """
+    Un "viaje" por (ciudad, fecha, ubicación): del centroide de la ciudad a la
+    ubicación registrada, con la velocidad media observada. El tiempo ahorrado
+    se compara contra la hora más lenta de la ciudad.
+    """
+    df = _city_frame(['CIUDAD_OPER', 'FECHA', 'LATITUD', 'LONGITUD', 'VELOCIDAD'])
+    grouped = df.groupby(['ciudad', 'FECHA', 'UBICACION_EXCESO']).agg(
+        velocidad=('VELOCIDAD', 'mean'),
+        lat=('LATITUD', 'first'),
+        lon=('LONGITUD', 'first'),
+    ).reset_index()
+
+    matrix = get_city_matrix()
+    idx = np.array([matrix.index(c) for c in grouped['ciudad']], dtype=np.int64)
+    dist = haversine_m(
+        matrix.lat[idx].astype(np.float64), matrix.lon[idx].astype(np.float64),
+        grouped['lat'].to_numpy(dtype=np.float64), grouped['lon'].to_numpy(dtype=np.float64)
+    ) / 1000 * ROAD_DETOUR_FACTOR
+    velocidad = grouped['velocidad'].to_numpy(dtype=np.float64)
+    lenta = matrix.speed_kmh[idx].min(axis=1).astype(np.float64)
+    duracion = dist / np.maximum(velocidad, 1.0) * 60
+    ahorrado = np.maximum(0.0, dist / np.maximum(lenta, 1.0) * 60 - duracion)
+
+    fecha_min = _fecha_minutes(grouped['FECHA'])
+    ubicaciones, ubicacion_code = np.unique(grouped['UBICACION_EXCESO'].astype(str).to_numpy(), return_inverse=True)
+    fecha_txt = pd.Series(np.asarray(fecha_min, dtype="datetime64[m]")).dt.strftime("%Y-%m-%d %H:%M")
+    keys = (grouped['ciudad'] + "|" + grouped['UBICACION_EXCESO'].astype(str) + "|" + fecha_txt).to_numpy(dtype=str)
+
+    return HistoryRollup.build(
+        fecha_min, keys, grouped['ciudad'].to_numpy(dtype=str),
+        columns={
+            "ubicacion": ubicacion_code.astype(np.int32),
+            "distancia": dist.astype(np.float32),
+            "duracion": np.rint(duracion).astype(np.int32),
+            "ahorrado": np.rint(ahorrado).astype(np.int32),
+            "trafico": _traffic_codes(velocidad),
+        },
+        labels={"ubicacion": ubicaciones.tolist()},
+        render=_render_route,
+        version=get_traffic_dataset().version,
+    )
+
+
+def build_prediction_rollup() -> HistoryRollup:
+    """Una predicción por (ciudad, fecha, hora) con la velocidad observada"""
+    df = _city_frame(['CIUDAD_OPER', 'FECHA', 'HORA', 'VELOCIDAD'])
+    grouped = df.groupby(['ciudad', 'FECHA', 'HORA']).agg(
+        velocidad=('VELOCIDAD', 'mean'),
+        registros=('VELOCIDAD', 'size'),
+    ).reset_index()
+
+    fecha_min = _fecha_minutes(grouped['FECHA']) + grouped['HORA'].to_numpy(dtype=np.int64) * 60
+    fecha_txt = pd.Series(np.asarray(fecha_min, dtype="datetime64[m]"))
+    keys = (grouped['ciudad'] + "|" + fecha_txt.dt.strftime("%Y-%m-%d|%H:%M")).to_numpy(dtype=str)
+
+    return HistoryRollup.build(
+        fecha_min, keys, grouped['ciudad'].to_numpy(dtype=str),
+        columns={
+            "velocidad": grouped['velocidad'].to_numpy(dtype=np.float32),
+            "registros": grouped['registros'].to_numpy(dtype=np.int32),
+        },
+        labels={},
+        render=_render_prediction,
+        version=get_traffic_dataset().version,
+    )
+
+
+_rollups: Dict[str, HistoryRollup] = {}
+_rollups_lock = threading.Lock()
+
+
+def get_history_rollup(kind: str) -> HistoryRollup:
+    """Agregado 'rutas' o 'predicciones', reconstruido solo si cambia el dataset"""
+    version = get_traffic_dataset().version
+    rollup = _rollups.get(kind)
+    if rollup is None or rollup.version != version:
+        with _rollups_lock:
+            rollup = _rollups.get(kind)
+            if rollup is None or rollup.version != version:
+                rollup = build_route_rollup() if kind == "rutas" else build_prediction_rollup()
+                _rollups[kind] = rollup
+    return rollup
+
+
+def dataset_route_history(limit: int, cursor: Optional[str] = None, ciudad: Optional[str] = None) -> Dict[str, Any]:
+    return get_history_rollup("rutas").page(limit, cursor, ciudad)
+
+
+def dataset_prediction_history(limit: int, cursor: Optional[str] = None, ciudad: Optional[str] = None) -> Dict[str, Any]:
+    return get_history_rollup("predicciones").page(limit, cursor, ciudad)
+
+
+def user_route_history(user_id: str, limit: int, cursor: Optional[str] = None, ciudad: Optional[str] = None) -> Dict[str, Any]:
+    page = fetch_user_history(ROUTES_TABLE, ROUTE_COLUMNS, user_id, limit, cursor, "origen", ciudad)
+    page["items"] = [
+        {
+            "id": r["id"],
+            "fecha": str(r["fecha"])[:16],
+            "origen": r["origen"],
+            "destino": r["destino"],
+            "distancia": float(r["distancia"]),
+            "duracion": int(r["duracion"]),
+            "tiempoAhorrado": int(r["tiempo_ahorrado"]),
+            "trafico": r.get("trafico"),
+        }
+        for r in page["items"]
+    ]
+    return page
+
+
+def user_prediction_history(user_id: str, limit: int, cursor: Optional[str] = None, ciudad: Optional[str] = None) -> Dict[str, Any]:
+    page = fetch_user_history(PREDICTIONS_TABLE, PREDICTION_COLUMNS, user_id, limit, cursor, "zona", ciudad)
+    page["items"] = [
+        {
+            "id": r["id"],
+            "fecha": str(r["fecha"])[:10],
+            "zona": r["zona"],
+            "horaConsulta": r["hora_consulta"],
+            "precisionReal": int(r["precision_real"]),
+            "congestionPredicha": float(r["congestion_predicha"]),
+        }
+        for r in page["items"]
+    ]
+    return page
+
+
+def user_stats(user_id: str) -> Dict[str, Any]:
+    """
+    Fila de estadísticas mantenida por triggers (database/historial_estadisticas.sql).
+    Un usuario sin historial retorna ceros.
+    """
+    from app.database import get_supabase
+
+    res = (
+        get_supabase()
+        .table(STATS_TABLE)
+        .select("total_rutas_consultadas,kilometros_totales,minutos_ahorrados_totales,"
+                "total_predicciones_consultadas,precision_promedio_predicciones,updated_at")
+        .eq("user_id", user_id)
+        .limit(1)
+        .execute()
+    )
+    row = (res.data or [{}])[0]
+    precision = row.get("precision_promedio_predicciones")
+    return {
+        "total_rutas": int(row.get("total_rutas_consultadas") or 0),
+        "kilometros_totales": float(row.get("kilometros_totales") or 0),
+        "minutos_ahorrados": int(row.get("minutos_ahorrados_totales") or 0),
+        "total_predicciones": int(row.get("total_predicciones_consultadas") or 0),
+        "precision_promedio": float(precision) if precision is not None else None,
+        "actualizado": row.get("updated_at"),
+    }
@@ -0,0 +1,213 @@
+"""
+Cliente HTTP compartido para las APIs de Mapbox
+===============================================
+
+Un único httpx.AsyncClient por proceso, abierto y cerrado en el lifespan de
+FastAPI, en lugar de un cliente nuevo (TCP + TLS) por llamada:
+
+- HTTP/2 (h2) y pool de conexiones keep-alive
+- Timeouts por servicio (directions, matrix, geocoding)
+- Inyectable: set_http_client() permite sustituir el cliente (p. ej. con un
+  httpx.MockTransport) y MAPBOX_API_URL apunta las URLs a un servidor stub
+  local para pruebas y benchmarks
+
+Todas las llamadas a Mapbox pasan por mapbox_request(), punto único donde
+enganchar límites, métricas y fallbacks; hoy aplica el limitador de tasa
+por API (rate_limiter), el cortocircuito (circuit_breaker), el medidor de
+consumo mensual (usage_meter) y, si se pide,
+solicitudes de cobertura: si la respuesta tarda más que el p95 reciente se
+envía un duplicado y gana la primera que responde.
+
+Autor: PrediRuta Team
+"""
+
+import os
+import time
+import asyncio
+from typing import Any, Dict, Optional
+
+import httpx
+
+from app.services.rate_limiter import INTERACTIVE, QUEUE_TIMEOUTS, current_priority, get_rate_limiter
+from app.services.circuit_breaker import CLOSED, CircuitBreaker, get_circuit_breaker
+from app.services.usage_meter import get_usage_meter
+
+
+# Timeouts (s) por servicio; configurables con MAPBOX_TIMEOUT_<SERVICIO>
+SERVICE_TIMEOUTS: Dict[str, float] = {
+    "directions": float(os.getenv("MAPBOX_TIMEOUT_DIRECTIONS", "15")),
+    "matrix": float(os.getenv("MAPBOX_TIMEOUT_MATRIX", "15")),
+    "geocoding": float(os.getenv("MAPBOX_TIMEOUT_GEOCODING", "10")),
+}
+DEFAULT_TIMEOUT = 15.0
+CONNECT_TIMEOUT = 5.0
+
+POOL_MAX_CONNECTIONS = int(os.getenv("MAPBOX_POOL_MAX_CONNECTIONS", "50"))
+POOL_MAX_KEEPALIVE = int(os.getenv("MAPBOX_POOL_MAX_KEEPALIVE", "20"))
+POOL_KEEPALIVE_EXPIRY = float(os.getenv("MAPBOX_POOL_KEEPALIVE_EXPIRY", "30"))
+
+# Solicitudes de cobertura (hedging) para llamadas interactivas que las piden
+HEDGE_ENABLED = os.getenv("MAPBOX_HEDGE_ENABLED", "false").lower() in ("1", "true", "yes")
+HEDGE_MIN_DELAY = 0.05
+
+_client: Optional[httpx.AsyncClient] = None
+
+
+def _http2_available() -> bool:
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def create_http_client(**kwargs: Any) -> httpx.AsyncClient:
+    """Cliente con HTTP/2 y pool keep-alive; kwargs sobrescribe la configuración"""
+    options: Dict[str, Any] = {
+        "http2": _http2_available(),
+        "limits": httpx.Limits(
+            max_connections=POOL_MAX_CONNECTIONS,
+            max_keepalive_connections=POOL_MAX_KEEPALIVE,
+            keepalive_expiry=POOL_KEEPALIVE_EXPIRY,
+        ),
+        "timeout": httpx.Timeout(DEFAULT_TIMEOUT, connect=CONNECT_TIMEOUT),
+    }
+    options.update(kwargs)
+    return httpx.AsyncClient(**options)
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """Cliente compartido; se crea bajo demanda fuera del lifespan (scripts, CLI)"""
+    global _client
+    if _client is None or _client.is_closed:
+        _client = create_http_client()
+    return _client
+
+
+def set_http_client(client: Optional[httpx.AsyncClient]) -> None:
+    """Inyecta el cliente a usar (pruebas, stubs); None vuelve al predeterminado"""
+    global _client
+    _client = client
+
+
+async def start_http_client() -> httpx.AsyncClient:
+    """Abre el cliente compartido (lifespan)"""
+    return get_http_client()
+
+
+async def close_http_client() -> None:
+    """Cierra el cliente compartido y sus conexiones (lifespan)"""
+    global _client
+    if _client is not None and not _client.is_closed:
+        await _client.aclose()
+    _client = None
+
+
+def service_timeout(service: str) -> httpx.Timeout:
+    return httpx.Timeout(SERVICE_TIMEOUTS.get(service, DEFAULT_TIMEOUT), connect=CONNECT_TIMEOUT)
+
+
+async def _send(
+    service: str,
+    url: str,
+    params: Optional[Dict[str, Any]],
+    breaker: CircuitBreaker,
+    units: int = 1,
+) -> httpx.Response:
+    """Un intento: circuito, turno en el limitador y registro del resultado y del consumo"""
+    breaker.allow()
+    limiter = get_rate_limiter(service)
+    if limiter is not None:
+        try:
+            await limiter.acquire()
+        except BaseException:
+            breaker.release_trial()
+            raise
+    started = time.monotonic()
+    try:
+        response = await get_http_client().get(url, params=params, timeout=service_timeout(service))
+    except httpx.RequestError:
+        breaker.record(time.monotonic() - started, failed=True)
+        raise
+    except BaseException:
+        # Cancelación u otro error: libera la prueba de half-open sin registrar resultado
+        breaker.release_trial()
+        raise
+    finally:
+        if limiter is not None:
+            limiter.release()
+    elapsed = time.monotonic() - started
+    breaker.record(elapsed, failed=response.status_code >= 500)
+    get_usage_meter().record(service, response.status_code, elapsed * 1000, len(response.content), units)
+    return response
+
+
+async def _send_hedged(
+    service: str,
+    url: str,
+    params: Optional[Dict[str, Any]],
+    breaker: CircuitBreaker,
+    units: int = 1,
+) -> httpx.Response:
+    """Envía un duplicado si la primera llamada supera el p95; gana la primera respuesta"""
+    delay = breaker.p95()
+    if delay is None or breaker.state != CLOSED:
+        return await _send(service, url, params, breaker, units)
+
+    first = asyncio.ensure_future(_send(service, url, params, breaker, units))
+    second = None
+    try:
+        done, _ = await asyncio.wait({first}, timeout=max(delay, HEDGE_MIN_DELAY))
+        if done:
+            return first.result()
+        breaker.hedged += 1
+        second = asyncio.ensure_future(_send(service, url, params, breaker, units))
+        pending = {first, second}
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    if task is second:
+                        breaker.hedge_wins += 1
+                    return task.result()
+        # Ambas fallaron: se propaga el error de la llamada original
+        return first.result()
+    finally:
+        for task in (first, second):
+            if task is not None and not task.done():
+                task.cancel()
+
+
+async def mapbox_request(
+    service: str,
+    url: str,
+    params: Optional[Dict[str, Any]] = None,
+    hedge: bool = False,
+    units: int = 1,
+) -> httpx.Response:
+    """
+    GET a una API de Mapbox con el cliente compartido y el timeout del servicio.
+    Propaga httpx.RequestError igual que una llamada directa, RateLimitExceeded
+    si la solicitud no obtiene turno en el limitador y CircuitOpenError si el
+    circuito de la API está abierto. Ante un 429 se reintenta una vez, tras
+    la pausa, si esta cabe en el plazo de la cola. BudgetExceeded (subclase
+    de RateLimitExceeded) indica que la cuota mensual no permite la llamada.
+
+    hedge=True activa la solicitud de cobertura (si MAPBOX_HEDGE_ENABLED y la
+    llamada es interactiva). `units` es la cantidad facturable de la llamada
+    (elementos para Matrix).
+    """
+    get_usage_meter().check(service, units)
+    breaker = get_circuit_breaker(service)
+    limiter = get_rate_limiter(service)
+    hedged = hedge and HEDGE_ENABLED and current_priority() == INTERACTIVE
+    send = _send_hedged if hedged else _send
+
+    for attempt in (0, 1):
+        response = await send(service, url, params, breaker, units)
+        if limiter is None:
+            return response
+        pause = limiter.on_response(response.status_code, response.headers)
+        if pause is None or attempt or pause > QUEUE_TIMEOUTS.get(current_priority(), 0.0):
+            return response
+    return response
@@ -0,0 +1,430 @@
+"""
+Geocodificador Local (sin Mapbox)
+=================================
+
+Índice en memoria de lugares de Ecuador que se consulta antes de Mapbox
+Geocoding:
+
+- Fuentes: ubicaciones del TrafficDataset (UBICACION_EXCESO, con la
+  mediana de sus coordenadas), ECUADOR_CITIES y un gazetteer opcional
+  (CSV en LOCAL_GEOCODER_GAZETTEER con columnas nombre, latitud, longitud y
+  opcionalmente canton, provincia, tipo, peso)
+- Directa: coincidencia exacta, por prefijo (autocompletado) o por
+  similitud de trigramas (Dice) sobre el nombre y el nombre completo,
+  normalizados sin tildes; solo responde si el mejor puntaje alcanza
+  LOCAL_GEOCODER_MIN_SCORE, si no la consulta sigue a Mapbox
+- Inversa: lugar más cercano con un cKDTree sobre (lat, lon·cos lat),
+  dentro de LOCAL_GEOCODER_REVERSE_RADIUS_M
+
+Se construye por worker en el arranque (lifespan) o, si no, al primer uso
+en un hilo aparte, y se reconstruye cuando cambia la versión del dataset.
+
+Autor: PrediRuta Team
+"""
+
+import os
+import math
+import asyncio
+import threading
+import unicodedata
+from collections import defaultdict
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from app.config.mapbox import ECUADOR_CITIES
+from app.services.dataset_loader import get_traffic_dataset
+from app.services.road_graph import haversine_m
+
+
+LOCAL_GEOCODER_GAZETTEER = os.getenv("LOCAL_GEOCODER_GAZETTEER", "")
+LOCAL_GEOCODER_MIN_SCORE = float(os.getenv("LOCAL_GEOCODER_MIN_SCORE", "0.8"))
+LOCAL_GEOCODER_REVERSE_RADIUS_M = float(os.getenv("LOCAL_GEOCODER_REVERSE_RADIUS_M", "3000"))
+# Caracteres mínimos para buscar por prefijo
+MIN_PREFIX = 3
+# Lugares con el mismo nombre y provincia a menos de esta distancia se
+# fusionan (la mediana del dataset de un cantón grande cae lejos del centro)
+MERGE_DISTANCE_M = 50000
+# Resultados secundarios: hasta esta distancia del mejor puntaje
+SCORE_SPREAD = 0.15
+# Prioridad de las coordenadas al fusionar (mayor gana)
+SOURCE_PRIORITY = {"dataset": 0, "ciudades": 1, "gazetteer": 2}
+_LOWER_WORDS = {"de", "del", "la", "las", "los", "el", "y"}
+
+
+def local_geocoder_enabled() -> bool:
+    return os.getenv("LOCAL_GEOCODER_ENABLED", "true").lower() in ("1", "true", "yes")
+
+
+def normalize(text: str) -> str:
+    """Minúsculas, sin tildes y solo letras, dígitos y espacios simples"""
+    text = unicodedata.normalize("NFKD", str(text).lower())
+    text = "".join(c if c.isalnum() else " " for c in text if not unicodedata.combining(c))
+    return " ".join(text.split())
+
+
+def _title(text: str) -> str:
+    words = str(text).strip().lower().split()
+    return " ".join(w if i and w in _LOWER_WORDS else w.capitalize() for i, w in enumerate(words))
+
+
+def _trigrams(text: str) -> frozenset:
+    padded = f"  {text} "
+    return frozenset(padded[i:i + 3] for i in range(len(padded) - 2))
+
+
+@dataclass
+class Place:
+    name: str
+    lat: float
+    lon: float
+    place_type: str
+    canton: Optional[str] = None
+    provincia: Optional[str] = None
+    weight: float = 0.0
+    source: str = "dataset"
+
+    @property
+    def place_name(self) -> str:
+        parts = [self.name]
+        if self.canton and normalize(self.canton) != normalize(self.name):
+            parts.append(self.canton)
+        if self.provincia and normalize(self.provincia) != normalize(self.name):
+            parts.append(self.provincia)
+        return ", ".join(parts + ["Ecuador"])
+
+    def context(self) -> List[Dict[str, Any]]:
+        context = []
+        if self.canton and normalize(self.canton) != normalize(self.name):
+            context.append({"id": "place", "text": self.canton})
+        if self.provincia:
+            context.append({"id": "region", "text": self.provincia})
+        context.append({"id": "country", "text": "Ecuador", "short_code": "ec"})
+        return context
+
+
+# ============================================================
+# Fuentes
+# ============================================================
+
+def _dataset_places() -> List[Place]:
+    """Una entrada por UBICACION_EXCESO ("PARROQUIA,CANTON,PROVINCIA")"""
+    dataset = get_traffic_dataset()
+    if not dataset.is_loaded:
+        return []
+    df = dataset._df.dropna(subset=["UBICACION_EXCESO", "LATITUD", "LONGITUD"])
+    grouped = df.groupby("UBICACION_EXCESO").agg(
+        lat=("LATITUD", "median"),
+        lon=("LONGITUD", "median"),
+        registros=("LATITUD", "size"),
+    )
+    places = []
+    for ubicacion, row in grouped.iterrows():
+        parts = [p.strip() for p in str(ubicacion).split(",")]
+        if not parts[0]:
+            continue
+        name = _title(parts[0])
+        canton = _title(parts[1]) if len(parts) > 1 and parts[1] else None
+        provincia = _title(parts[2]) if len(parts) > 2 and parts[2] else None
+        # La parroquia con el nombre del cantón es su cabecera (ciudad)
+        is_city = canton is not None and normalize(canton) == normalize(name)
+        places.append(Place(
+            name=name,
+            lat=float(row["lat"]),
+            lon=float(row["lon"]),
+            place_type="place" if is_city else "locality",
+            canton=canton,
+            provincia=provincia,
+            weight=float(row["registros"]),
+            source="dataset",
+        ))
+    return places
+
+
+def _city_places() -> List[Place]:
+    places = []
+    for city in ECUADOR_CITIES:
+        name, _, provincia = city["name"].partition(",")
+        places.append(Place(
+            name=name.strip(),
+            lat=float(city["coords"][0]),
+            lon=float(city["coords"][1]),
+            place_type="place",
+            provincia=provincia.strip() or None,
+            source="ciudades",
+        ))
+    return places
+
+
+def _gazetteer_places(path: str) -> List[Place]:
+    if not path:
+        return []
+    if not os.path.exists(path):
+        print(f"⚠️ Gazetteer no encontrado: {path}")
+        return []
+    import pandas as pd
+
+    try:
+        df = pd.read_csv(path)
+    except Exception as e:
+        print(f"⚠️ Error leyendo gazetteer {path}: {e}")
+        return []
+    # Columnas faltantes o coordenadas no numéricas invalidan todo el archivo
+    try:
+        df.columns = df.columns.str.strip().str.lower()
+        df = df.dropna(subset=["nombre", "latitud", "longitud"])
+        places = []
+        for row in df.to_dict("records"):
+            places.append(Place(
+                name=str(row["nombre"]).strip(),
+                lat=float(row["latitud"]),
+                lon=float(row["longitud"]),
+                place_type=str(row["tipo"]).strip() if isinstance(row.get("tipo"), str) else "locality",
+                canton=str(row["canton"]).strip() if isinstance(row.get("canton"), str) else None,
+                provincia=str(row["provincia"]).strip() if isinstance(row.get("provincia"), str) else None,
+                weight=float(row["peso"]) if pd.notna(row.get("peso")) else 0.0,
+                source="gazetteer",
+            ))
+    except Exception as e:
+        print(f"⚠️ Gazetteer inválido {path}: {e}")
+        return []
+    return places
+
+
+def _merge(places: Sequence[Place]) -> List[Place]:
+    """
+    Fusiona lugares con el mismo nombre, tipo y provincia (si ambos la
+    tienen) a menos de MERGE_DISTANCE_M: conserva las coordenadas de la
+    fuente de mayor prioridad y suma pesos
+    """
+    merged: List[Place] = []
+    by_name: Dict[Tuple[str, str], List[int]] = defaultdict(list)
+    for place in sorted(places, key=lambda p: -SOURCE_PRIORITY.get(p.source, 0)):
+        key = (normalize(place.name), place.place_type)
+        for i in by_name[key]:
+            other = merged[i]
+            if other.provincia and place.provincia and normalize(other.provincia) != normalize(place.provincia):
+                continue
+            if haversine_m(other.lat, other.lon, place.lat, place.lon) <= MERGE_DISTANCE_M:
+                other.weight += place.weight
+                other.canton = other.canton or place.canton
+                other.provincia = other.provincia or place.provincia
+                break
+        else:
+            by_name[key].append(len(merged))
+            merged.append(Place(**place.__dict__))
+    return merged
+
+
+# ============================================================
+# Índice
+# ============================================================
+
+@dataclass
+class LocalGeocoder:
+    places: List[Place]
+    # Versión del TrafficDataset con que se construyó
+    version: str = ""
+    _exact: Dict[str, List[int]] = field(default_factory=dict, repr=False)
+    _prefix: Dict[str, List[int]] = field(default_factory=dict, repr=False)
+    _trigram: Dict[str, List[int]] = field(default_factory=dict, repr=False)
+    _keys: List[Tuple[int, str, frozenset]] = field(default_factory=list, repr=False)
+    _tree: Any = field(default=None, repr=False)
+    _coslat: float = field(default=1.0, repr=False)
+    hits: int = 0
+    misses: int = 0
+    reverse_hits: int = 0
+    reverse_misses: int = 0
+
+    def __post_init__(self):
+        exact: Dict[str, List[int]] = defaultdict(list)
+        prefix: Dict[str, set] = defaultdict(set)
+        trigram: Dict[str, List[int]] = defaultdict(list)
+        for i, place in enumerate(self.places):
+            # Claves de búsqueda: nombre y nombre completo
+            for key in {normalize(place.name), normalize(place.place_name.rsplit(",", 1)[0])}:
+                k = len(self._keys)
+                grams = _trigrams(key)
+                self._keys.append((i, key, grams))
+                exact[key].append(i)
+                for n in range(MIN_PREFIX, len(key) + 1):
+                    prefix[key[:n]].add(k)
+                for gram in grams:
+                    trigram[gram].append(k)
+        self._exact = dict(exact)
+        self._prefix = {p: sorted(ks) for p, ks in prefix.items()}
+        self._trigram = dict(trigram)
+        if self.places:
+            from scipy.spatial import cKDTree
+
+            lat = np.array([p.lat for p in self.places], dtype=np.float64)
+            lon = np.array([p.lon for p in self.places], dtype=np.float64)
+            self._coslat = math.cos(math.radians(float(lat.mean())))
+            self._tree = cKDTree(np.column_stack([lat, lon * self._coslat]))
+
+    # --------------------------------------------------------
+    # Directa
+    # --------------------------------------------------------
+
+    def _scores(self, query: str) -> Dict[int, float]:
+        scores: Dict[int, float] = {}
+
+        def offer(i: int, score: float) -> None:
+            if score > scores.get(i, 0.0):
+                scores[i] = score
+
+        for i in self._exact.get(query, ()):
+            offer(i, 1.0)
+        for k in self._prefix.get(query, ()):
+            i, key, _ = self._keys[k]
+            offer(i, 0.8 + 0.2 * len(query) / len(key))
+        grams = _trigrams(query)
+        shared: Dict[int, int] = defaultdict(int)
+        for gram in grams:
+            for k in self._trigram.get(gram, ()):
+                shared[k] += 1
+        for k, n in shared.items():
+            i, _, key_grams = self._keys[k]
+            offer(i, 2.0 * n / (len(grams) + len(key_grams)))
+        return scores
+
+    def forward(
+        self,
+        query: str,
+        limit: int = 5,
+        types: Optional[List[str]] = None,
+        min_score: float = LOCAL_GEOCODER_MIN_SCORE,
+    ) -> Optional[List[Dict[str, Any]]]:
+        """Resultados con el formato de geocode_forward, o None si no hay coincidencia suficiente"""
+        q = normalize(query)
+        if len(q) < MIN_PREFIX:
+            self.misses += 1
+            return None
+        scores = self._scores(q)
+        ranked = sorted(
+            ((s, i) for i, s in scores.items()
+             if s >= min_score and (not types or self.places[i].place_type in types)),
+            key=lambda t: (-round(t[0], 3), -self.places[t[1]].weight, self.places[t[1]].name),
+        )
+        if not ranked:
+            self.misses += 1
+            return None
+        best = ranked[0][0]
+        ranked = [(s, i) for s, i in ranked if s >= best - SCORE_SPREAD]
+        self.hits += 1
+        return [self._feature(self.places[i], round(s, 3)) for s, i in ranked[:limit]]
+
+    # --------------------------------------------------------
+    # Inversa
+    # --------------------------------------------------------
+
+    def reverse(
+        self,
+        longitude: float,
+        latitude: float,
+        types: Optional[List[str]] = None,
+        radius_m: float = LOCAL_GEOCODER_REVERSE_RADIUS_M,
+    ) -> Optional[Dict[str, Any]]:
+        """Lugar más cercano dentro del radio (formato de geocode_reverse), o None"""
+        if self._tree is None:
+            self.reverse_misses += 1
+            return None
+        k = min(8, len(self.places))
+        _, idx = self._tree.query([latitude, longitude * self._coslat], k=k)
+        for i in np.atleast_1d(idx).tolist():
+            place = self.places[int(i)]
+            if types and place.place_type not in types:
+                continue
+            distance = haversine_m(latitude, longitude, place.lat, place.lon)
+            if distance > radius_m:
+                break
+            self.reverse_hits += 1
+            feature = self._feature(place)
+            return {
+                "name": feature["name"],
+                "place_name": feature["place_name"],
+                "place_type": feature["place_type"],
+                "address": None,
+                "context": feature["context"],
+                "distance_m": round(float(distance), 1),
+            }
+        self.reverse_misses += 1
+        return None
+
+    @staticmethod
+    def _feature(place: Place, relevance: float = 1.0) -> Dict[str, Any]:
+        return {
+            "name": place.name,
+            "place_name": place.place_name,
+            "coordinates": {"longitude": round(place.lon, 6), "latitude": round(place.lat, 6)},
+            "bbox": None,
+            "place_type": [place.place_type],
+            "relevance": relevance,
+            "address": None,
+            "context": place.context(),
+        }
+
+    def stats(self) -> Dict[str, Any]:
+        forward = self.hits + self.misses
+        reverse = self.reverse_hits + self.reverse_misses
+        by_source: Dict[str, int] = defaultdict(int)
+        for place in self.places:
+            by_source[place.source] += 1
+        return {
+            "lugares": len(self.places),
+            "por_fuente": dict(by_source),
+            "claves_prefijo": len(self._prefix),
+            "trigramas": len(self._trigram),
+            "directas_locales": self.hits,
+            "directas_a_mapbox": self.misses,
+            "tasa_local_directa": round(self.hits / forward, 4) if forward else None,
+            "inversas_locales": self.reverse_hits,
+            "inversas_a_mapbox": self.reverse_misses,
+            "tasa_local_inversa": round(self.reverse_hits / reverse, 4) if reverse else None,
+        }
+
+
+def _dataset_version() -> str:
+    return get_traffic_dataset().version or ""
+
+
+def build_local_geocoder(gazetteer: str = LOCAL_GEOCODER_GAZETTEER) -> LocalGeocoder:
+    version = _dataset_version()
+    places = _merge(_dataset_places() + _city_places() + _gazetteer_places(gazetteer))
+    return LocalGeocoder(places=places, version=version)
+
+
+_geocoder: Optional[LocalGeocoder] = None
+_geocoder_lock = threading.Lock()
+
+
+def current_local_geocoder() -> Optional[LocalGeocoder]:
+    """Índice ya construido para la versión actual del dataset (nunca lo construye)"""
+    if not local_geocoder_enabled():
+        return None
+    geocoder = _geocoder
+    if geocoder is None or geocoder.version != _dataset_version():
+        return None
+    return geocoder
+
+
+def _ensure_local_geocoder() -> LocalGeocoder:
+    global _geocoder
+    with _geocoder_lock:
+        if _geocoder is None or _geocoder.version != _dataset_version():
+            _geocoder = build_local_geocoder()
+        return _geocoder
+
+
+async def get_local_geocoder() -> Optional[LocalGeocoder]:
+    """
+    Índice del worker para la versión actual del dataset (None si está
+    desactivado); si falta o quedó desactualizado se construye en un hilo
+    """
+    if not local_geocoder_enabled():
+        return None
+    geocoder = current_local_geocoder()
+    if geocoder is None:
+        geocoder = await asyncio.to_thread(_ensure_local_geocoder)
+    return geocoder
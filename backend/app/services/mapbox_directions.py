@@ -9,21 +9,40 @@ Este módulo proporciona funcionalidades para:
 """
 
 import os
-import time
 from typing import Any, Dict, List, Optional, Tuple
 import httpx
 from app.config.mapbox import mapbox_config, TRAFFIC_PROFILES
+from app.services.http_client import mapbox_request
+from app.services.rate_limiter import RateLimitExceeded
+from app.services.circuit_breaker import CircuitOpenError
+from app.services.ttl_cache import TTLCache
+from app.services.shared_cache import TieredCache
+from app.services.single_flight import SingleFlight
+from app.services.route_shaping import shape_directions
+from app.services.cache_warmer import register_refresher, track
 
 
-# Cache simple para rutas
-_route_cache: Dict[str, Dict[str, Any]] = {}
+# Cache acotada para rutas
 _CACHE_TTL = 300  # 5 minutos para rutas
+_route_cache = TieredCache(
+    TTLCache(
+        "directions",
+        _CACHE_TTL,
+        max_entries=int(os.getenv("ROUTE_CACHE_MAX_ENTRIES", "512")),
+        max_bytes=int(os.getenv("ROUTE_CACHE_MAX_BYTES", str(64 * 1024 * 1024))),
+    ),
+)
+# Llamadas concurrentes con la misma clave comparten una sola solicitud
+_route_flights = SingleFlight("directions")
 
 
-def _cache_key(coordinates: List[Tuple[float, float]], profile: str) -> str:
-    """Generar clave de cache para ruta"""
+def _cache_key(coordinates: List[Tuple[float, float]], profile: str, *options: Any) -> str:
+    """Generar clave de cache para ruta (incluye las opciones que cambian la respuesta)"""
     coords_str = ";".join([f"{round(lon, 5)},{round(lat, 5)}" for lon, lat in coordinates])
-    return f"{profile}:{coords_str}"
+    key = f"{profile}:{coords_str}"
+    if options:
+        key += "|" + "|".join(",".join(o) if isinstance(o, (list, tuple)) else str(o) for o in options)
+    return key
 
 
 async def get_directions(
@@ -34,18 +53,30 @@ async def get_directions(
     geometries: str = "geojson",
     overview: str = "full",
     annotations: Optional[List[str]] = None,
+    refresh: bool = False,
+    track_usage: bool = True,
+    zoom: Optional[float] = None,
+    hedge: bool = False,
 ) -> Dict[str, Any]:
     """
     Obtener direcciones entre múltiples puntos usando Mapbox Directions API
+
+    A Mapbox se pide siempre polyline6 y así se guarda en cache (compacto);
+    la geometría se convierte al formato pedido al responder.
     
     Args:
         coordinates: Lista de tuplas (longitud, latitud) para los waypoints
         profile: Perfil de ruta (driving-traffic, driving, walking, cycling)
         alternatives: Si debe devolver rutas alternativas
         steps: Si debe incluir instrucciones paso a paso
-        geometries: Formato de geometría (geojson, polyline, polyline6)
+        geometries: Formato de geometría de la respuesta (geojson, polyline6)
         overview: Nivel de detalle de geometría (full, simplified, false)
         annotations: Datos adicionales a incluir (duration, distance, speed, congestion)
+        refresh: Consultar al proveedor aunque haya una entrada vigente en cache
+        track_usage: Contar la consulta para el calentador de cache
+        zoom: Simplificar la geometría (Douglas-Peucker) a la resolución de este zoom
+        hedge: Enviar una solicitud de cobertura si Mapbox tarda más que su p95
+            (solo para consultas interactivas; duplica el consumo en la cola lenta)
     
     Returns:
         Diccionario con rutas, distancias, tiempos y geometría
@@ -68,11 +99,39 @@ async def get_directions(
         }
     
     # Verificar cache
-    cache_key = _cache_key(coordinates, profile)
-    cached = _route_cache.get(cache_key)
-    if cached and (time.time() - cached["t"]) < _CACHE_TTL:
-        return cached["v"]
+    cache_key = _cache_key(coordinates, profile, alternatives, steps, overview, annotations or "")
+    if track_usage:
+        track("directions", cache_key, {
+            "coordinates": [tuple(c) for c in coordinates],
+            "profile": profile,
+            "alternatives": alternatives,
+            "steps": steps,
+            "overview": overview,
+            "annotations": annotations,
+        })
+    if not refresh:
+        cached = await _route_cache.get(cache_key)
+        if cached is not None:
+            return shape_directions(cached, geometries, zoom)
     
+    result = await _route_flights.do(
+        cache_key,
+        lambda: _fetch_directions(cache_key, coordinates, profile, alternatives, steps, overview, annotations, hedge),
+    )
+    return shape_directions(result, geometries, zoom)
+
+
+async def _fetch_directions(
+    cache_key: str,
+    coordinates: List[Tuple[float, float]],
+    profile: str,
+    alternatives: bool,
+    steps: bool,
+    overview: str,
+    annotations: Optional[List[str]],
+    hedge: bool = False,
+) -> Dict[str, Any]:
+    """Solicitud a Directions API (una por clave en vuelo); guarda en cache si es exitosa"""
     # Construir URL
     coords_str = ";".join([f"{lon},{lat}" for lon, lat in coordinates])
     url = f"{mapbox_config.directions_url}/{profile}/{coords_str}"
@@ -82,7 +141,7 @@ async def get_directions(
         "access_token": mapbox_config.access_token,
         "alternatives": "true" if alternatives else "false",
         "steps": "true" if steps else "false",
-        "geometries": geometries,
+        "geometries": "polyline6",
         "overview": overview,
     }
     
@@ -94,58 +153,61 @@ async def get_directions(
         params["annotations"] = "duration,distance,speed,congestion"
     
     try:
-        async with httpx.AsyncClient(timeout=15.0) as client:
-            response = await client.get(url, params=params)
-            
-            if response.status_code != 200:
-                error_detail = response.json() if response.headers.get("content-type", "").startswith("application/json") else response.text
-                return {
-                    "status": "error",
-                    "code": response.status_code,
-                    "message": f"Error de Mapbox Directions API: {error_detail}",
-                }
-            
-            data = response.json()
-            
-            # Procesar respuesta
-            if not data.get("routes"):
-                return {
-                    "status": "error",
-                    "code": 404,
-                    "message": "No se encontraron rutas para los puntos especificados",
-                }
-            
-            # Formatear resultado
-            result = {
-                "status": "ok",
-                "provider": "mapbox",
-                "routes": [
-                    {
-                        "distance": route.get("distance"),  # Metros
-                        "duration": route.get("duration"),  # Segundos
-                        "geometry": route.get("geometry"),  # GeoJSON
-                        "legs": [
-                            {
-                                "distance": leg.get("distance"),
-                                "duration": leg.get("duration"),
-                                "steps": leg.get("steps", []) if steps else [],
-                                "annotation": leg.get("annotation", {}),
-                            }
-                            for leg in route.get("legs", [])
-                        ],
-                        "weight": route.get("weight"),
-                        "weight_name": route.get("weight_name"),
-                    }
-                    for route in data.get("routes", [])
-                ],
-                "waypoints": data.get("waypoints", []),
+        response = await mapbox_request("directions", url, params, hedge=hedge)
+        
+        if response.status_code != 200:
+            error_detail = response.json() if response.headers.get("content-type", "").startswith("application/json") else response.text
+            return {
+                "status": "error",
+                "code": response.status_code,
+                "message": f"Error de Mapbox Directions API: {error_detail}",
             }
-            
-            # Guardar en cache
-            _route_cache[cache_key] = {"t": time.time(), "v": result}
-            
-            return result
-            
+        
+        data = response.json()
+        
+        # Procesar respuesta
+        if not data.get("routes"):
+            return {
+                "status": "error",
+                "code": 404,
+                "message": "No se encontraron rutas para los puntos especificados",
+            }
+        
+        # Formatear resultado
+        result = {
+            "status": "ok",
+            "provider": "mapbox",
+            "routes": [
+                {
+                    "distance": route.get("distance"),  # Metros
+                    "duration": route.get("duration"),  # Segundos
+                    "geometry": route.get("geometry"),  # polyline6
+                    "legs": [
+                        {
+                            "distance": leg.get("distance"),
+                            "duration": leg.get("duration"),
+                            "steps": leg.get("steps", []) if steps else [],
+                            "annotation": leg.get("annotation", {}),
+                        }
+                        for leg in route.get("legs", [])
+                    ],
+                    "weight": route.get("weight"),
+                    "weight_name": route.get("weight_name"),
+                }
+                for route in data.get("routes", [])
+            ],
+            "waypoints": data.get("waypoints", []),
+        }
+        
+        # Guardar en cache
+        await _route_cache.set(cache_key, result)
+        
+        return result
+        
+    except RateLimitExceeded as e:
+        return {"status": "error", "code": 429, "message": str(e)}
+    except CircuitOpenError as e:
+        return {"status": "error", "code": 503, "message": str(e)}
     except httpx.RequestError as e:
         return {
             "status": "error",
@@ -164,6 +226,13 @@ async def get_route_with_traffic(
     start: Tuple[float, float],
     end: Tuple[float, float],
     alternatives: bool = True,
+    refresh: bool = False,
+    track_usage: bool = True,
+    steps: bool = True,
+    geometries: str = "geojson",
+    zoom: Optional[float] = None,
+    annotations: Optional[List[str]] = None,
+    hedge: bool = False,
 ) -> Dict[str, Any]:
     """
     Obtener ruta con información de tráfico en tiempo real
@@ -172,6 +241,13 @@ async def get_route_with_traffic(
         start: Tupla (longitud, latitud) del punto inicial
         end: Tupla (longitud, latitud) del punto final
         alternatives: Si debe devolver rutas alternativas
+        refresh: Consultar al proveedor aunque haya una entrada vigente en cache
+        track_usage: Contar la consulta para el calentador de cache
+        steps: Si debe incluir instrucciones paso a paso
+        geometries: Formato de geometría de la respuesta (geojson, polyline6)
+        zoom: Simplificar la geometría a la resolución de este zoom
+        annotations: Anotaciones a incluir (por defecto las de tráfico)
+        hedge: Solicitud de cobertura ante latencia alta (ver get_directions)
     
     Returns:
         Diccionario con ruta principal y alternativas con datos de tráfico
@@ -180,24 +256,40 @@ async def get_route_with_traffic(
         coordinates=[start, end],
         profile="driving-traffic",
         alternatives=alternatives,
-        annotations=["duration", "distance", "speed", "congestion"],
+        steps=steps,
+        geometries=geometries,
+        annotations=annotations or ["duration", "distance", "speed", "congestion"],
+        refresh=refresh,
+        track_usage=track_usage,
+        zoom=zoom,
+        hedge=hedge,
     )
 
 
+async def _refresh_directions(args: Dict[str, Any]) -> Dict[str, Any]:
+    """Refresco del calentador: repite la consulta sin pasar por la cache"""
+    return await get_directions(**args, refresh=True, track_usage=False)
+
+
+register_refresher("directions", _refresh_directions, _route_cache.ttl_remaining)
+
+
 async def get_matrix(
     coordinates: List[Tuple[float, float]],
     profile: str = "driving-traffic",
     sources: Optional[List[int]] = None,
     destinations: Optional[List[int]] = None,
+    annotations: Optional[List[str]] = None,
 ) -> Dict[str, Any]:
     """
     Obtener matriz de distancias/tiempos entre múltiples puntos usando Mapbox Matrix API
     
     Args:
         coordinates: Lista de tuplas (longitud, latitud)
-        profile: Perfil de ruta
+        profile: Perfil de ruta (driving-traffic admite hasta 10 coordenadas)
         sources: Índices de puntos origen (None = todos)
         destinations: Índices de puntos destino (None = todos)
+        annotations: Matrices a devolver ("duration", "distance"); None = por defecto de Mapbox
     
     Returns:
         Matriz de distancias y duraciones
@@ -213,7 +305,7 @@ async def get_matrix(
     
     # Construir URL
     coords_str = ";".join([f"{lon},{lat}" for lon, lat in coordinates])
-    url = f"https://api.mapbox.com/directions-matrix/v1/mapbox/{profile}/{coords_str}"
+    url = f"{mapbox_config.matrix_url}/{profile}/{coords_str}"
     
     # Parámetros
     params = {
@@ -224,30 +316,37 @@ async def get_matrix(
         params["sources"] = ";".join(map(str, sources))
     if destinations:
         params["destinations"] = ";".join(map(str, destinations))
+    if annotations:
+        params["annotations"] = ",".join(annotations)
     
     try:
-        async with httpx.AsyncClient(timeout=15.0) as client:
-            response = await client.get(url, params=params)
-            
-            if response.status_code != 200:
-                error_detail = response.json() if response.headers.get("content-type", "").startswith("application/json") else response.text
-                return {
-                    "status": "error",
-                    "code": response.status_code,
-                    "message": f"Error de Mapbox Matrix API: {error_detail}",
-                }
-            
-            data = response.json()
-            
+        # La Matrix API factura por elemento (orígenes × destinos)
+        units = len(sources or coordinates) * len(destinations or coordinates)
+        response = await mapbox_request("matrix", url, params, units=units)
+        
+        if response.status_code != 200:
+            error_detail = response.json() if response.headers.get("content-type", "").startswith("application/json") else response.text
             return {
-                "status": "ok",
-                "provider": "mapbox",
-                "durations": data.get("durations", []),  # Matriz de tiempos (segundos)
-                "distances": data.get("distances", []),  # Matriz de distancias (metros)
-                "destinations": data.get("destinations", []),
-                "sources": data.get("sources", []),
+                "status": "error",
+                "code": response.status_code,
+                "message": f"Error de Mapbox Matrix API: {error_detail}",
             }
-            
+        
+        data = response.json()
+        
+        return {
+            "status": "ok",
+            "provider": "mapbox",
+            "durations": data.get("durations", []),  # Matriz de tiempos (segundos)
+            "distances": data.get("distances", []),  # Matriz de distancias (metros)
+            "destinations": data.get("destinations", []),
+            "sources": data.get("sources", []),
+        }
+        
+    except RateLimitExceeded as e:
+        return {"status": "error", "code": 429, "message": str(e)}
+    except CircuitOpenError as e:
+        return {"status": "error", "code": 503, "message": str(e)}
     except httpx.RequestError as e:
         return {"status": "error", "code": 503, "message": f"Error de conexión: {str(e)}"}
     except Exception as e:
@@ -6,23 +6,50 @@ Este módulo proporciona funcionalidades para:
 - Geocodificación inversa (coordenadas -> dirección)
 - Búsqueda de lugares
 - Autocompletado de direcciones
+
+Antes de Mapbox se consulta el geocodificador local (local_geocoder.py):
+los nombres de ciudades y ubicaciones de Ecuador conocidos se resuelven en
+memoria sin llamar a la API. En la inversa solo cuando los tipos pedidos se
+limitan a place/locality (el índice no tiene direcciones ni POIs).
 """
 
-import time
+import os
 from typing import Any, Dict, List, Optional, Tuple
 import httpx
 from app.config.mapbox import mapbox_config
+from app.services.http_client import mapbox_request
+from app.services.rate_limiter import RateLimitExceeded
+from app.services.circuit_breaker import CircuitOpenError
+from app.services.ttl_cache import TTLCache
+from app.services.shared_cache import TieredCache
+from app.services.single_flight import SingleFlight
+from app.services.local_geocoder import get_local_geocoder
+
 
+# Tipos de lugar que el geocodificador local puede responder en la inversa
+LOCAL_REVERSE_TYPES = {"place", "locality"}
 
-# Cache simple
-_geocode_cache: Dict[str, Dict[str, Any]] = {}
+# Cache acotada
 _CACHE_TTL = 3600  # 1 hora para geocoding
+_geocode_cache = TieredCache(
+    TTLCache(
+        "geocoding",
+        _CACHE_TTL,
+        max_entries=int(os.getenv("GEOCODE_CACHE_MAX_ENTRIES", "4096")),
+        max_bytes=int(os.getenv("GEOCODE_CACHE_MAX_BYTES", str(16 * 1024 * 1024))),
+    ),
+)
+# Búsquedas concurrentes con la misma clave comparten una sola solicitud
+_geocode_flights = SingleFlight("geocoding")
 
 
-def _cache_key(query: str, reverse: bool = False) -> str:
-    """Generar clave de cache"""
+def _cache_key(query: str, reverse: bool = False, *options: Any) -> str:
+    """Generar clave de cache (incluye las opciones que cambian la respuesta)"""
     prefix = "rev" if reverse else "fwd"
-    return f"{prefix}:{query.lower()}"
+    key = f"{prefix}:{query.lower()}"
+    if options:
+        key += "|" + "|".join(",".join(o) if isinstance(o, (list, tuple)) else str(o) for o in options)
+    return key
 
 
 async def geocode_forward(
@@ -52,17 +79,39 @@ async def geocode_forward(
         https://docs.mapbox.com/api/search/geocoding/
     """
     
+    # Geocodificador local (solo Ecuador)
+    local = await get_local_geocoder()
+    if local is not None and (not country or "ec" in country.lower().split(",")):
+        results = local.forward(query, limit=limit, types=types)
+        if results is not None:
+            return {"status": "ok", "provider": "local", "query": query, "results": results}
+    
     # Validar configuración
     valid, message = mapbox_config.validate()
     if not valid:
         return {"status": "error", "code": 428, "message": message}
     
     # Verificar cache
-    cache_key = _cache_key(query, False)
-    cached = _geocode_cache.get(cache_key)
-    if cached and (time.time() - cached["t"]) < _CACHE_TTL:
-        return cached["v"]
+    cache_key = _cache_key(query, False, country, types or "", limit, language)
+    cached = await _geocode_cache.get(cache_key)
+    if cached is not None:
+        return cached
     
+    return await _geocode_flights.do(
+        cache_key,
+        lambda: _fetch_forward(cache_key, query, country, types, limit, language),
+    )
+
+
+async def _fetch_forward(
+    cache_key: str,
+    query: str,
+    country: Optional[str],
+    types: Optional[List[str]],
+    limit: int,
+    language: str,
+) -> Dict[str, Any]:
+    """Solicitud de geocodificación directa (una por clave en vuelo)"""
     # Construir URL
     url = f"{mapbox_config.geocoding_url}/{query}.json"
     
@@ -80,53 +129,61 @@ async def geocode_forward(
         params["types"] = ",".join(types)
     
     try:
-        async with httpx.AsyncClient(timeout=10.0) as client:
-            response = await client.get(url, params=params)
-            
-            if response.status_code != 200:
-                error_detail = response.json() if response.headers.get("content-type", "").startswith("application/json") else response.text
-                return {
-                    "status": "error",
-                    "code": response.status_code,
-                    "message": f"Error de Mapbox Geocoding API: {error_detail}",
-                }
-            
-            data = response.json()
-            
-            # Formatear resultados
-            result = {
-                "status": "ok",
-                "provider": "mapbox",
-                "query": query,
-                "results": [
-                    {
-                        "name": feature.get("text"),
-                        "place_name": feature.get("place_name"),
-                        "coordinates": {
-                            "longitude": feature.get("center", [None, None])[0],
-                            "latitude": feature.get("center", [None, None])[1],
-                        },
-                        "bbox": feature.get("bbox"),  # Bounding box
-                        "place_type": feature.get("place_type", []),
-                        "relevance": feature.get("relevance"),
-                        "address": feature.get("address"),
-                        "context": feature.get("context", []),  # Información jerárquica (ciudad, región, etc.)
-                    }
-                    for feature in data.get("features", [])
-                ],
+        response = await mapbox_request("geocoding", url, params)
+        
+        if response.status_code != 200:
+            error_detail = response.json() if response.headers.get("content-type", "").startswith("application/json") else response.text
+            return {
+                "status": "error",
+                "code": response.status_code,
+                "message": f"Error de Mapbox Geocoding API: {error_detail}",
             }
-            
-            # Guardar en cache
-            _geocode_cache[cache_key] = {"t": time.time(), "v": result}
-            
-            return result
-            
+        
+        data = response.json()
+        
+        # Formatear resultados
+        result = {
+            "status": "ok",
+            "provider": "mapbox",
+            "query": query,
+            "results": [
+                {
+                    "name": feature.get("text"),
+                    "place_name": feature.get("place_name"),
+                    "coordinates": {
+                        "longitude": feature.get("center", [None, None])[0],
+                        "latitude": feature.get("center", [None, None])[1],
+                    },
+                    "bbox": feature.get("bbox"),  # Bounding box
+                    "place_type": feature.get("place_type", []),
+                    "relevance": feature.get("relevance"),
+                    "address": feature.get("address"),
+                    "context": feature.get("context", []),  # Información jerárquica (ciudad, región, etc.)
+                }
+                for feature in data.get("features", [])
+            ],
+        }
+        
+        # Guardar en cache
+        await _geocode_cache.set(cache_key, result)
+        
+        return result
+        
+    except RateLimitExceeded as e:
+        return {"status": "error", "code": 429, "message": str(e)}
+    except CircuitOpenError as e:
+        return {"status": "error", "code": 503, "message": str(e)}
     except httpx.RequestError as e:
         return {"status": "error", "code": 503, "message": f"Error de conexión: {str(e)}"}
     except Exception as e:
         return {"status": "error", "code": 500, "message": f"Error interno: {str(e)}"}
 
 
+def _local_reverse_types(types: Optional[List[str]]) -> bool:
+    """La inversa local solo responde si los tipos pedidos se limitan a place/locality"""
+    return bool(types) and set(types) <= LOCAL_REVERSE_TYPES
+
+
 async def geocode_reverse(
     longitude: float,
     latitude: float,
@@ -152,6 +209,20 @@ async def geocode_reverse(
         https://docs.mapbox.com/api/search/geocoding/#reverse-geocoding
     """
     
+    # Geocodificador local: lugar conocido más cercano dentro del radio; solo
+    # conoce ciudades y parroquias, así que las consultas sin tipos o con
+    # otros tipos (address, poi, ...) van a Mapbox
+    local = await get_local_geocoder() if _local_reverse_types(types) else None
+    if local is not None:
+        place = local.reverse(longitude, latitude, types=types)
+        if place is not None:
+            return {
+                "status": "ok",
+                "provider": "local",
+                "coordinates": {"longitude": longitude, "latitude": latitude},
+                "result": place,
+            }
+    
     # Validar configuración
     valid, message = mapbox_config.validate()
     if not valid:
@@ -159,11 +230,25 @@ async def geocode_reverse(
     
     # Verificar cache
     query_str = f"{round(longitude, 6)},{round(latitude, 6)}"
-    cache_key = _cache_key(query_str, True)
-    cached = _geocode_cache.get(cache_key)
-    if cached and (time.time() - cached["t"]) < _CACHE_TTL:
-        return cached["v"]
+    cache_key = _cache_key(query_str, True, types or "", language)
+    cached = await _geocode_cache.get(cache_key)
+    if cached is not None:
+        return cached
     
+    return await _geocode_flights.do(
+        cache_key,
+        lambda: _fetch_reverse(cache_key, longitude, latitude, types, language),
+    )
+
+
+async def _fetch_reverse(
+    cache_key: str,
+    longitude: float,
+    latitude: float,
+    types: Optional[List[str]],
+    language: str,
+) -> Dict[str, Any]:
+    """Solicitud de geocodificación inversa (una por clave en vuelo)"""
     # Construir URL
     url = f"{mapbox_config.geocoding_url}/{longitude},{latitude}.json"
     
@@ -177,49 +262,52 @@ async def geocode_reverse(
         params["types"] = ",".join(types)
     
     try:
-        async with httpx.AsyncClient(timeout=10.0) as client:
-            response = await client.get(url, params=params)
-            
-            if response.status_code != 200:
-                error_detail = response.json() if response.headers.get("content-type", "").startswith("application/json") else response.text
-                return {
-                    "status": "error",
-                    "code": response.status_code,
-                    "message": f"Error de Mapbox Geocoding API: {error_detail}",
-                }
-            
-            data = response.json()
-            
-            if not data.get("features"):
-                return {
-                    "status": "ok",
-                    "provider": "mapbox",
-                    "coordinates": {"longitude": longitude, "latitude": latitude},
-                    "result": None,
-                    "message": "No se encontró información para estas coordenadas",
-                }
-            
-            # Tomar el primer resultado (más relevante)
-            feature = data["features"][0]
-            
-            result = {
+        response = await mapbox_request("geocoding", url, params)
+        
+        if response.status_code != 200:
+            error_detail = response.json() if response.headers.get("content-type", "").startswith("application/json") else response.text
+            return {
+                "status": "error",
+                "code": response.status_code,
+                "message": f"Error de Mapbox Geocoding API: {error_detail}",
+            }
+        
+        data = response.json()
+        
+        if not data.get("features"):
+            return {
                 "status": "ok",
                 "provider": "mapbox",
                 "coordinates": {"longitude": longitude, "latitude": latitude},
-                "result": {
-                    "name": feature.get("text"),
-                    "place_name": feature.get("place_name"),
-                    "place_type": feature.get("place_type", []),
-                    "address": feature.get("address"),
-                    "context": feature.get("context", []),
-                },
+                "result": None,
+                "message": "No se encontró información para estas coordenadas",
             }
-            
-            # Guardar en cache
-            _geocode_cache[cache_key] = {"t": time.time(), "v": result}
-            
-            return result
-            
+        
+        # Tomar el primer resultado (más relevante)
+        feature = data["features"][0]
+        
+        result = {
+            "status": "ok",
+            "provider": "mapbox",
+            "coordinates": {"longitude": longitude, "latitude": latitude},
+            "result": {
+                "name": feature.get("text"),
+                "place_name": feature.get("place_name"),
+                "place_type": feature.get("place_type", []),
+                "address": feature.get("address"),
+                "context": feature.get("context", []),
+            },
+        }
+        
+        # Guardar en cache
+        await _geocode_cache.set(cache_key, result)
+        
+        return result
+        
+    except RateLimitExceeded as e:
+        return {"status": "error", "code": 429, "message": str(e)}
+    except CircuitOpenError as e:
+        return {"status": "error", "code": 503, "message": str(e)}
     except httpx.RequestError as e:
         return {"status": "error", "code": 503, "message": f"Error de conexión: {str(e)}"}
     except Exception as e:
@@ -10,6 +10,8 @@ Este módulo proporciona funcionalidades para:
 from typing import Any, Dict, List, Optional, Tuple
 import httpx
 from app.config.mapbox import mapbox_config
+from app.services.rate_limiter import RateLimitExceeded
+from app.services.usage_meter import get_usage_meter
 
 
 async def generate_static_image(
@@ -75,6 +77,13 @@ async def generate_static_image(
             "message": "Las dimensiones máximas son 1280x1280px",
         }
     
+    # Cada URL entregada cuenta como una carga de imagen estática
+    meter = get_usage_meter()
+    try:
+        meter.check("static_images")
+    except RateLimitExceeded as e:
+        return {"status": "error", "code": 429, "message": str(e)}
+    
     # Construir overlays (marcadores y rutas)
     overlays = []
     
@@ -132,6 +141,7 @@ async def generate_static_image(
     
     # Agregar token
     image_url = f"{url}?access_token={mapbox_config.access_token}"
+    meter.record("static_images", 200, 0)
     
     return {
         "status": "ok",
@@ -0,0 +1,221 @@
+"""
+Estimador en Línea de Velocidades
+=================================
+
+Combina las velocidades en vivo de Mapbox con el histórico del dataset.
+
+- Celdas de ~1 km (0.01°) y hora del día como clave del estado
+- Previo: cubo histórico celda×hora (con respaldo a celda gruesa de 0.1°
+  y a la media global por hora)
+- Observaciones en vivo: media exponencialmente ponderada con decaimiento
+  temporal (vida media configurable)
+- Calibración global: el dataset registra excesos de velocidad (100-149 km/h),
+  por lo que el previo se escala con la razón promedio vivo/histórico
+  aprendida en línea
+
+El estado vive en memoria por worker; no requiere llamadas al proveedor
+para responder.
+
+Autor: PrediRuta Team
+"""
+
+import os
+import math
+import time
+import threading
+from datetime import datetime
+from typing import Any, Dict, Optional, Tuple
+
+import numpy as np
+
+from app.services.dataset_loader import get_traffic_dataset
+from app.services.prediction_jobs import LOCAL_TZ
+
+
+CELL_SIZE_DEG = float(os.getenv("ONLINE_ESTIMATOR_CELL_DEG", "0.01"))
+COARSE_SIZE_DEG = 0.1
+HALF_LIFE_SECONDS = float(os.getenv("ONLINE_ESTIMATOR_HALF_LIFE", "900"))
+PRIOR_WEIGHT = float(os.getenv("ONLINE_ESTIMATOR_PRIOR_WEIGHT", "2.0"))
+CALIBRATION_ALPHA = 0.05
+
+_DECAY_RATE = math.log(2) / HALF_LIFE_SECONDS
+
+
+def _cell(lat: float, lon: float, size: float = CELL_SIZE_DEG) -> Tuple[int, int]:
+    return (int(math.floor(lat / size)), int(math.floor(lon / size)))
+
+
+class OnlineSpeedEstimator:
+    """Estado EWMA por (celda, hora) con el histórico como previo"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # (celda, hora) -> [valor, peso, timestamp]
+        self._state: Dict[Tuple[Tuple[int, int], int], list] = {}
+        self._calibration = 1.0
+        self._calibration_n = 0
+        self._prior_ready = False
+        self._fine: Dict[Tuple[int, int], np.ndarray] = {}
+        self._coarse: Dict[Tuple[int, int], np.ndarray] = {}
+        self._global = np.full(24, np.nan, dtype=np.float32)
+        self._city_cells: Dict[str, set] = {}
+
+    # ------------------------------------------------------------
+    # Previo histórico
+    # ------------------------------------------------------------
+
+    def _build_prior(self):
+        dataset = get_traffic_dataset()
+        if dataset.is_loaded and 'HORA' in dataset._df.columns:
+            df = dataset._df.dropna(subset=['LATITUD', 'LONGITUD', 'HORA', 'VELOCIDAD'])
+            lat = df['LATITUD'].to_numpy(dtype=np.float64)
+            lon = df['LONGITUD'].to_numpy(dtype=np.float64)
+            hora = df['HORA'].to_numpy(dtype=np.intp)
+            vel = df['VELOCIDAD'].to_numpy(dtype=np.float64)
+
+            self._fine = dataset.get_hourly_cube(CELL_SIZE_DEG)
+            self._coarse = dataset.get_hourly_cube(COARSE_SIZE_DEG)
+
+            sums = np.bincount(hora, weights=vel, minlength=24)
+            counts = np.bincount(hora, minlength=24)
+            with np.errstate(invalid="ignore", divide="ignore"):
+                self._global = np.where(counts > 0, sums / counts, vel.mean()).astype(np.float32)
+
+            ciudades = df['CIUDAD_OPER'].astype(str).str.strip().str.upper().to_numpy()
+            fy = np.floor(lat / CELL_SIZE_DEG).astype(np.int64)
+            fx = np.floor(lon / CELL_SIZE_DEG).astype(np.int64)
+            for c, y, x in zip(ciudades, fy, fx):
+                self._city_cells.setdefault(c, set()).add((int(y), int(x)))
+        self._prior_ready = True
+
+    def _ensure_prior(self):
+        if not self._prior_ready:
+            with self._lock:
+                if not self._prior_ready:
+                    self._build_prior()
+
+    def prior_profile(self, lat: float, lon: float) -> Optional[np.ndarray]:
+        """Perfil histórico de 24 horas para la celda (sin calibrar)"""
+        self._ensure_prior()
+        profile = self._fine.get(_cell(lat, lon))
+        if profile is None:
+            profile = self._coarse.get(_cell(lat, lon, COARSE_SIZE_DEG))
+        if profile is None and not np.isnan(self._global).all():
+            profile = self._global
+        return profile
+
+    # ------------------------------------------------------------
+    # Observaciones en vivo
+    # ------------------------------------------------------------
+
+    def observe(self, lat: float, lon: float, speed: float, ts: Optional[float] = None) -> None:
+        """Incorpora una velocidad observada en vivo (km/h)"""
+        if speed is None or speed <= 0:
+            return
+        ts = ts or time.time()
+        # Horas en la zona del dataset (America/Guayaquil), no la del servidor
+        hora = datetime.fromtimestamp(ts, LOCAL_TZ).hour
+        key = (_cell(lat, lon), hora)
+        profile = self.prior_profile(lat, lon)
+
+        with self._lock:
+            entry = self._state.get(key)
+            if entry is None:
+                self._state[key] = [float(speed), 1.0, ts]
+            else:
+                w = entry[1] * math.exp(-_DECAY_RATE * max(0.0, ts - entry[2]))
+                entry[0] = (entry[0] * w + speed) / (w + 1.0)
+                entry[1] = w + 1.0
+                entry[2] = ts
+
+            if profile is not None and profile[hora] > 0:
+                ratio = speed / float(profile[hora])
+                self._calibration_n += 1
+                alpha = max(CALIBRATION_ALPHA, 1.0 / self._calibration_n)
+                self._calibration += alpha * (ratio - self._calibration)
+
+    def estimate(self, lat: float, lon: float, ts: Optional[float] = None) -> Optional[Dict[str, Any]]:
+        """Velocidad combinada previo+vivo para un punto y la hora actual"""
+        ts = ts or time.time()
+        hora = datetime.fromtimestamp(ts, LOCAL_TZ).hour
+        profile = self.prior_profile(lat, lon)
+        entry = self._state.get((_cell(lat, lon), hora))
+
+        if profile is None and entry is None:
+            return None
+
+        prior = float(profile[hora]) * self._calibration if profile is not None else None
+        free_flow = float(profile.max()) * self._calibration if profile is not None else None
+
+        observed, weight, age = None, 0.0, None
+        if entry is not None:
+            observed = entry[0]
+            age = max(0.0, ts - entry[2])
+            weight = entry[1] * math.exp(-_DECAY_RATE * age)
+
+        if prior is None:
+            speed = observed
+            confidence = min(1.0, weight)
+        else:
+            k = PRIOR_WEIGHT
+            speed = (prior * k + (observed or 0.0) * weight) / (k + weight)
+            confidence = weight / (k + weight)
+
+        return {
+            "speed": round(speed, 1),
+            "prior": round(prior, 1) if prior is not None else None,
+            "observed": round(observed, 1) if observed is not None else None,
+            "freeFlowSpeed": round(max(free_flow or 0.0, speed), 1),
+            "weight": round(weight, 3),
+            "confidence": round(confidence, 2),
+            "age": round(age, 1) if age is not None else None,
+            "calibration": round(self._calibration, 3),
+        }
+
+    def city_factor(self, ciudad: str, hora: int, ts: Optional[float] = None) -> Optional[Dict[str, Any]]:
+        """
+        Razón vivo/previo promedio sobre las celdas de una ciudad para una
+        hora. Permite ajustar pronósticos históricos con condiciones actuales.
+        """
+        self._ensure_prior()
+        ts = ts or time.time()
+        cells = self._city_cells.get(ciudad.strip().upper())
+        if not cells:
+            return None
+
+        num, den, obs = 0.0, 0.0, 0
+        for cell in cells:
+            entry = self._state.get((cell, hora))
+            profile = self._fine.get(cell)
+            if entry is None or profile is None or profile[hora] <= 0:
+                continue
+            w = entry[1] * math.exp(-_DECAY_RATE * max(0.0, ts - entry[2]))
+            prior = float(profile[hora]) * self._calibration
+            num += w * (entry[0] / prior)
+            den += w
+            obs += 1
+
+        if den <= 0:
+            return None
+
+        confidence = den / (PRIOR_WEIGHT + den)
+        # Razón contraída hacia 1.0 según la confianza acumulada
+        factor = 1.0 + confidence * (num / den - 1.0)
+        return {"factor": round(factor, 3), "confianza": round(confidence, 2), "celdas_observadas": obs}
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "celdas_con_estado": len(self._state),
+            "calibracion": round(self._calibration, 3),
+            "observaciones_calibracion": self._calibration_n,
+            "celdas_historicas": len(self._fine),
+        }
+
+
+# Instancia global por worker
+online_estimator = OnlineSpeedEstimator()
+
+
+def get_online_estimator() -> OnlineSpeedEstimator:
+    """Obtiene el estimador en línea del worker"""
+    return online_estimator
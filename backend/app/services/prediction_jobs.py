@@ -0,0 +1,286 @@
+"""
+Precomputación de Pronósticos
+=============================
+
+Job por lotes que calcula las próximas N horas (24 por defecto) de
+pronóstico para todas las ciudades del dataset y las escribe en la tabla
+traffic_predictions mediante UPSERT por lotes.
+
+- CLI: python -m app.services.prediction_jobs precompute [--horizon 24]
+- Programador opcional en proceso (PREDICTIONS_SCHEDULER_ENABLED=true)
+- Lectura para la API con caché corta; si no hay filas precomputadas la
+  API vuelve al cálculo bajo demanda
+
+Requiere database/traffic_predictions_precompute.sql aplicado en Supabase.
+
+Autor: PrediRuta Team
+"""
+
+import os
+import time
+import asyncio
+import argparse
+import json
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+from zoneinfo import ZoneInfo
+
+import numpy as np
+
+from app.services.dataset_loader import get_traffic_dataset
+from app.services.forecast_model import get_forecast_model
+
+
+PREDICTIONS_TABLE = "traffic_predictions"
+DEFAULT_HORIZON_HOURS = int(os.getenv("PREDICTIONS_HORIZON_HOURS", "24"))
+DEFAULT_BATCH_SIZE = int(os.getenv("PREDICTIONS_BATCH_SIZE", "500"))
+SCHEDULER_INTERVAL = int(os.getenv("PREDICTIONS_SCHEDULER_INTERVAL", "3600"))
+READ_CACHE_TTL = int(os.getenv("PREDICTION_CACHE_TTL", "300"))
+LOCAL_TZ = ZoneInfo(os.getenv("PREDICTIONS_TIMEZONE", "America/Guayaquil"))
+
+HISTORICAL_VERSION = "promedio_historico"
+
+
+# Código de predicted_traffic_level (escala 1-5 de la tabla) para los cuatro
+# niveles del dataset: los extremos coinciden con los de la escala y el 3
+# queda sin uso (solo para un nivel desconocido)
+TRAFFIC_LEVEL_CODES = {"fluido": 1, "moderado": 2, "congestionado": 4, "severo": 5}
+UNKNOWN_LEVEL_CODE = 3
+
+
+def _traffic_level_code(velocidad: float) -> int:
+    """Código 1, 2, 4 o 5 (1 = fluido, 5 = severo) a partir de la velocidad; ver TRAFFIC_LEVEL_CODES"""
+    nivel = get_traffic_dataset().get_traffic_level(velocidad, 60)
+    return TRAFFIC_LEVEL_CODES.get(nivel, UNKNOWN_LEVEL_CODE)
+
+
+def _target_hours(horizon_hours: int, now: Optional[datetime] = None) -> List[datetime]:
+    """Horas completas siguientes a `now` en hora local de Ecuador"""
+    now = (now or datetime.now(LOCAL_TZ)).astimezone(LOCAL_TZ)
+    start = now.replace(minute=0, second=0, microsecond=0) + timedelta(hours=1)
+    return [start + timedelta(hours=i) for i in range(horizon_hours)]
+
+
+def build_forecast_rows(
+    horizon_hours: int = DEFAULT_HORIZON_HOURS,
+    now: Optional[datetime] = None,
+) -> List[Dict[str, Any]]:
+    """
+    Calcula en una sola pasada vectorizada los pronósticos de todas las
+    ciudades para las próximas `horizon_hours` horas.
+    """
+    dataset = get_traffic_dataset()
+    if not dataset.is_loaded:
+        raise RuntimeError("Dataset no disponible")
+
+    ciudades = sorted({str(c).strip().upper() for c in dataset.get_ciudades()})
+    targets = _target_hours(horizon_hours, now)
+    prediction_time = datetime.now(LOCAL_TZ).isoformat(timespec="seconds")
+
+    n_c, n_t = len(ciudades), len(targets)
+    horas = np.tile([t.hour for t in targets], n_c)
+    dias = np.tile([t.weekday() for t in targets], n_c)
+    meses = np.tile([t.month for t in targets], n_c)
+
+    modelo = get_forecast_model()
+    if modelo is not None:
+        city_idx = np.repeat(modelo.city_indices(ciudades), n_t)
+        velocidades = modelo.predict_indices(city_idx, horas, dias, meses)
+        confianzas = np.repeat([modelo.confidence(c) for c in ciudades], n_t)
+        version = modelo.version
+    else:
+        hourly = dataset.get_city_hourly_matrix(ciudades)
+        velocidades = hourly[np.repeat(np.arange(n_c), n_t), horas]
+        confianzas = np.full(n_c * n_t, 0.5)
+        version = HISTORICAL_VERSION
+
+    rows = []
+    for i, (vel, conf) in enumerate(zip(velocidades.tolist(), confianzas.tolist())):
+        ciudad = ciudades[i // n_t]
+        target = targets[i % n_t]
+        rows.append({
+            "ciudad": ciudad,
+            "prediction_time": prediction_time,
+            "target_time": target.isoformat(),
+            "predicted_speed": round(vel, 2),
+            "predicted_traffic_level": _traffic_level_code(vel),
+            "congestion_probability": round(max(0.0, min(1.0, (120 - vel) / 120)), 3),
+            "confidence_score": round(conf, 3),
+            "model_version": version,
+            "features_used": {
+                "hora": target.hour,
+                "dia_semana": target.weekday(),
+                "mes": target.month,
+            },
+        })
+    return rows
+
+
+def upsert_predictions(rows: List[Dict[str, Any]], batch_size: int = DEFAULT_BATCH_SIZE) -> int:
+    """Escribe las filas en traffic_predictions por lotes (UPSERT ciudad+target_time)"""
+    from app.database import get_supabase
+
+    sb = get_supabase()
+    written = 0
+    for i in range(0, len(rows), batch_size):
+        batch = rows[i:i + batch_size]
+        sb.table(PREDICTIONS_TABLE).upsert(batch, on_conflict="ciudad,target_time").execute()
+        written += len(batch)
+    return written
+
+
+def run_precompute_job(
+    horizon_hours: int = DEFAULT_HORIZON_HOURS,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    dry_run: bool = False,
+) -> Dict[str, Any]:
+    """Ejecuta el job completo y retorna un resumen"""
+    t0 = time.perf_counter()
+    rows = build_forecast_rows(horizon_hours)
+    t_compute = time.perf_counter() - t0
+
+    written = 0 if dry_run else upsert_predictions(rows, batch_size)
+
+    if not dry_run:
+        _read_cache.clear()
+
+    return {
+        "filas": len(rows),
+        "escritas": written,
+        "ciudades": len({r["ciudad"] for r in rows}),
+        "horizonte_horas": horizon_hours,
+        "model_version": rows[0]["model_version"] if rows else None,
+        "tiempo_calculo_ms": round(t_compute * 1000, 1),
+        "tiempo_total_ms": round((time.perf_counter() - t0) * 1000, 1),
+    }
+
+
+# ============================================
+# LECTURA PARA LA API
+# ============================================
+
+_read_cache: Dict[str, Dict[str, Any]] = {}
+
+
+def _fetch_city_predictions(ciudad: str) -> List[Dict[str, Any]]:
+    from app.database import get_supabase
+
+    desde = datetime.now(LOCAL_TZ).replace(minute=0, second=0, microsecond=0)
+    res = (
+        get_supabase()
+        .table(PREDICTIONS_TABLE)
+        .select("target_time,predicted_speed,predicted_traffic_level,confidence_score,model_version,prediction_time")
+        .eq("ciudad", ciudad)
+        .gte("target_time", desde.isoformat())
+        .order("target_time")
+        .limit(DEFAULT_HORIZON_HOURS * 2)
+        .execute()
+    )
+    return res.data or []
+
+
+async def get_precomputed_forecast(ciudad: str) -> Optional[List[Dict[str, Any]]]:
+    """
+    Filas precomputadas vigentes para una ciudad (None si no hay o si
+    Supabase no está configurado, para que la API use el cálculo bajo demanda).
+    """
+    key = ciudad.strip().upper()
+    now = time.time()
+    cached = _read_cache.get(key)
+    if cached and (now - cached["t"]) < READ_CACHE_TTL:
+        return cached["v"]
+
+    try:
+        rows = await asyncio.to_thread(_fetch_city_predictions, key)
+    except Exception:
+        rows = []
+
+    value = rows or None
+    _read_cache[key] = {"t": now, "v": value}
+    return value
+
+
+def find_precomputed(rows: List[Dict[str, Any]], fecha, hora: int) -> Optional[Dict[str, Any]]:
+    """Busca la fila cuyo target_time local corresponde a (fecha, hora)"""
+    for row in rows:
+        target = datetime.fromisoformat(str(row["target_time"])).astimezone(LOCAL_TZ)
+        if target.date() == fecha and target.hour == hora:
+            return row
+    return None
+
+
+# ============================================
+# PROGRAMADOR EN PROCESO
+# ============================================
+
+class PredictionScheduler:
+    """Ejecuta el job de precomputación periódicamente dentro del worker"""
+
+    def __init__(self, interval_seconds: int = SCHEDULER_INTERVAL):
+        self.interval = interval_seconds
+        self._task: Optional[asyncio.Task] = None
+        self.last_run: Optional[Dict[str, Any]] = None
+
+    async def _loop(self):
+        while True:
+            try:
+                self.last_run = await asyncio.to_thread(run_precompute_job)
+                print(f"✅ Pronósticos precomputados: {self.last_run['escritas']} filas")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"⚠️ Error en precomputación de pronósticos: {e}")
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+def scheduler_enabled() -> bool:
+    return os.getenv("PREDICTIONS_SCHEDULER_ENABLED", "false").lower() in ("1", "true", "yes")
+
+
+def main():
+    from dotenv import load_dotenv
+
+    load_dotenv()
+
+    parser = argparse.ArgumentParser(description="Precomputación de pronósticos PrediRuta")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    pre = sub.add_parser("precompute", help="Calcular y escribir las próximas horas")
+    pre.add_argument("--horizon", type=int, default=DEFAULT_HORIZON_HOURS, help="Horas a pronosticar")
+    pre.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE, help="Filas por UPSERT")
+    pre.add_argument("--dry-run", action="store_true", help="Calcular sin escribir en la base de datos")
+
+    sch = sub.add_parser("schedule", help="Ejecutar el job periódicamente")
+    sch.add_argument("--interval", type=int, default=SCHEDULER_INTERVAL, help="Segundos entre ejecuciones")
+
+    args = parser.parse_args()
+
+    if args.command == "precompute":
+        summary = run_precompute_job(args.horizon, args.batch_size, args.dry_run)
+        print(json.dumps(summary, indent=2, ensure_ascii=False))
+    else:
+        async def _forever():
+            PredictionScheduler(args.interval).start()
+            await asyncio.Event().wait()
+
+        try:
+            asyncio.run(_forever())
+        except KeyboardInterrupt:
+            print("\n⚠️ Programador detenido")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,280 @@
+"""
+Limitador de Tasa para las APIs de Mapbox
+=========================================
+
+Una cubeta de fichas por API (directions, matrix, geocoding) delante de
+cada llamada saliente en mapbox_request():
+
+- Tasa por minuto y concurrencia máxima configurables (MapboxConfig)
+- Cola con plazo: la solicitud que no obtiene ficha antes de su plazo se
+  rechaza con RateLimitExceeded en lugar de esperar indefinidamente
+- Prioridad: el tráfico interactivo se atiende antes que el del calentador
+  de caché y otros trabajos en segundo plano (background_priority())
+- Adaptativo ante 429: pausa según Retry-After / X-Rate-Limit-Reset (o
+  retroceso exponencial) y reduce la tasa a la mitad; la recupera de forma
+  gradual con cada respuesta correcta
+- Métricas: admitidas, encoladas, espera media y máxima, rechazos y 429
+
+Autor: PrediRuta Team
+"""
+
+import os
+import time
+import heapq
+import asyncio
+import itertools
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, List, Mapping, Optional
+
+from app.config.mapbox import mapbox_config
+
+
+INTERACTIVE = 0
+BACKGROUND = 1
+
+# Plazo máximo (s) en cola según prioridad
+QUEUE_TIMEOUTS = {
+    INTERACTIVE: float(os.getenv("MAPBOX_RATE_QUEUE_TIMEOUT", "5")),
+    BACKGROUND: float(os.getenv("MAPBOX_RATE_QUEUE_TIMEOUT_BACKGROUND", "30")),
+}
+MAX_QUEUE = int(os.getenv("MAPBOX_RATE_MAX_QUEUE", "500"))
+# Ráfaga permitida: fichas equivalentes a estos segundos de tasa
+BURST_SECONDS = 10.0
+# Retroceso ante 429 sin cabeceras de reintento
+BACKOFF_BASE_SECONDS = 1.0
+BACKOFF_MAX_SECONDS = 60.0
+# Tasa mínima tras 429 (fracción de la configurada) y recuperación por respuesta correcta
+MIN_RATE_FRACTION = 0.1
+RECOVERY_STEP = 0.02
+
+_priority: ContextVar[int] = ContextVar("mapbox_priority", default=INTERACTIVE)
+
+
+@contextmanager
+def background_priority():
+    """Las llamadas a Mapbox dentro del bloque (y sus tareas) ceden ante las interactivas"""
+    token = _priority.set(BACKGROUND)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def current_priority() -> int:
+    return _priority.get()
+
+
+class RateLimitExceeded(Exception):
+    """La solicitud no obtuvo turno antes de su plazo (o la cola está llena)"""
+
+    def __init__(self, api: str, reason: str):
+        self.api = api
+        self.reason = reason
+        super().__init__(f"Límite de solicitudes a Mapbox {api}: {reason}")
+
+
+def _retry_after(headers: Mapping[str, str]) -> Optional[float]:
+    """Segundos de espera indicados por el proveedor (Retry-After o X-Rate-Limit-Reset)"""
+    value = headers.get("retry-after")
+    if value:
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+    reset = headers.get("x-rate-limit-reset")
+    if reset:
+        try:
+            return max(0.0, float(reset) - time.time())
+        except ValueError:
+            pass
+    return None
+
+
+_registry: Dict[str, "RateLimiter"] = {}
+
+
+class RateLimiter:
+    """Cubeta de fichas con cola por prioridad y plazo, y concurrencia acotada"""
+
+    def __init__(self, name: str, rate_per_minute: float, max_concurrency: int = 16, max_queue: int = MAX_QUEUE):
+        self.name = name
+        self.base_rate = rate_per_minute / 60.0
+        self.rate = self.base_rate
+        self.capacity = max(1.0, self.base_rate * BURST_SECONDS)
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self._tokens = self.capacity
+        self._last_fill = time.monotonic()
+        self._active = 0
+        self._blocked_until = 0.0
+        self._strikes = 0
+        # (prioridad, orden de llegada, future); las entradas vencidas o
+        # canceladas se quedan en el montículo hasta el siguiente reparto o
+        # compactación, por eso la ocupación real se lleva en _pending
+        self._waiters: List[list] = []
+        self._pending = 0
+        self._seq = itertools.count()
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._timer_loop: Optional[asyncio.AbstractEventLoop] = None
+        self.admitted = 0
+        self.queued = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.rejected_timeout = 0
+        self.rejected_full = 0
+        self.throttled = 0
+        _registry[name] = self
+
+    # --------------------------------------------------------
+    # Fichas
+    # --------------------------------------------------------
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._last_fill) * self.rate)
+        self._last_fill = now
+
+    def _can_admit(self) -> bool:
+        return (
+            time.monotonic() >= self._blocked_until
+            and self._tokens >= 1.0
+            and self._active < self.max_concurrency
+        )
+
+    def _admit(self) -> None:
+        self._tokens -= 1.0
+        self._active += 1
+        self.admitted += 1
+
+    def _dispatch(self) -> None:
+        """Da turno a las solicitudes en cola mientras haya fichas y concurrencia"""
+        self._timer = None
+        self._refill()
+        while self._waiters:
+            future = self._waiters[0][2]
+            if future.done():
+                heapq.heappop(self._waiters)
+                continue
+            if not self._can_admit():
+                break
+            heapq.heappop(self._waiters)
+            self._pending -= 1
+            self._admit()
+            future.set_result(None)
+        self._schedule()
+
+    def _schedule(self) -> None:
+        """Programa el próximo reparto cuando haya ficha (si la espera no es por concurrencia)"""
+        if not self._pending or self._active >= self.max_concurrency:
+            return
+        loop = asyncio.get_running_loop()
+        if self._timer is not None and self._timer_loop is loop:
+            return
+        now = time.monotonic()
+        delay = max(self._blocked_until - now, (1.0 - self._tokens) / self.rate, 0.0)
+        self._timer = loop.call_later(delay, self._dispatch)
+        self._timer_loop = loop
+
+    async def acquire(self, priority: Optional[int] = None, timeout: Optional[float] = None) -> None:
+        """Espera turno; lanza RateLimitExceeded si vence el plazo o la cola está llena"""
+        priority = current_priority() if priority is None else priority
+        timeout = QUEUE_TIMEOUTS.get(priority, QUEUE_TIMEOUTS[INTERACTIVE]) if timeout is None else timeout
+        self._refill()
+        if not self._pending and self._can_admit():
+            self._admit()
+            return
+        if self._pending >= self.max_queue:
+            self.rejected_full += 1
+            raise RateLimitExceeded(self.name, "cola llena")
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, [priority, next(self._seq), future])
+        self._pending += 1
+        self.queued += 1
+        started = time.monotonic()
+        self._schedule()
+        try:
+            await asyncio.wait({future}, timeout=timeout)
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self.release()
+            else:
+                self._abandon(future)
+            raise
+        waited = time.monotonic() - started
+        self.wait_total += waited
+        self.wait_max = max(self.wait_max, waited)
+        if not future.done():
+            self._abandon(future)
+            self.rejected_timeout += 1
+            raise RateLimitExceeded(self.name, f"sin turno tras {timeout:.1f} s en cola")
+
+    def _abandon(self, future: asyncio.Future) -> None:
+        """Retira de la cola una espera vencida o cancelada y compacta el montículo si conviene"""
+        future.cancel()
+        self._pending -= 1
+        if len(self._waiters) > 2 * self._pending + 16:
+            self._waiters = [w for w in self._waiters if not w[2].done()]
+            heapq.heapify(self._waiters)
+
+    def release(self) -> None:
+        self._active = max(0, self._active - 1)
+        if self._pending:
+            self._dispatch()
+
+    # --------------------------------------------------------
+    # Adaptación a las respuestas del proveedor
+    # --------------------------------------------------------
+
+    def on_response(self, status_code: int, headers: Mapping[str, str]) -> Optional[float]:
+        """Ajusta la tasa según la respuesta; ante 429 devuelve la pausa aplicada (s)"""
+        if status_code == 429:
+            self.throttled += 1
+            pause = _retry_after(headers)
+            if pause is None:
+                pause = min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2 ** self._strikes)
+            self._strikes += 1
+            self._blocked_until = max(self._blocked_until, time.monotonic() + pause)
+            self.rate = max(self.base_rate * MIN_RATE_FRACTION, self.rate / 2.0)
+            self._tokens = 0.0
+            return pause
+        if status_code < 500:
+            self._strikes = 0
+            if self.rate < self.base_rate:
+                self.rate = min(self.base_rate, self.rate + self.base_rate * RECOVERY_STEP)
+        return None
+
+    def stats(self) -> Dict[str, Any]:
+        self._refill()
+        return {
+            "tasa_por_minuto": round(self.rate * 60.0, 1),
+            "tasa_configurada": round(self.base_rate * 60.0, 1),
+            "fichas": round(self._tokens, 2),
+            "activas": self._active,
+            "en_cola": self._pending,
+            "pausa_restante_s": round(max(0.0, self._blocked_until - time.monotonic()), 2),
+            "admitidas": self.admitted,
+            "encoladas": self.queued,
+            "espera_media_ms": round(self.wait_total / self.queued * 1000, 1) if self.queued else None,
+            "espera_max_ms": round(self.wait_max * 1000, 1),
+            "rechazadas_plazo": self.rejected_timeout,
+            "rechazadas_cola_llena": self.rejected_full,
+            "respuestas_429": self.throttled,
+        }
+
+
+_limiters = {
+    "directions": RateLimiter("directions", mapbox_config.directions_rate_per_minute, mapbox_config.max_concurrency),
+    "matrix": RateLimiter("matrix", mapbox_config.matrix_rate_per_minute, mapbox_config.max_concurrency),
+    "geocoding": RateLimiter("geocoding", mapbox_config.geocoding_rate_per_minute, mapbox_config.max_concurrency),
+}
+
+
+def get_rate_limiter(api: str) -> Optional[RateLimiter]:
+    return _limiters.get(api)
+
+
+def get_rate_limiter_stats() -> Dict[str, Dict[str, Any]]:
+    """Métricas de los limitadores de todas las APIs"""
+    return {name: limiter.stats() for name, limiter in _registry.items()}
@@ -0,0 +1,393 @@
+"""
+Grafo Vial de Ecuador (formato CSR)
+===================================
+
+Carga y construcción del grafo vial usado por el motor de rutas local.
+
+El grafo se guarda como un directorio de arrays .npy (cargados con
+mmap_mode='r', por lo que los workers comparten las páginas del sistema
+operativo):
+
+- node_lat, node_lon      float32[N]   coordenadas de nodos
+- indptr, heads           int64[N+1], int32[E]   aristas salientes (CSR)
+- length_m                float32[E]   longitud de cada arista
+- speed_kmh               uint8[E]     velocidad base (maxspeed o por tipo de vía)
+- road_class              uint8[E]     índice en ROAD_CLASSES
+- toll                    uint8[E]     1 si la vía tiene peaje
+- rev_indptr, rev_tails, rev_edges   CSR inverso (aristas entrantes)
+- meta.json               resumen del grafo
+
+Construcción desde un extracto OSM en XML (convertir el .pbf con
+`osmium cat ecuador-latest.osm.pbf -o ecuador.osm`):
+
+    python -m app.services.road_graph build --osm ecuador.osm
+
+Autor: PrediRuta Team
+"""
+
+import os
+import json
+import math
+import argparse
+import threading
+import xml.etree.ElementTree as ET
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from app.services.dataset_loader import get_traffic_dataset
+
+
+GRAPH_DIR = Path(os.getenv(
+    "ROAD_GRAPH_DIR",
+    str(Path(__file__).parent.parent.parent / "data" / "graph" / "ecuador"),
+))
+
+# Vías transitables en auto y velocidad base (km/h) si no hay maxspeed
+ROAD_CLASSES: List[Tuple[str, int]] = [
+    ("motorway", 90), ("motorway_link", 50),
+    ("trunk", 80), ("trunk_link", 45),
+    ("primary", 65), ("primary_link", 40),
+    ("secondary", 55), ("secondary_link", 35),
+    ("tertiary", 45), ("tertiary_link", 30),
+    ("unclassified", 40), ("residential", 30),
+    ("living_street", 15), ("service", 20), ("road", 30),
+]
+_CLASS_INDEX = {name: i for i, (name, _) in enumerate(ROAD_CLASSES)}
+
+# Celda del perfil horario (0.1° ≈ 11 km) y límites del factor horario
+PROFILE_CELL_DEG = 0.1
+PROFILE_FACTOR_MIN = 0.6
+PROFILE_FACTOR_MAX = 1.15
+
+_ARRAYS = (
+    "node_lat", "node_lon", "indptr", "heads", "length_m", "speed_kmh",
+    "road_class", "toll", "rev_indptr", "rev_tails", "rev_edges",
+)
+
+
+def haversine_m(lat1, lon1, lat2, lon2):
+    """Distancia de gran círculo en metros (acepta escalares o arrays NumPy)"""
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 6371008.8 * 2 * np.arcsin(np.sqrt(a))
+
+
+@dataclass
+class RoadGraph:
+    """Grafo dirigido en formato CSR con perfiles horarios de velocidad"""
+
+    node_lat: np.ndarray
+    node_lon: np.ndarray
+    indptr: np.ndarray
+    heads: np.ndarray
+    length_m: np.ndarray
+    speed_kmh: np.ndarray
+    road_class: np.ndarray
+    toll: np.ndarray
+    rev_indptr: np.ndarray
+    rev_tails: np.ndarray
+    rev_edges: np.ndarray
+    meta: Dict[str, Any]
+
+    def __post_init__(self):
+        self._kdtree = None
+        self._kd_lock = threading.Lock()
+        self._base_time: Optional[np.ndarray] = None
+        self._edge_profile: Optional[np.ndarray] = None
+        self._profiles: Optional[np.ndarray] = None
+
+    @property
+    def n_nodes(self) -> int:
+        return len(self.node_lat)
+
+    @property
+    def n_edges(self) -> int:
+        return len(self.heads)
+
+    def edge_tails(self) -> np.ndarray:
+        """Nodo de origen de cada arista (expande indptr)"""
+        return np.repeat(np.arange(self.n_nodes, dtype=np.int32), np.diff(self.indptr))
+
+    # ------------------------------------------------------------
+    # Pesos dependientes de la hora
+    # ------------------------------------------------------------
+
+    @property
+    def base_time(self) -> np.ndarray:
+        """Tiempo de recorrido (s) de cada arista a velocidad base"""
+        if self._base_time is None:
+            speed_ms = np.maximum(self.speed_kmh.astype(np.float32), 5.0) / 3.6
+            self._base_time = (self.length_m / speed_ms).astype(np.float32)
+        return self._base_time
+
+    def _build_profiles(self):
+        """
+        Asigna a cada arista un perfil de 24 factores derivado del cubo
+        horario del dataset (velocidad de la hora / media de la celda).
+        Las aristas fuera de celdas con datos usan factor 1.0.
+        """
+        cube = get_traffic_dataset().get_hourly_cube(PROFILE_CELL_DEG)
+        keys = list(cube.keys())
+        profiles = np.ones((len(keys) + 1, 24), dtype=np.float32)
+        for i, k in enumerate(keys, start=1):
+            row = cube[k]
+            profiles[i] = np.clip(row / row.mean(), PROFILE_FACTOR_MIN, PROFILE_FACTOR_MAX)
+
+        index = {k: i for i, k in enumerate(keys, start=1)}
+        tails = self.edge_tails()
+        cy = np.floor(self.node_lat[tails] / PROFILE_CELL_DEG).astype(np.int64)
+        cx = np.floor(self.node_lon[tails] / PROFILE_CELL_DEG).astype(np.int64)
+        self._edge_profile = np.fromiter(
+            (index.get((int(y), int(x)), 0) for y, x in zip(cy, cx)),
+            dtype=np.int32, count=len(tails),
+        )
+        self._profiles = profiles
+
+    @property
+    def edge_profile(self) -> np.ndarray:
+        if self._edge_profile is None:
+            self._build_profiles()
+        return self._edge_profile
+
+    @property
+    def profiles(self) -> np.ndarray:
+        """Tabla (perfiles, 24) de factores de velocidad"""
+        if self._profiles is None:
+            self._build_profiles()
+        return self._profiles
+
+    @property
+    def max_speed_ms(self) -> float:
+        """Cota superior de velocidad efectiva (para la heurística de A*)"""
+        return float(self.speed_kmh.max()) / 3.6 * float(self.profiles.max())
+
+    def edge_times(self, edges: np.ndarray, hour: int) -> np.ndarray:
+        """Tiempos (s) de un conjunto de aristas a una hora del día"""
+        return self.base_time[edges] / self.profiles[self.edge_profile[edges], hour % 24]
+
+    # ------------------------------------------------------------
+    # Ajuste de coordenadas al grafo
+    # ------------------------------------------------------------
+
+    def _tree(self):
+        if self._kdtree is None:
+            with self._kd_lock:
+                if self._kdtree is None:
+                    from scipy.spatial import cKDTree
+                    coslat = math.cos(math.radians(float(np.mean(self.node_lat))))
+                    self._coslat = coslat
+                    self._kdtree = cKDTree(np.column_stack([
+                        np.asarray(self.node_lat, dtype=np.float64),
+                        np.asarray(self.node_lon, dtype=np.float64) * coslat,
+                    ]))
+        return self._kdtree
+
+    def nearest_node(self, lat: float, lon: float) -> Tuple[int, float]:
+        """Nodo más cercano y su distancia en metros"""
+        tree = self._tree()
+        _, idx = tree.query([lat, lon * self._coslat])
+        idx = int(idx)
+        return idx, float(haversine_m(lat, lon, self.node_lat[idx], self.node_lon[idx]))
+
+
+# ============================================
+# CARGA
+# ============================================
+
+def load_graph(directory: Path = GRAPH_DIR) -> Optional[RoadGraph]:
+    """Carga el grafo mapeado en memoria (None si no se ha construido)"""
+    meta_file = directory / "meta.json"
+    if not meta_file.exists():
+        return None
+    try:
+        arrays = {name: np.load(directory / f"{name}.npy", mmap_mode="r") for name in _ARRAYS}
+        meta = json.loads(meta_file.read_text(encoding="utf-8"))
+        return RoadGraph(meta=meta, **arrays)
+    except Exception as e:
+        print(f"❌ Error cargando grafo vial desde {directory}: {e}")
+        return None
+
+
+_graph: Optional[RoadGraph] = None
+_graph_loaded = False
+_graph_lock = threading.Lock()
+
+
+def get_road_graph() -> Optional[RoadGraph]:
+    """Obtiene el grafo vial del worker (se carga una sola vez)"""
+    global _graph, _graph_loaded
+    if _graph_loaded:
+        return _graph
+    with _graph_lock:
+        if not _graph_loaded:
+            _graph = load_graph()
+            _graph_loaded = True
+            if _graph is not None:
+                print(f"✅ Grafo vial cargado: {_graph.n_nodes} nodos, {_graph.n_edges} aristas")
+    return _graph
+
+
+# ============================================
+# CONSTRUCCIÓN DESDE OSM
+# ============================================
+
+def _parse_maxspeed(value: Optional[str]) -> Optional[int]:
+    if not value:
+        return None
+    token = value.split(";")[0].strip().lower()
+    try:
+        if token.endswith("mph"):
+            return int(float(token[:-3].strip()) * 1.609)
+        return int(float(token.replace("km/h", "").strip()))
+    except ValueError:
+        return None
+
+
+def _oneway(tags: Dict[str, str]) -> int:
+    """1 = sentido de la vía, -1 = sentido inverso, 0 = doble sentido"""
+    value = tags.get("oneway", "").lower()
+    if value in ("yes", "true", "1"):
+        return 1
+    if value == "-1":
+        return -1
+    if tags.get("highway") in ("motorway", "motorway_link") or tags.get("junction") == "roundabout":
+        return 1
+    return 0
+
+
+def parse_osm(osm_path: Path) -> Tuple[Dict[int, Tuple[float, float]], List[Tuple[List[int], Dict[str, str]]]]:
+    """Lee nodos y vías transitables de un archivo OSM XML"""
+    nodes: Dict[int, Tuple[float, float]] = {}
+    ways: List[Tuple[List[int], Dict[str, str]]] = []
+
+    for _, elem in ET.iterparse(str(osm_path), events=("end",)):
+        if elem.tag == "node":
+            nodes[int(elem.get("id"))] = (float(elem.get("lat")), float(elem.get("lon")))
+            elem.clear()
+        elif elem.tag == "way":
+            tags = {t.get("k"): t.get("v") for t in elem.findall("tag")}
+            if tags.get("highway") in _CLASS_INDEX and tags.get("access") not in ("no", "private"):
+                refs = [int(nd.get("ref")) for nd in elem.findall("nd")]
+                if len(refs) >= 2:
+                    ways.append((refs, tags))
+            elem.clear()
+        elif elem.tag == "relation":
+            elem.clear()
+
+    return nodes, ways
+
+
+def build_graph(osm_path: Path, out_dir: Path = GRAPH_DIR) -> Dict[str, Any]:
+    """Construye los arrays CSR a partir de un extracto OSM y los guarda"""
+    nodes, ways = parse_osm(osm_path)
+
+    # Solo los nodos usados por vías transitables
+    used: Dict[int, int] = {}
+    tails: List[int] = []
+    heads: List[int] = []
+    speeds: List[int] = []
+    classes: List[int] = []
+    tolls: List[int] = []
+
+    def node_index(osm_id: int) -> int:
+        idx = used.get(osm_id)
+        if idx is None:
+            idx = used[osm_id] = len(used)
+        return idx
+
+    for refs, tags in ways:
+        refs = [r for r in refs if r in nodes]
+        cls = _CLASS_INDEX[tags["highway"]]
+        speed = _parse_maxspeed(tags.get("maxspeed")) or ROAD_CLASSES[cls][1]
+        toll = 1 if tags.get("toll", "").lower() == "yes" else 0
+        direction = _oneway(tags)
+        for a, b in zip(refs[:-1], refs[1:]):
+            u, v = node_index(a), node_index(b)
+            if u == v:
+                continue
+            pairs = [(u, v), (v, u)] if direction == 0 else ([(u, v)] if direction == 1 else [(v, u)])
+            for t, h in pairs:
+                tails.append(t)
+                heads.append(h)
+                speeds.append(min(speed, 255))
+                classes.append(cls)
+                tolls.append(toll)
+
+    n = len(used)
+    lat = np.empty(n, dtype=np.float32)
+    lon = np.empty(n, dtype=np.float32)
+    for osm_id, idx in used.items():
+        lat[idx], lon[idx] = nodes[osm_id]
+
+    tails_arr = np.asarray(tails, dtype=np.int32)
+    heads_arr = np.asarray(heads, dtype=np.int32)
+    length = haversine_m(lat[tails_arr], lon[tails_arr], lat[heads_arr], lon[heads_arr]).astype(np.float32)
+
+    # Ordenar por nodo origen para el CSR directo
+    order = np.argsort(tails_arr, kind="stable")
+    indptr = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(np.bincount(tails_arr, minlength=n), out=indptr[1:])
+
+    arrays = {
+        "node_lat": lat,
+        "node_lon": lon,
+        "indptr": indptr,
+        "heads": heads_arr[order],
+        "length_m": length[order],
+        "speed_kmh": np.asarray(speeds, dtype=np.uint8)[order],
+        "road_class": np.asarray(classes, dtype=np.uint8)[order],
+        "toll": np.asarray(tolls, dtype=np.uint8)[order],
+    }
+
+    # CSR inverso: aristas entrantes agrupadas por nodo destino
+    sorted_tails = tails_arr[order]
+    rev_order = np.argsort(arrays["heads"], kind="stable")
+    rev_indptr = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(np.bincount(arrays["heads"], minlength=n), out=rev_indptr[1:])
+    arrays["rev_indptr"] = rev_indptr
+    arrays["rev_tails"] = sorted_tails[rev_order].astype(np.int32)
+    arrays["rev_edges"] = rev_order.astype(np.int32)
+
+    out_dir.mkdir(parents=True, exist_ok=True)
+    for name, arr in arrays.items():
+        np.save(out_dir / f"{name}.npy", arr)
+
+    meta = {
+        "fuente": str(osm_path.name),
+        "nodos": int(n),
+        "aristas": int(len(heads_arr)),
+        "clases": [c for c, _ in ROAD_CLASSES],
+        "bbox": [float(lon.min()), float(lat.min()), float(lon.max()), float(lat.max())] if n else None,
+    }
+    (out_dir / "meta.json").write_text(json.dumps(meta, indent=2), encoding="utf-8")
+    return meta
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Grafo vial PrediRuta")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    build = sub.add_parser("build", help="Construir el grafo desde un extracto OSM XML")
+    build.add_argument("--osm", required=True, type=Path, help="Archivo .osm (XML)")
+    build.add_argument("--out", type=Path, default=GRAPH_DIR, help="Directorio de salida")
+
+    sub.add_parser("info", help="Mostrar el resumen del grafo actual")
+
+    args = parser.parse_args()
+    if args.command == "build":
+        meta = build_graph(args.osm, args.out)
+        print(f"✅ Grafo construido en {args.out}")
+        print(json.dumps(meta, indent=2, ensure_ascii=False))
+    else:
+        graph = load_graph()
+        if graph is None:
+            print(f"⚠️ No hay grafo en {GRAPH_DIR}. Ejecuta: python -m app.services.road_graph build --osm ecuador.osm")
+        else:
+            print(json.dumps(graph.meta, indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
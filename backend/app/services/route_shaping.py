@@ -0,0 +1,258 @@
+"""
+Formato Compacto de Rutas
+=========================
+
+Reduce el tamaño de las respuestas de Directions:
+
+- Geometría polyline6 (la que se pide a Mapbox y se guarda en caché); se
+  decodifica a GeoJSON solo si el cliente lo pide
+- Simplificación Douglas-Peucker con tolerancia de un píxel al zoom
+  pedido, respetando los waypoints; las anotaciones por segmento se
+  agregan a los segmentos simplificados para seguir alineadas
+- Pasos opcionales y subconjuntos de anotaciones
+
+Autor: PrediRuta Team
+"""
+
+import math
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+
+
+POLYLINE_PRECISION = 6
+# Tolerancia de simplificación en píxeles (teselas de 256 px)
+SIMPLIFY_PIXELS = 1.0
+VALID_ANNOTATIONS = ("duration", "distance", "speed", "congestion", "congestion_numeric", "maxspeed", "closure")
+CONGESTION_ORDER = {"unknown": 0, "low": 1, "moderate": 2, "heavy": 3, "severe": 4}
+
+
+# ============================================================
+# Polyline
+# ============================================================
+
+def encode_polyline(coordinates: Sequence[Sequence[float]], precision: int = POLYLINE_PRECISION) -> str:
+    """Codifica [[lon, lat], ...] en polyline (el formato guarda lat, lon)"""
+    factor = 10 ** precision
+    out: List[str] = []
+    prev_lat = prev_lon = 0
+    for lon, lat in coordinates:
+        ilat = int(round(lat * factor))
+        ilon = int(round(lon * factor))
+        for delta in (ilat - prev_lat, ilon - prev_lon):
+            value = ~(delta << 1) if delta < 0 else delta << 1
+            while value >= 0x20:
+                out.append(chr((0x20 | (value & 0x1F)) + 63))
+                value >>= 5
+            out.append(chr(value + 63))
+        prev_lat, prev_lon = ilat, ilon
+    return "".join(out)
+
+
+def decode_polyline(encoded: str, precision: int = POLYLINE_PRECISION) -> List[List[float]]:
+    """Decodifica polyline a [[lon, lat], ...]"""
+    factor = 10 ** precision
+    coordinates: List[List[float]] = []
+    index = lat = lon = 0
+    length = len(encoded)
+    while index < length:
+        deltas = []
+        for _ in range(2):
+            shift = result = 0
+            while True:
+                byte = ord(encoded[index]) - 63
+                index += 1
+                result |= (byte & 0x1F) << shift
+                shift += 5
+                if byte < 0x20:
+                    break
+            deltas.append(~(result >> 1) if result & 1 else result >> 1)
+        lat += deltas[0]
+        lon += deltas[1]
+        coordinates.append([lon / factor, lat / factor])
+    return coordinates
+
+
+def _coordinates(geometry: Any) -> Optional[List[List[float]]]:
+    """Coordenadas [[lon, lat], ...] de una geometría polyline6 o GeoJSON"""
+    if isinstance(geometry, str):
+        return decode_polyline(geometry)
+    if isinstance(geometry, dict) and geometry.get("type") == "LineString":
+        return geometry.get("coordinates") or []
+    return None
+
+
+def _format(coordinates: List[List[float]], geometries: str) -> Any:
+    if geometries == "polyline6":
+        return encode_polyline(coordinates)
+    return {"type": "LineString", "coordinates": coordinates}
+
+
+# ============================================================
+# Douglas-Peucker
+# ============================================================
+
+def tolerance_for_zoom(zoom: float, latitude: float = 0.0) -> float:
+    """Grados de longitud que ocupan SIMPLIFY_PIXELS píxeles al zoom dado"""
+    return SIMPLIFY_PIXELS * 360.0 / (256.0 * 2 ** zoom) * math.cos(math.radians(latitude))
+
+
+def douglas_peucker(points: np.ndarray, tolerance: float) -> np.ndarray:
+    """Índices conservados (ordenados, incluye extremos) de una línea (N, 2)"""
+    n = len(points)
+    if n <= 2:
+        return np.arange(n)
+    keep = np.zeros(n, dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, n - 1)]
+    while stack:
+        start, end = stack.pop()
+        if end - start < 2:
+            continue
+        a, b = points[start], points[end]
+        seg = b - a
+        inner = points[start + 1:end] - a
+        seg_len = math.hypot(seg[0], seg[1])
+        if seg_len == 0:
+            dist = np.hypot(inner[:, 0], inner[:, 1])
+        else:
+            dist = np.abs(seg[0] * inner[:, 1] - seg[1] * inner[:, 0]) / seg_len
+        i = int(dist.argmax())
+        if dist[i] > tolerance:
+            mid = start + 1 + i
+            keep[mid] = True
+            stack.append((start, mid))
+            stack.append((mid, end))
+    return np.flatnonzero(keep)
+
+
+def _aggregate_annotation(annotation: Dict[str, Any], kept: np.ndarray) -> Dict[str, Any]:
+    """Anotaciones por segmento original -> por segmento simplificado (kept: índices locales del tramo)"""
+    out: Dict[str, Any] = {}
+    bounds = list(zip(kept[:-1].tolist(), kept[1:].tolist()))
+    distance = annotation.get("distance")
+    duration = annotation.get("duration")
+    for key, values in annotation.items():
+        if not isinstance(values, list):
+            out[key] = values
+        elif key in ("distance", "duration"):
+            out[key] = [round(sum(values[a:b]), 1) for a, b in bounds]
+        elif key == "speed" and distance and duration:
+            out[key] = [
+                round(sum(distance[a:b]) / sum(duration[a:b]), 1) if sum(duration[a:b]) > 0 else values[a]
+                for a, b in bounds
+            ]
+        elif key == "congestion":
+            out[key] = [max(values[a:b], key=lambda c: CONGESTION_ORDER.get(c, 0)) for a, b in bounds]
+        elif key == "congestion_numeric":
+            out[key] = [max((v for v in values[a:b] if v is not None), default=None) for a, b in bounds]
+        else:
+            out[key] = [values[a] for a, _ in bounds]
+    return out
+
+
+def _segment_count(annotation: Dict[str, Any]) -> Optional[int]:
+    for values in annotation.values():
+        if isinstance(values, list):
+            return len(values)
+    return None
+
+
+def _simplify_route(route: Dict[str, Any], coordinates: List[List[float]], zoom: float) -> List[List[float]]:
+    """
+    Simplifica la geometría de la ruta por tramos (los waypoints se
+    conservan) y agrega las anotaciones de cada tramo si están alineadas
+    con la geometría.
+    """
+    points = np.asarray(coordinates, dtype=np.float64)
+    if len(points) <= 2:
+        return coordinates
+    mean_lat = float(points[:, 1].mean())
+    tolerance = tolerance_for_zoom(zoom, mean_lat)
+    # Escala la longitud para medir distancias aproximadamente isótropas
+    scaled = points * np.array([math.cos(math.radians(mean_lat)), 1.0])
+
+    legs = route.get("legs") or []
+    counts = [_segment_count(leg.get("annotation") or {}) for leg in legs]
+    aligned = bool(legs) and all(c is not None for c in counts) and sum(counts) == len(points) - 1
+
+    if not aligned:
+        kept = douglas_peucker(scaled, tolerance)
+        return points[kept].tolist()
+
+    kept_all: List[int] = []
+    offset = 0
+    for leg, count in zip(legs, counts):
+        local = douglas_peucker(scaled[offset:offset + count + 1], tolerance)
+        leg["annotation"] = _aggregate_annotation(leg["annotation"], local)
+        global_idx = (local + offset).tolist()
+        kept_all.extend(global_idx if not kept_all else global_idx[1:])
+        offset += count
+    return points[kept_all].tolist()
+
+
+# ============================================================
+# Respuesta
+# ============================================================
+
+def _format_step(step: Dict[str, Any], geometries: str) -> Dict[str, Any]:
+    coordinates = _coordinates(step.get("geometry"))
+    if coordinates is None:
+        return step
+    return {**step, "geometry": _format(coordinates, geometries)}
+
+
+def shape_directions(
+    result: Dict[str, Any],
+    geometries: str = "geojson",
+    zoom: Optional[float] = None,
+    steps: bool = True,
+    annotations: Optional[Sequence[str]] = None,
+) -> Dict[str, Any]:
+    """
+    Copia de la respuesta de get_directions en el formato pedido. No modifica
+    `result` (puede venir de la caché).
+
+    Args:
+        geometries: "geojson" o "polyline6"
+        zoom: Si se indica, simplifica la geometría a la resolución de ese zoom
+        steps: Si es False se omiten los pasos
+        annotations: Subconjunto de anotaciones a conservar (None = todas)
+    """
+    if result.get("status") != "ok":
+        return result
+    passthrough = geometries == "polyline6" and zoom is None and steps and annotations is None
+    if passthrough and all(isinstance(r.get("geometry"), str) for r in result.get("routes", [])):
+        return result
+
+    routes = []
+    original_points = points = 0
+    for route in result.get("routes", []):
+        route = {**route, "legs": [dict(leg) for leg in route.get("legs", [])]}
+        for leg in route["legs"]:
+            annotation = leg.get("annotation") or {}
+            if annotations is not None:
+                annotation = {k: v for k, v in annotation.items() if k in annotations}
+            leg["annotation"] = annotation
+            if not steps:
+                leg["steps"] = []
+            elif leg.get("steps"):
+                leg["steps"] = [_format_step(step, geometries) for step in leg["steps"]]
+
+        coordinates = _coordinates(route.get("geometry"))
+        if coordinates is not None:
+            original_points += len(coordinates)
+            if zoom is not None:
+                coordinates = _simplify_route(route, coordinates, zoom)
+            points += len(coordinates)
+            route["geometry"] = _format(coordinates, geometries)
+        routes.append(route)
+
+    shaped = {**result, "routes": routes}
+    shaped["shape"] = {
+        "geometry": geometries,
+        "zoom": zoom,
+        "points": points,
+        "original_points": original_points,
+    }
+    return shaped
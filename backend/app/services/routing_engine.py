@@ -0,0 +1,372 @@
+"""
+Motor de Rutas Local
+====================
+
+Calcula rutas sobre el grafo vial de Ecuador sin llamadas de red.
+
+- A* dependiente del tiempo: el peso de cada arista se evalúa con el
+  perfil horario correspondiente a la hora estimada de llegada a ella
+- Dijkstra bidireccional con los pesos de la hora de salida, usado para
+  generar alternativas rápidamente
+- Alternativas por método de penalización: se encarecen las aristas de
+  las rutas ya encontradas y se aceptan las que difieren lo suficiente
+- ETA final de cada alternativa reevaluado de forma dependiente del tiempo
+- Consultas de larga distancia resueltas con la jerarquía de contracción
+  (app.services.contraction_hierarchy) cuando está construida
+
+Autor: PrediRuta Team
+"""
+
+import os
+import heapq
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from app.services.road_graph import RoadGraph, get_road_graph, haversine_m
+from app.services.contraction_hierarchy import ContractionHierarchy, get_contraction_hierarchy
+
+
+# Distancia máxima (m) entre una coordenada y el nodo del grafo más cercano
+MAX_SNAP_DISTANCE_M = 5000
+# Alternativas: factor de penalización, solapamiento máximo y estiramiento máximo
+ALT_PENALTY = 1.4
+ALT_MAX_OVERLAP = 0.7
+ALT_MAX_STRETCH = 1.4
+# Puntos máximos de la geometría devuelta por ruta
+MAX_GEOMETRY_POINTS = 200
+# Distancia en línea recta (km) desde la que se usa la jerarquía de contracción
+CH_MIN_DISTANCE_KM = float(os.getenv("CH_MIN_DISTANCE_KM", "30"))
+
+INF = float("inf")
+
+
+@dataclass
+class RoutePath:
+    """Ruta encontrada en el grafo"""
+
+    edges: np.ndarray          # ids de aristas en orden
+    nodes: np.ndarray          # nodos en orden (len = edges + 1)
+    distance_m: float
+    duration_s: float
+    toll: bool
+
+
+class RoutingEngine:
+    """Búsquedas de camino mínimo sobre un RoadGraph"""
+
+    def __init__(self, graph: RoadGraph, ch: Optional[ContractionHierarchy] = None):
+        self.graph = graph
+        self.ch = ch
+
+    # ------------------------------------------------------------
+    # A* dependiente del tiempo
+    # ------------------------------------------------------------
+
+    def astar(
+        self,
+        source: int,
+        target: int,
+        depart_s: float,
+        avoid_toll: bool = False,
+        penalties: Optional[Dict[int, float]] = None,
+    ) -> Optional[List[int]]:
+        """
+        A* con pesos dependientes de la hora de llegada a cada arista.
+        `depart_s` son los segundos desde la medianoche local.
+        """
+        g = self.graph
+        vmax = g.max_speed_ms
+        t_lat, t_lon = float(g.node_lat[target]), float(g.node_lon[target])
+
+        dist = {source: 0.0}
+        pred_edge: Dict[int, int] = {}
+        heap = [(0.0, 0.0, source)]
+        settled = set()
+
+        while heap:
+            _, d_u, u = heapq.heappop(heap)
+            if u in settled:
+                continue
+            settled.add(u)
+            if u == target:
+                return self._unpack(pred_edge, source, target)
+
+            a, b = int(g.indptr[u]), int(g.indptr[u + 1])
+            if a == b:
+                continue
+            edges = np.arange(a, b)
+            hour = int((depart_s + d_u) // 3600) % 24
+            w = g.edge_times(edges, hour)
+            if avoid_toll:
+                w = np.where(g.toll[a:b] > 0, np.inf, w)
+            heads = g.heads[a:b]
+            h = haversine_m(g.node_lat[heads], g.node_lon[heads], t_lat, t_lon) / vmax
+
+            for e, v, we, hv in zip(edges.tolist(), heads.tolist(), w.tolist(), h.tolist()):
+                if we == INF or v in settled:
+                    continue
+                if penalties:
+                    we *= penalties.get(e, 1.0)
+                nd = d_u + we
+                if nd < dist.get(v, INF):
+                    dist[v] = nd
+                    pred_edge[v] = e
+                    heapq.heappush(heap, (nd + hv, nd, v))
+        return None
+
+    # ------------------------------------------------------------
+    # Dijkstra bidireccional (pesos de la hora de salida)
+    # ------------------------------------------------------------
+
+    def bidirectional_dijkstra(
+        self,
+        source: int,
+        target: int,
+        hour: int,
+        avoid_toll: bool = False,
+        penalties: Optional[Dict[int, float]] = None,
+    ) -> Optional[List[int]]:
+        """Dijkstra bidireccional con los pesos estáticos de `hour`"""
+        if source == target:
+            return []
+        g = self.graph
+
+        def weights(edges: np.ndarray) -> List[float]:
+            w = g.edge_times(edges, hour)
+            if avoid_toll:
+                w = np.where(g.toll[edges] > 0, np.inf, w)
+            w = w.tolist()
+            if penalties:
+                w = [we * penalties.get(e, 1.0) for e, we in zip(edges.tolist(), w)]
+            return w
+
+        dist = ({source: 0.0}, {target: 0.0})
+        pred: Tuple[Dict[int, int], Dict[int, int]] = ({}, {})
+        heaps = ([(0.0, source)], [(0.0, target)])
+        settled = (set(), set())
+        best, meet = INF, -1
+
+        while heaps[0] and heaps[1]:
+            if heaps[0][0][0] + heaps[1][0][0] >= best:
+                break
+            side = 0 if heaps[0][0][0] <= heaps[1][0][0] else 1
+            d_u, u = heapq.heappop(heaps[side])
+            if u in settled[side]:
+                continue
+            settled[side].add(u)
+
+            if side == 0:
+                a, b = int(g.indptr[u]), int(g.indptr[u + 1])
+                edges = np.arange(a, b)
+                neighbors = g.heads[a:b].tolist()
+            else:
+                a, b = int(g.rev_indptr[u]), int(g.rev_indptr[u + 1])
+                edges = np.asarray(g.rev_edges[a:b])
+                neighbors = g.rev_tails[a:b].tolist()
+            if a == b:
+                continue
+
+            for e, v, we in zip(edges.tolist(), neighbors, weights(edges)):
+                nd = d_u + we
+                if nd < dist[side].get(v, INF):
+                    dist[side][v] = nd
+                    pred[side][v] = e
+                    heapq.heappush(heaps[side], (nd, v))
+                other = dist[1 - side].get(v)
+                if other is not None and nd + other < best:
+                    best, meet = nd + other, v
+
+        if meet < 0:
+            return None
+        forward = self._unpack(pred[0], source, meet)
+        backward = []
+        v = meet
+        while v != target:
+            e = pred[1][v]
+            backward.append(e)
+            v = int(g.heads[e])
+        return forward + backward
+
+    # ------------------------------------------------------------
+    # Utilidades
+    # ------------------------------------------------------------
+
+    def _unpack(self, pred_edge: Dict[int, int], source: int, target: int) -> List[int]:
+        edges = []
+        v = target
+        while v != source:
+            e = pred_edge[v]
+            edges.append(e)
+            v = self._edge_tail(e)
+        edges.reverse()
+        return edges
+
+    def _edge_tail(self, e: int) -> int:
+        return int(np.searchsorted(self.graph.indptr, e, side="right") - 1)
+
+    def path_eta(self, edges: List[int], depart_s: float) -> float:
+        """Duración (s) recorriendo las aristas con el perfil de cada hora de llegada"""
+        g = self.graph
+        edges_arr = np.asarray(edges, dtype=np.int64)
+        if len(edges_arr) == 0:
+            return 0.0
+        base = g.base_time[edges_arr].astype(np.float64)
+        profile = g.edge_profile[edges_arr]
+        # Por bloque horario: las aristas que empiezan antes del cambio de hora
+        # usan el factor de esa hora (una suma acumulada por hora, no por arista)
+        t = 0.0
+        i = 0
+        m = len(edges_arr)
+        while i < m:
+            block = (depart_s + t) // 3600
+            ends = t + np.cumsum(base[i:] / g.profiles[profile[i:], int(block) % 24])
+            boundary = (block + 1) * 3600 - depart_s
+            used = min(int(np.searchsorted(ends, boundary, side="left")) + 1, m - i)
+            t = float(ends[used - 1])
+            i += used
+        return t
+
+    def make_path(self, edges: List[int], depart_s: float) -> RoutePath:
+        g = self.graph
+        edges_arr = np.asarray(edges, dtype=np.int64)
+        if len(edges_arr):
+            nodes = np.concatenate([[self._edge_tail(int(edges_arr[0]))], g.heads[edges_arr]])
+        else:
+            nodes = np.asarray([], dtype=np.int64)
+        return RoutePath(
+            edges=edges_arr,
+            nodes=nodes,
+            distance_m=float(g.length_m[edges_arr].sum()) if len(edges_arr) else 0.0,
+            duration_s=self.path_eta(edges, depart_s),
+            toll=bool(g.toll[edges_arr].any()) if len(edges_arr) else False,
+        )
+
+    def alternatives(
+        self,
+        source: int,
+        target: int,
+        depart_s: float,
+        k: int = 3,
+        avoid_toll: bool = False,
+    ) -> List[RoutePath]:
+        """Ruta principal (A* dependiente del tiempo) y hasta k-1 alternativas"""
+        best_edges = self.astar(source, target, depart_s, avoid_toll=avoid_toll)
+        if best_edges is None:
+            return []
+        paths = [self.make_path(best_edges, depart_s)]
+
+        hour = int(depart_s // 3600) % 24
+        penalties: Dict[int, float] = {}
+        attempts = 0
+        while len(paths) < k and attempts < k * 2:
+            attempts += 1
+            for e in paths[-1].edges.tolist():
+                penalties[e] = penalties.get(e, 1.0) * ALT_PENALTY
+            edges = self.bidirectional_dijkstra(source, target, hour, avoid_toll, penalties)
+            if not edges:
+                break
+            candidate = self.make_path(edges, depart_s)
+            if candidate.duration_s > paths[0].duration_s * ALT_MAX_STRETCH:
+                break
+            if all(self._overlap(candidate, p) <= ALT_MAX_OVERLAP for p in paths):
+                paths.append(candidate)
+        return paths
+
+    def ch_alternatives(self, source: int, target: int, depart_s: float, k: int = 3) -> List[RoutePath]:
+        """
+        Rutas sobre la jerarquía de contracción (pesos de flujo libre). El ETA
+        de cada candidata se reevalúa con el perfil horario y se ordenan por él.
+        """
+        candidates = [
+            self.make_path(edges, depart_s)
+            for _, edges in self.ch.alternatives(
+                source, target, k=k, max_stretch=ALT_MAX_STRETCH, max_overlap=ALT_MAX_OVERLAP
+            )
+        ]
+        if not candidates:
+            return []
+        candidates.sort(key=lambda p: p.duration_s)
+        paths = [candidates[0]]
+        for candidate in candidates[1:]:
+            if len(paths) >= k:
+                break
+            if candidate.duration_s > paths[0].duration_s * ALT_MAX_STRETCH:
+                continue
+            if all(self._overlap(candidate, p) <= ALT_MAX_OVERLAP for p in paths):
+                paths.append(candidate)
+        return paths
+
+    def _overlap(self, a: RoutePath, b: RoutePath) -> float:
+        """Fracción de la longitud de `a` compartida con `b`"""
+        if a.distance_m <= 0:
+            return 1.0
+        shared = np.intersect1d(a.edges, b.edges)
+        return float(self.graph.length_m[shared].sum()) / a.distance_m
+
+    def geometry(self, path: RoutePath, max_points: int = MAX_GEOMETRY_POINTS) -> List[Dict[str, float]]:
+        """Coordenadas de la ruta, submuestreadas a max_points"""
+        nodes = path.nodes
+        if len(nodes) > max_points:
+            idx = np.unique(np.linspace(0, len(nodes) - 1, max_points).astype(np.int64))
+            nodes = nodes[idx]
+        g = self.graph
+        return [
+            {"lat": float(g.node_lat[n]), "lng": float(g.node_lon[n])}
+            for n in nodes.tolist()
+        ]
+
+    def route(
+        self,
+        origin: Tuple[float, float],
+        destination: Tuple[float, float],
+        depart_s: float,
+        k: int = 3,
+        avoid_toll: bool = False,
+    ) -> Dict[str, Any]:
+        """
+        Rutas entre dos coordenadas (lat, lon). Retorna {"status": "ok", "paths": [...]}
+        o un error con el formato de los servicios.
+        """
+        g = self.graph
+        src, d_src = g.nearest_node(*origin)
+        dst, d_dst = g.nearest_node(*destination)
+        if d_src > MAX_SNAP_DISTANCE_M or d_dst > MAX_SNAP_DISTANCE_M:
+            return {
+                "status": "error",
+                "code": 404,
+                "message": "Origen o destino fuera de la cobertura del grafo vial",
+            }
+
+        # La jerarquía se construye sin restricción de peajes
+        straight_km = haversine_m(origin[0], origin[1], destination[0], destination[1]) / 1000
+        use_ch = self.ch is not None and not avoid_toll and straight_km >= CH_MIN_DISTANCE_KM
+
+        if use_ch:
+            paths = self.ch_alternatives(src, dst, depart_s, k=k)
+        else:
+            paths = self.alternatives(src, dst, depart_s, k=k, avoid_toll=avoid_toll)
+        if not paths:
+            return {"status": "error", "code": 404, "message": "No existe ruta en el grafo vial"}
+
+        return {
+            "status": "ok",
+            "provider": "grafo_local",
+            "algorithm": "ch" if use_ch else "astar",
+            "paths": paths,
+            "snap_m": [round(d_src, 1), round(d_dst, 1)],
+        }
+
+
+_engine: Optional[RoutingEngine] = None
+
+
+def get_routing_engine() -> Optional[RoutingEngine]:
+    """Motor de rutas del worker (None si el grafo no está construido)"""
+    global _engine
+    if _engine is None:
+        graph = get_road_graph()
+        if graph is not None:
+            _engine = RoutingEngine(graph, get_contraction_hierarchy(graph))
+    return _engine
@@ -0,0 +1,383 @@
+"""
+Caché Compartida de Segundo Nivel (L2)
+======================================
+
+Detrás de la caché en memoria de cada worker (L1, TTLCache) se consulta un
+almacén compartido por todos los workers del nodo, que además sobrevive a
+los reinicios:
+
+- sqlite: archivo local en modo WAL (por defecto, SHARED_CACHE_PATH)
+- redis: cualquier servidor que hable el protocolo RESP (REDIS_URL); el
+  cliente es mínimo y no requiere dependencias adicionales
+- none: solo L1
+
+Los valores se guardan serializados (orjson si está disponible) y
+comprimidos con zlib a partir de cierto tamaño. La expiración es absoluta:
+un acierto en L2 se copia a L1 con el TTL restante, no con uno nuevo.
+
+Un fallo del almacén nunca rompe la solicitud: se registra y se sigue solo
+con L1.
+
+Autor: PrediRuta Team
+"""
+
+import os
+import time
+import zlib
+import socket
+import sqlite3
+import asyncio
+import threading
+from typing import Any, Dict, Hashable, Optional, Tuple
+from urllib.parse import urlparse
+
+try:
+    import orjson as _json
+
+    def _dumps(value: Any) -> bytes:
+        return _json.dumps(value, default=str)
+except ImportError:  # pragma: no cover - orjson está en requirements
+    import json as _json
+
+    def _dumps(value: Any) -> bytes:
+        return _json.dumps(value, separators=(",", ":"), default=str).encode("utf-8")
+
+from app.services.ttl_cache import TTLCache
+
+
+SHARED_CACHE_BACKEND = os.getenv("SHARED_CACHE_BACKEND", "sqlite").lower()
+SHARED_CACHE_PATH = os.getenv("SHARED_CACHE_PATH", "./data/cache/mapbox_cache.sqlite")
+REDIS_URL = os.getenv("REDIS_URL", "redis://127.0.0.1:6379/0")
+COMPRESS_MIN_BYTES = 512
+# Tras un error del almacén se usa solo L1 durante este tiempo (s)
+ERROR_BACKOFF_SECONDS = 30.0
+SQLITE_PURGE_EVERY = 500
+
+_RAW = b"\x00"
+_ZLIB = b"\x01"
+
+
+def serialize(value: Any) -> bytes:
+    raw = _dumps(value)
+    if len(raw) >= COMPRESS_MIN_BYTES:
+        return _ZLIB + zlib.compress(raw, 6)
+    return _RAW + raw
+
+
+def deserialize(blob: bytes) -> Any:
+    flag, body = blob[:1], blob[1:]
+    if flag == _ZLIB:
+        body = zlib.decompress(body)
+    return _json.loads(body)
+
+
+# ============================================================
+# Backends
+# ============================================================
+
+class SQLiteBackend:
+    """Tabla clave → (valor, expiración) en un archivo SQLite local"""
+
+    name = "sqlite"
+
+    def __init__(self, path: str = SHARED_CACHE_PATH):
+        self.path = path
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._local = threading.local()
+        self._writes = 0
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache ("
+            " k TEXT PRIMARY KEY, v BLOB NOT NULL, expires REAL NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS cache_expires ON cache (expires)")
+        conn.commit()
+
+    def _conn(self) -> sqlite3.Connection:
+        # Una conexión por hilo (las llamadas llegan desde asyncio.to_thread)
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=1.0, isolation_level=None)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key: str) -> Optional[Tuple[bytes, float]]:
+        row = self._conn().execute(
+            "SELECT v, expires FROM cache WHERE k = ? AND expires > ?", (key, time.time())
+        ).fetchone()
+        return (row[0], row[1]) if row else None
+
+    def set(self, key: str, blob: bytes, expires_at: float) -> None:
+        conn = self._conn()
+        conn.execute(
+            "INSERT INTO cache (k, v, expires) VALUES (?, ?, ?)"
+            " ON CONFLICT(k) DO UPDATE SET v = excluded.v, expires = excluded.expires",
+            (key, blob, expires_at),
+        )
+        self._writes += 1
+        if self._writes % SQLITE_PURGE_EVERY == 0:
+            self.purge_expired()
+
+    def delete(self, key: str) -> None:
+        self._conn().execute("DELETE FROM cache WHERE k = ?", (key,))
+
+    def purge_expired(self) -> int:
+        return self._conn().execute("DELETE FROM cache WHERE expires <= ?", (time.time(),)).rowcount
+
+
+class RespError(Exception):
+    """Error devuelto por el servidor RESP"""
+
+
+class RedisBackend:
+    """Cliente RESP mínimo (GET / SET PX / DEL) sobre un socket con reconexión"""
+
+    name = "redis"
+
+    def __init__(self, url: str = REDIS_URL, timeout: float = 0.5):
+        parsed = urlparse(url)
+        self.host = parsed.hostname or "127.0.0.1"
+        self.port = parsed.port or 6379
+        self.password = parsed.password
+        self.db = int(parsed.path.lstrip("/") or 0)
+        self.timeout = timeout
+        self._sock: Optional[socket.socket] = None
+        self._file = None
+        self._lock = threading.Lock()
+
+    def _connect(self) -> None:
+        self._sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        self._sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._file = self._sock.makefile("rb")
+        if self.password:
+            self._call("AUTH", self.password)
+        if self.db:
+            self._call("SELECT", str(self.db))
+
+    def _close(self) -> None:
+        if self._sock is not None:
+            try:
+                self._sock.close()
+            except OSError:
+                pass
+        self._sock = None
+        self._file = None
+
+    @staticmethod
+    def _encode(*args: Any) -> bytes:
+        out = [b"*%d\r\n" % len(args)]
+        for arg in args:
+            data = arg if isinstance(arg, bytes) else str(arg).encode("utf-8")
+            out.append(b"$%d\r\n%s\r\n" % (len(data), data))
+        return b"".join(out)
+
+    def _read(self) -> Any:
+        line = self._file.readline()
+        if not line:
+            raise ConnectionError("Conexión RESP cerrada")
+        kind, body = line[:1], line[1:-2]
+        if kind == b"+":
+            return body
+        if kind == b"-":
+            raise RespError(body.decode("utf-8", "replace"))
+        if kind == b":":
+            return int(body)
+        if kind == b"$":
+            size = int(body)
+            if size < 0:
+                return None
+            data = self._file.read(size + 2)
+            return data[:-2]
+        if kind == b"*":
+            size = int(body)
+            return None if size < 0 else [self._read() for _ in range(size)]
+        raise RespError(f"Respuesta RESP desconocida: {line!r}")
+
+    def _call(self, *args: Any) -> Any:
+        self._sock.sendall(self._encode(*args))
+        return self._read()
+
+    def command(self, *args: Any) -> Any:
+        with self._lock:
+            for attempt in (0, 1):
+                try:
+                    if self._sock is None:
+                        self._connect()
+                    return self._call(*args)
+                except (OSError, ConnectionError):
+                    self._close()
+                    if attempt:
+                        raise
+
+    def get(self, key: str) -> Optional[Tuple[bytes, float]]:
+        # Valor almacenado: 8 bytes de expiración (ms) + blob
+        data = self.command("GET", key)
+        if data is None:
+            return None
+        expires_at = int.from_bytes(data[:8], "big") / 1000.0
+        return data[8:], expires_at
+
+    def set(self, key: str, blob: bytes, expires_at: float) -> None:
+        ttl_ms = int((expires_at - time.time()) * 1000)
+        if ttl_ms <= 0:
+            return
+        stamp = int(expires_at * 1000).to_bytes(8, "big")
+        self.command("SET", key, stamp + blob, "PX", ttl_ms)
+
+    def delete(self, key: str) -> None:
+        self.command("DEL", key)
+
+    def purge_expired(self) -> int:
+        # Redis expira las claves por sí mismo
+        return 0
+
+
+_backend = None
+_backend_lock = threading.Lock()
+_backend_ready = False
+
+
+def get_shared_backend():
+    """Backend L2 configurado (None si está desactivado o no se pudo abrir)"""
+    global _backend, _backend_ready
+    if _backend_ready:
+        return _backend
+    with _backend_lock:
+        if not _backend_ready:
+            try:
+                if SHARED_CACHE_BACKEND == "sqlite":
+                    _backend = SQLiteBackend()
+                elif SHARED_CACHE_BACKEND == "redis":
+                    _backend = RedisBackend()
+            except Exception as e:
+                print(f"⚠️ Caché compartida no disponible ({SHARED_CACHE_BACKEND}): {e}")
+                _backend = None
+            _backend_ready = True
+    return _backend
+
+
+def set_shared_backend(backend) -> None:
+    """Inyecta el backend L2 (pruebas); None desactiva L2"""
+    global _backend, _backend_ready
+    _backend = backend
+    _backend_ready = True
+
+
+# ============================================================
+# Caché de dos niveles
+# ============================================================
+
+_registry: Dict[str, "TieredCache"] = {}
+
+
+class TieredCache:
+    """L1 en memoria (TTLCache) respaldada por el backend compartido"""
+
+    def __init__(self, l1: TTLCache, namespace: Optional[str] = None):
+        self.l1 = l1
+        self.namespace = namespace or l1.name
+        self.l2_hits = 0
+        self.l2_misses = 0
+        self.l2_errors = 0
+        self._retry_at = 0.0
+        _registry[self.namespace] = self
+
+    def _key(self, key: Hashable) -> str:
+        return f"{self.namespace}:{key}"
+
+    def _backend(self):
+        if time.time() < self._retry_at:
+            return None
+        return get_shared_backend()
+
+    def _error(self, action: str, error: Exception) -> None:
+        self.l2_errors += 1
+        self._retry_at = time.time() + ERROR_BACKOFF_SECONDS
+        print(f"⚠️ Error {action} caché compartida ({self.namespace}): {error}")
+
+    async def _get_l2(self, key: Hashable) -> Optional[Tuple[Any, float]]:
+        """(valor, edad) desde L2, copiándolo a L1 con el TTL restante"""
+        backend = self._backend()
+        if backend is None:
+            return None
+        try:
+            found = await asyncio.to_thread(backend.get, self._key(key))
+        except Exception as e:
+            self._error("leyendo", e)
+            return None
+        if found is None:
+            self.l2_misses += 1
+            return None
+        blob, expires_at = found
+        remaining = expires_at - time.time()
+        if remaining <= 0:
+            self.l2_misses += 1
+            return None
+        try:
+            value = deserialize(blob)
+        except Exception as e:
+            # Entrada ilegible (corrupta o de otro formato): se descarta sin
+            # suspender L2, que sigue sano para las demás claves
+            self.l2_errors += 1
+            print(f"⚠️ Entrada ilegible en caché compartida ({self.namespace}): {e}")
+            try:
+                await asyncio.to_thread(backend.delete, self._key(key))
+            except Exception as e:
+                self._error("borrando", e)
+            return None
+        self.l2_hits += 1
+        age = max(0.0, self.l1.ttl - remaining)
+        self.l1.set(key, value, ttl=remaining, age=age)
+        return value, age
+
+    async def get(self, key: Hashable) -> Any:
+        value = self.l1.get(key)
+        if value is not None:
+            return value
+        found = await self._get_l2(key)
+        return found[0] if found is not None else None
+
+    async def get_with_age(self, key: Hashable) -> Optional[Tuple[Any, float, bool]]:
+        """
+        (valor, edad, obsoleto). Las entradas obsoletas dentro de la gracia
+        solo se sirven desde L1; L2 guarda únicamente valores vigentes.
+        """
+        found = self.l1.get_with_age(key)
+        if found is not None and not found[2]:
+            return found
+        fresh = await self._get_l2(key)
+        if fresh is not None:
+            return fresh[0], fresh[1], False
+        return found
+
+    def ttl_remaining(self, key: Hashable) -> Optional[float]:
+        """TTL restante en L1 (el valor que sirve este worker)"""
+        return self.l1.ttl_remaining(key)
+
+    async def set(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> None:
+        ttl = self.l1.ttl if ttl is None else ttl
+        self.l1.set(key, value, ttl=ttl)
+        backend = self._backend()
+        if backend is None:
+            return
+        try:
+            await asyncio.to_thread(backend.set, self._key(key), serialize(value), time.time() + ttl)
+        except Exception as e:
+            self._error("escribiendo", e)
+
+    def stats(self) -> Dict[str, Any]:
+        backend = get_shared_backend()
+        return {
+            "backend": backend.name if backend is not None else None,
+            "aciertos": self.l2_hits,
+            "fallos": self.l2_misses,
+            "errores": self.l2_errors,
+        }
+
+
+def get_shared_cache_stats() -> Dict[str, Dict[str, Any]]:
+    """Métricas L2 por espacio de nombres"""
+    return {name: cache.stats() for name, cache in _registry.items()}
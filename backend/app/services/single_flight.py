@@ -0,0 +1,111 @@
+"""
+Coalescencia de Solicitudes (single-flight)
+===========================================
+
+Cuando varias corrutinas fallan la caché con la misma clave a la vez, solo
+la primera llama al proveedor; las demás esperan esa misma llamada en vuelo
+y reciben su resultado (o su excepción).
+
+La llamada corre como tarea propia protegida con asyncio.shield: si el
+cliente que la inició se desconecta, las que esperan no se cancelan.
+
+Una misma llamada puede resolver varias claves (start_many, p. ej. una
+Matrix para un grupo de puntos): mientras dura, cada clave queda en vuelo
+y las consultas individuales de esas claves esperan su parte del resultado.
+
+Autor: PrediRuta Team
+"""
+
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable, Iterable
+
+
+_registry: Dict[str, "SingleFlight"] = {}
+
+
+class SingleFlight:
+    """Comparte una única llamada en vuelo por clave"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self._inflight: Dict[Hashable, asyncio.Future] = {}
+        self.leaders = 0
+        self.shared = 0
+        _registry[name] = self
+
+    def __len__(self) -> int:
+        return len(self._inflight)
+
+    def in_flight(self, key: Hashable) -> bool:
+        return key in self._inflight
+
+    def start(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> asyncio.Future:
+        """Llamada en vuelo para la clave, iniciándola si no existe, sin esperarla"""
+        task = self._inflight.get(key)
+        if task is None:
+            self.leaders += 1
+            task = asyncio.ensure_future(fn())
+            self._inflight[key] = task
+            task.add_done_callback(lambda t, k=key: self._done(k, t))
+        else:
+            self.shared += 1
+        return task
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        return await asyncio.shield(self.start(key, fn))
+
+    def start_many(
+        self,
+        keys: Iterable[Hashable],
+        fn: Callable[[], Awaitable[Dict[Hashable, Any]]],
+    ) -> asyncio.Task:
+        """
+        Inicia una llamada que resuelve varias claves a la vez y devuelve su
+        tarea ({clave: resultado}). Cada clave libre queda en vuelo hasta
+        que la tarea termina; las que ya estaban en vuelo no se tocan (el
+        llamador debe esperarlas con do()).
+        """
+        self.leaders += 1
+        task = asyncio.ensure_future(fn())
+        loop = asyncio.get_running_loop()
+        futures: Dict[Hashable, asyncio.Future] = {}
+        for key in keys:
+            if key in self._inflight:
+                continue
+            future = loop.create_future()
+            self._inflight[key] = future
+            future.add_done_callback(lambda f, k=key: self._done(k, f))
+            futures[key] = future
+
+        def settle(t: asyncio.Task) -> None:
+            for key, future in futures.items():
+                if t.cancelled():
+                    future.cancel()
+                elif t.exception() is not None:
+                    future.set_exception(t.exception())
+                elif key in t.result():
+                    future.set_result(t.result()[key])
+                else:
+                    future.set_exception(KeyError(key))
+
+        task.add_done_callback(settle)
+        return task
+
+    def _done(self, key: Hashable, task: asyncio.Future) -> None:
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        if not task.cancelled():
+            # Marca la excepción como recuperada si ya nadie espera la tarea
+            task.exception()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "en_vuelo": len(self._inflight),
+            "llamadas": self.leaders,
+            "compartidas": self.shared,
+        }
+
+
+def get_flight_stats() -> Dict[str, Dict[str, Any]]:
+    """Métricas de coalescencia de todos los servicios registrados"""
+    return {name: flights.stats() for name, flights in _registry.items()}
@@ -1,15 +1,52 @@
 import os
 import time
-from typing import Any, Dict, Optional, Tuple
+import asyncio
+from typing import Any, Dict, List, Tuple
 
-import httpx
+import numpy as np
 from app.config.mapbox import mapbox_config
-from app.services.mapbox_directions import get_route_with_traffic
+from app.services.mapbox_directions import get_directions, get_matrix, get_route_with_traffic
+from app.services.city_matrix import haversine_matrix, ROAD_DETOUR_FACTOR
+from app.services.online_estimator import get_online_estimator
+from app.services.ttl_cache import TTLCache
+from app.services.shared_cache import TieredCache
+from app.services.single_flight import SingleFlight
+from app.services.cache_warmer import register_refresher, track
+from app.services.rate_limiter import background_priority
 
 
-# Caché en memoria muy simple con TTL
-_cache: Dict[str, Dict[str, Any]] = {}
+# Caché acotada con TTL: L1 en memoria + L2 compartida entre workers
 _TTL_SECONDS = int(os.getenv("TRAFFIC_CACHE_TTL", "30"))
+# Stale-while-revalidate: tras expirar, el valor se sirve (marcado stale)
+# durante esta ventana mientras se refresca en segundo plano; 0 lo desactiva
+_GRACE_SECONDS = int(os.getenv("TRAFFIC_CACHE_GRACE", "120"))
+_cache = TieredCache(
+    TTLCache(
+        "traffic",
+        _TTL_SECONDS,
+        max_entries=int(os.getenv("TRAFFIC_CACHE_MAX_ENTRIES", "10000")),
+        grace=_GRACE_SECONDS,
+    ),
+)
+# Consultas concurrentes de la misma celda comparten una sola llamada a Mapbox
+_flights = SingleFlight("traffic")
+# Referencias a los refrescos en segundo plano (evita que se recolecten)
+_refreshes: set = set()
+
+# Consultas por lote: driving-traffic admite como máximo 3 coordenadas por
+# solicitud, así que se encadenan hasta 2 puntos cercanos (A → B → B+offset)
+DIRECTIONS_TRAFFIC_MAX_COORDS = 3
+_PROBE_OFFSET_DEG = 0.005
+BATCH_PACK_RADIUS_KM = float(os.getenv("TRAFFIC_BATCH_PACK_RADIUS_M", "1000")) / 1000.0
+BATCH_CONCURRENCY = int(os.getenv("TRAFFIC_BATCH_CONCURRENCY", "8"))
+# Resolutor de fallos por lote: "matrix" (una Matrix API para varios puntos)
+# o "directions" (cadenas de 2 puntos por solicitud Directions)
+BATCH_RESOLVER = os.getenv("TRAFFIC_BATCH_RESOLVER", "matrix").lower()
+# Matrix con driving-traffic admite como máximo 10 coordenadas por solicitud
+MATRIX_TRAFFIC_MAX_COORDS = 10
+# Pares de muestreo: vecinos del mismo grupo a menos de este radio
+MATRIX_PAIR_RADIUS_KM = float(os.getenv("TRAFFIC_MATRIX_PAIR_RADIUS_M", "1500")) / 1000.0
+MATRIX_MAX_PARTNERS = 3
 
 
 def _cache_key(lat: float, lon: float) -> str:
@@ -48,11 +85,116 @@ async def get_traffic_status_for_point(lat: float, lon: float) -> Dict[str, Any]
         return {"status": "unavailable", "code": 428, "message": message}
 
     key = _cache_key(lat, lon)
-    now = time.time()
-    cached = _cache.get(key)
-    if cached and (now - cached["t"]) < _TTL_SECONDS:
-        return cached["v"]
+    track("traffic", key, (lat, lon))
+    found = await _cache.get_with_age(key)
+    if found is not None:
+        value, age, stale = found
+        if stale:
+            _refresh_in_background(key, lat, lon)
+        return {**value, "age": round(age, 1), "stale": stale}
+
+    result = await _flights.do(key, lambda: _fetch_traffic_status(key, lat, lon))
+    return _with_fallback(result, lat, lon)
+
+
+def _with_fallback(result: Dict[str, Any], lat: float, lon: float) -> Dict[str, Any]:
+    """
+    Si Mapbox está degradado (5xx, circuito abierto, sin turno en el
+    limitador o sin presupuesto mensual) responde con el estimador
+    histórico en lugar del error
+    """
+    code = result.get("code", 0)
+    if result.get("status") == "ok" or not (code >= 500 or code == 429):
+        return result
+    estimated = get_estimated_status_for_point(lat, lon)
+    if estimated.get("status") != "ok":
+        return result
+    return {**estimated, "fallback": True, "upstream_error": result.get("message"), "age": None, "stale": False}
+
+
+def _refresh_in_background(key: str, lat: float, lon: float) -> None:
+    """
+    Refresca una entrada obsoleta sin bloquear la respuesta (una por clave),
+    con prioridad de segundo plano en el limitador de tasa
+    """
+    if _flights.in_flight(key):
+        return
+    # start() registra la clave en el acto: otro acierto obsoleto antes de
+    # que la tarea arranque ya la encuentra en vuelo
+    with background_priority():
+        task = _flights.start(key, lambda: _fetch_traffic_status(key, lat, lon))
+    _refreshes.add(task)
+    task.add_done_callback(_refreshes.discard)
+
+
+def _status_from_leg(leg: Dict[str, Any], lat: float, lon: float) -> Dict[str, Any]:
+    """Estado de tráfico de un punto a partir del tramo (leg) de Directions que lo sondea"""
+    annotation = leg.get("annotation", {})
+    
+    # Obtener velocidades y congestión
+    speeds = annotation.get("speed", [])
+    congestion_levels = annotation.get("congestion", [])
+    duration = leg.get("duration", 0)
+    distance = leg.get("distance", 0)
+    
+    # Calcular velocidad promedio actual
+    current_speed = None
+    if distance > 0 and duration > 0:
+        # Velocidad en km/h
+        current_speed = (distance / duration) * 3.6
+    
+    # Determinar nivel de congestión promedio
+    congestion_level = "unknown"
+    if congestion_levels:
+        # Mapbox devuelve: low, moderate, heavy, severe
+        # Contar ocurrencias
+        congestion_counts = {}
+        for level in congestion_levels:
+            congestion_counts[level] = congestion_counts.get(level, 0) + 1
+        
+        # Nivel más común
+        congestion_level = max(congestion_counts.items(), key=lambda x: x[1])[0] if congestion_counts else "unknown"
+    
+    # Estimar velocidad de flujo libre (aproximación)
+    # En flujo libre, típicamente se viaja a velocidad límite o cercana
+    # Para Ecuador: ~60-80 km/h en vías urbanas principales
+    free_flow_speed = current_speed * 1.5 if current_speed else 60.0
+    
+    # Mapear congestion_level a valores numéricos para compatibilidad
+    congestion_map = {
+        "low": 0.2,
+        "moderate": 0.5,
+        "heavy": 0.7,
+        "severe": 0.9,
+        "unknown": 0.0,
+    }
+    
+    return {
+        "status": "ok",
+        "provider": "mapbox",
+        "currentSpeed": round(current_speed, 1) if current_speed else None,
+        "freeFlowSpeed": round(free_flow_speed, 1),
+        "confidence": 1.0 if congestion_levels else 0.5,
+        "roadClosure": False,
+        "congestionLevel": congestion_level,
+        "congestionValue": congestion_map.get(congestion_level, 0.0),
+        "coordinates": {"lat": lat, "lon": lon},
+    }
+
+
+async def _refresh_traffic_status(args: Tuple[float, float]) -> Dict[str, Any]:
+    """Refresco del calentador: consulta a Mapbox aunque haya datos vigentes"""
+    valid, message = mapbox_config.validate()
+    if not valid:
+        return {"status": "unavailable", "code": 428, "message": message}
+    lat, lon = args
+    key = _cache_key(lat, lon)
+    return await _flights.do(key, lambda: _fetch_traffic_status(key, lat, lon, refresh=True))
+
 
+async def _fetch_traffic_status(key: str, lat: float, lon: float, refresh: bool = False) -> Dict[str, Any]:
+    """Consulta a Mapbox para un punto (una por clave en vuelo); guarda en caché si es exitosa"""
+    now = time.time()
     # Estrategia: Crear una ruta corta alrededor del punto para obtener datos de tráfico
     # Offset pequeño (~500m) en diferentes direcciones
     offset = 0.005  # Aproximadamente 500 metros
@@ -64,7 +206,9 @@ async def get_traffic_status_for_point(lat: float, lon: float) -> Dict[str, Any]
     
     try:
         # Obtener ruta con información de tráfico
-        route_data = await get_route_with_traffic(start, end, alternatives=False)
+        route_data = await get_route_with_traffic(
+            start, end, alternatives=False, refresh=refresh, track_usage=False, steps=False, geometries="polyline6",
+        )
         
         if route_data.get("status") != "ok":
             return {
@@ -92,70 +236,363 @@ async def get_traffic_status_for_point(lat: float, lon: float) -> Dict[str, Any]
                 "message": "No hay información de segmentos para esta ruta",
             }
         
-        leg = legs[0]
-        annotation = leg.get("annotation", {})
-        
-        # Obtener velocidades y congestión
-        speeds = annotation.get("speed", [])
-        congestion_levels = annotation.get("congestion", [])
-        duration = leg.get("duration", 0)
-        distance = leg.get("distance", 0)
-        
-        # Calcular velocidad promedio actual
-        current_speed = None
-        if distance > 0 and duration > 0:
-            # Velocidad en km/h
-            current_speed = (distance / duration) * 3.6
+        result = _status_from_leg(legs[0], lat, lon)
+        current_speed = result["currentSpeed"]
         
-        # Determinar nivel de congestión promedio
-        congestion_level = "unknown"
-        if congestion_levels:
-            # Mapbox devuelve: low, moderate, heavy, severe
-            # Contar ocurrencias
-            congestion_counts = {}
-            for level in congestion_levels:
-                congestion_counts[level] = congestion_counts.get(level, 0) + 1
-            
-            # Nivel más común
-            congestion_level = max(congestion_counts.items(), key=lambda x: x[1])[0] if congestion_counts else "unknown"
+        # Guardar en cache
+        await _cache.set(key, result)
         
-        # Estimar velocidad de flujo libre (aproximación)
-        # En flujo libre, típicamente se viaja a velocidad límite o cercana
-        # Para Ecuador: ~60-80 km/h en vías urbanas principales
-        free_flow_speed = current_speed * 1.5 if current_speed else 60.0
+        # Alimentar el estimador en línea (histórico + vivo)
+        if current_speed:
+            get_online_estimator().observe(lat, lon, current_speed, now)
+        return {**result, "age": 0.0, "stale": False}
         
-        # Mapear congestion_level a valores numéricos para compatibilidad
-        congestion_map = {
-            "low": 0.2,
-            "moderate": 0.5,
-            "heavy": 0.7,
-            "severe": 0.9,
-            "unknown": 0.0,
+    except Exception as e:
+        error_result = {
+            "status": "unavailable",
+            "code": 500,
+            "message": f"Error al obtener tráfico: {str(e)}",
         }
-        
+        return error_result
+
+
+def _pack_points(misses: List[Tuple[str, float, float]]) -> List[List[Tuple[str, float, float]]]:
+    """
+    Agrupa puntos cercanos (≤ BATCH_PACK_RADIUS_KM) en cadenas de hasta
+    DIRECTIONS_TRAFFIC_MAX_COORDS - 1 puntos, eligiendo siempre el vecino
+    libre más cercano.
+    """
+    per_group = DIRECTIONS_TRAFFIC_MAX_COORDS - 1
+    if per_group < 2 or len(misses) < 2:
+        return [[m] for m in misses]
+
+    lat = np.array([m[1] for m in misses])
+    lon = np.array([m[2] for m in misses])
+    dist = haversine_matrix(lat, lon)
+    np.fill_diagonal(dist, np.inf)
+    dist[dist > BATCH_PACK_RADIUS_KM] = np.inf
+
+    free = np.ones(len(misses), dtype=bool)
+    groups = []
+    for i in np.lexsort((lon, lat)):
+        if not free[i]:
+            continue
+        free[i] = False
+        chain = [int(i)]
+        while len(chain) < per_group:
+            row = np.where(free, dist[chain[-1]], np.inf)
+            j = int(row.argmin())
+            if not np.isfinite(row[j]):
+                break
+            free[j] = False
+            chain.append(j)
+        groups.append([misses[k] for k in chain])
+    return groups
+
+
+async def _fetch_packed(group: List[Tuple[str, float, float]]) -> Dict[str, Dict[str, Any]]:
+    """
+    Una solicitud Directions para una cadena de puntos: el tramo i sondea el
+    punto i; el último punto se sondea hacia el norte como en la consulta
+    individual. Cada tramo se guarda en caché con la clave de su punto.
+    """
+    if len(group) == 1:
+        key, lat, lon = group[0]
+        return {key: await _fetch_traffic_status(key, lat, lon)}
+
+    now = time.time()
+    coordinates = [(lon, lat) for _, lat, lon in group]
+    last_lat, last_lon = group[-1][1], group[-1][2]
+    coordinates.append((last_lon, last_lat + _PROBE_OFFSET_DEG))
+
+    route_data = await get_directions(
+        coordinates=coordinates,
+        profile="driving-traffic",
+        alternatives=False,
+        steps=False,
+        geometries="polyline6",
+        annotations=["duration", "distance", "speed", "congestion"],
+        track_usage=False,
+    )
+    legs = (route_data.get("routes") or [{}])[0].get("legs", []) if route_data.get("status") == "ok" else []
+    if len(legs) != len(group):
+        error = {
+            "status": "unavailable",
+            "code": route_data.get("code", 404) if route_data.get("status") != "ok" else 404,
+            "message": f"No se pudo obtener datos de tráfico: {route_data.get('message', 'tramos incompletos')}",
+        }
+        return {key: error for key, _, _ in group}
+
+    out = {}
+    for (key, lat, lon), leg in zip(group, legs):
+        result = _status_from_leg(leg, lat, lon)
+        await _cache.set(key, result)
+        if result["currentSpeed"]:
+            get_online_estimator().observe(lat, lon, result["currentSpeed"], now)
+        out[key] = {**result, "age": 0.0, "stale": False}
+    return out
+
+
+def _level_from_ratio(ratio: float) -> str:
+    """Nivel de congestión (escala de Mapbox) según velocidad actual / libre"""
+    if ratio >= 0.9:
+        return "low"
+    if ratio >= 0.7:
+        return "moderate"
+    if ratio >= 0.5:
+        return "heavy"
+    return "severe"
+
+
+def _matrix_coordinate_count(dist: np.ndarray, members: List[int]) -> int:
+    """Coordenadas que ocupa un grupo: una por punto más una sonda por punto aislado"""
+    sub = dist[np.ix_(members, members)]
+    isolated = int((~(sub <= MATRIX_PAIR_RADIUS_KM).any(axis=1)).sum())
+    return len(members) + isolated
+
+
+def _matrix_groups(misses: List[Tuple[str, float, float]]) -> List[List[Tuple[str, float, float]]]:
+    """
+    Agrupa puntos para la Matrix API: cada grupo crece con el punto libre más
+    cercano a cualquiera de sus miembros (≤ MATRIX_PAIR_RADIUS_KM) mientras
+    quepa en MATRIX_TRAFFIC_MAX_COORDS coordenadas contando las sondas.
+    """
+    if len(misses) < 2:
+        return [[m] for m in misses]
+
+    lat = np.array([m[1] for m in misses])
+    lon = np.array([m[2] for m in misses])
+    dist = haversine_matrix(lat, lon)
+    np.fill_diagonal(dist, np.inf)
+
+    free = np.ones(len(misses), dtype=bool)
+    groups = []
+    for i in np.lexsort((lon, lat)):
+        if not free[i]:
+            continue
+        free[i] = False
+        members = [int(i)]
+        while True:
+            reach = np.where(free, dist[members].min(axis=0), np.inf)
+            j = int(reach.argmin())
+            if reach[j] > MATRIX_PAIR_RADIUS_KM:
+                break
+            if _matrix_coordinate_count(dist, members + [j]) > MATRIX_TRAFFIC_MAX_COORDS:
+                break
+            free[j] = False
+            members.append(j)
+        groups.append([misses[k] for k in members])
+    return groups
+
+
+async def _fetch_matrix(group: List[Tuple[str, float, float]]) -> Dict[str, Dict[str, Any]]:
+    """
+    Una solicitud Matrix (solo duraciones) para un grupo de puntos cercanos.
+    Cada punto se mide contra sus vecinos más cercanos del grupo, o contra
+    una sonda al norte si está aislado; la distancia de cada par se calcula
+    localmente (gran círculo × ROAD_DETOUR_FACTOR) y la velocidad es
+    Σ distancia / Σ duración en ambos sentidos.
+    """
+    if len(group) == 1:
+        key, lat, lon = group[0]
+        return {key: await _fetch_traffic_status(key, lat, lon)}
+
+    now = time.time()
+    lat = [p[1] for p in group]
+    lon = [p[2] for p in group]
+    near = haversine_matrix(lat, lon)
+    np.fill_diagonal(near, np.inf)
+
+    partners: List[List[int]] = []
+    for i in range(len(group)):
+        neighbours = [int(j) for j in np.argsort(near[i])[:MATRIX_MAX_PARTNERS] if near[i, j] <= MATRIX_PAIR_RADIUS_KM]
+        if not neighbours:
+            lat.append(lat[i] + _PROBE_OFFSET_DEG)
+            lon.append(lon[i])
+            neighbours = [len(lat) - 1]
+        partners.append(neighbours)
+
+    matrix = await get_matrix(
+        coordinates=list(zip(lon, lat)),
+        profile="driving-traffic",
+        annotations=["duration"],
+    )
+    durations = matrix.get("durations") or []
+    if matrix.get("status") != "ok" or len(durations) != len(lat):
+        error = {
+            "status": "unavailable",
+            "code": matrix.get("code", 404) if matrix.get("status") != "ok" else 404,
+            "message": f"No se pudo obtener datos de tráfico: {matrix.get('message', 'matriz incompleta')}",
+        }
+        return {key: error for key, _, _ in group}
+
+    km = haversine_matrix(lat, lon) * ROAD_DETOUR_FACTOR
+    estimator = get_online_estimator()
+    out = {}
+    for i, (key, la, lo) in enumerate(group):
+        total_km = total_s = 0.0
+        for j in partners[i]:
+            for a, b in ((i, j), (j, i)):
+                seconds = durations[a][b]
+                if seconds:
+                    total_km += float(km[a, b])
+                    total_s += seconds
+        if total_s <= 0:
+            out[key] = {"status": "unavailable", "code": 404, "message": "Sin duraciones para este punto en la matriz"}
+            continue
+
+        current_speed = total_km / total_s * 3600.0
+        estimate = estimator.estimate(la, lo, now)
+        if estimate is not None and estimate.get("prior") is not None:
+            free_flow_speed = max(estimate["freeFlowSpeed"], current_speed)
+            level = _level_from_ratio(current_speed / free_flow_speed)
+        else:
+            # Misma aproximación que la consulta individual
+            free_flow_speed = current_speed * 1.5
+            level = "unknown"
         result = {
             "status": "ok",
             "provider": "mapbox",
-            "currentSpeed": round(current_speed, 1) if current_speed else None,
+            "currentSpeed": round(current_speed, 1),
             "freeFlowSpeed": round(free_flow_speed, 1),
-            "confidence": 1.0 if congestion_levels else 0.5,
+            "confidence": 0.5,
             "roadClosure": False,
-            "congestionLevel": congestion_level,
-            "congestionValue": congestion_map.get(congestion_level, 0.0),
-            "coordinates": {"lat": lat, "lon": lon},
+            "congestionLevel": level,
+            "congestionValue": {"low": 0.2, "moderate": 0.5, "heavy": 0.7, "severe": 0.9}.get(level, 0.0),
+            "coordinates": {"lat": la, "lon": lo},
+            "method": "matrix",
         }
-        
-        # Guardar en cache
-        _cache[key] = {"t": now, "v": result}
-        return result
-        
-    except Exception as e:
-        error_result = {
+        await _cache.set(key, result)
+        estimator.observe(la, lo, current_speed, now)
+        out[key] = {**result, "age": 0.0, "stale": False}
+    return out
+
+
+async def get_traffic_status_for_points(points: List[Tuple[float, float]]) -> Dict[str, Any]:
+    """
+    Estado de tráfico para muchos puntos (lat, lon) en una sola llamada:
+
+    - Deduplica por la clave de caché (~100 m)
+    - Sirve aciertos de caché (incluidos obsoletos dentro de la gracia)
+    - Los fallos que ya tienen una consulta en vuelo (individual, de otro
+      lote o de un refresco) esperan esa consulta
+    - Resuelve el resto con concurrencia acotada, agrupando puntos cercanos
+      en una solicitud Matrix (TRAFFIC_BATCH_RESOLVER=matrix, por defecto) o
+      en solicitudes Directions de varios waypoints ("directions"); cada
+      clave del grupo queda en vuelo en _flights mientras dura la solicitud
+    - Si Mapbox está degradado, usa el estimador histórico por punto
+
+    Retorna {"keys": clave por punto de entrada, "results": {clave: estado},
+    "stats": {...}}.
+    """
+    keys = [_cache_key(lat, lon) for lat, lon in points]
+    unique: Dict[str, Tuple[float, float]] = {}
+    for key, point in zip(keys, points):
+        unique.setdefault(key, point)
+
+    valid, message = mapbox_config.validate()
+    if not valid:
+        error = {"status": "unavailable", "code": 428, "message": message}
+        return {
+            "keys": keys,
+            "results": {key: error for key in unique},
+            "stats": {
+                "puntos": len(points),
+                "unicos": len(unique),
+                "desde_cache": 0,
+                "en_vuelo": 0,
+                "solicitudes": 0,
+                "agrupados": 0,
+                "resolutor": BATCH_RESOLVER,
+            },
+        }
+
+    results: Dict[str, Dict[str, Any]] = {}
+    misses: List[Tuple[str, float, float]] = []
+    for key, (lat, lon) in unique.items():
+        track("traffic", key, (lat, lon))
+        found = await _cache.get_with_age(key)
+        if found is None:
+            misses.append((key, lat, lon))
+            continue
+        value, age, stale = found
+        if stale:
+            _refresh_in_background(key, lat, lon)
+        results[key] = {**value, "age": round(age, 1), "stale": stale}
+    cached = len(results)
+
+    # Sin await entre la comprobación y el registro de los grupos en _flights
+    joined = [m for m in misses if _flights.in_flight(m[0])]
+    fresh = [m for m in misses if not _flights.in_flight(m[0])]
+    if BATCH_RESOLVER == "matrix":
+        groups, fetch = _matrix_groups(fresh), _fetch_matrix
+    else:
+        groups, fetch = _pack_points(fresh), _fetch_packed
+    semaphore = asyncio.Semaphore(BATCH_CONCURRENCY)
+
+    async def resolve(group):
+        async with semaphore:
+            try:
+                return await fetch(group)
+            except Exception as e:
+                error = {"status": "unavailable", "code": 500, "message": f"Error al obtener tráfico: {str(e)}"}
+                return {key: error for key, _, _ in group}
+
+    tasks = [_flights.start_many([key for key, _, _ in g], lambda g=g: resolve(g)) for g in groups]
+
+    async def wait_flight(key, lat, lon):
+        return {key: await _flights.do(key, lambda: _fetch_traffic_status(key, lat, lon))}
+
+    pending = [asyncio.shield(t) for t in tasks] + [wait_flight(*m) for m in joined]
+    for partial in await asyncio.gather(*pending):
+        results.update(partial)
+    for key, _, _ in misses:
+        lat, lon = unique[key]
+        results[key] = _with_fallback(results[key], lat, lon)
+
+    return {
+        "keys": keys,
+        "results": results,
+        "stats": {
+            "puntos": len(points),
+            "unicos": len(unique),
+            "desde_cache": cached,
+            "en_vuelo": len(joined),
+            "solicitudes": len(groups),
+            "agrupados": sum(len(g) for g in groups if len(g) > 1),
+            "resolutor": BATCH_RESOLVER,
+        },
+    }
+
+
+register_refresher("traffic", _refresh_traffic_status, _cache.ttl_remaining)
+
+
+def get_estimated_status_for_point(lat: float, lon: float) -> Dict[str, Any]:
+    """
+    Estado de tráfico desde el estimador en línea, sin llamar al proveedor.
+    Combina el cubo histórico del dataset con las observaciones en vivo recientes.
+    """
+    estimate = get_online_estimator().estimate(lat, lon)
+    if estimate is None:
+        return {
             "status": "unavailable",
-            "code": 500,
-            "message": f"Error al obtener tráfico: {str(e)}",
+            "code": 404,
+            "message": "Sin datos históricos ni observaciones para este punto",
         }
-        return error_result
+
+    return {
+        "status": "ok",
+        "provider": "estimador",
+        "currentSpeed": estimate["speed"],
+        "freeFlowSpeed": estimate["freeFlowSpeed"],
+        "confidence": estimate["confidence"],
+        "roadClosure": False,
+        "congestionLevel": "unknown",
+        "congestionValue": 0.0,
+        "coordinates": {"lat": lat, "lon": lon},
+        "estimate": estimate,
+    }
 
 
 async def get_traffic_for_route(
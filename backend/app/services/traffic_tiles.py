@@ -0,0 +1,271 @@
+"""
+Rejilla de Tráfico por Teselas
+==============================
+
+Resuelve consultas de tráfico por bbox combinando teselas slippy-map
+(z/x/y, Web Mercator) en lugar de muestrear centro y esquinas:
+
+- La bbox se cubre con las teselas del mayor zoom que no supere
+  TRAFFIC_TILE_MAX_TILES teselas
+- Cada tesela se resume (velocidad actual / libre media, peor razón,
+  confianza) a partir de una rejilla de puntos de muestreo cuya densidad
+  depende del zoom (TRAFFIC_TILE_SAMPLES)
+- Los resúmenes se guardan en caché por tesela; los puntos de todas las
+  teselas ausentes se resuelven en una sola llamada al resolutor por lotes
+  (caché por punto y agrupación Matrix de traffic_service)
+- Con los valores por defecto (4 teselas, 1 punto por tesela) una bbox en
+  frío consulta a lo sumo 4 puntos
+- La respuesta de la bbox pondera cada tesela por su área de intersección
+
+Autor: PrediRuta Team
+"""
+
+import os
+import math
+import time
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from app.services.ttl_cache import TTLCache
+from app.services.shared_cache import TieredCache
+
+
+TILE_MAX_ZOOM = int(os.getenv("TRAFFIC_TILE_MAX_ZOOM", "15"))
+TILE_MAX_TILES = int(os.getenv("TRAFFIC_TILE_MAX_TILES", "4"))
+MAX_LATITUDE = 85.05112878
+
+
+def _parse_samples(spec: str) -> List[Tuple[int, int]]:
+    """'0:2,12:1' -> [(12, 1), (0, 2)]: desde el zoom z, rejilla n×n"""
+    out = []
+    for part in spec.split(","):
+        zoom, side = part.split(":")
+        out.append((int(zoom), max(1, int(side))))
+    return sorted(out, reverse=True)
+
+
+# Puntos de muestreo por tesela (lado de la rejilla) según el zoom
+TILE_SAMPLES = _parse_samples(os.getenv("TRAFFIC_TILE_SAMPLES", "0:1"))
+
+_tile_cache = TieredCache(
+    TTLCache(
+        "traffic_tiles",
+        int(os.getenv("TRAFFIC_CACHE_TTL", "30")),
+        max_entries=int(os.getenv("TRAFFIC_TILE_CACHE_MAX_ENTRIES", "4096")),
+    ),
+)
+
+# Resolutor por lotes: un estado por punto (lat, lon), en el mismo orden
+StatusResolver = Callable[[List[Tuple[float, float]]], Awaitable[List[Dict[str, Any]]]]
+
+
+# ============================================================
+# Geometría slippy-map
+# ============================================================
+
+def lonlat_to_tile_fraction(lon: float, lat: float, zoom: int) -> Tuple[float, float]:
+    """Coordenadas de tesela fraccionarias (x, y) para el zoom"""
+    lat = max(-MAX_LATITUDE, min(MAX_LATITUDE, lat))
+    n = 2 ** zoom
+    x = (lon + 180.0) / 360.0 * n
+    lat_rad = math.radians(lat)
+    y = (1.0 - math.asinh(math.tan(lat_rad)) / math.pi) / 2.0 * n
+    return x, y
+
+
+def lonlat_to_tile(lon: float, lat: float, zoom: int) -> Tuple[int, int]:
+    n = 2 ** zoom
+    x, y = lonlat_to_tile_fraction(lon, lat, zoom)
+    return min(n - 1, max(0, int(x))), min(n - 1, max(0, int(y)))
+
+
+def tile_fraction_to_lonlat(x: float, y: float, zoom: int) -> Tuple[float, float]:
+    n = 2 ** zoom
+    lon = x / n * 360.0 - 180.0
+    lat = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * y / n))))
+    return lon, lat
+
+
+def tile_bounds(x: int, y: int, zoom: int) -> Tuple[float, float, float, float]:
+    """(west, south, east, north) de la tesela"""
+    west, north = tile_fraction_to_lonlat(x, y, zoom)
+    east, south = tile_fraction_to_lonlat(x + 1, y + 1, zoom)
+    return west, south, east, north
+
+
+def tiles_for_bbox(west: float, south: float, east: float, north: float, zoom: int) -> List[Tuple[int, int]]:
+    x0, y0 = lonlat_to_tile(west, north, zoom)
+    x1, y1 = lonlat_to_tile(east, south, zoom)
+    return [(x, y) for y in range(y0, y1 + 1) for x in range(x0, x1 + 1)]
+
+
+def zoom_for_bbox(west: float, south: float, east: float, north: float) -> int:
+    """Mayor zoom (≤ TILE_MAX_ZOOM) cuya cobertura no supera TILE_MAX_TILES teselas"""
+    for zoom in range(TILE_MAX_ZOOM, -1, -1):
+        x0, y0 = lonlat_to_tile(west, north, zoom)
+        x1, y1 = lonlat_to_tile(east, south, zoom)
+        if (x1 - x0 + 1) * (y1 - y0 + 1) <= TILE_MAX_TILES:
+            return zoom
+    return 0
+
+
+def samples_per_side(zoom: int) -> int:
+    for min_zoom, side in TILE_SAMPLES:
+        if zoom >= min_zoom:
+            return side
+    return 1
+
+
+def sample_points(x: int, y: int, zoom: int) -> List[Tuple[float, float]]:
+    """Puntos (lat, lon) en el centro de cada subcelda n×n de la tesela"""
+    side = samples_per_side(zoom)
+    points = []
+    for j in range(side):
+        for i in range(side):
+            lon, lat = tile_fraction_to_lonlat(x + (i + 0.5) / side, y + (j + 0.5) / side, zoom)
+            points.append((lat, lon))
+    return points
+
+
+def _overlap(a: Tuple[float, float, float, float], b: Tuple[float, float, float, float]) -> float:
+    """Área (grados²) de la intersección de dos cajas west,south,east,north"""
+    w = min(a[2], b[2]) - max(a[0], b[0])
+    h = min(a[3], b[3]) - max(a[1], b[1])
+    return w * h if w > 0 and h > 0 else 0.0
+
+
+# ============================================================
+# Resúmenes por tesela
+# ============================================================
+
+def _is_valid(status: Dict[str, Any]) -> bool:
+    return status.get("status") == "ok" and status.get("currentSpeed") is not None and bool(status.get("freeFlowSpeed"))
+
+
+def summarize_samples(results: List[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """Resumen de una tesela a partir de sus puntos; None si ninguno es válido"""
+    valid = [r for r in results if _is_valid(r)]
+    if not valid:
+        return None
+    ages = [v["age"] for v in valid if v.get("age") is not None]
+    return {
+        "currentSpeed": sum(v["currentSpeed"] for v in valid) / len(valid),
+        "freeFlowSpeed": sum(v["freeFlowSpeed"] for v in valid) / len(valid),
+        "worstRatio": min(v["currentSpeed"] / v["freeFlowSpeed"] for v in valid),
+        "confidence": max((v.get("confidence") or 0) for v in valid),
+        "provider": valid[0].get("provider"),
+        "samples": len(valid),
+        "age": max(ages) if ages else None,
+        "stale": any(v.get("stale") for v in valid),
+    }
+
+
+async def _cached_summary(key: str) -> Optional[Dict[str, Any]]:
+    """Resumen en caché de la tesela, con la edad de sus datos al día"""
+    found = await _tile_cache.get_with_age(key)
+    if found is None:
+        return None
+    summary, tile_age, _ = found
+    if summary.get("age") is not None:
+        summary = {**summary, "age": summary["age"] + tile_age}
+    return summary
+
+
+async def _resolve_tiles(
+    tiles: List[Tuple[int, int]],
+    zoom: int,
+    fuente: str,
+    resolve: StatusResolver,
+) -> Dict[Tuple[int, int], Tuple[Optional[Dict[str, Any]], List[Dict[str, Any]]]]:
+    """(resumen, resultados de puntos) de cada tesela, con una sola llamada al resolutor"""
+    points = {tile: sample_points(tile[0], tile[1], zoom) for tile in tiles}
+    statuses = await resolve([p for pts in points.values() for p in pts])
+
+    out = {}
+    start = 0
+    for (x, y), pts in points.items():
+        results = statuses[start:start + len(pts)]
+        start += len(pts)
+        summary = summarize_samples(results)
+        if summary is not None:
+            await _tile_cache.set(f"{fuente}:{zoom}/{x}/{y}", summary)
+        out[(x, y)] = (summary, results)
+    return out
+
+
+async def get_bbox_traffic(
+    west: float,
+    south: float,
+    east: float,
+    north: float,
+    resolve: StatusResolver,
+    fuente: str = "live",
+) -> Dict[str, Any]:
+    """
+    Estado agregado de la bbox combinando teselas. Devuelve status "ok" con
+    currentSpeed, freeFlowSpeed, worstRatio, confidence, provider, age,
+    stale y el detalle de teselas; o status "unavailable" con el primer
+    error de los puntos consultados.
+    """
+    zoom = zoom_for_bbox(west, south, east, north)
+    tiles = tiles_for_bbox(west, south, east, north, zoom)
+    started = time.time()
+
+    cached_summaries = await asyncio.gather(*(_cached_summary(f"{fuente}:{zoom}/{x}/{y}") for x, y in tiles))
+    missing = [tile for tile, summary in zip(tiles, cached_summaries) if summary is None]
+    fetched = await _resolve_tiles(missing, zoom, fuente, resolve) if missing else {}
+    summaries = [
+        (summary, [], True) if summary is not None else (*fetched[tile], False)
+        for tile, summary in zip(tiles, cached_summaries)
+    ]
+
+    bbox = (west, south, east, north)
+    total_w = cur = free = 0.0
+    worst = None
+    conf = 0.0
+    provider = None
+    ages: List[float] = []
+    stale = False
+    cached = 0
+    first_error: Optional[Dict[str, Any]] = None
+    for (x, y), (summary, results, from_cache) in zip(tiles, summaries):
+        cached += from_cache
+        if summary is None:
+            if first_error is None:
+                first_error = next((r for r in results if r.get("status") != "ok"), None)
+            continue
+        weight = _overlap(tile_bounds(x, y, zoom), bbox) or 1e-12
+        total_w += weight
+        cur += summary["currentSpeed"] * weight
+        free += summary["freeFlowSpeed"] * weight
+        worst = summary["worstRatio"] if worst is None else min(worst, summary["worstRatio"])
+        conf = max(conf, summary["confidence"])
+        provider = provider or summary["provider"]
+        if summary.get("age") is not None:
+            ages.append(summary["age"])
+        stale = stale or summary.get("stale", False)
+
+    tiles_info = {
+        "zoom": zoom,
+        "total": len(tiles),
+        "desde_cache": cached,
+        "consultadas": len(tiles) - cached,
+        "puntos_por_tesela": samples_per_side(zoom) ** 2,
+        "puntos_consultados": len(missing) * samples_per_side(zoom) ** 2,
+        "ms": round((time.time() - started) * 1000, 1),
+    }
+    if total_w == 0:
+        error = first_error or {"status": "unavailable", "code": 502, "message": "Sin resultados del proveedor"}
+        return {**error, "status": "unavailable", "tiles": tiles_info}
+
+    return {
+        "status": "ok",
+        "currentSpeed": cur / total_w,
+        "freeFlowSpeed": free / total_w,
+        "worstRatio": worst,
+        "confidence": conf,
+        "provider": provider,
+        "age": max(ages) if ages else None,
+        "stale": stale,
+        "tiles": tiles_info,
+    }
@@ -0,0 +1,233 @@
+"""
+Caché TTL + LRU en memoria
+==========================
+
+Caché acotada para las respuestas de proveedores externos (rutas,
+geocodificación, tráfico):
+
+- Expiración por TTL (por entrada o por defecto de la caché)
+- Ventana de gracia opcional: tras expirar, la entrada se conserva un tiempo
+  para servirla como obsoleta (stale-while-revalidate) con get_with_age()
+- Desalojo LRU al superar el máximo de entradas o de bytes estimados
+- Purga periódica de entradas expiradas en segundo plano (CacheJanitor)
+- Métricas por caché: aciertos, fallos, desalojos y expiraciones
+
+Cada caché se registra por nombre para exponer sus métricas en conjunto.
+
+Autor: PrediRuta Team
+"""
+
+import os
+import sys
+import json
+import time
+import asyncio
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+
+CACHE_PURGE_INTERVAL = float(os.getenv("CACHE_PURGE_INTERVAL", "60"))
+
+_registry: Dict[str, "TTLCache"] = {}
+
+
+def estimate_size(value: Any) -> int:
+    """Tamaño aproximado en bytes (JSON serializado; getsizeof si no es JSON)"""
+    try:
+        return len(json.dumps(value, separators=(",", ":"), default=str))
+    except (TypeError, ValueError):
+        return sys.getsizeof(value)
+
+
+class _Entry:
+    __slots__ = ("value", "stored_at", "expires_at", "size")
+
+    def __init__(self, value: Any, stored_at: float, expires_at: float, size: int):
+        self.value = value
+        self.stored_at = stored_at
+        self.expires_at = expires_at
+        self.size = size
+
+
+class TTLCache:
+    """Caché con TTL y desalojo LRU por número de entradas y bytes"""
+
+    def __init__(
+        self,
+        name: str,
+        ttl: float,
+        max_entries: int = 1024,
+        max_bytes: Optional[int] = None,
+        sizeof: Callable[[Any], int] = estimate_size,
+        grace: float = 0.0,
+    ):
+        self.name = name
+        self.ttl = float(ttl)
+        self.grace = float(grace)
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._sizeof = sizeof
+        self._data: "OrderedDict[Hashable, _Entry]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.stale_hits = 0
+        _registry[name] = self
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __contains__(self, key: Hashable) -> bool:
+        entry = self._data.get(key)
+        return entry is not None and entry.expires_at > time.time()
+
+    def _remove(self, key: Hashable) -> Optional[_Entry]:
+        entry = self._data.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry.size
+        return entry
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Valor vigente para la clave (y lo marca como usado recientemente)"""
+        now = time.time()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            if entry.expires_at <= now:
+                if entry.expires_at + self.grace <= now:
+                    self._remove(key)
+                    self.expirations += 1
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry.value
+
+    def get_with_age(self, key: Hashable) -> Optional[Tuple[Any, float, bool]]:
+        """
+        (valor, edad en s, obsoleto) para la clave. Una entrada expirada dentro
+        de la ventana de gracia se devuelve con obsoleto=True.
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            if entry.expires_at + self.grace <= now:
+                self._remove(key)
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            stale = entry.expires_at <= now
+            if stale:
+                self.stale_hits += 1
+            else:
+                self.hits += 1
+            return entry.value, now - entry.stored_at, stale
+
+    def ttl_remaining(self, key: Hashable) -> Optional[float]:
+        """Segundos hasta que expire la entrada (negativo si ya expiró); no cuenta como acceso"""
+        entry = self._data.get(key)
+        return None if entry is None else entry.expires_at - time.time()
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None, age: float = 0.0) -> None:
+        """Guarda el valor; `age` indica cuánto tiempo lleva ya el valor en otra caché"""
+        now = time.time()
+        size = self._sizeof(value) if self.max_bytes else 0
+        if self.max_bytes and size > self.max_bytes:
+            # Un valor mayor que toda la caché no se guarda
+            return
+        with self._lock:
+            self._remove(key)
+            self._data[key] = _Entry(value, now - age, now + (self.ttl if ttl is None else ttl), size)
+            self._bytes += size
+            self._evict()
+
+    def _evict(self) -> None:
+        while len(self._data) > self.max_entries or (self.max_bytes and self._bytes > self.max_bytes):
+            _, entry = self._data.popitem(last=False)
+            self._bytes -= entry.size
+            self.evictions += 1
+
+    def delete(self, key: Hashable) -> bool:
+        with self._lock:
+            return self._remove(key) is not None
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+
+    def purge_expired(self) -> int:
+        """Elimina las entradas expiradas (y fuera de gracia); devuelve cuántas"""
+        now = time.time() - self.grace
+        with self._lock:
+            expired = [k for k, e in self._data.items() if e.expires_at <= now]
+            for key in expired:
+                self._remove(key)
+            self.expirations += len(expired)
+        return len(expired)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "nombre": self.name,
+            "entradas": len(self._data),
+            "max_entradas": self.max_entries,
+            "bytes": self._bytes if self.max_bytes else None,
+            "max_bytes": self.max_bytes,
+            "ttl_s": self.ttl,
+            "gracia_s": self.grace,
+            "aciertos": self.hits,
+            "aciertos_obsoletos": self.stale_hits,
+            "fallos": self.misses,
+            "tasa_aciertos": round(self.hits / lookups, 4) if lookups else None,
+            "desalojos": self.evictions,
+            "expiraciones": self.expirations,
+        }
+
+
+def get_cache_stats() -> Dict[str, Dict[str, Any]]:
+    """Métricas de todas las cachés registradas"""
+    return {name: cache.stats() for name, cache in _registry.items()}
+
+
+def purge_all_expired() -> int:
+    return sum(cache.purge_expired() for cache in list(_registry.values()))
+
+
+class CacheJanitor:
+    """Purga periódicamente las entradas expiradas de todas las cachés"""
+
+    def __init__(self, interval_seconds: float = CACHE_PURGE_INTERVAL):
+        self.interval = interval_seconds
+        self._task: Optional[asyncio.Task] = None
+
+    async def _loop(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                purge_all_expired()
+            except Exception as e:
+                print(f"⚠️ Error purgando cachés: {e}")
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
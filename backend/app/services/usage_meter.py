@@ -0,0 +1,302 @@
+"""
+Medidor de Consumo de Mapbox
+============================
+
+Cuenta cada llamada saliente a Mapbox por API y la compara con las cuotas
+mensuales de MapboxConfig:
+
+- Registro en memoria (sin E/S en la solicitud): contador del mes en curso
+  y búfer de filas para api_usage
+- Volcado por lotes a api_usage (Supabase) cada USAGE_FLUSH_INTERVAL o al
+  llenarse un lote; si la base no responde, las filas esperan en el búfer
+  (acotado) y se reintentan
+- Sincronización periódica del consumo del mes desde la base
+  (api_usage_mensual, database/api_usage_mapbox.sql), así el contador
+  incluye a los demás workers y sobrevive a los reinicios
+- Presupuestos: al superar la fracción blanda de la cuota solo pasan las
+  llamadas interactivas (el calentador y los refrescos en segundo plano
+  quedan en solo caché); al superar la dura ninguna llamada sale y los
+  servicios responden desde caché o su alternativa histórica
+
+Autor: PrediRuta Team
+"""
+
+import os
+import time
+import asyncio
+from collections import deque
+from datetime import datetime, timezone
+from typing import Any, Deque, Dict, List, Optional
+
+from app.config.mapbox import mapbox_config
+from app.services.rate_limiter import BACKGROUND, RateLimitExceeded, current_priority
+
+
+USAGE_TABLE = "api_usage"
+USAGE_FLUSH_INTERVAL = float(os.getenv("USAGE_FLUSH_INTERVAL", "30"))
+USAGE_FLUSH_BATCH = int(os.getenv("USAGE_FLUSH_BATCH", "200"))
+USAGE_SYNC_INTERVAL = float(os.getenv("USAGE_SYNC_INTERVAL", "300"))
+# Filas máximas en espera si la base no responde (se descartan las más antiguas)
+USAGE_MAX_BUFFER = 10000
+
+NORMAL = "normal"
+INTERACTIVE_ONLY = "solo_interactivo"
+CACHE_ONLY = "solo_cache"
+
+
+def _month_start() -> datetime:
+    """Inicio del mes de facturación (UTC)"""
+    return datetime.now(timezone.utc).replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def usage_enabled() -> bool:
+    return os.getenv("USAGE_METER_ENABLED", "true").lower() in ("1", "true", "yes")
+
+
+class BudgetExceeded(RateLimitExceeded):
+    """El consumo del mes superó el presupuesto de la API"""
+
+    def __init__(self, api: str, mode: str, used: int, limit: int):
+        self.mode = mode
+        self.used = used
+        self.limit = limit
+        detail = "solo caché" if mode == CACHE_ONLY else "solo llamadas interactivas"
+        super().__init__(api, f"cuota mensual en {used}/{limit} ({detail})")
+
+
+class UsageMeter:
+    """Contadores mensuales por API, búfer de filas y presupuestos blando/duro"""
+
+    def __init__(
+        self,
+        limits: Optional[Dict[str, int]] = None,
+        soft_ratio: float = mapbox_config.budget_soft_ratio,
+        hard_ratio: float = mapbox_config.budget_hard_ratio,
+        persist: bool = True,
+    ):
+        self.limits = limits if limits is not None else mapbox_config.monthly_limits()
+        self.soft_ratio = soft_ratio
+        self.hard_ratio = hard_ratio
+        self.persist = persist
+        self._month = _month_start()
+        # Unidades del mes: sincronizadas desde la base + volcadas desde la
+        # última sincronización + aún en el búfer
+        self._synced: Dict[str, int] = {}
+        self._flushed_units: Dict[str, int] = {}
+        self._unflushed: Dict[str, int] = {}
+        self._pending: Deque[Dict[str, Any]] = deque()
+        self._flushing = False
+        self._flush_task: Optional[asyncio.Task] = None
+        self._last_sync = 0.0
+        self._task: Optional[asyncio.Task] = None
+        self.blocked: Dict[str, int] = {}
+        self.flushed = 0
+        self.dropped = 0
+        self.flush_errors = 0
+
+    # --------------------------------------------------------
+    # Conteo y presupuestos
+    # --------------------------------------------------------
+
+    def _roll_month(self) -> None:
+        month = _month_start()
+        if month != self._month:
+            self._month = month
+            self._synced.clear()
+            self._flushed_units.clear()
+            self._unflushed.clear()
+
+    def used(self, api: str) -> int:
+        self._roll_month()
+        return self._synced.get(api, 0) + self._flushed_units.get(api, 0) + self._unflushed.get(api, 0)
+
+    @staticmethod
+    def _add(counter: Dict[str, int], api: str, units: int) -> None:
+        counter[api] = counter.get(api, 0) + units
+
+    def mode(self, api: str) -> str:
+        limit = self.limits.get(api)
+        if not limit:
+            return NORMAL
+        used = self.used(api)
+        if used >= limit * self.hard_ratio:
+            return CACHE_ONLY
+        if used >= limit * self.soft_ratio:
+            return INTERACTIVE_ONLY
+        return NORMAL
+
+    def check(self, api: str, units: int = 1) -> None:
+        """Lanza BudgetExceeded si la llamada superaría el presupuesto vigente"""
+        limit = self.limits.get(api)
+        if not limit:
+            return
+        used = self.used(api) + units
+        if used > limit * self.hard_ratio:
+            mode = CACHE_ONLY
+        elif used > limit * self.soft_ratio and current_priority() == BACKGROUND:
+            mode = INTERACTIVE_ONLY
+        else:
+            return
+        self.blocked[api] = self.blocked.get(api, 0) + 1
+        raise BudgetExceeded(api, mode, used - units, limit)
+
+    def record(
+        self,
+        api: str,
+        status_code: int,
+        elapsed_ms: float,
+        response_bytes: int = 0,
+        units: int = 1,
+    ) -> None:
+        """Registra una llamada enviada a Mapbox (solo memoria)"""
+        self._roll_month()
+        billable = units if status_code < 400 else 0
+        if not self.persist:
+            self._add(self._flushed_units, api, billable)
+            return
+        self._add(self._unflushed, api, billable)
+        if len(self._pending) >= USAGE_MAX_BUFFER:
+            self._pending.popleft()
+            self.dropped += 1
+        self._pending.append({
+            "endpoint": f"mapbox/{api}",
+            "method": "GET",
+            "status_code": status_code,
+            "response_time_ms": int(elapsed_ms),
+            "response_size_bytes": response_bytes,
+            "units": units,
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+        })
+        if len(self._pending) >= USAGE_FLUSH_BATCH and self._task is not None and not self._flushing:
+            self._flush_task = asyncio.get_running_loop().create_task(self.flush())
+
+    # --------------------------------------------------------
+    # Persistencia
+    # --------------------------------------------------------
+
+    def _insert(self, rows: List[Dict[str, Any]]) -> None:
+        from app.database import get_supabase
+
+        get_supabase().table(USAGE_TABLE).insert(rows).execute()
+
+    def _fetch_month_usage(self) -> Dict[str, int]:
+        from app.database import get_supabase
+
+        res = get_supabase().rpc("api_usage_mensual", {"desde": self._month.isoformat()}).execute()
+        out = {}
+        for row in res.data or []:
+            endpoint = str(row.get("endpoint") or "")
+            if endpoint.startswith("mapbox/"):
+                out[endpoint[len("mapbox/"):]] = int(row.get("unidades") or 0)
+        return out
+
+    async def flush(self) -> int:
+        """Inserta las filas pendientes por lotes; devuelve cuántas se escribieron"""
+        if self._flushing or not self._pending:
+            return 0
+        self._flushing = True
+        written = 0
+        try:
+            while self._pending:
+                batch = [self._pending.popleft() for _ in range(min(USAGE_FLUSH_BATCH, len(self._pending)))]
+                try:
+                    await asyncio.to_thread(self._insert, batch)
+                except Exception as e:
+                    # Se devuelven al búfer para el próximo intento
+                    self._pending.extendleft(reversed(batch))
+                    self.flush_errors += 1
+                    print(f"⚠️ Error volcando consumo de Mapbox: {e}")
+                    break
+                written += len(batch)
+                self.flushed += len(batch)
+                for row in batch:
+                    if row["status_code"] < 400:
+                        api = row["endpoint"][len("mapbox/"):]
+                        self._add(self._unflushed, api, -row["units"])
+                        self._add(self._flushed_units, api, row["units"])
+        finally:
+            self._flushing = False
+        return written
+
+    async def sync(self) -> bool:
+        """
+        Toma de la base el consumo del mes (todos los workers). Las unidades
+        volcadas antes de la consulta pasan a la cuenta sincronizada.
+        """
+        month = self._month
+        included = dict(self._flushed_units)
+        try:
+            month_usage = await asyncio.to_thread(self._fetch_month_usage)
+        except Exception as e:
+            print(f"⚠️ Error sincronizando consumo de Mapbox: {e}")
+            return False
+        self._roll_month()
+        if month != self._month:
+            return False
+        self._synced = month_usage
+        # Lo volcado durante la consulta puede no estar incluido todavía
+        self._flushed_units = {
+            api: n - included.get(api, 0)
+            for api, n in self._flushed_units.items()
+            if n > included.get(api, 0)
+        }
+        self._last_sync = time.time()
+        return True
+
+    async def _loop(self):
+        await self.sync()
+        while True:
+            await asyncio.sleep(USAGE_FLUSH_INTERVAL)
+            try:
+                await self.flush()
+                if time.time() - self._last_sync >= USAGE_SYNC_INTERVAL:
+                    await self.sync()
+            except Exception as e:
+                print(f"⚠️ Error en el medidor de consumo: {e}")
+
+    def start(self):
+        if self._task is None and self.persist:
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    def stats(self) -> Dict[str, Any]:
+        apis = {}
+        for api, limit in self.limits.items():
+            used = self.used(api)
+            apis[api] = {
+                "usado": used,
+                "cuota": limit,
+                "porcentaje": round(used / limit * 100, 2) if limit else None,
+                "modo": self.mode(api),
+                "bloqueadas": self.blocked.get(api, 0),
+            }
+        return {
+            "mes": self._month.strftime("%Y-%m"),
+            "presupuesto_blando": self.soft_ratio,
+            "presupuesto_duro": self.hard_ratio,
+            "apis": apis,
+            "pendientes": len(self._pending),
+            "volcadas": self.flushed,
+            "descartadas": self.dropped,
+            "errores_volcado": self.flush_errors,
+            "ultima_sincronizacion": self._last_sync or None,
+        }
+
+
+_meter: Optional[UsageMeter] = None
+
+
+def get_usage_meter() -> UsageMeter:
+    global _meter
+    if _meter is None:
+        _meter = UsageMeter(persist=usage_enabled())
+    return _meter
@@ -0,0 +1,28 @@
+-- =====================================================
+-- Consumo de APIs de Mapbox en api_usage
+-- =====================================================
+-- El medidor de consumo del backend (app/services/usage_meter.py) escribe
+-- una fila por llamada saliente a Mapbox con endpoint 'mapbox/<api>'. Las
+-- filas se insertan por lotes cada pocos segundos.
+--
+-- `units` es la cantidad facturable de la llamada: 1 para Directions y
+-- Geocoding, y el número de elementos (orígenes × destinos) para Matrix.
+
+ALTER TABLE public.api_usage
+    ADD COLUMN IF NOT EXISTS units integer NOT NULL DEFAULT 1;
+
+-- Conteo del mes en curso por endpoint
+CREATE INDEX IF NOT EXISTS idx_api_usage_endpoint_timestamp
+    ON public.api_usage (endpoint, "timestamp");
+
+-- Unidades consumidas por endpoint desde una fecha (inicio del mes de
+-- facturación). Solo cuentan las respuestas correctas (status < 400).
+CREATE OR REPLACE FUNCTION api_usage_mensual(desde TIMESTAMPTZ)
+RETURNS TABLE (endpoint character varying, unidades BIGINT) AS $$
+    SELECT u.endpoint, COALESCE(SUM(u.units), 0)::BIGINT
+    FROM public.api_usage u
+    WHERE u."timestamp" >= desde
+      AND u.endpoint LIKE 'mapbox/%'
+      AND COALESCE(u.status_code, 0) < 400
+    GROUP BY u.endpoint;
+$$ LANGUAGE sql STABLE;
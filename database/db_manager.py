@@ -15,6 +15,8 @@ Uso:
     python db_manager.py migrate       # Ejecutar migraciones
     python db_manager.py check         # Verificar estado de la DB
     python db_manager.py reset         # Reiniciar base de datos (CUIDADO!)
+    python db_manager.py partitions    # Crear particiones mensuales del historial
+    python db_manager.py retention     # Eliminar particiones vencidas del historial
 
 Autor: PrediRuta Team
 Fecha: Septiembre 2025
@@ -357,6 +359,40 @@ class PrediRutaDBManager:
             console.print(f"[red]❌ Error creando backup: {e}[/red]")
             return False
 
+    async def create_partitions(self, months_ahead: int = 3) -> bool:
+        """Crea por adelantado las particiones mensuales del historial"""
+        try:
+            console.print(f"[yellow]🗂️  Creando particiones del historial ({months_ahead} meses adelante)...[/yellow]")
+            result = self.supabase.rpc('crear_particiones_historial', {'meses_adelante': months_ahead}).execute()
+            console.print(f"[green]✅ Particiones creadas: {result.data}[/green]")
+            return True
+        except Exception as e:
+            console.print(f"[red]❌ Error creando particiones: {e}[/red]")
+            console.print("[dim]Aplica primero database/historial_particiones.sql en Supabase[/dim]")
+            return False
+    
+    async def apply_retention(self, days: int = 90) -> bool:
+        """Desacopla y elimina las particiones del historial más antiguas que `days`"""
+        try:
+            console.print(f"[yellow]🧹 Aplicando retención del historial ({days} días)...[/yellow]")
+            result = self.supabase.rpc('aplicar_retencion_historial', {'dias_antiguedad': days}).execute()
+            
+            if not result.data:
+                console.print("[green]✅ No hay particiones vencidas[/green]")
+                return True
+            
+            table = Table(title="Particiones eliminadas")
+            table.add_column("Partición", style="cyan")
+            table.add_column("Filas", style="magenta")
+            for row in result.data:
+                table.add_row(row['particion'], str(row['filas']))
+            console.print(table)
+            return True
+        except Exception as e:
+            console.print(f"[red]❌ Error aplicando retención: {e}[/red]")
+            console.print("[dim]Aplica primero database/historial_particiones.sql en Supabase[/dim]")
+            return False
+
 
 async def main():
     """Función principal del script"""
@@ -370,12 +406,14 @@ Ejemplos de uso:
   python db_manager.py check     # Verificar estado
   python db_manager.py backup    # Crear backup
   python db_manager.py reset     # Reiniciar DB (¡CUIDADO!)
+  python db_manager.py partitions --months 3   # Particiones del historial
+  python db_manager.py retention --days 90     # Retención del historial
         """
     )
     
     parser.add_argument(
         'action',
-        choices=['init', 'seed', 'check', 'reset', 'backup', 'migrate'],
+        choices=['init', 'seed', 'check', 'reset', 'backup', 'migrate', 'partitions', 'retention'],
         help='Acción a realizar'
     )
     
@@ -385,6 +423,20 @@ Ejemplos de uso:
         help='Forzar operación sin confirmación'
     )
     
+    parser.add_argument(
+        '--months',
+        type=int,
+        default=3,
+        help='Meses a crear por adelantado (partitions)'
+    )
+    
+    parser.add_argument(
+        '--days',
+        type=int,
+        default=90,
+        help='Días de historial a conservar (retention)'
+    )
+    
     args = parser.parse_args()
     
     # Mostrar banner
@@ -410,6 +462,12 @@ Ejemplos de uso:
     elif args.action == 'reset':
         await db_manager.reset_database()
         
+    elif args.action == 'partitions':
+        await db_manager.create_partitions(args.months)
+        
+    elif args.action == 'retention':
+        await db_manager.apply_retention(args.days)
+        
     elif args.action == 'migrate':
         console.print("[yellow]🔄 Función de migraciones en desarrollo...[/yellow]")
         
@@ -0,0 +1,207 @@
+-- =====================================================
+-- Estadísticas de historial por usuario (tabla mantenida)
+-- =====================================================
+-- Reemplaza la vista estadisticas_historial_usuario, que unía
+-- historial_rutas con historial_predicciones por user_id: el JOIN
+-- multiplicaba filas (rutas × predicciones) y se recalculaba en cada
+-- lectura. Ahora los totales viven en una fila por usuario que actualizan
+-- triggers por sentencia sobre ambas tablas, así que leerla cuesta lo
+-- mismo sin importar el tamaño del historial.
+--
+-- Aplicar después de historial_schema.sql. Es idempotente: al final
+-- recalcula todas las filas desde las tablas de historial.
+
+DROP VIEW IF EXISTS estadisticas_historial_usuario;
+
+CREATE TABLE IF NOT EXISTS estadisticas_historial_usuario (
+    user_id UUID PRIMARY KEY REFERENCES auth.users(id) ON DELETE CASCADE,
+    total_rutas_consultadas BIGINT NOT NULL DEFAULT 0,
+    kilometros_totales DECIMAL(14, 2) NOT NULL DEFAULT 0,
+    minutos_ahorrados_totales BIGINT NOT NULL DEFAULT 0,
+    total_predicciones_consultadas BIGINT NOT NULL DEFAULT 0,
+    suma_precision_predicciones BIGINT NOT NULL DEFAULT 0,
+    precision_promedio_predicciones DECIMAL(5, 2) GENERATED ALWAYS AS (
+        CASE WHEN total_predicciones_consultadas > 0
+             THEN suma_precision_predicciones::DECIMAL / total_predicciones_consultadas
+        END
+    ) STORED,
+    updated_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT NOW()
+);
+
+-- =====================================================
+-- Triggers incrementales (por sentencia, con tablas de transición)
+-- =====================================================
+-- Un DELETE masivo (p. ej. limpiar_historial_antiguo) aplica un solo
+-- UPDATE agregado por usuario en lugar de uno por fila.
+
+CREATE OR REPLACE FUNCTION estadisticas_historial_rutas_trigger()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP IN ('DELETE', 'UPDATE') THEN
+        UPDATE estadisticas_historial_usuario e
+        SET total_rutas_consultadas = e.total_rutas_consultadas - d.rutas,
+            kilometros_totales = e.kilometros_totales - d.km,
+            minutos_ahorrados_totales = e.minutos_ahorrados_totales - d.minutos,
+            updated_at = NOW()
+        FROM (
+            SELECT user_id, COUNT(*) AS rutas, SUM(distancia) AS km, SUM(tiempo_ahorrado) AS minutos
+            FROM filas_anteriores
+            GROUP BY user_id
+        ) d
+        WHERE e.user_id = d.user_id;
+    END IF;
+
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        INSERT INTO estadisticas_historial_usuario AS e
+            (user_id, total_rutas_consultadas, kilometros_totales, minutos_ahorrados_totales)
+        SELECT user_id, COUNT(*), SUM(distancia), SUM(tiempo_ahorrado)
+        FROM filas_nuevas
+        GROUP BY user_id
+        ON CONFLICT (user_id) DO UPDATE
+        SET total_rutas_consultadas = e.total_rutas_consultadas + EXCLUDED.total_rutas_consultadas,
+            kilometros_totales = e.kilometros_totales + EXCLUDED.kilometros_totales,
+            minutos_ahorrados_totales = e.minutos_ahorrados_totales + EXCLUDED.minutos_ahorrados_totales,
+            updated_at = NOW();
+    END IF;
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER;
+
+CREATE OR REPLACE FUNCTION estadisticas_historial_predicciones_trigger()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP IN ('DELETE', 'UPDATE') THEN
+        UPDATE estadisticas_historial_usuario e
+        SET total_predicciones_consultadas = e.total_predicciones_consultadas - d.predicciones,
+            suma_precision_predicciones = e.suma_precision_predicciones - d.suma_precision,
+            updated_at = NOW()
+        FROM (
+            SELECT user_id, COUNT(*) AS predicciones, SUM(precision_real) AS suma_precision
+            FROM filas_anteriores
+            GROUP BY user_id
+        ) d
+        WHERE e.user_id = d.user_id;
+    END IF;
+
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        INSERT INTO estadisticas_historial_usuario AS e
+            (user_id, total_predicciones_consultadas, suma_precision_predicciones)
+        SELECT user_id, COUNT(*), SUM(precision_real)
+        FROM filas_nuevas
+        GROUP BY user_id
+        ON CONFLICT (user_id) DO UPDATE
+        SET total_predicciones_consultadas = e.total_predicciones_consultadas + EXCLUDED.total_predicciones_consultadas,
+            suma_precision_predicciones = e.suma_precision_predicciones + EXCLUDED.suma_precision_predicciones,
+            updated_at = NOW();
+    END IF;
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER;
+
+-- PostgreSQL no permite tablas de transición en triggers de varios eventos
+DROP TRIGGER IF EXISTS estadisticas_rutas_insert ON historial_rutas;
+CREATE TRIGGER estadisticas_rutas_insert
+    AFTER INSERT ON historial_rutas
+    REFERENCING NEW TABLE AS filas_nuevas
+    FOR EACH STATEMENT EXECUTE FUNCTION estadisticas_historial_rutas_trigger();
+
+DROP TRIGGER IF EXISTS estadisticas_rutas_update ON historial_rutas;
+CREATE TRIGGER estadisticas_rutas_update
+    AFTER UPDATE ON historial_rutas
+    REFERENCING OLD TABLE AS filas_anteriores NEW TABLE AS filas_nuevas
+    FOR EACH STATEMENT EXECUTE FUNCTION estadisticas_historial_rutas_trigger();
+
+DROP TRIGGER IF EXISTS estadisticas_rutas_delete ON historial_rutas;
+CREATE TRIGGER estadisticas_rutas_delete
+    AFTER DELETE ON historial_rutas
+    REFERENCING OLD TABLE AS filas_anteriores
+    FOR EACH STATEMENT EXECUTE FUNCTION estadisticas_historial_rutas_trigger();
+
+DROP TRIGGER IF EXISTS estadisticas_predicciones_insert ON historial_predicciones;
+CREATE TRIGGER estadisticas_predicciones_insert
+    AFTER INSERT ON historial_predicciones
+    REFERENCING NEW TABLE AS filas_nuevas
+    FOR EACH STATEMENT EXECUTE FUNCTION estadisticas_historial_predicciones_trigger();
+
+DROP TRIGGER IF EXISTS estadisticas_predicciones_update ON historial_predicciones;
+CREATE TRIGGER estadisticas_predicciones_update
+    AFTER UPDATE ON historial_predicciones
+    REFERENCING OLD TABLE AS filas_anteriores NEW TABLE AS filas_nuevas
+    FOR EACH STATEMENT EXECUTE FUNCTION estadisticas_historial_predicciones_trigger();
+
+DROP TRIGGER IF EXISTS estadisticas_predicciones_delete ON historial_predicciones;
+CREATE TRIGGER estadisticas_predicciones_delete
+    AFTER DELETE ON historial_predicciones
+    REFERENCING OLD TABLE AS filas_anteriores
+    FOR EACH STATEMENT EXECUTE FUNCTION estadisticas_historial_predicciones_trigger();
+
+-- =====================================================
+-- Recalculo completo (backfill y reparación)
+-- =====================================================
+
+CREATE OR REPLACE FUNCTION recalcular_estadisticas_historial(p_user_id UUID DEFAULT NULL)
+RETURNS INTEGER AS $$
+DECLARE
+    filas INTEGER;
+BEGIN
+    -- Bloquea escrituras concurrentes para no perder deltas de los triggers
+    LOCK TABLE historial_rutas, historial_predicciones IN SHARE ROW EXCLUSIVE MODE;
+
+    DELETE FROM estadisticas_historial_usuario
+    WHERE p_user_id IS NULL OR user_id = p_user_id;
+
+    INSERT INTO estadisticas_historial_usuario (
+        user_id, total_rutas_consultadas, kilometros_totales, minutos_ahorrados_totales,
+        total_predicciones_consultadas, suma_precision_predicciones
+    )
+    SELECT
+        u.user_id,
+        COALESCE(r.rutas, 0),
+        COALESCE(r.km, 0),
+        COALESCE(r.minutos, 0),
+        COALESCE(p.predicciones, 0),
+        COALESCE(p.suma_precision, 0)
+    FROM (
+        SELECT user_id FROM historial_rutas WHERE p_user_id IS NULL OR user_id = p_user_id
+        UNION
+        SELECT user_id FROM historial_predicciones WHERE p_user_id IS NULL OR user_id = p_user_id
+    ) u
+    -- Cada tabla se agrega por separado: no hay producto rutas × predicciones
+    LEFT JOIN (
+        SELECT user_id, COUNT(*) AS rutas, SUM(distancia) AS km, SUM(tiempo_ahorrado) AS minutos
+        FROM historial_rutas
+        WHERE p_user_id IS NULL OR user_id = p_user_id
+        GROUP BY user_id
+    ) r ON r.user_id = u.user_id
+    LEFT JOIN (
+        SELECT user_id, COUNT(*) AS predicciones, SUM(precision_real) AS suma_precision
+        FROM historial_predicciones
+        WHERE p_user_id IS NULL OR user_id = p_user_id
+        GROUP BY user_id
+    ) p ON p.user_id = u.user_id;
+
+    GET DIAGNOSTICS filas = ROW_COUNT;
+    RETURN filas;
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER;
+
+-- =====================================================
+-- Seguridad
+-- =====================================================
+
+ALTER TABLE estadisticas_historial_usuario ENABLE ROW LEVEL SECURITY;
+
+DROP POLICY IF EXISTS "Users can view their own history stats" ON estadisticas_historial_usuario;
+CREATE POLICY "Users can view their own history stats"
+    ON estadisticas_historial_usuario
+    FOR SELECT
+    USING (auth.uid() = user_id);
+
+COMMENT ON TABLE estadisticas_historial_usuario IS 'Estadísticas agregadas del historial por usuario, mantenidas por triggers';
+COMMENT ON COLUMN estadisticas_historial_usuario.suma_precision_predicciones IS 'Suma de precision_real; el promedio se deriva de ella';
+COMMENT ON FUNCTION recalcular_estadisticas_historial IS 'Recalcula las estadísticas de un usuario (o de todos) desde las tablas de historial';
+
+-- Backfill inicial
+SELECT recalcular_estadisticas_historial();
@@ -0,0 +1,349 @@
+-- =====================================================
+-- Particionado mensual y retención del historial
+-- =====================================================
+-- Convierte historial_rutas e historial_predicciones en tablas
+-- particionadas por rango mensual sobre `fecha`. La retención deja de
+-- borrar fila por fila: las particiones completas más antiguas que el
+-- período de retención se desacoplan (DETACH) y se eliminan (DROP), sin
+-- generar tuplas muertas ni bloqueos largos sobre las filas vigentes.
+--
+-- Particiones: <tabla>_pAAAAMM, más una partición DEFAULT para filas fuera
+-- de rango. `python database/db_manager.py partitions` crea los meses
+-- siguientes por adelantado y `python database/db_manager.py retention`
+-- aplica la retención. Si la DEFAULT ya recibió filas de un mes, al crear
+-- su partición esas filas se trasladan a ella; la retención también borra
+-- de la DEFAULT las filas más antiguas que el período de retención.
+--
+-- Aplicar después de historial_schema.sql e historial_estadisticas.sql.
+-- Es idempotente: si las tablas ya están particionadas no las toca.
+
+-- =====================================================
+-- Funciones de mantenimiento
+-- =====================================================
+
+CREATE OR REPLACE FUNCTION crear_particiones_historial(
+    meses_adelante INTEGER DEFAULT 3,
+    desde DATE DEFAULT NULL
+)
+RETURNS INTEGER AS $$
+DECLARE
+    tabla TEXT;
+    mes DATE;
+    siguiente DATE;
+    particion TEXT;
+    por_defecto TEXT;
+    en_defecto BOOLEAN;
+    creadas INTEGER := 0;
+BEGIN
+    FOREACH tabla IN ARRAY ARRAY['historial_rutas', 'historial_predicciones'] LOOP
+        por_defecto := tabla || '_default';
+        mes := date_trunc('month', COALESCE(desde, CURRENT_DATE))::DATE;
+        WHILE mes <= (date_trunc('month', CURRENT_DATE) + make_interval(months => meses_adelante))::DATE LOOP
+            particion := format('%s_p%s', tabla, to_char(mes, 'YYYYMM'));
+            siguiente := (mes + INTERVAL '1 month')::DATE;
+            IF to_regclass(particion) IS NULL THEN
+                en_defecto := FALSE;
+                IF to_regclass(por_defecto) IS NOT NULL THEN
+                    EXECUTE format(
+                        'SELECT EXISTS (SELECT 1 FROM %I WHERE fecha >= %L AND fecha < %L)',
+                        por_defecto, mes, siguiente
+                    ) INTO en_defecto;
+                END IF;
+
+                IF en_defecto THEN
+                    -- CREATE ... PARTITION OF fallaría: la DEFAULT ya tiene filas del
+                    -- mes. Se trasladan a una tabla nueva que luego se adjunta. Se
+                    -- opera sobre las particiones (no la raíz), así que los
+                    -- triggers de estadísticas no cuentan estas filas dos veces.
+                    EXECUTE format(
+                        'CREATE TABLE %I (LIKE %I INCLUDING DEFAULTS INCLUDING CONSTRAINTS)',
+                        particion, tabla
+                    );
+                    EXECUTE format(
+                        'WITH movidas AS (DELETE FROM %I WHERE fecha >= %L AND fecha < %L RETURNING *)
+                         INSERT INTO %I SELECT * FROM movidas',
+                        por_defecto, mes, siguiente, particion
+                    );
+                    EXECUTE format(
+                        'ALTER TABLE %I ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)',
+                        tabla, particion, mes, siguiente
+                    );
+                ELSE
+                    EXECUTE format(
+                        'CREATE TABLE %I PARTITION OF %I FOR VALUES FROM (%L) TO (%L)',
+                        particion, tabla, mes, siguiente
+                    );
+                END IF;
+                creadas := creadas + 1;
+            END IF;
+            mes := siguiente;
+        END LOOP;
+    END LOOP;
+    RETURN creadas;
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER;
+
+CREATE OR REPLACE FUNCTION aplicar_retencion_historial(dias_antiguedad INTEGER DEFAULT 90)
+RETURNS TABLE (particion TEXT, filas BIGINT) AS $$
+DECLARE
+    tabla TEXT;
+    hijo TEXT;
+    fin DATE;
+    limite DATE := (CURRENT_DATE - dias_antiguedad);
+BEGIN
+    FOREACH tabla IN ARRAY ARRAY['historial_rutas', 'historial_predicciones'] LOOP
+        FOR hijo IN
+            SELECT c.relname
+            FROM pg_inherits i
+            JOIN pg_class c ON c.oid = i.inhrelid
+            JOIN pg_class p ON p.oid = i.inhparent
+            WHERE p.relname = tabla
+              AND c.relname ~ ('^' || tabla || '_p[0-9]{6}$')
+            ORDER BY c.relname
+        LOOP
+            fin := (to_date(right(hijo, 6), 'YYYYMM') + INTERVAL '1 month')::DATE;
+            -- Solo particiones cuyo mes completo quedó fuera de la retención
+            CONTINUE WHEN fin > limite;
+
+            EXECUTE format('ALTER TABLE %I DETACH PARTITION %I', tabla, hijo);
+
+            -- DROP no dispara los triggers de DELETE: se descuentan las
+            -- estadísticas con un único agregado sobre la partición desacoplada
+            IF tabla = 'historial_rutas' THEN
+                EXECUTE format(
+                    'UPDATE estadisticas_historial_usuario e
+                     SET total_rutas_consultadas = e.total_rutas_consultadas - d.rutas,
+                         kilometros_totales = e.kilometros_totales - d.km,
+                         minutos_ahorrados_totales = e.minutos_ahorrados_totales - d.minutos,
+                         updated_at = NOW()
+                     FROM (SELECT user_id, COUNT(*) AS rutas, SUM(distancia) AS km,
+                                  SUM(tiempo_ahorrado) AS minutos
+                           FROM %I GROUP BY user_id) d
+                     WHERE e.user_id = d.user_id', hijo);
+            ELSE
+                EXECUTE format(
+                    'UPDATE estadisticas_historial_usuario e
+                     SET total_predicciones_consultadas = e.total_predicciones_consultadas - d.predicciones,
+                         suma_precision_predicciones = e.suma_precision_predicciones - d.suma_precision,
+                         updated_at = NOW()
+                     FROM (SELECT user_id, COUNT(*) AS predicciones,
+                                  SUM(precision_real) AS suma_precision
+                           FROM %I GROUP BY user_id) d
+                     WHERE e.user_id = d.user_id', hijo);
+            END IF;
+
+            EXECUTE format('SELECT COUNT(*) FROM %I', hijo) INTO filas;
+            EXECUTE format('DROP TABLE %I', hijo);
+            particion := hijo;
+            RETURN NEXT;
+        END LOOP;
+
+        -- Filas antiguas que cayeron en la DEFAULT (meses sin partición): se
+        -- borran a través de la raíz para que los triggers descuenten las
+        -- estadísticas; la DEFAULT debería tener pocas filas
+        hijo := tabla || '_default';
+        IF to_regclass(hijo) IS NOT NULL THEN
+            EXECUTE format(
+                'DELETE FROM %I WHERE tableoid = %L::regclass AND fecha < %L',
+                tabla, hijo, limite
+            );
+            GET DIAGNOSTICS filas = ROW_COUNT;
+            IF filas > 0 THEN
+                particion := hijo;
+                RETURN NEXT;
+            END IF;
+        END IF;
+    END LOOP;
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER;
+
+-- Compatibilidad: misma firma que la versión con DELETE fila por fila
+CREATE OR REPLACE FUNCTION limpiar_historial_antiguo(dias_antiguedad INTEGER DEFAULT 90)
+RETURNS INTEGER AS $$
+    SELECT COALESCE(SUM(filas), 0)::INTEGER FROM aplicar_retencion_historial(dias_antiguedad);
+$$ LANGUAGE sql SECURITY DEFINER;
+
+COMMENT ON FUNCTION crear_particiones_historial IS 'Crea las particiones mensuales del historial desde `desde` (mes actual por defecto) hasta meses_adelante, trasladando las filas del mes que estén en la DEFAULT';
+COMMENT ON FUNCTION aplicar_retencion_historial IS 'Desacopla y elimina las particiones del historial cuyo mes completo es más antiguo que dias_antiguedad, y borra de la DEFAULT las filas anteriores al límite';
+COMMENT ON FUNCTION limpiar_historial_antiguo IS 'Retención del historial por particiones; retorna las filas eliminadas';
+
+-- =====================================================
+-- Conversión de las tablas existentes
+-- =====================================================
+
+DO $$
+DECLARE
+    primer_mes DATE;
+BEGIN
+    IF EXISTS (
+        SELECT 1 FROM pg_partitioned_table pt
+        JOIN pg_class c ON c.oid = pt.partrelid
+        WHERE c.relname = 'historial_rutas'
+    ) THEN
+        RAISE NOTICE 'El historial ya está particionado';
+        RETURN;
+    END IF;
+
+    -- Las tablas actuales pasan a *_legacy con sus índices renombrados
+    ALTER TABLE historial_rutas RENAME TO historial_rutas_legacy;
+    ALTER INDEX historial_rutas_pkey RENAME TO historial_rutas_legacy_pkey;
+    ALTER TABLE historial_predicciones RENAME TO historial_predicciones_legacy;
+    ALTER INDEX historial_predicciones_pkey RENAME TO historial_predicciones_legacy_pkey;
+    DROP INDEX IF EXISTS idx_historial_rutas_user_id;
+    DROP INDEX IF EXISTS idx_historial_rutas_fecha;
+    DROP INDEX IF EXISTS idx_historial_rutas_user_fecha;
+    DROP INDEX IF EXISTS idx_historial_predicciones_user_id;
+    DROP INDEX IF EXISTS idx_historial_predicciones_fecha;
+    DROP INDEX IF EXISTS idx_historial_predicciones_user_fecha;
+
+    -- La clave primaria de una tabla particionada debe incluir la columna de partición
+    CREATE TABLE historial_rutas (
+        id TEXT NOT NULL,
+        user_id UUID NOT NULL REFERENCES auth.users(id) ON DELETE CASCADE,
+        fecha TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT NOW(),
+        origen TEXT NOT NULL,
+        destino TEXT NOT NULL,
+        distancia DECIMAL(10, 2) NOT NULL,
+        duracion INTEGER NOT NULL,
+        tiempo_ahorrado INTEGER NOT NULL,
+        trafico TEXT CHECK (trafico IN ('fluido', 'moderado', 'congestionado')),
+        coordenadas_origen JSONB,
+        coordenadas_destino JSONB,
+        created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+        updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+        PRIMARY KEY (id, fecha)
+    ) PARTITION BY RANGE (fecha);
+
+    CREATE TABLE historial_predicciones (
+        id TEXT NOT NULL,
+        user_id UUID NOT NULL REFERENCES auth.users(id) ON DELETE CASCADE,
+        fecha DATE NOT NULL,
+        zona TEXT NOT NULL,
+        hora_consulta TEXT NOT NULL,
+        precision_real INTEGER NOT NULL CHECK (precision_real >= 0 AND precision_real <= 100),
+        congestion_predicha DECIMAL(3, 2) NOT NULL CHECK (congestion_predicha >= 0 AND congestion_predicha <= 1),
+        created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+        updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+        PRIMARY KEY (id, fecha)
+    ) PARTITION BY RANGE (fecha);
+
+    CREATE TABLE historial_rutas_default PARTITION OF historial_rutas DEFAULT;
+    CREATE TABLE historial_predicciones_default PARTITION OF historial_predicciones DEFAULT;
+
+    -- Particiones desde el mes más antiguo con datos hasta tres meses adelante
+    SELECT LEAST(
+        (SELECT MIN(fecha)::DATE FROM historial_rutas_legacy),
+        (SELECT MIN(fecha) FROM historial_predicciones_legacy)
+    ) INTO primer_mes;
+    PERFORM crear_particiones_historial(3, primer_mes);
+
+    -- Las estadísticas ya incluyen estas filas: los triggers se crean después de copiar
+    INSERT INTO historial_rutas SELECT
+        id, user_id, fecha, origen, destino, distancia, duracion, tiempo_ahorrado,
+        trafico, coordenadas_origen, coordenadas_destino, created_at, updated_at
+    FROM historial_rutas_legacy;
+    INSERT INTO historial_predicciones SELECT
+        id, user_id, fecha, zona, hora_consulta, precision_real, congestion_predicha,
+        created_at, updated_at
+    FROM historial_predicciones_legacy;
+
+    DROP TABLE historial_rutas_legacy;
+    DROP TABLE historial_predicciones_legacy;
+END;
+$$;
+
+-- =====================================================
+-- Índices, triggers y seguridad sobre las tablas particionadas
+-- =====================================================
+
+CREATE INDEX IF NOT EXISTS idx_historial_rutas_user_fecha ON historial_rutas(user_id, fecha DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_historial_rutas_fecha ON historial_rutas(fecha DESC);
+CREATE INDEX IF NOT EXISTS idx_historial_predicciones_user_fecha ON historial_predicciones(user_id, fecha DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_historial_predicciones_fecha ON historial_predicciones(fecha DESC);
+
+DROP TRIGGER IF EXISTS update_historial_rutas_updated_at ON historial_rutas;
+CREATE TRIGGER update_historial_rutas_updated_at
+    BEFORE UPDATE ON historial_rutas
+    FOR EACH ROW
+    EXECUTE FUNCTION update_updated_at_column();
+
+DROP TRIGGER IF EXISTS update_historial_predicciones_updated_at ON historial_predicciones;
+CREATE TRIGGER update_historial_predicciones_updated_at
+    BEFORE UPDATE ON historial_predicciones
+    FOR EACH ROW
+    EXECUTE FUNCTION update_updated_at_column();
+
+-- Triggers de estadísticas (historial_estadisticas.sql) sobre las tablas raíz
+DROP TRIGGER IF EXISTS estadisticas_rutas_insert ON historial_rutas;
+CREATE TRIGGER estadisticas_rutas_insert
+    AFTER INSERT ON historial_rutas
+    REFERENCING NEW TABLE AS filas_nuevas
+    FOR EACH STATEMENT EXECUTE FUNCTION estadisticas_historial_rutas_trigger();
+
+DROP TRIGGER IF EXISTS estadisticas_rutas_update ON historial_rutas;
+CREATE TRIGGER estadisticas_rutas_update
+    AFTER UPDATE ON historial_rutas
+    REFERENCING OLD TABLE AS filas_anteriores NEW TABLE AS filas_nuevas
+    FOR EACH STATEMENT EXECUTE FUNCTION estadisticas_historial_rutas_trigger();
+
+DROP TRIGGER IF EXISTS estadisticas_rutas_delete ON historial_rutas;
+CREATE TRIGGER estadisticas_rutas_delete
+    AFTER DELETE ON historial_rutas
+    REFERENCING OLD TABLE AS filas_anteriores
+    FOR EACH STATEMENT EXECUTE FUNCTION estadisticas_historial_rutas_trigger();
+
+DROP TRIGGER IF EXISTS estadisticas_predicciones_insert ON historial_predicciones;
+CREATE TRIGGER estadisticas_predicciones_insert
+    AFTER INSERT ON historial_predicciones
+    REFERENCING NEW TABLE AS filas_nuevas
+    FOR EACH STATEMENT EXECUTE FUNCTION estadisticas_historial_predicciones_trigger();
+
+DROP TRIGGER IF EXISTS estadisticas_predicciones_update ON historial_predicciones;
+CREATE TRIGGER estadisticas_predicciones_update
+    AFTER UPDATE ON historial_predicciones
+    REFERENCING OLD TABLE AS filas_anteriores NEW TABLE AS filas_nuevas
+    FOR EACH STATEMENT EXECUTE FUNCTION estadisticas_historial_predicciones_trigger();
+
+DROP TRIGGER IF EXISTS estadisticas_predicciones_delete ON historial_predicciones;
+CREATE TRIGGER estadisticas_predicciones_delete
+    AFTER DELETE ON historial_predicciones
+    REFERENCING OLD TABLE AS filas_anteriores
+    FOR EACH STATEMENT EXECUTE FUNCTION estadisticas_historial_predicciones_trigger();
+
+ALTER TABLE historial_rutas ENABLE ROW LEVEL SECURITY;
+ALTER TABLE historial_predicciones ENABLE ROW LEVEL SECURITY;
+
+DROP POLICY IF EXISTS "Users can view their own route history" ON historial_rutas;
+CREATE POLICY "Users can view their own route history"
+    ON historial_rutas FOR SELECT USING (auth.uid() = user_id);
+
+DROP POLICY IF EXISTS "Users can insert their own route history" ON historial_rutas;
+CREATE POLICY "Users can insert their own route history"
+    ON historial_rutas FOR INSERT WITH CHECK (auth.uid() = user_id);
+
+DROP POLICY IF EXISTS "Users can delete their own route history" ON historial_rutas;
+CREATE POLICY "Users can delete their own route history"
+    ON historial_rutas FOR DELETE USING (auth.uid() = user_id);
+
+DROP POLICY IF EXISTS "Users can update their own route history" ON historial_rutas;
+CREATE POLICY "Users can update their own route history"
+    ON historial_rutas FOR UPDATE USING (auth.uid() = user_id) WITH CHECK (auth.uid() = user_id);
+
+DROP POLICY IF EXISTS "Users can view their own prediction history" ON historial_predicciones;
+CREATE POLICY "Users can view their own prediction history"
+    ON historial_predicciones FOR SELECT USING (auth.uid() = user_id);
+
+DROP POLICY IF EXISTS "Users can insert their own prediction history" ON historial_predicciones;
+CREATE POLICY "Users can insert their own prediction history"
+    ON historial_predicciones FOR INSERT WITH CHECK (auth.uid() = user_id);
+
+DROP POLICY IF EXISTS "Users can delete their own prediction history" ON historial_predicciones;
+CREATE POLICY "Users can delete their own prediction history"
+    ON historial_predicciones FOR DELETE USING (auth.uid() = user_id);
+
+DROP POLICY IF EXISTS "Users can update their own prediction history" ON historial_predicciones;
+CREATE POLICY "Users can update their own prediction history"
+    ON historial_predicciones FOR UPDATE USING (auth.uid() = user_id) WITH CHECK (auth.uid() = user_id);
+
+COMMENT ON TABLE historial_rutas IS 'Historial de rutas consultadas, particionado por mes de fecha';
+COMMENT ON TABLE historial_predicciones IS 'Historial de predicciones consultadas, particionado por mes de fecha';
@@ -151,27 +151,17 @@ COMMENT ON COLUMN historial_predicciones.precision_real IS 'Precisión real de l
 COMMENT ON COLUMN historial_predicciones.congestion_predicha IS 'Nivel de congestión predicho (0-1)';
 
 -- =====================================================
--- Vista para estadísticas de usuario
+-- Estadísticas de usuario
 -- =====================================================
 
-CREATE OR REPLACE VIEW estadisticas_historial_usuario AS
-SELECT 
-    hr.user_id,
-    COUNT(DISTINCT hr.id) as total_rutas_consultadas,
-    SUM(hr.distancia) as kilometros_totales,
-    SUM(hr.tiempo_ahorrado) as minutos_ahorrados_totales,
-    AVG(hp.precision_real) as precision_promedio_predicciones,
-    COUNT(DISTINCT hp.id) as total_predicciones_consultadas
-FROM historial_rutas hr
-LEFT JOIN historial_predicciones hp ON hr.user_id = hp.user_id
-GROUP BY hr.user_id;
-
-COMMENT ON VIEW estadisticas_historial_usuario IS 'Estadísticas agregadas del historial por usuario';
+-- La tabla estadisticas_historial_usuario (mantenida por triggers) se crea
+-- en historial_estadisticas.sql; aplicarlo después de este script.
 
 -- =====================================================
 -- Función para limpiar historial antiguo (opcional)
 -- =====================================================
 
+-- historial_particiones.sql la reemplaza por retención con particiones mensuales
 CREATE OR REPLACE FUNCTION limpiar_historial_antiguo(dias_antiguedad INTEGER DEFAULT 90)
 RETURNS INTEGER AS $$
 DECLARE
@@ -0,0 +1,35 @@
+-- =====================================================
+-- Precomputación de pronósticos en traffic_predictions
+-- =====================================================
+-- El job `python -m app.services.prediction_jobs precompute` escribe
+-- las próximas 24 horas de pronóstico por ciudad. Cada ejecución hace
+-- UPSERT sobre (ciudad, target_time), por lo que se requiere la columna
+-- ciudad y un índice único sobre esa pareja.
+
+ALTER TABLE public.traffic_predictions
+    ADD COLUMN IF NOT EXISTS ciudad character varying;
+
+-- Clave de UPSERT del job de precomputación
+CREATE UNIQUE INDEX IF NOT EXISTS uq_traffic_predictions_ciudad_target
+    ON public.traffic_predictions (ciudad, target_time);
+
+-- Lectura de la API: pronósticos de una ciudad en una ventana de tiempo
+CREATE INDEX IF NOT EXISTS idx_traffic_predictions_target_time
+    ON public.traffic_predictions (target_time);
+
+-- Limpieza de pronósticos vencidos (las horas ya pasadas no se consultan)
+CREATE OR REPLACE FUNCTION limpiar_predicciones_vencidas(horas_antiguedad INTEGER DEFAULT 48)
+RETURNS INTEGER AS $$
+DECLARE
+    registros_eliminados INTEGER;
+BEGIN
+    DELETE FROM public.traffic_predictions
+    WHERE ciudad IS NOT NULL
+      AND target_time < NOW() - INTERVAL '1 hour' * horas_antiguedad;
+    GET DIAGNOSTICS registros_eliminados = ROW_COUNT;
+    RETURN registros_eliminados;
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER;
+
+COMMENT ON COLUMN public.traffic_predictions.ciudad IS 'Ciudad del pronóstico precomputado (CIUDAD_OPER del dataset)';
+COMMENT ON FUNCTION limpiar_predicciones_vencidas IS 'Elimina pronósticos precomputados cuyo target_time ya pasó';
@@ -0,0 +1,103 @@
+"""
+Configuración común de pytest: backend en sys.path y grafos viales sintéticos
+"""
+import os
+import sys
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent / "backend"
+if str(BACKEND_DIR) not in sys.path:
+    sys.path.insert(0, str(BACKEND_DIR))
+
+# Sin Redis ni Supabase en las pruebas: solo caché local por worker
+os.environ.setdefault("SHARED_CACHE_BACKEND", "none")
+
+
+def _make_grid_graph(side: int = 30, seed: int = 0, spacing: float = 0.01, oneway_frac: float = 0.1):
+    """
+    Cuadrícula side x side cerca de Ecuador con un 10% de vías de un solo
+    sentido y velocidades de 30/50/80 km/h; perfil horario plano
+    """
+    from app.services.road_graph import RoadGraph, haversine_m
+
+    rng = np.random.default_rng(seed)
+    n = side * side
+    jitter = spacing * 0.1
+    lat = (np.repeat(np.arange(side), side) * spacing - 1.0 + rng.normal(0, jitter, n)).astype(np.float32)
+    lon = (np.tile(np.arange(side), side) * spacing - 79.0 + rng.normal(0, jitter, n)).astype(np.float32)
+
+    tails, heads = [], []
+    for r in range(side):
+        for c in range(side):
+            u = r * side + c
+            for v in ([u + 1] if c + 1 < side else []) + ([u + side] if r + 1 < side else []):
+                d = rng.random()
+                if d < oneway_frac / 2:
+                    tails.append(u)
+                    heads.append(v)
+                elif d < oneway_frac:
+                    tails.append(v)
+                    heads.append(u)
+                else:
+                    tails += [u, v]
+                    heads += [v, u]
+    t = np.asarray(tails, dtype=np.int32)
+    h = np.asarray(heads, dtype=np.int32)
+    order = np.argsort(t, kind="stable")
+    t, h = t[order], h[order]
+    m = len(t)
+
+    indptr = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(np.bincount(t, minlength=n), out=indptr[1:])
+    rev = np.argsort(h, kind="stable")
+    rev_indptr = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(np.bincount(h, minlength=n), out=rev_indptr[1:])
+
+    graph = RoadGraph(
+        node_lat=lat,
+        node_lon=lon,
+        indptr=indptr,
+        heads=h,
+        length_m=haversine_m(lat[t], lon[t], lat[h], lon[h]).astype(np.float32),
+        speed_kmh=rng.choice([30, 50, 80], m).astype(np.uint8),
+        road_class=np.zeros(m, np.uint8),
+        toll=np.zeros(m, np.uint8),
+        rev_indptr=rev_indptr,
+        rev_tails=t[rev].astype(np.int32),
+        rev_edges=rev.astype(np.int32),
+        meta={"nodos": n, "aristas": m},
+    )
+    # Perfil plano: sin depender del dataset histórico
+    graph._profiles = np.ones((1, 24), dtype=np.float32)
+    graph._edge_profile = np.zeros(m, dtype=np.int32)
+    return graph
+
+
+def _free_flow_distances(graph, sources):
+    """Tiempos mínimos de flujo libre con scipy (referencia)"""
+    from scipy.sparse import csr_matrix
+    from scipy.sparse.csgraph import dijkstra
+
+    matrix = csr_matrix(
+        (graph.base_time.astype(np.float64), (graph.edge_tails(), graph.heads)),
+        shape=(graph.n_nodes, graph.n_nodes),
+    )
+    return dijkstra(matrix, indices=sources)
+
+
+@pytest.fixture(scope="session")
+def grid_graph():
+    return _make_grid_graph(30)
+
+
+@pytest.fixture(scope="session")
+def free_flow_distances():
+    return _free_flow_distances
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
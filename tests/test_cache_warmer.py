@@ -0,0 +1,124 @@
+"""
+Tests del calentador de caché: frecuencia decaída, semillas, poda,
+selección de candidatas y presupuesto de refrescos
+"""
+import pytest
+
+from app.services import cache_warmer as cw
+from app.services.cache_warmer import CacheWarmer, HotKeyTracker
+from app.services.rate_limiter import BACKGROUND, current_priority
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = _Clock()
+    monkeypatch.setattr(cw.time, "time", clock)
+    return clock
+
+
+def _scores(tracker, namespace="ns"):
+    return {key: score for key, score, _ in tracker.top(namespace, 100, min_score=0.0)}
+
+
+def test_scores_decay_with_half_life(clock):
+    tracker = HotKeyTracker(half_life=100)
+    tracker.track("ns", "k", None)
+    clock.now += 100
+    assert _scores(tracker)["k"] == pytest.approx(0.5)
+
+    tracker.track("ns", "k", ("nuevos", "args"))
+    assert _scores(tracker)["k"] == pytest.approx(1.5)
+    clock.now += 200
+    assert _scores(tracker)["k"] == pytest.approx(0.375)
+    assert tracker.top("ns", 1, min_score=0.0)[0][2] == ("nuevos", "args")
+
+
+def test_seeds_keep_a_floor(clock):
+    tracker = HotKeyTracker(half_life=100)
+    tracker.seed("ns", "semilla", None, score=1.0)
+    tracker.track("ns", "semilla", None, weight=4.0)
+    clock.now += 100
+    assert _scores(tracker)["semilla"] == pytest.approx(2.0)
+    clock.now += 1000
+    assert _scores(tracker)["semilla"] == pytest.approx(1.0)
+    # Bajo el mínimo por defecto solo quedan las semillas
+    tracker.track("ns", "suelta", None)
+    clock.now += 1000
+    assert [key for key, _, _ in tracker.top("ns", 10)] == ["semilla"]
+
+
+def test_prune_keeps_highest_scores(clock):
+    tracker = HotKeyTracker(half_life=1000, max_keys=10)
+    tracker.seed("ns", "semilla", None, score=100.0)
+    for i in range(9):
+        tracker.track("ns", f"k{i}", None, weight=float(i + 1))
+    assert tracker.size("ns") == 10
+
+    tracker.track("ns", "nueva", None, weight=0.1)  # supera max_keys
+    assert set(_scores(tracker)) == {"semilla", "k8", "k7", "k6", "k5"}
+
+
+@pytest.fixture
+def namespace(monkeypatch, clock):
+    """Espacio de nombres simulado con TTL restante por clave y refrescos contados"""
+    tracker = HotKeyTracker(half_life=1e9)  # sin decaimiento apreciable
+    remaining = {}
+    calls = []
+
+    async def refresh(args):
+        calls.append((args, current_priority()))
+        return {"status": "ok"}
+
+    monkeypatch.setattr(cw, "_tracker", tracker)
+    monkeypatch.setattr(cw, "_refreshers", {"ns": cw._Refresher(refresh, remaining.get)})
+    return tracker, remaining, calls
+
+
+def test_candidates_expire_before_next_cycle(namespace):
+    tracker, remaining, _ = namespace
+    ttl = {"sin_cache": None, "expirada": -3.0, "pronto": 5.0, "limite": 15.0, "vigente": 16.0}
+    for weight, (key, value) in enumerate(ttl.items(), start=1):
+        tracker.track("ns", key, key, weight=float(weight))
+        if value is not None:
+            remaining[key] = value
+
+    warmer = CacheWarmer(interval_seconds=10, top_k=10, budget_per_minute=60)
+    keys = [key for _, _, key, _ in warmer._candidates()]
+    # Ordenadas por puntaje; "vigente" expira después de interval * 1.5
+    assert keys == ["limite", "pronto", "expirada", "sin_cache"]
+
+
+@pytest.mark.anyio
+async def test_run_once_never_exceeds_budget(namespace, clock):
+    tracker, _, calls = namespace
+    for i in range(20):
+        tracker.track("ns", f"k{i}", i)
+
+    # 6 por minuto con ciclos de 10 s: 1 ficha inicial y 1 por ciclo
+    warmer = CacheWarmer(interval_seconds=10, top_k=50, budget_per_minute=6)
+    first = await warmer.run_once()
+    assert (first["candidatas"], first["refrescadas"], first["sin_presupuesto"]) == (20, 1, 19)
+
+    total = first["refrescadas"]
+    for _ in range(5):
+        clock.now += 10
+        run = await warmer.run_once()
+        assert run["refrescadas"] + run["sin_presupuesto"] == run["candidatas"]
+        assert run["refrescadas"] <= 1
+        total += run["refrescadas"]
+    assert total == len(calls) <= 1 + 6 * 50 / 60
+
+    # Tras una pausa larga se acumula como máximo un minuto de presupuesto
+    clock.now += 3600
+    run = await warmer.run_once()
+    assert run["refrescadas"] == 6
+    assert all(priority == BACKGROUND for _, priority in calls)
+    assert warmer.stats()["omitidas_por_presupuesto"] == sum([19, 19, 19, 19, 19, 19, 14])
@@ -0,0 +1,184 @@
+"""
+Tests del cortocircuito: transiciones cerrado / abierto / semiabierto y
+respuesta histórica cuando Mapbox está degradado
+"""
+import pytest
+
+from app.services import circuit_breaker as cb
+from app.services.circuit_breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, CircuitOpenError
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = _Clock()
+    monkeypatch.setattr(cb.time, "time", clock)
+    return clock
+
+
+@pytest.fixture
+def breaker():
+    breaker = CircuitBreaker("test")
+    cb._registry.pop("test", None)  # fuera de las métricas globales
+    return breaker
+
+
+def _fail_until_open(breaker):
+    for _ in range(cb.BREAKER_MIN_CALLS):
+        breaker.allow()
+        breaker.record(0.1, failed=True)
+
+
+def test_opens_when_failure_ratio_reached(clock, breaker):
+    for _ in range(cb.BREAKER_MIN_CALLS - 1):
+        breaker.allow()
+        breaker.record(0.1, failed=True)
+    assert breaker.state == CLOSED  # aún sin el mínimo de llamadas
+
+    breaker.allow()
+    breaker.record(0.1, failed=True)
+    assert breaker.state == OPEN
+    with pytest.raises(CircuitOpenError):
+        breaker.allow()
+    assert breaker.stats()["cortocircuitadas"] == 1
+
+
+def test_slow_calls_count_as_failures(clock, breaker):
+    for _ in range(cb.BREAKER_MIN_CALLS):
+        breaker.allow()
+        breaker.record(cb.BREAKER_SLOW_CALL_SECONDS + 1, failed=False)
+    assert breaker.state == OPEN
+    assert breaker.slow_calls == cb.BREAKER_MIN_CALLS
+
+
+def test_old_failures_leave_the_window(clock, breaker):
+    for _ in range(cb.BREAKER_MIN_CALLS - 1):
+        breaker.record(0.1, failed=True)
+    clock.now += cb.BREAKER_WINDOW_SECONDS + 1
+    breaker.record(0.1, failed=True)
+    assert breaker.state == CLOSED
+
+
+def test_half_open_closes_after_successful_trials(clock, breaker):
+    _fail_until_open(breaker)
+    clock.now += cb.BREAKER_OPEN_SECONDS + 1
+
+    for _ in range(cb.BREAKER_HALF_OPEN_CALLS):
+        breaker.allow()
+    assert breaker.state == HALF_OPEN
+    # Turnos de prueba agotados: el resto sigue cortocircuitado
+    with pytest.raises(CircuitOpenError):
+        breaker.allow()
+
+    for _ in range(cb.BREAKER_HALF_OPEN_CALLS):
+        breaker.record(0.1, failed=False)
+    assert breaker.state == CLOSED
+    assert breaker.stats()["llamadas_ventana"] == 0
+    breaker.allow()
+
+
+def test_half_open_failure_reopens(clock, breaker):
+    _fail_until_open(breaker)
+    clock.now += cb.BREAKER_OPEN_SECONDS + 1
+
+    breaker.allow()
+    breaker.record(0.1, failed=True)
+    assert breaker.state == OPEN
+    assert breaker.opened == 2
+    with pytest.raises(CircuitOpenError):
+        breaker.allow()
+
+
+def test_released_trial_is_returned(clock, breaker):
+    _fail_until_open(breaker)
+    clock.now += cb.BREAKER_OPEN_SECONDS + 1
+
+    for _ in range(cb.BREAKER_HALF_OPEN_CALLS):
+        breaker.allow()
+    breaker.release_trial()
+    breaker.allow()
+
+
+@pytest.mark.anyio
+async def test_degraded_directions_use_historical_route():
+    from app.routes.mapbox import _with_fallback
+
+    coords = [(-79.0, -1.0), (-79.1, -1.1)]
+    upstream = {"status": "error", "code": 503, "message": "circuito abierto"}
+    result = await _with_fallback(upstream, coords, "driving-traffic")
+    assert result["fallback"] is True
+    assert result["upstream_error"] == "circuito abierto"
+    assert result["routes"][0]["duration"] > 0
+
+    # Errores del cliente o perfiles no motorizados no usan la alternativa
+    bad_request = {"status": "error", "code": 422, "message": "coordenadas"}
+    assert await _with_fallback(bad_request, coords, "driving-traffic") is bad_request
+    assert await _with_fallback(upstream, coords, "walking") is upstream
+
+
+@pytest.mark.anyio
+async def test_send_releases_trial_on_unexpected_error(clock, breaker):
+    import httpx
+
+    from app.services import http_client
+
+    def handler(request):
+        raise RuntimeError("fallo inesperado del transporte")
+
+    _fail_until_open(breaker)
+    clock.now += cb.BREAKER_OPEN_SECONDS + 1
+    http_client.set_http_client(http_client.create_http_client(transport=httpx.MockTransport(handler)))
+    try:
+        for _ in range(cb.BREAKER_HALF_OPEN_CALLS + 1):
+            with pytest.raises(RuntimeError):
+                await http_client._send("test", "https://api.test/x", None, breaker)
+    finally:
+        http_client.set_http_client(None)
+
+    # Ningún turno de prueba quedó retenido
+    assert breaker.state == HALF_OPEN
+    for _ in range(cb.BREAKER_HALF_OPEN_CALLS):
+        breaker.allow()
+
+
+@pytest.mark.anyio
+async def test_only_interactive_route_endpoints_hedge(monkeypatch):
+    import httpx
+    from fastapi import FastAPI
+
+    from app.config.mapbox import mapbox_config
+    from app.routes import mapbox as mapbox_routes
+    from app.services import mapbox_directions
+
+    hedges = []
+
+    async def fake_request(service, url, params, hedge=False, **kwargs):
+        hedges.append(hedge)
+        return httpx.Response(503, text="no disponible")
+
+    monkeypatch.setattr(mapbox_config, "access_token", "pk.test")
+    monkeypatch.setattr(mapbox_directions, "mapbox_request", fake_request)
+
+    # Llamadas internas (estado de tráfico, calentador): sin cobertura
+    await mapbox_directions.get_directions([(-79.0, -1.0), (-79.1, -1.1)], refresh=True)
+    await mapbox_directions.get_route_with_traffic((-79.0, -1.0), (-79.2, -1.2), refresh=True)
+    assert hedges == [False, False]
+
+    app = FastAPI()
+    app.include_router(mapbox_routes.router)
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+        directions = await client.post("/api/mapbox/directions", json={"coordinates": [
+            {"longitude": -79.0, "latitude": -1.0}, {"longitude": -79.3, "latitude": -1.3},
+        ]})
+        route = await client.get("/api/mapbox/route", params={
+            "start_lon": -79.0, "start_lat": -1.0, "end_lon": -79.4, "end_lat": -1.4,
+        })
+    assert directions.status_code == route.status_code == 200
+    assert hedges == [False, False, True, True]
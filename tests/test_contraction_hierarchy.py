@@ -0,0 +1,97 @@
+"""
+Tests de la jerarquía de contracción: exactitud frente a scipy y latencia
+
+La prueba de latencia depende del equipo y solo corre con CH_BENCH_TESTS=1;
+para medir en producción usar `python -m app.services.contraction_hierarchy bench`.
+"""
+import os
+
+import numpy as np
+import pytest
+
+from app.services import contraction_hierarchy as chm
+from app.services.routing_engine import ALT_MAX_OVERLAP, ALT_MAX_STRETCH, RoutingEngine
+
+
+@pytest.fixture(scope="module")
+def ch(grid_graph, tmp_path_factory):
+    out = tmp_path_factory.mktemp("ch")
+    chm.build_ch(grid_graph, out, progress_every=0)
+    loaded = chm.load_ch(out, grid_graph)
+    assert loaded is not None
+    return loaded
+
+
+@pytest.fixture(scope="module")
+def pairs(grid_graph):
+    return np.random.default_rng(1).integers(0, grid_graph.n_nodes, size=(300, 2)).tolist()
+
+
+def test_query_matches_scipy(grid_graph, ch, pairs, free_flow_distances):
+    sources = sorted({s for s, _ in pairs})
+    row = {s: i for i, s in enumerate(sources)}
+    expected = free_flow_distances(grid_graph, sources)
+    tails = grid_graph.edge_tails()
+
+    for s, t in pairs:
+        exp = expected[row[s], t]
+        result = ch.query(s, t)
+        if not np.isfinite(exp):
+            assert result is None
+            continue
+        weight, edges = result
+        assert weight == pytest.approx(exp, rel=1e-4)
+        # Camino desempaquetado: contiguo, de s a t y con el mismo peso
+        assert float(grid_graph.base_time[edges].sum()) == pytest.approx(exp, rel=1e-4)
+        if edges:
+            assert tails[edges[0]] == s and grid_graph.heads[edges[-1]] == t
+            assert all(grid_graph.heads[a] == tails[b] for a, b in zip(edges, edges[1:]))
+
+
+def test_alternatives_unpack_only_winners(grid_graph, ch, pairs):
+    for s, t in pairs[:50]:
+        routes = ch.alternatives(s, t, k=3, max_stretch=ALT_MAX_STRETCH, max_overlap=ALT_MAX_OVERLAP)
+        assert 1 <= len(routes) <= 3
+        best = ch.query(s, t)[0]
+        assert routes[0][0] == pytest.approx(best, rel=1e-4)
+        for weight, edges in routes[1:]:
+            assert weight <= best * ALT_MAX_STRETCH + 1e-6
+            assert float(grid_graph.base_time[edges].sum()) == pytest.approx(weight, rel=1e-4)
+
+
+def test_load_rejects_other_graph(grid_graph, tmp_path):
+    chm.build_ch(grid_graph, tmp_path, progress_every=0)
+    meta = (tmp_path / "meta.json").read_text(encoding="utf-8")
+    (tmp_path / "meta.json").write_text(meta.replace('"formato": 2', '"formato": 1'), encoding="utf-8")
+    assert chm.load_ch(tmp_path, grid_graph) is None
+
+
+@pytest.mark.skipif(
+    os.getenv("CH_BENCH_TESTS", "").lower() not in ("1", "true", "yes"),
+    reason="prueba de latencia opcional (CH_BENCH_TESTS=1)",
+)
+def test_query_latency_under_one_millisecond(ch):
+    chm.benchmark(ch, pairs=200, seed=3)  # calentamiento de las adyacencias
+    result = chm.benchmark(ch, pairs=1000, seed=2)
+    assert result["consulta"]["media_ms"] < 1.0
+    assert result["alternativas"]["media_ms"] < 2.0
+
+
+def test_path_eta_matches_per_edge_hours(grid_graph):
+    rng = np.random.default_rng(4)
+    graph = grid_graph
+    engine = RoutingEngine(graph)
+    profiles, edge_profile = graph._profiles, graph._edge_profile
+    try:
+        graph._profiles = rng.uniform(0.4, 1.2, size=(4, 24)).astype(np.float32)
+        graph._edge_profile = rng.integers(0, 4, graph.n_edges).astype(np.int32)
+        for _ in range(100):
+            edges = rng.integers(0, graph.n_edges, rng.integers(0, 600)).tolist()
+            depart = float(rng.uniform(0, 86400))
+            t = 0.0
+            for e in edges:
+                hour = int((depart + t) // 3600) % 24
+                t += float(graph.base_time[e] / graph.profiles[graph.edge_profile[e], hour])
+            assert engine.path_eta(edges, depart) == pytest.approx(t, rel=1e-6)
+    finally:
+        graph._profiles, graph._edge_profile = profiles, edge_profile
@@ -0,0 +1,88 @@
+"""
+Tests del modelo de pronóstico: entrenamiento con datos sintéticos,
+artefacto versionado, puntero a la versión activa y recarga
+"""
+import json
+from datetime import date
+
+import numpy as np
+import pytest
+
+pd = pytest.importorskip("pandas")
+pytest.importorskip("sklearn")
+pytest.importorskip("joblib")
+
+from app.services import forecast_model as fm  # noqa: E402
+
+
+def _synthetic_frame():
+    """Dos ciudades con patrón horario claro y una con pocos registros"""
+    rng = np.random.default_rng(0)
+    rows = []
+    for dia in range(28):
+        fecha = pd.Timestamp("2026-02-01") + pd.Timedelta(days=dia)
+        for hora in range(24):
+            base = {"HORA": hora, "DIA_SEMANA": fecha.weekday(), "MES": fecha.month, "FECHA": fecha}
+            rows.append({**base, "CIUDAD_OPER": "quito ", "VELOCIDAD": 30 + hora + rng.normal(0, 0.5)})
+            rows.append({**base, "CIUDAD_OPER": "GUAYAQUIL", "VELOCIDAD": 60 - hora + rng.normal(0, 0.5)})
+    for hora in range(5):
+        rows.append({"HORA": hora, "DIA_SEMANA": 0, "MES": 2, "FECHA": pd.Timestamp("2026-02-02"),
+                     "CIUDAD_OPER": "LOJA", "VELOCIDAD": 90.0})
+    return pd.DataFrame(rows)
+
+
+@pytest.fixture
+def store(monkeypatch, tmp_path):
+    monkeypatch.setattr(fm, "_training_frame", _synthetic_frame)
+    monkeypatch.setattr(fm, "MODELS_DIR", tmp_path)
+    monkeypatch.setattr(fm, "LATEST_FILE", tmp_path / "traffic_forecast_latest.json")
+    monkeypatch.delenv("FORECAST_MODEL_VERSION", raising=False)
+    fm.reset_forecast_model()
+    yield tmp_path
+    fm.reset_forecast_model()
+
+
+def test_train_save_reload_and_predict(store):
+    assert fm.get_forecast_model() is None
+    fm.reset_forecast_model()
+
+    model = fm.train_model(alpha=0.1, min_samples=100)
+    assert model.cities == [fm.GLOBAL_KEY, "GUAYAQUIL", "QUITO"]
+    assert model.metrics["registros"] == 28 * 24 * 2 + 5
+    assert model.training_range == {"inicio": "2026-02-01", "fin": "2026-02-28"}
+
+    path = fm.save_model(model)
+    assert path == store / f"traffic_forecast_{model.version}.joblib"
+    assert path.exists()
+    latest = json.loads((store / "traffic_forecast_latest.json").read_text(encoding="utf-8"))
+    assert latest == {"version": model.version, "path": path.name}
+
+    loaded = fm.get_forecast_model()
+    assert loaded is not None and loaded is not model
+    assert loaded.version == model.version
+    np.testing.assert_allclose(loaded.coef, model.coef)
+    np.testing.assert_allclose(loaded.intercept, model.intercept)
+
+    fecha = date(2026, 2, 16)
+    quito = loaded.predict_day("Quito", fecha)["velocidades"]
+    guayaquil = loaded.predict_day("guayaquil", fecha)["velocidades"]
+    np.testing.assert_allclose(quito, 30 + np.arange(24), atol=1.5)
+    np.testing.assert_allclose(guayaquil, 60 - np.arange(24), atol=1.5)
+    assert loaded.confidence("QUITO") > 0.5
+
+
+def test_unknown_city_falls_back_to_global(store):
+    model = fm.train_model(alpha=0.1, min_samples=100)
+    fecha = date(2026, 2, 16)
+    global_row = model.predict_day(fm.GLOBAL_KEY, fecha)
+
+    # LOJA no alcanza el mínimo de registros y CUENCA no existe en el dataset
+    for ciudad in ("LOJA", "CUENCA"):
+        assert not model.has_city(ciudad)
+        day = model.predict_day(ciudad, fecha)
+        np.testing.assert_array_equal(day["velocidades"], global_row["velocidades"])
+        assert int(day["registros"][0]) == model.metrics["registros"]
+
+    batch = model.predict(["QUITO", "CUENCA"], [8, 8], [0, 0], [2, 2])
+    assert batch[0] == pytest.approx(38, abs=1.5)
+    assert batch[1] == pytest.approx(float(global_row["velocidades"][8]))
@@ -0,0 +1,77 @@
+"""
+Tests del historial paginado por cursor frente a un recorrido por fuerza bruta
+"""
+import numpy as np
+import pytest
+
+from app.services.history_store import HistoryRollup, InvalidCursor, encode_cursor
+
+
+def _render(r, i):
+    return {
+        "id": int(r.ids[i]),
+        "fecha": r.fecha(i)[:10],
+        "zona": r.ciudades[int(r.city_code[i])],
+        "valor": int(r.columns["valor"][i]),
+    }
+
+
+@pytest.fixture(scope="module")
+def rollup():
+    rng = np.random.default_rng(0)
+    n = 500
+    # Pocas fechas distintas: muchas filas comparten la misma clave de fecha
+    fecha_min = 27_000_000 + rng.integers(0, 40, n) * 60
+    ciudad = rng.choice(["QUITO", "CUENCA", "MANTA"], n)
+    keys = np.array([f"{c}|{i:04d}" for i, c in enumerate(ciudad)])
+    return HistoryRollup.build(
+        fecha_min, keys, ciudad,
+        columns={"valor": np.arange(n)},
+        labels={},
+        render=_render,
+    )
+
+
+def _brute_force(r, ciudad=None):
+    """Todas las filas en orden (fecha DESC, id DESC), filtradas por ciudad"""
+    rows = [
+        (int(r.fecha_min[i]), int(r.ids[i]), i)
+        for i in range(len(r.ids))
+        if ciudad is None or r.ciudades[int(r.city_code[i])] == ciudad
+    ]
+    return [i for _, _, i in sorted(rows, reverse=True)]
+
+
+def _walk(r, limit, ciudad=None):
+    seen, cursor = [], None
+    while True:
+        page = r.page(limit, cursor, ciudad)
+        seen.extend(item["valor"] for item in page["items"])
+        assert len(page["items"]) <= limit
+        if not page["has_more"]:
+            assert page["next_cursor"] is None
+            return seen
+        cursor = page["next_cursor"]
+
+
+@pytest.mark.parametrize("limit", [1, 7, 50, 1000])
+@pytest.mark.parametrize("ciudad", [None, "QUITO", "MANTA"])
+def test_cursor_pages_match_brute_force(rollup, limit, ciudad):
+    expected = [int(rollup.columns["valor"][i]) for i in _brute_force(rollup, ciudad)]
+    assert _walk(rollup, limit, ciudad) == expected
+
+
+def test_items_keep_integer_ids_and_date_only_fecha(rollup):
+    items = rollup.page(5, None, None)["items"]
+    assert all(isinstance(item["id"], int) for item in items)
+    assert all(len(item["fecha"]) == 10 for item in items)
+
+
+def test_unknown_city_is_empty(rollup):
+    assert rollup.page(10, None, "LOJA") == {"items": [], "next_cursor": None, "has_more": False}
+
+
+@pytest.mark.parametrize("cursor", ["no-es-base64!!", encode_cursor("ayer", "1"), encode_cursor("2021-05-01 10:00", "x")])
+def test_invalid_cursor(rollup, cursor):
+    with pytest.raises(InvalidCursor):
+        rollup.page(10, cursor, None)
@@ -0,0 +1,107 @@
+"""
+Tests del geocodificador local: cuándo responde la inversa sin Mapbox e
+índice ligado a la versión del dataset
+"""
+import httpx
+import pytest
+
+from app.config.mapbox import mapbox_config
+from app.services import http_client, local_geocoder
+from app.services.dataset_loader import get_traffic_dataset
+from app.services.mapbox_geocoding import geocode_reverse
+
+pytestmark = pytest.mark.anyio
+
+MANTA = (-80.72, -0.95)
+
+
+@pytest.fixture
+def mapbox_calls(monkeypatch):
+    calls = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        calls.append(request)
+        return httpx.Response(200, json={"features": [{
+            "text": "Av. 4 de Noviembre",
+            "place_name": "Av. 4 de Noviembre, Manta, Manabí, Ecuador",
+            "place_type": ["address"],
+        }]})
+
+    monkeypatch.setattr(mapbox_config, "access_token", "pk.test")
+    http_client.set_http_client(http_client.create_http_client(transport=httpx.MockTransport(handler)))
+    yield calls
+    http_client.set_http_client(None)
+
+
+async def test_reverse_with_place_types_is_local(mapbox_calls):
+    result = await geocode_reverse(*MANTA, types=["place", "locality"])
+    assert result["provider"] == "local"
+    assert result["result"]["name"] == "Manta"
+    assert mapbox_calls == []
+
+
+@pytest.mark.parametrize("types", [None, ["address"], ["place", "poi"]])
+async def test_reverse_other_types_go_to_mapbox(mapbox_calls, types):
+    lon, lat = MANTA
+    # Coordenadas distintas por caso para no acertar en la caché
+    offset = 0.0001 * (len(types or []) + 1)
+    result = await geocode_reverse(lon + offset, lat, types=types)
+    assert result["provider"] == "mapbox"
+    assert len(mapbox_calls) == 1
+
+
+async def test_index_is_built_once_per_dataset_version(monkeypatch):
+    monkeypatch.setattr(local_geocoder, "_geocoder", None)
+    assert local_geocoder.current_local_geocoder() is None  # la consulta no construye
+
+    first = await local_geocoder.get_local_geocoder()
+    assert first is not None
+    assert local_geocoder.current_local_geocoder() is first
+    assert await local_geocoder.get_local_geocoder() is first
+
+    dataset = get_traffic_dataset()
+    monkeypatch.setattr(dataset, "_version", f"{dataset.version}-nueva")
+    assert local_geocoder.current_local_geocoder() is None
+    rebuilt = await local_geocoder.get_local_geocoder()
+    assert rebuilt is not first
+    assert rebuilt.version == dataset.version
+
+
+async def test_cache_stats_do_not_build_the_index(monkeypatch):
+    from app.routes.mapbox import cache_stats_endpoint
+
+    monkeypatch.setattr(local_geocoder, "_geocoder", None)
+    stats = await cache_stats_endpoint()
+    assert stats["geocodificador_local"] is None
+    assert local_geocoder._geocoder is None
+
+
+@pytest.mark.parametrize("contenido", [
+    "nombre,lat,lon\nManta,-0.95,-80.72\n",  # faltan columnas
+    "nombre,latitud,longitud\nManta,-0.95,-80.72\nPortoviejo,s/n,-80.45\n",  # no numérica
+])
+def test_invalid_gazetteer_is_ignored(tmp_path, contenido):
+    path = tmp_path / "gazetteer.csv"
+    path.write_text(contenido, encoding="utf-8")
+    assert local_geocoder._gazetteer_places(str(path)) == []
+
+
+def test_gazetteer_places(tmp_path):
+    path = tmp_path / "gazetteer.csv"
+    path.write_text("Nombre, Latitud ,LONGITUD,tipo,peso\nEl Carmen,-0.27,-79.46,,2\n", encoding="utf-8")
+    [place] = local_geocoder._gazetteer_places(str(path))
+    assert (place.name, place.lat, place.lon) == ("El Carmen", -0.27, -79.46)
+    assert (place.place_type, place.weight, place.source) == ("locality", 2.0, "gazetteer")
+
+
+async def test_broken_index_does_not_stop_startup(monkeypatch):
+    from app.main import app, lifespan
+
+    async def broken():
+        raise RuntimeError("índice corrupto")
+
+    monkeypatch.setattr(local_geocoder, "get_local_geocoder", broken)
+    monkeypatch.delenv("CACHE_WARMER_ENABLED", raising=False)
+    monkeypatch.delenv("PREDICTIONS_SCHEDULER_ENABLED", raising=False)
+    async with lifespan(app):
+        pass
@@ -0,0 +1,99 @@
+"""
+Tests del estimador en línea: decaimiento EWMA, previo histórico,
+horas locales de Ecuador y factor por ciudad
+"""
+from datetime import datetime, timezone
+
+import numpy as np
+import pytest
+
+from app.services import online_estimator as oe
+from app.services.dataset_loader import get_traffic_dataset
+from app.services.online_estimator import OnlineSpeedEstimator
+
+# 13:30 UTC = 08:30 en Guayaquil
+TS_08 = datetime(2026, 3, 10, 13, 30, tzinfo=timezone.utc).timestamp()
+LAT, LON = -0.2205, -78.5005
+CELL = oe._cell(LAT, LON)
+
+
+@pytest.fixture
+def estimator():
+    """Estimador con un previo conocido en lugar del dataset"""
+    profile = np.full(24, 50.0, dtype=np.float32)
+    profile[8] = 40.0
+    est = OnlineSpeedEstimator()
+    est._fine = {CELL: profile}
+    est._coarse = {oe._cell(-2.19, -79.88, oe.COARSE_SIZE_DEG): np.full(24, 35.0, dtype=np.float32)}
+    est._global = np.full(24, 45.0, dtype=np.float32)
+    est._city_cells = {"QUITO": {CELL}}
+    est._prior_ready = True
+    return est
+
+
+def test_prior_without_observations(estimator):
+    est = estimator.estimate(LAT, LON, ts=TS_08)
+    assert (est["speed"], est["prior"], est["observed"]) == (40.0, 40.0, None)
+    assert (est["weight"], est["confidence"], est["age"]) == (0.0, 0.0, None)
+    assert est["freeFlowSpeed"] == 50.0
+
+    # Respaldo a la celda gruesa y luego a la media global por hora
+    assert estimator.estimate(-2.19, -79.88, ts=TS_08)["prior"] == 35.0
+    assert estimator.estimate(-4.0, -79.2, ts=TS_08)["prior"] == 45.0
+
+
+def test_prior_from_dataset_hourly_cube():
+    dataset = get_traffic_dataset()
+    df = dataset._df.dropna(subset=["LATITUD", "LONGITUD", "HORA", "VELOCIDAD"])
+    lat, lon = float(df["LATITUD"].iloc[0]), float(df["LONGITUD"].iloc[0])
+    cube = dataset.get_hourly_cube(oe.CELL_SIZE_DEG)
+
+    est = OnlineSpeedEstimator().estimate(lat, lon, ts=TS_08)
+    assert est["observed"] is None
+    assert est["prior"] == pytest.approx(float(cube[oe._cell(lat, lon)][8]), abs=0.05)
+
+
+def test_ewma_half_life_decay(estimator):
+    start = TS_08 - 1800  # 08:00, para quedar dentro de la misma hora
+    estimator.observe(LAT, LON, 20.0, ts=start)
+    # Una vida media después, la primera observación pesa la mitad
+    estimator.observe(LAT, LON, 40.0, ts=start + oe.HALF_LIFE_SECONDS)
+    value, weight, ts = estimator._state[(CELL, 8)]
+    assert value == pytest.approx((20.0 * 0.5 + 40.0) / 1.5)
+    assert weight == pytest.approx(1.5)
+    assert ts == start + oe.HALF_LIFE_SECONDS
+
+    est = estimator.estimate(LAT, LON, ts=start + 2 * oe.HALF_LIFE_SECONDS)
+    assert est["weight"] == pytest.approx(0.75)
+    assert est["age"] == pytest.approx(oe.HALF_LIFE_SECONDS)
+    prior = 40.0 * estimator._calibration
+    assert est["speed"] == pytest.approx(
+        (prior * oe.PRIOR_WEIGHT + value * 0.75) / (oe.PRIOR_WEIGHT + 0.75), abs=0.05
+    )
+
+
+def test_observations_bucketed_by_local_hour(estimator):
+    # 01:30 UTC = 20:30 del día anterior en Guayaquil
+    ts = datetime(2026, 3, 11, 1, 30, tzinfo=timezone.utc).timestamp()
+    estimator.observe(LAT, LON, 30.0, ts=ts)
+    assert list(estimator._state) == [(CELL, 20)]
+
+    assert estimator.estimate(LAT, LON, ts=ts)["observed"] == 30.0
+    assert estimator.estimate(LAT, LON, ts=TS_08)["observed"] is None
+
+
+def test_city_factor(estimator):
+    assert estimator.city_factor("QUITO", 8, ts=TS_08) is None  # sin observaciones
+    assert estimator.city_factor("CUENCA", 8, ts=TS_08) is None  # ciudad sin celdas
+
+    estimator.observe(LAT, LON, 20.0, ts=TS_08)
+    estimator._calibration = 1.0  # aislar la calibración global
+    factor = estimator.city_factor(" quito ", 8, ts=TS_08)
+    # Razón 20/40 = 0.5 contraída hacia 1.0 con confianza 1 / (PRIOR_WEIGHT + 1)
+    confidence = 1.0 / (oe.PRIOR_WEIGHT + 1.0)
+    assert factor == {
+        "factor": round(1.0 + confidence * (0.5 - 1.0), 3),
+        "confianza": round(confidence, 2),
+        "celdas_observadas": 1,
+    }
+    assert estimator.city_factor("QUITO", 9, ts=TS_08) is None
@@ -0,0 +1,81 @@
+"""
+Tests de la precomputación de pronósticos: horizonte en hora de Ecuador,
+filas generadas y caché de lectura
+"""
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from app.services import prediction_jobs as pj
+from app.services.dataset_loader import get_traffic_dataset
+
+# 01:30 UTC = 20:30 del día anterior en Guayaquil
+AHORA_UTC = datetime(2026, 3, 11, 1, 30, tzinfo=timezone.utc)
+
+
+def test_target_hours_are_local_full_hours():
+    targets = pj._target_hours(4, AHORA_UTC)
+    assert [t.isoformat() for t in targets] == [
+        "2026-03-10T21:00:00-05:00",
+        "2026-03-10T22:00:00-05:00",
+        "2026-03-10T23:00:00-05:00",
+        "2026-03-11T00:00:00-05:00",
+    ]
+
+
+def test_build_forecast_rows_historical(monkeypatch):
+    monkeypatch.setattr(pj, "get_forecast_model", lambda: None)
+    dataset = get_traffic_dataset()
+    hourly = {}
+
+    rows = pj.build_forecast_rows(horizon_hours=3, now=AHORA_UTC)
+
+    ciudades = sorted({str(c).strip().upper() for c in dataset.get_ciudades()})
+    matrix = dataset.get_city_hourly_matrix(ciudades)
+    assert len(rows) == len(ciudades) * 3
+    for i, row in enumerate(rows):
+        ciudad, target = ciudades[i // 3], datetime.fromisoformat(row["target_time"])
+        assert row["ciudad"] == ciudad
+        assert target == AHORA_UTC.astimezone(pj.LOCAL_TZ).replace(minute=0) + timedelta(hours=1 + i % 3)
+        assert row["features_used"] == {"hora": target.hour, "dia_semana": target.weekday(), "mes": target.month}
+        assert row["predicted_speed"] == pytest.approx(float(matrix[i // 3, target.hour]), abs=0.01)
+        assert row["predicted_traffic_level"] == pj._traffic_level_code(row["predicted_speed"])
+        assert row["model_version"] == pj.HISTORICAL_VERSION
+        assert 0.0 <= row["congestion_probability"] <= 1.0
+        hourly.setdefault(ciudad, []).append(target.hour)
+    assert all(hours == [21, 22, 23] for hours in hourly.values())
+
+
+@pytest.mark.parametrize("velocidad, codigo", [(60, 1), (40, 2), (30, 4), (10, 5)])
+def test_traffic_level_codes(velocidad, codigo):
+    assert pj._traffic_level_code(velocidad) == codigo
+    assert codigo in pj.TRAFFIC_LEVEL_CODES.values()
+
+
+@pytest.mark.anyio
+async def test_read_cache_ttl(monkeypatch):
+    calls = []
+    clock = [1_000_000.0]
+
+    def fake_fetch(ciudad):
+        calls.append(ciudad)
+        return [{"target_time": "2026-03-10T21:00:00-05:00"}] if ciudad == "QUITO" else []
+
+    monkeypatch.setattr(pj, "_fetch_city_predictions", fake_fetch)
+    monkeypatch.setattr(pj.time, "time", lambda: clock[0])
+    monkeypatch.setattr(pj, "_read_cache", {})
+
+    first = await pj.get_precomputed_forecast(" quito ")
+    assert first and calls == ["QUITO"]
+    clock[0] += pj.READ_CACHE_TTL - 1
+    assert await pj.get_precomputed_forecast("Quito") is first
+    assert calls == ["QUITO"]
+
+    clock[0] += 2
+    await pj.get_precomputed_forecast("QUITO")
+    assert calls == ["QUITO", "QUITO"]
+
+    # Sin filas: None, también en caché
+    assert await pj.get_precomputed_forecast("LOJA") is None
+    assert await pj.get_precomputed_forecast("LOJA") is None
+    assert calls.count("LOJA") == 1
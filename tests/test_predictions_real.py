@@ -0,0 +1,78 @@
+"""
+Tests del pronóstico por ciudad: la fecha por defecto es la de Ecuador
+aunque el servidor esté en UTC
+"""
+from datetime import date, datetime, timezone
+
+import pytest
+
+from app.routes import predictions_real
+from app.services.prediction_jobs import LOCAL_TZ
+
+pytestmark = pytest.mark.anyio
+
+CIUDAD = "SANTO DOMINGO"
+# 20:00 en Guayaquil = 01:00 UTC del día siguiente
+AHORA = datetime(2026, 3, 10, 20, 15, tzinfo=LOCAL_TZ)
+
+
+class _FrozenDatetime(datetime):
+    @classmethod
+    def now(cls, tz=None):
+        return AHORA.astimezone(tz) if tz is not None else AHORA.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+class _UTCHostDate(date):
+    @classmethod
+    def today(cls):
+        return AHORA.astimezone(timezone.utc).date()
+
+
+class _Estimator:
+    def __init__(self):
+        self.calls = []
+
+    def city_factor(self, ciudad, hora, ts=None):
+        self.calls.append((ciudad, hora))
+        return {"factor": 0.5, "observaciones": 3}
+
+
+@pytest.fixture
+def frozen(monkeypatch):
+    estimator = _Estimator()
+    precomputed = [{
+        "target_time": "2026-03-10T20:00:00-05:00",
+        "predicted_speed": 42.0,
+        "confidence_score": 0.9,
+        "model_version": "v-test",
+        "prediction_time": "2026-03-10T19:00:00-05:00",
+    }]
+
+    async def fake_precomputed(ciudad):
+        return precomputed
+
+    monkeypatch.setattr(predictions_real, "datetime", _FrozenDatetime)
+    monkeypatch.setattr(predictions_real, "date", _UTCHostDate)
+    monkeypatch.setattr(predictions_real, "get_precomputed_forecast", fake_precomputed)
+    monkeypatch.setattr(predictions_real, "get_online_estimator", lambda: estimator)
+    return estimator
+
+
+async def test_default_date_is_local_at_night(frozen):
+    result = await predictions_real.get_traffic_forecast(CIUDAD, hora=None, fecha=None)
+
+    assert result["fecha"] == "2026-03-10"
+    assert result["modelo"]["tipo"] == "precomputado"
+    # La hora en curso usa la fila precomputada de hoy con el ajuste en vivo
+    item = next(i for i in result["predicciones_por_hora"] if i["hora"] == "20:00")
+    assert item["velocidad_promedio"] == pytest.approx(21.0)
+    assert result["ajuste_en_vivo"] == {"factor": 0.5, "observaciones": 3}
+    assert frozen.calls == [(CIUDAD, 20)]
+
+
+async def test_default_date_for_single_hour(frozen):
+    result = await predictions_real.get_traffic_forecast(CIUDAD, hora=20, fecha=None)
+
+    assert result["fecha"] == "2026-03-10"
+    assert result["velocidad_predicha"] == pytest.approx(21.0)
+    assert result["ajuste_en_vivo"] is not None
@@ -0,0 +1,88 @@
+"""
+Tests del limitador de tasa: plazo en cola, prioridad y ocupación de la cola
+"""
+import asyncio
+
+import pytest
+
+from app.services import rate_limiter
+from app.services.rate_limiter import BACKGROUND, INTERACTIVE, RateLimiter, RateLimitExceeded
+
+pytestmark = pytest.mark.anyio
+
+
+def _limiter(rate_per_minute=60.0, max_concurrency=1, max_queue=10):
+    limiter = RateLimiter("test", rate_per_minute, max_concurrency, max_queue)
+    rate_limiter._registry.pop("test", None)  # fuera de las métricas globales
+    return limiter
+
+
+async def test_waiter_rejected_after_deadline():
+    limiter = _limiter()
+    await limiter.acquire(INTERACTIVE, timeout=1.0)  # ocupa la única plaza
+
+    with pytest.raises(RateLimitExceeded, match="sin turno"):
+        await limiter.acquire(INTERACTIVE, timeout=0.05)
+    stats = limiter.stats()
+    assert stats["rechazadas_plazo"] == 1
+    assert stats["en_cola"] == 0
+
+
+async def test_interactive_served_before_background():
+    limiter = _limiter()
+    await limiter.acquire(INTERACTIVE, timeout=1.0)
+    order = []
+
+    async def worker(name, priority):
+        await limiter.acquire(priority, timeout=1.0)
+        order.append(name)
+        limiter.release()
+
+    tasks = [
+        asyncio.create_task(worker("fondo-1", BACKGROUND)),
+        asyncio.create_task(worker("fondo-2", BACKGROUND)),
+        asyncio.create_task(worker("usuario", INTERACTIVE)),
+    ]
+    await asyncio.sleep(0.01)  # los tres en cola
+    limiter.release()
+    await asyncio.gather(*tasks)
+    assert order == ["usuario", "fondo-1", "fondo-2"]
+
+
+async def test_expired_waiters_do_not_fill_queue():
+    limiter = _limiter(max_queue=3)
+    await limiter.acquire(INTERACTIVE, timeout=1.0)
+
+    # Muchas más esperas vencidas que el tamaño de la cola
+    for _ in range(20):
+        with pytest.raises(RateLimitExceeded, match="sin turno"):
+            await limiter.acquire(INTERACTIVE, timeout=0.001)
+    assert limiter.rejected_full == 0
+    assert len(limiter._waiters) <= 2 * limiter._pending + 16
+
+    waiter = asyncio.create_task(limiter.acquire(INTERACTIVE, timeout=1.0))
+    await asyncio.sleep(0.01)
+    limiter.release()
+    await waiter
+    assert limiter.stats()["en_cola"] == 0
+
+
+async def test_cancelled_waiters_free_their_slot():
+    limiter = _limiter(max_queue=2)
+    await limiter.acquire(INTERACTIVE, timeout=1.0)
+
+    for _ in range(5):
+        task = asyncio.create_task(limiter.acquire(INTERACTIVE, timeout=1.0))
+        await asyncio.sleep(0)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+    assert limiter.stats()["en_cola"] == 0
+
+    queued = [asyncio.create_task(limiter.acquire(INTERACTIVE, timeout=1.0)) for _ in range(2)]
+    await asyncio.sleep(0)
+    with pytest.raises(RateLimitExceeded, match="cola llena"):
+        await limiter.acquire(INTERACTIVE, timeout=1.0)
+    for task in queued:
+        limiter.release()
+        await task
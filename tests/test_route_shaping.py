@@ -0,0 +1,34 @@
+"""
+Tests del formato compacto de rutas: ida y vuelta de polyline6
+"""
+import numpy as np
+import pytest
+
+from app.services.route_shaping import decode_polyline, encode_polyline
+
+
+def test_known_polyline5_vector():
+    # Ejemplo de la especificación de Google (precisión 5)
+    coordinates = [[-120.2, 38.5], [-120.95, 40.7], [-126.453, 43.252]]
+    encoded = encode_polyline(coordinates, precision=5)
+    assert encoded == "_p~iF~ps|U_ulLnnqC_mqNvxq`@"
+    assert decode_polyline(encoded, precision=5) == coordinates
+
+
+@pytest.mark.parametrize("precision", [5, 6])
+def test_round_trip_within_precision(precision):
+    rng = np.random.default_rng(precision)
+    lon = -79.0 + np.cumsum(rng.normal(0, 0.01, 500))
+    lat = -1.5 + np.cumsum(rng.normal(0, 0.01, 500))
+    coordinates = np.column_stack([lon, lat]).tolist()
+
+    decoded = decode_polyline(encode_polyline(coordinates, precision), precision)
+    assert len(decoded) == len(coordinates)
+    np.testing.assert_allclose(decoded, coordinates, atol=0.5 / 10 ** precision + 1e-12)
+    # Ya cuantizadas: la segunda vuelta es exacta
+    assert decode_polyline(encode_polyline(decoded, precision), precision) == decoded
+
+
+def test_empty_polyline():
+    assert encode_polyline([]) == ""
+    assert decode_polyline("") == []
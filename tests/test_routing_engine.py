@@ -0,0 +1,81 @@
+"""
+Tests del motor de rutas local: caminos mínimos frente a scipy
+"""
+import numpy as np
+import pytest
+
+from app.services.routing_engine import ALT_MAX_STRETCH, RoutingEngine
+
+
+@pytest.fixture(scope="module")
+def engine(grid_graph):
+    return RoutingEngine(grid_graph)
+
+
+@pytest.fixture(scope="module")
+def reference(grid_graph, free_flow_distances):
+    pairs = np.random.default_rng(7).integers(0, grid_graph.n_nodes, size=(60, 2)).tolist()
+    sources = sorted({s for s, _ in pairs})
+    matrix = free_flow_distances(grid_graph, sources)
+    row = {s: i for i, s in enumerate(sources)}
+    return [(s, t, float(matrix[row[s], t])) for s, t in pairs]
+
+
+def _assert_path(graph, edges, source, target):
+    tails = graph.edge_tails()
+    if source == target:
+        assert edges == []
+        return
+    assert tails[edges[0]] == source and graph.heads[edges[-1]] == target
+    assert all(graph.heads[a] == tails[b] for a, b in zip(edges, edges[1:]))
+
+
+def test_astar_matches_scipy(grid_graph, engine, reference):
+    for s, t, expected in reference:
+        edges = engine.astar(s, t, depart_s=8 * 3600)
+        if not np.isfinite(expected):
+            assert edges is None
+            continue
+        _assert_path(grid_graph, edges, s, t)
+        assert float(grid_graph.base_time[edges].sum()) == pytest.approx(expected, rel=1e-4)
+
+
+def test_bidirectional_dijkstra_matches_scipy(grid_graph, engine, reference):
+    for s, t, expected in reference:
+        edges = engine.bidirectional_dijkstra(s, t, hour=8)
+        if not np.isfinite(expected):
+            assert edges is None
+            continue
+        _assert_path(grid_graph, edges, s, t)
+        assert float(grid_graph.base_time[edges].sum()) == pytest.approx(expected, rel=1e-4)
+
+
+def test_route_returns_alternatives_within_stretch(grid_graph, engine):
+    origin = (float(grid_graph.node_lat[0]), float(grid_graph.node_lon[0]))
+    destination = (float(grid_graph.node_lat[-1]), float(grid_graph.node_lon[-1]))
+    result = engine.route(origin, destination, depart_s=8 * 3600, k=3)
+
+    assert result["status"] == "ok"
+    assert result["algorithm"] == "astar"
+    paths = result["paths"]
+    assert 1 <= len(paths) <= 3
+    for path in paths:
+        assert len(path.nodes) == len(path.edges) + 1
+        assert path.duration_s <= paths[0].duration_s * ALT_MAX_STRETCH + 1e-6
+
+
+def test_route_outside_coverage(engine):
+    result = engine.route((-2.9, -79.0), (-1.0, -79.0), depart_s=0)
+    assert result["status"] == "error"
+    assert result["code"] == 404
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("hora", [0, 13])
+async def test_straight_line_routes_report_requested_hour(monkeypatch, hora):
+    from app.routes import routes_history_real as rhr
+
+    monkeypatch.setattr(rhr, "get_routing_engine", lambda: None)
+    result = await rhr.calculate_routes("QUITO", "GUAYAQUIL", False, hora, False)
+    assert result["datos_desde"] == "dataset_ecuador_2022"
+    assert result["hora_consulta"] == f"{hora:02d}:00"
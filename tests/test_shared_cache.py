@@ -0,0 +1,76 @@
+"""
+Tests de la caché de dos niveles (L1 por worker + L2 compartida)
+"""
+import time
+
+import pytest
+
+from app.services import shared_cache
+from app.services.shared_cache import SQLiteBackend, TieredCache, serialize, set_shared_backend
+from app.services.ttl_cache import TTLCache
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+def backend(tmp_path):
+    backend = SQLiteBackend(str(tmp_path / "cache.sqlite"))
+    set_shared_backend(backend)
+    yield backend
+    set_shared_backend(None)
+
+
+def _cache(name: str, ttl: float = 60) -> TieredCache:
+    return TieredCache(TTLCache(name, ttl=ttl))
+
+
+async def test_l2_hit_fills_l1_with_remaining_ttl(backend):
+    writer, reader = _cache("prueba_a"), _cache("prueba_a")
+    await writer.set("k", {"v": 1}, ttl=60)
+    backend.set("prueba_a:k", serialize({"v": 1}), time.time() + 20)
+
+    assert await reader.get("k") == {"v": 1}
+    assert reader.l2_hits == 1
+    assert 0 < reader.ttl_remaining("k") <= 20
+
+
+async def test_expired_entry_is_a_miss(backend):
+    cache = _cache("prueba_b")
+    backend.set("prueba_b:k", serialize("x"), time.time() - 1)
+    assert await cache.get("k") is None
+    assert cache.l2_misses == 1
+
+
+async def test_unreadable_entry_counts_error_and_is_deleted(backend):
+    cache = _cache("prueba_c")
+    backend.set("prueba_c:k", b"\x01no-es-zlib", time.time() + 60)
+
+    assert await cache.get("k") is None
+    assert cache.l2_errors == 1
+    assert cache.l2_hits == 0
+    assert backend.get("prueba_c:k") is None
+
+    # Un blob ilegible no suspende L2 para las demás claves
+    backend.set("prueba_c:otra", serialize([1, 2]), time.time() + 60)
+    assert await cache.get("otra") == [1, 2]
+
+
+async def test_backend_failure_falls_back_to_l1(backend, monkeypatch):
+    cache = _cache("prueba_d")
+
+    def fail(*args):
+        raise OSError("disco lleno")
+
+    monkeypatch.setattr(backend, "set", fail)
+    await cache.set("k", "v")
+    assert cache.l2_errors == 1
+    assert await cache.get("k") == "v"
+    assert time.time() < cache._retry_at <= time.time() + shared_cache.ERROR_BACKOFF_SECONDS
+
+
+async def test_without_backend_only_l1():
+    set_shared_backend(None)
+    cache = _cache("prueba_e")
+    await cache.set("k", 5)
+    assert await cache.get("k") == 5
+    assert cache.stats()["backend"] is None
@@ -0,0 +1,104 @@
+"""
+Tests de la coalescencia de solicitudes (single-flight)
+"""
+import asyncio
+
+import pytest
+
+from app.services import single_flight
+from app.services.single_flight import SingleFlight
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+def flights():
+    flights = SingleFlight("test")
+    single_flight._registry.pop("test", None)  # fuera de las métricas globales
+    return flights
+
+
+async def test_concurrent_calls_share_one_execution(flights):
+    calls = []
+    release = asyncio.Event()
+
+    async def fetch():
+        calls.append(1)
+        await release.wait()
+        return {"valor": 42}
+
+    waiters = [asyncio.ensure_future(flights.do("k", fetch)) for _ in range(10)]
+    await asyncio.sleep(0)
+    assert flights.in_flight("k")
+    release.set()
+    results = await asyncio.gather(*waiters)
+
+    assert calls == [1]
+    assert all(r is results[0] for r in results)
+    assert flights.stats() == {"en_vuelo": 0, "llamadas": 1, "compartidas": 9}
+
+
+async def test_exception_reaches_every_waiter_and_clears_key(flights):
+    release = asyncio.Event()
+
+    async def failing():
+        await release.wait()
+        raise RuntimeError("proveedor caído")
+
+    waiters = [asyncio.ensure_future(flights.do("k", failing)) for _ in range(3)]
+    await asyncio.sleep(0)
+    release.set()
+    results = await asyncio.gather(*waiters, return_exceptions=True)
+
+    assert all(isinstance(r, RuntimeError) for r in results)
+    assert not flights.in_flight("k")
+
+    async def ok():
+        return "otra vez"
+
+    # Una nueva llamada con la misma clave vuelve a ejecutar la función
+    assert await flights.do("k", ok) == "otra vez"
+
+
+async def test_cancelled_waiter_does_not_cancel_shared_call(flights):
+    release = asyncio.Event()
+    calls = []
+
+    async def fetch():
+        calls.append(1)
+        await release.wait()
+        return "listo"
+
+    leader = asyncio.ensure_future(flights.do("k", fetch))
+    follower = asyncio.ensure_future(flights.do("k", fetch))
+    await asyncio.sleep(0)
+
+    leader.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await leader
+    assert flights.in_flight("k")
+
+    release.set()
+    assert await follower == "listo"
+    assert calls == [1]
+    assert not flights.in_flight("k")
+
+
+async def test_start_many_resolves_each_key(flights):
+    release = asyncio.Event()
+
+    async def fetch_group():
+        await release.wait()
+        return {"a": 1, "b": 2}
+
+    group = flights.start_many(["a", "b", "c"], fetch_group)
+    waiters = [asyncio.ensure_future(flights.do(k, pytest.fail)) for k in ("a", "b", "c")]
+    await asyncio.sleep(0)
+    assert len(flights) == 3
+    release.set()
+
+    assert await group == {"a": 1, "b": 2}
+    results = await asyncio.gather(*waiters, return_exceptions=True)
+    assert results[:2] == [1, 2]
+    assert isinstance(results[2], KeyError)
+    assert len(flights) == 0
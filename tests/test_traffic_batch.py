@@ -0,0 +1,323 @@
+"""
+Tests del estado de tráfico por lotes: deduplicación, caché, agrupación de
+fallos, alternativa con el estimador y coalescencia con otras consultas;
+también el refresco en segundo plano de entradas obsoletas
+"""
+import asyncio
+
+import httpx
+import numpy as np
+import pytest
+from fastapi import FastAPI
+
+from app.config.mapbox import mapbox_config
+from app.routes import traffic as traffic_routes
+from app.services.city_matrix import ROAD_DETOUR_FACTOR, haversine_matrix
+from app.services.rate_limiter import BACKGROUND, current_priority
+from app.services import traffic_service as ts
+from app.services.traffic_service import _cache_key, get_traffic_status_for_point, get_traffic_status_for_points
+
+# A y B a ~150 m (mismo grupo); C y D en otra ciudad, cerca entre sí
+A = (-0.95, -80.72)
+B = (-0.951, -80.721)
+C = (-2.19, -79.88)
+D = (-2.191, -79.881)
+
+
+def _leg(seconds=60.0, meters=500.0):
+    return {"distance": meters, "duration": seconds, "annotation": {"speed": [8.0], "congestion": ["low"]}}
+
+
+class _Upstream:
+    """Sustituye a get_matrix / get_directions / get_route_with_traffic y registra las claves pedidas"""
+
+    def __init__(self, error_code=None, delay=0.01, seconds=60.0):
+        self.error_code = error_code
+        self.delay = delay
+        self.seconds = seconds
+        # Matriz de duraciones fija (por defecto, `seconds` entre todos los pares)
+        self.durations = None
+        self.matrix_calls = []
+        self.directions_calls = []
+        self.route_calls = []
+        self.route_priorities = []
+
+    def _error(self):
+        return {"status": "error", "code": self.error_code, "message": "Mapbox degradado"}
+
+    async def get_matrix(self, coordinates, profile, annotations):
+        self.matrix_calls.append(list(coordinates))
+        await asyncio.sleep(self.delay)
+        if self.error_code:
+            return self._error()
+        n = len(coordinates)
+        if self.durations is not None:
+            return {"status": "ok", "durations": self.durations}
+        return {"status": "ok", "durations": [[0.0 if i == j else self.seconds for j in range(n)] for i in range(n)]}
+
+    async def get_directions(self, coordinates, **kwargs):
+        self.directions_calls.append(list(coordinates))
+        await asyncio.sleep(self.delay)
+        if self.error_code:
+            return self._error()
+        return {"status": "ok", "routes": [{"legs": [_leg(self.seconds) for _ in coordinates[1:]]}]}
+
+    async def get_route_with_traffic(self, start, end, **kwargs):
+        self.route_calls.append(start)
+        self.route_priorities.append(current_priority())
+        await asyncio.sleep(self.delay)
+        if self.error_code:
+            return self._error()
+        return {"status": "ok", "routes": [{"legs": [_leg(self.seconds)]}]}
+
+    def requested(self):
+        """Claves de caché consultadas al proveedor (sin las sondas)"""
+        keys = [_cache_key(lat, lon) for lon, lat in self.route_calls]
+        for coords in self.directions_calls:
+            keys += [_cache_key(lat, lon) for lon, lat in coords[:-1]]
+        for coords in self.matrix_calls:
+            keys += [_cache_key(lat, lon) for lon, lat in coords]
+        probes = {_cache_key(lat + ts._PROBE_OFFSET_DEG, lon) for lat, lon in (A, B, C, D)}
+        return sorted(k for k in keys if k not in probes)
+
+
+class _Estimator:
+    def estimate(self, lat, lon, ts=None):
+        return None
+
+    def observe(self, lat, lon, speed, ts=None):
+        pass
+
+
+@pytest.fixture
+def upstream(monkeypatch):
+    upstream = _Upstream()
+    monkeypatch.setattr(mapbox_config, "access_token", "pk.test")
+    monkeypatch.setattr(ts, "get_matrix", upstream.get_matrix)
+    monkeypatch.setattr(ts, "get_directions", upstream.get_directions)
+    monkeypatch.setattr(ts, "get_route_with_traffic", upstream.get_route_with_traffic)
+    monkeypatch.setattr(ts, "get_online_estimator", lambda: _Estimator())
+    monkeypatch.setattr(ts, "BATCH_RESOLVER", "matrix")
+    ts._cache.l1.clear()
+    yield upstream
+    ts._cache.l1.clear()
+
+
+def _key(point):
+    return _cache_key(*point)
+
+
+@pytest.mark.anyio
+async def test_points_deduplicated_by_cache_key(upstream):
+    near_a = (A[0] + 0.00001, A[1])
+    batch = await get_traffic_status_for_points([A, near_a, B])
+
+    assert batch["keys"][0] == batch["keys"][1] == _key(A)
+    assert batch["stats"]["unicos"] == 2
+    assert batch["stats"]["solicitudes"] == 1
+    assert upstream.requested() == sorted([_key(A), _key(B)])
+    assert all(r["status"] == "ok" for r in batch["results"].values())
+
+
+@pytest.mark.anyio
+async def test_cached_stale_and_missing_points(upstream):
+    fresh = {"status": "ok", "currentSpeed": 40.0, "freeFlowSpeed": 60.0}
+    ts._cache.l1.set(_key(A), fresh)
+    ts._cache.l1.set(_key(B), fresh, ttl=-1)  # expirado, dentro de la gracia
+
+    batch = await get_traffic_status_for_points([A, B, C])
+    results = batch["results"]
+
+    assert results[_key(A)]["stale"] is False
+    assert results[_key(B)]["stale"] is True
+    assert results[_key(C)]["status"] == "ok" and results[_key(C)]["age"] == 0.0
+    assert batch["stats"]["desde_cache"] == 2
+
+    # El obsoleto se refresca una vez en segundo plano
+    await asyncio.gather(*list(ts._refreshes))
+    assert upstream.requested() == sorted([_key(B), _key(C)])
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("code", [503, 429])
+async def test_degraded_provider_falls_back_to_estimator(upstream, monkeypatch, code):
+    upstream.error_code = code
+    monkeypatch.setattr(ts, "get_estimated_status_for_point", lambda lat, lon: {
+        "status": "ok", "provider": "estimador", "currentSpeed": 30.0, "freeFlowSpeed": 50.0,
+    })
+
+    batch = await get_traffic_status_for_points([A, B, C])
+    for result in batch["results"].values():
+        assert result["fallback"] is True
+        assert result["provider"] == "estimador"
+        assert "degradado" in result["upstream_error"]
+
+
+@pytest.mark.anyio
+async def test_client_errors_do_not_fall_back(upstream, monkeypatch):
+    upstream.error_code = 404
+    monkeypatch.setattr(ts, "get_estimated_status_for_point", lambda lat, lon: pytest.fail("sin alternativa"))
+
+    batch = await get_traffic_status_for_points([A, B])
+    assert all(r["status"] == "unavailable" and r["code"] == 404 for r in batch["results"].values())
+
+
+def test_pack_points_chains_up_to_two_points():
+    misses = [(_key(p), *p) for p in (A, C, B, D)]
+    groups = ts._pack_points(misses)
+
+    assert sorted(sorted(k for k, _, _ in g) for g in groups) == sorted([
+        sorted([_key(A), _key(B)]),
+        sorted([_key(C), _key(D)]),
+    ])
+    assert all(len(g) <= ts.DIRECTIONS_TRAFFIC_MAX_COORDS - 1 for g in groups)
+
+
+@pytest.mark.anyio
+async def test_directions_resolver_uses_three_coordinates(upstream, monkeypatch):
+    monkeypatch.setattr(ts, "BATCH_RESOLVER", "directions")
+    far = (-0.22, -78.51)
+    batch = await get_traffic_status_for_points([A, B, far])
+
+    assert [len(c) for c in upstream.directions_calls] == [ts.DIRECTIONS_TRAFFIC_MAX_COORDS]
+    assert upstream.directions_calls[0][-1][1] == pytest.approx(upstream.directions_calls[0][1][1] + ts._PROBE_OFFSET_DEG)
+    assert len(upstream.route_calls) == 1  # el punto aislado va solo
+    assert batch["stats"]["agrupados"] == 2
+    assert all(r["status"] == "ok" for r in batch["results"].values())
+
+
+@pytest.mark.anyio
+async def test_concurrent_batches_and_single_calls_share_flights(upstream):
+    results = await asyncio.gather(
+        get_traffic_status_for_points([A, B]),
+        get_traffic_status_for_point(*A),
+        get_traffic_status_for_points([B, A]),
+        get_traffic_status_for_point(*B),
+    )
+
+    # Cada clave se pide al proveedor una sola vez
+    assert upstream.requested() == sorted([_key(A), _key(B)])
+    assert results[1]["status"] == "ok" and results[3]["status"] == "ok"
+    assert len(ts._flights) == 0
+
+
+@pytest.mark.anyio
+async def test_batch_endpoint_point_limit():
+    app = FastAPI()
+    app.include_router(traffic_routes.router)
+    point = {"lat": A[0], "lon": A[1]}
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+        too_many = await client.post("/api/v1/traffic/status:batch", json={
+            "points": [point] * (traffic_routes.BATCH_MAX_POINTS + 1), "fuente": "estimador",
+        })
+        assert too_many.status_code == 422
+
+        response = await client.post("/api/v1/traffic/status:batch", json={
+            "points": [point] * traffic_routes.BATCH_MAX_POINTS, "fuente": "estimador",
+        })
+    assert response.status_code == 200
+    assert len(response.json()["results"]) == traffic_routes.BATCH_MAX_POINTS
+
+
+# ============================================================
+# Agrupación Matrix
+# ============================================================
+
+def test_matrix_groups_respect_coordinate_limit():
+    rng = np.random.default_rng(5)
+    # Tres barrios densos y puntos sueltos
+    centers = [(-0.95, -80.72), (-2.19, -79.88), (-0.22, -78.51)]
+    points = [(la + rng.normal(0, 0.004), lo + rng.normal(0, 0.004)) for la, lo in centers for _ in range(15)]
+    points += [(-1.5 + i, -79.0) for i in range(3)]
+    misses = [(f"p{i}", la, lo) for i, (la, lo) in enumerate(points)]
+
+    groups = ts._matrix_groups(misses)
+    assert sorted(k for g in groups for k, _, _ in g) == sorted(k for k, _, _ in misses)
+    lat = np.array([m[1] for m in misses])
+    lon = np.array([m[2] for m in misses])
+    dist = haversine_matrix(lat, lon)
+    np.fill_diagonal(dist, np.inf)
+    index = {k: i for i, (k, _, _) in enumerate(misses)}
+    for group in groups:
+        members = [index[k] for k, _, _ in group]
+        assert ts._matrix_coordinate_count(dist, members) <= ts.MATRIX_TRAFFIC_MAX_COORDS
+    # 15 puntos cercanos no caben en una sola Matrix
+    assert sum(len(g) > 1 for g in groups) >= 6
+
+
+def test_isolated_point_counts_its_probe():
+    lat = np.array([A[0], B[0], C[0]])
+    lon = np.array([A[1], B[1], C[1]])
+    dist = haversine_matrix(lat, lon)
+    np.fill_diagonal(dist, np.inf)
+    assert ts._matrix_coordinate_count(dist, [0, 1]) == 2
+    assert ts._matrix_coordinate_count(dist, [0, 1, 2]) == 4
+
+
+@pytest.mark.anyio
+async def test_matrix_probes_isolated_points(upstream):
+    group = [(_key(p), *p) for p in (A, B, C)]
+    out = await ts._fetch_matrix(group)
+
+    coords = upstream.matrix_calls[0]
+    assert len(coords) == 4
+    assert coords[3] == (C[1], pytest.approx(C[0] + ts._PROBE_OFFSET_DEG))
+    assert all(r["status"] == "ok" and r["method"] == "matrix" for r in out.values())
+
+
+@pytest.mark.anyio
+async def test_matrix_speed_uses_both_directions(upstream):
+    upstream.durations = [[0.0, 50.0], [70.0, 0.0]]
+    out = await ts._fetch_matrix([(_key(A), *A), (_key(B), *B)])
+
+    km = float(haversine_matrix([A[0], B[0]], [A[1], B[1]])[0, 1]) * ROAD_DETOUR_FACTOR
+    expected = 2 * km / 120.0 * 3600.0
+    assert out[_key(A)]["currentSpeed"] == pytest.approx(expected, abs=0.05)
+    assert out[_key(B)]["currentSpeed"] == pytest.approx(expected, abs=0.05)
+
+
+@pytest.mark.anyio
+async def test_incomplete_matrix_is_an_error(upstream):
+    upstream.durations = [[0.0, 60.0]]
+    out = await ts._fetch_matrix([(_key(A), *A), (_key(B), *B)])
+    for result in out.values():
+        assert result["status"] == "unavailable"
+        assert result["code"] == 404
+        assert "matriz incompleta" in result["message"]
+
+
+@pytest.mark.anyio
+async def test_point_without_durations_is_unavailable(upstream):
+    upstream.durations = [[0.0, None], [None, 0.0]]
+    out = await ts._fetch_matrix([(_key(A), *A), (_key(B), *B)])
+    assert all(r["status"] == "unavailable" and r["code"] == 404 for r in out.values())
+
+
+# ============================================================
+# Stale-while-revalidate
+# ============================================================
+
+@pytest.mark.anyio
+async def test_stale_entry_served_and_refreshed_once_in_background(upstream):
+    old = {"status": "ok", "currentSpeed": 40.0, "freeFlowSpeed": 60.0}
+    ts._cache.l1.set(_key(A), old, ttl=-1)
+
+    first = await get_traffic_status_for_point(*A)
+    second = await get_traffic_status_for_point(*A)
+
+    # Respuesta inmediata con el valor obsoleto, sin esperar al proveedor
+    assert first["stale"] is True and second["stale"] is True
+    assert first["currentSpeed"] == 40.0
+    assert upstream.route_calls == []
+    assert len(ts._refreshes) == 1
+
+    await asyncio.gather(*list(ts._refreshes))
+    assert upstream.route_calls == [(A[1], A[0])]
+    assert upstream.route_priorities == [BACKGROUND]
+    assert len(ts._refreshes) == 0
+
+    fresh = await get_traffic_status_for_point(*A)
+    assert fresh["stale"] is False
+    assert fresh["currentSpeed"] != 40.0
+    assert len(upstream.route_calls) == 1
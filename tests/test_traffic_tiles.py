@@ -0,0 +1,93 @@
+"""
+Tests de la rejilla de teselas de tráfico: costo de una bbox en frío y en caché
+"""
+import httpx
+import pytest
+
+from app.config.mapbox import mapbox_config
+from app.services import http_client, traffic_tiles
+from app.services.traffic_tiles import get_bbox_traffic, tiles_for_bbox, zoom_for_bbox
+
+pytestmark = pytest.mark.anyio
+
+# Muestreo anterior a la rejilla: centro y cuatro esquinas de la bbox
+BASELINE_POINT_CALLS = 5
+
+
+def _status(speed: float = 30.0, free: float = 60.0):
+    return {"status": "ok", "currentSpeed": speed, "freeFlowSpeed": free, "confidence": 0.5, "provider": "mapbox", "age": 0.0}
+
+
+@pytest.fixture
+def mapbox_calls(monkeypatch):
+    """Cliente HTTP simulado que cuenta las llamadas a Mapbox"""
+    calls = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        calls.append(request.url.path)
+        coords = request.url.path.rsplit("/", 1)[1].split(";")
+        if "directions-matrix" in request.url.path:
+            n = len(coords)
+            return httpx.Response(200, json={"code": "Ok", "durations": [[0 if i == j else 60 for j in range(n)] for i in range(n)]})
+        leg = {"distance": 550, "duration": 60, "annotation": {"speed": [9, 10], "congestion": ["low", "low"]}}
+        return httpx.Response(200, json={"code": "Ok", "routes": [{"distance": 550, "duration": 60, "legs": [leg]}]})
+
+    monkeypatch.setattr(mapbox_config, "access_token", "pk.test")
+    http_client.set_http_client(http_client.create_http_client(transport=httpx.MockTransport(handler)))
+    yield calls
+    http_client.set_http_client(None)
+
+
+@pytest.mark.parametrize("bbox", [
+    (-79.62, -2.22, -79.58, -2.18),     # barrio
+    (-78.55, -0.25, -78.45, -0.15),     # ciudad
+    (-80.0, -2.5, -79.0, -1.5),         # región
+])
+def test_cold_bbox_samples_at_most_baseline(bbox):
+    zoom = zoom_for_bbox(*bbox)
+    tiles = tiles_for_bbox(*bbox, zoom)
+    points = len(tiles) * traffic_tiles.samples_per_side(zoom) ** 2
+    assert points <= BASELINE_POINT_CALLS
+
+
+async def test_missing_tiles_resolve_in_one_batch():
+    batches = []
+
+    async def resolve(points):
+        batches.append(list(points))
+        return [_status() for _ in points]
+
+    bbox = (-79.95, -2.25, -79.85, -2.15)
+    cold = await get_bbox_traffic(*bbox, resolve=resolve, fuente="prueba")
+    assert cold["status"] == "ok"
+    assert len(batches) == 1
+    assert cold["tiles"]["puntos_consultados"] == len(batches[0])
+    assert cold["currentSpeed"] == pytest.approx(30.0)
+    assert cold["worstRatio"] == pytest.approx(0.5)
+
+    warm = await get_bbox_traffic(*bbox, resolve=resolve, fuente="prueba")
+    assert len(batches) == 1
+    assert warm["tiles"]["desde_cache"] == warm["tiles"]["total"]
+
+
+async def test_unavailable_when_no_sample_is_valid():
+    async def resolve(points):
+        return [{"status": "unavailable", "code": 503, "message": "caído"} for _ in points]
+
+    result = await get_bbox_traffic(-79.5, -1.05, -79.45, -1.0, resolve=resolve, fuente="prueba")
+    assert result["status"] == "unavailable"
+    assert result["code"] == 503
+
+
+async def test_route_cold_bbox_costs_no_more_than_baseline(mapbox_calls):
+    from app.routes.traffic import traffic_status
+
+    bbox = "-78.56,-0.26,-78.46,-0.16"
+    cold = await traffic_status(bbox=bbox, lat=None, lon=None, threshold=0.8, fuente="live")
+    assert cold["tiles"]["consultadas"] == cold["tiles"]["total"]
+    assert 1 <= len(mapbox_calls) <= BASELINE_POINT_CALLS
+
+    mapbox_calls.clear()
+    warm = await traffic_status(bbox=bbox, lat=None, lon=None, threshold=0.8, fuente="live")
+    assert warm["tiles"]["desde_cache"] == warm["tiles"]["total"]
+    assert mapbox_calls == []
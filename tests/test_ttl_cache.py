@@ -0,0 +1,152 @@
+"""
+Tests de la caché TTL + LRU: desalojo, expiración, gracia, métricas y purga
+"""
+import asyncio
+
+import pytest
+
+from app.services import ttl_cache
+from app.services.ttl_cache import CacheJanitor, TTLCache
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = _Clock()
+    monkeypatch.setattr(ttl_cache.time, "time", clock)
+    return clock
+
+
+@pytest.fixture
+def make_cache():
+    names = []
+
+    def make(**kwargs):
+        name = f"test-{len(names)}"
+        names.append(name)
+        return TTLCache(name, **{"ttl": 10, **kwargs})
+
+    yield make
+    for name in names:
+        ttl_cache._registry.pop(name, None)
+
+
+def test_lru_eviction_by_entries(clock, make_cache):
+    cache = make_cache(max_entries=3)
+    for key in "abc":
+        cache.set(key, key.upper())
+    assert cache.get("a") == "A"  # "a" pasa a ser la más reciente
+    cache.set("d", "D")
+
+    assert "b" not in cache
+    assert [k for k in "acd" if k in cache] == ["a", "c", "d"]
+    assert cache.stats()["desalojos"] == 1
+
+
+def test_lru_eviction_by_bytes(clock, make_cache):
+    cache = make_cache(max_entries=100, max_bytes=30, sizeof=len)
+    cache.set("a", "x" * 10)
+    cache.set("b", "y" * 10)
+    cache.set("c", "z" * 10)
+    assert cache.stats()["bytes"] == 30
+
+    cache.set("d", "w" * 15)
+    assert "a" not in cache and "b" not in cache
+    assert cache.stats()["bytes"] == 25
+    assert cache.stats()["desalojos"] == 2
+
+    # Un valor mayor que toda la caché no se guarda ni desaloja nada
+    cache.set("e", "v" * 31)
+    assert "e" not in cache and len(cache) == 2
+
+
+def test_ttl_expiry(clock, make_cache):
+    cache = make_cache()
+    cache.set("default", 1)
+    cache.set("short", 2, ttl=2)
+
+    clock.now += 3
+    assert cache.get("short") is None
+    assert cache.get("default") == 1
+    clock.now += 8
+    assert cache.get("default") is None
+    assert cache.ttl_remaining("default") is None
+    assert cache.stats()["expiraciones"] == 2
+
+
+def test_stale_served_only_within_grace(clock, make_cache):
+    cache = make_cache(grace=5)
+    cache.set("k", "v")
+
+    clock.now += 4
+    assert cache.get_with_age("k") == ("v", 4, False)
+    clock.now += 8  # 2 s después de expirar
+    value, age, stale = cache.get_with_age("k")
+    assert (value, age, stale) == ("v", 12, True)
+    # get() solo devuelve valores vigentes, pero conserva la entrada en gracia
+    assert cache.get("k") is None
+    assert cache.get_with_age("k")[2] is True
+
+    clock.now += 4  # fuera de la gracia
+    assert cache.get_with_age("k") is None
+    assert len(cache) == 0
+
+
+def test_age_from_other_cache(clock, make_cache):
+    cache = make_cache()
+    cache.set("k", "v", ttl=5, age=7)
+    assert cache.get_with_age("k") == ("v", 7, False)
+
+
+def test_stats_counters(clock, make_cache):
+    cache = make_cache(grace=5)
+    cache.set("k", "v")
+    cache.get("k")
+    cache.get("k")
+    cache.get("otra")
+    clock.now += 12
+    cache.get_with_age("k")
+
+    stats = cache.stats()
+    assert (stats["aciertos"], stats["aciertos_obsoletos"], stats["fallos"]) == (2, 1, 1)
+    assert stats["tasa_aciertos"] == pytest.approx(2 / 3, abs=1e-4)
+    assert stats["entradas"] == 1
+    assert ttl_cache.get_cache_stats()[cache.name] == stats
+
+
+def test_purge_expired_respects_grace(clock, make_cache):
+    cache = make_cache(grace=5)
+    cache.set("vieja", 1, ttl=1)
+    cache.set("en_gracia", 2, ttl=8)
+    cache.set("vigente", 3)
+
+    clock.now += 9
+    assert cache.purge_expired() == 1
+    assert "vigente" in cache
+    assert cache.get_with_age("en_gracia")[2] is True
+
+
+@pytest.mark.anyio
+async def test_janitor_purges_in_background(clock, make_cache):
+    cache = make_cache()
+    cache.set("k", "v", ttl=1)
+    clock.now += 2
+
+    janitor = CacheJanitor(interval_seconds=0.01)
+    janitor.start()
+    try:
+        for _ in range(100):
+            if len(cache) == 0:
+                break
+            await asyncio.sleep(0.01)
+    finally:
+        await janitor.stop()
+    assert len(cache) == 0
+    assert janitor._task is None
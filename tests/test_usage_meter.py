@@ -0,0 +1,94 @@
+"""
+Tests de los presupuestos mensuales de Mapbox: modos normal, solo
+interactivo y solo caché
+"""
+from datetime import datetime, timezone
+
+import httpx
+import pytest
+
+from app.config.mapbox import mapbox_config
+from app.services import http_client, usage_meter
+from app.services.rate_limiter import background_priority
+from app.services.usage_meter import CACHE_ONLY, INTERACTIVE_ONLY, NORMAL, BudgetExceeded, UsageMeter
+
+
+def _meter(limit=10):
+    return UsageMeter(limits={"directions": limit}, soft_ratio=0.8, hard_ratio=1.0, persist=False)
+
+
+def _spend(meter, units, status_code=200):
+    for _ in range(units):
+        meter.record("directions", status_code, 10.0)
+
+
+def test_modes_follow_soft_and_hard_limits():
+    meter = _meter()
+    assert meter.mode("directions") == NORMAL
+    _spend(meter, 8)
+    assert meter.mode("directions") == INTERACTIVE_ONLY
+    _spend(meter, 2)
+    assert meter.mode("directions") == CACHE_ONLY
+    # Sin límite configurado: siempre normal
+    assert meter.mode("geocoding") == NORMAL
+
+
+def test_soft_limit_only_blocks_background_calls():
+    meter = _meter()
+    _spend(meter, 8)
+    meter.check("directions")  # interactiva: permitida
+    with background_priority():
+        with pytest.raises(BudgetExceeded) as exc:
+            meter.check("directions")
+    assert exc.value.mode == INTERACTIVE_ONLY
+    assert meter.blocked == {"directions": 1}
+
+
+def test_hard_limit_blocks_every_call():
+    meter = _meter()
+    _spend(meter, 9)
+    meter.check("directions")
+    with pytest.raises(BudgetExceeded) as exc:
+        meter.check("directions", units=2)
+    assert exc.value.mode == CACHE_ONLY
+    assert (exc.value.used, exc.value.limit) == (9, 10)
+
+
+def test_failed_calls_are_not_billed():
+    meter = _meter()
+    _spend(meter, 20, status_code=503)
+    assert meter.used("directions") == 0
+    assert meter.mode("directions") == NORMAL
+
+
+def test_new_month_resets_usage(monkeypatch):
+    meter = _meter()
+    _spend(meter, 10)
+    assert meter.mode("directions") == CACHE_ONLY
+    monkeypatch.setattr(usage_meter, "_month_start", lambda: datetime(2099, 1, 1, tzinfo=timezone.utc))
+    assert meter.used("directions") == 0
+    assert meter.mode("directions") == NORMAL
+
+
+@pytest.mark.anyio
+async def test_exhausted_budget_does_not_call_mapbox(monkeypatch):
+    calls = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        calls.append(request)
+        return httpx.Response(200, json={})
+
+    meter = _meter(limit=1)
+    monkeypatch.setattr(usage_meter, "_meter", meter)
+    monkeypatch.setattr(mapbox_config, "access_token", "pk.test")
+    http_client.set_http_client(http_client.create_http_client(transport=httpx.MockTransport(handler)))
+    try:
+        url = f"{mapbox_config.directions_url}/driving/-80.72,-0.95;-79.88,-2.19"
+        response = await http_client.mapbox_request("directions", url, {})
+        assert response.status_code == 200
+        with pytest.raises(BudgetExceeded):
+            await http_client.mapbox_request("directions", url, {})
+    finally:
+        http_client.set_http_client(None)
+    assert len(calls) == 1
+    assert meter.used("directions") == 1